@@ -0,0 +1,395 @@
+"""
+Created on 2024-12-27
+
+@author: wf
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from fractions import Fraction
+from typing import Callable, Dict, List
+
+import av
+import cv2
+import numpy as np
+
+from nicetrack.hls import HlsSegmenter
+from nicetrack.srt import SRT
+from nicetrack.video_info import VideoInfo
+from nicetrack.video_proxy import lower_priority
+
+
+@dataclass
+class TelemetryTable:
+    """
+    the telemetry of a video by frame index - looked up in a precomputed table
+    instead of searching the subtitles for every frame
+    """
+
+    # the head up display lines of each subtitle
+    lines: List[List[str]]
+    # the subtitle index of each frame - -1 if there is none
+    frame_subtitles: np.ndarray
+
+    @classmethod
+    def get_speeds(
+        cls, lat: np.ndarray, lon: np.ndarray, start_ms: np.ndarray
+    ) -> np.ndarray:
+        """
+        get the ground speed in m/s at each of the given positions
+        """
+        speeds = np.zeros(len(lat))
+        if len(lat) > 1:
+            lat1, lat2 = np.radians(lat[:-1]), np.radians(lat[1:])
+            dlat = lat2 - lat1
+            dlon = np.radians(lon[1:] - lon[:-1])
+            a = (
+                np.sin(dlat / 2) ** 2
+                + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+            )
+            meters = 2 * 6371000.0 * np.arcsin(np.sqrt(a))
+            seconds = np.diff(start_ms) / 1000.0
+            with np.errstate(divide="ignore", invalid="ignore"):
+                step_speeds = np.where(seconds > 0, meters / seconds, np.nan)
+            speeds[1:] = step_speeds
+            speeds[0] = step_speeds[0]
+        return speeds
+
+    @classmethod
+    def get_hud_lines(cls, telemetry: dict, speed: float) -> List[str]:
+        """
+        get the head up display lines for the given telemetry values
+        """
+        lines = []
+        timestamp = telemetry.get("timestamp")
+        if timestamp:
+            lines.append(timestamp.strftime("%Y-%m-%d %H:%M:%S"))
+        lat, lon = telemetry.get("lat"), telemetry.get("lon")
+        if lat is not None and lon is not None:
+            lines.append(f"LAT {lat:.6f} LON {lon:.6f}")
+        altitude = telemetry.get("elevation")
+        if altitude is not None:
+            line = f"ALT {altitude:.1f} m"
+            rel_alt = telemetry.get("rel_alt")
+            if rel_alt is not None:
+                line += f" REL {rel_alt:.1f} m"
+            lines.append(line)
+        if not np.isnan(speed):
+            lines.append(f"SPD {speed * 3.6:.1f} km/h")
+        camera = []
+        for key, label in [("iso", "ISO"), ("shutter", "S"), ("ev", "EV")]:
+            value = telemetry.get(key)
+            if value not in (None, ""):
+                camera.append(f"{label} {value}")
+        fnum = telemetry.get("fnum")
+        if fnum not in (None, ""):
+            fnum = float(fnum)
+            # DJI gives the f-number times 100
+            if fnum > 50:
+                fnum /= 100
+            camera.append(f"F{fnum:.1f}")
+        if camera:
+            lines.append(" ".join(camera))
+        return lines
+
+    @classmethod
+    def from_srt(cls, srt: SRT, fps: float, frames: int) -> "TelemetryTable":
+        """
+        create the table for the given subtitles
+
+        Args:
+            srt (SRT): the telemetry subtitles of the video
+            fps (float): the frames per second of the video
+            frames (int): the number of frames of the video
+
+        Returns:
+            TelemetryTable: the table
+        """
+        count = len(srt.subtitles)
+        start_ms = np.array(
+            [subtitle.start.ordinal for subtitle in srt.subtitles], dtype=np.float64
+        )
+        telemetries = []
+        lat = np.full(count, np.nan)
+        lon = np.full(count, np.nan)
+        for index in range(count):
+            try:
+                telemetry = srt.as_telemetry(index)
+            except BaseException as ex:
+                srt.handle_exception(ex, trace=srt.debug)
+                telemetry = {}
+            telemetries.append(telemetry)
+            if telemetry.get("lat") is not None and telemetry.get("lon") is not None:
+                lat[index] = telemetry["lat"]
+                lon[index] = telemetry["lon"]
+        speeds = cls.get_speeds(lat, lon, start_ms)
+        lines = [
+            cls.get_hud_lines(telemetry, speed)
+            for telemetry, speed in zip(telemetries, speeds)
+        ]
+        frame_ms = np.arange(frames) * 1000.0 / fps
+        frame_subtitles = np.searchsorted(start_ms, frame_ms, side="right") - 1
+        table = cls(lines=lines, frame_subtitles=frame_subtitles.astype(np.int32))
+        return table
+
+    def get_lines(self, frame_index: int) -> List[str]:
+        """
+        get the head up display lines for the given frame
+        """
+        lines = []
+        if 0 <= frame_index < len(self.frame_subtitles):
+            subtitle_index = self.frame_subtitles[frame_index]
+            if subtitle_index >= 0:
+                lines = self.lines[subtitle_index]
+        return lines
+
+
+@dataclass
+class BurnInChunk:
+    """
+    a keyframe aligned chunk of a video to render in a worker process
+    """
+
+    index: int
+    video_path: str
+    chunk_path: str
+    start_pts: int
+    # None for the last chunk
+    end_pts: int
+    fps: Fraction
+    # the head up display lines by frame index
+    hud: Dict[int, List[str]] = field(default_factory=dict)
+    crf: int = 20
+    preset: str = "veryfast"
+    # the result
+    frames: int = 0
+    seconds: float = 0.0
+
+
+def draw_hud(img: np.ndarray, lines: List[str]):
+    """
+    draw the given head up display lines on a darkened box of the given image
+    """
+    if not lines:
+        return
+    height = img.shape[0]
+    scale = height / 1080
+    line_height = max(12, int(40 * scale))
+    margin = max(4, int(20 * scale))
+    box_width = min(img.shape[1] - margin, int(640 * scale))
+    box_height = line_height * len(lines) + margin
+    roi = img[margin : margin + box_height, margin : margin + box_width]
+    roi //= 2
+    for i, line in enumerate(lines):
+        cv2.putText(
+            img,
+            line,
+            (margin * 3 // 2, margin + (i + 1) * line_height),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.9 * scale,
+            (255, 255, 255),
+            max(1, round(2 * scale)),
+            cv2.LINE_AA,
+        )
+
+
+def render_chunk(chunk: BurnInChunk) -> BurnInChunk:
+    """
+    decode, overlay and encode the given chunk - runs in a worker process
+
+    the frames are encoded with their index in the whole video as
+    timestamp so that the chunks can be concatenated as they are
+    """
+    start = time.perf_counter()
+    with av.open(chunk.video_path) as source:
+        in_stream = source.streams.video[0]
+        stream_start = in_stream.start_time or 0
+        time_base = in_stream.time_base
+        width = in_stream.codec_context.width
+        height = in_stream.codec_context.height
+        source.seek(chunk.start_pts, stream=in_stream, backward=True)
+        with av.open(chunk.chunk_path, "w") as output:
+            out_stream = output.add_stream("libx264", rate=chunk.fps)
+            out_stream.width = width
+            out_stream.height = height
+            out_stream.pix_fmt = "yuv420p"
+            out_stream.codec_context.thread_count = 1
+            out_stream.options = {"preset": chunk.preset, "crf": str(chunk.crf)}
+            for frame in source.decode(in_stream):
+                if frame.pts < chunk.start_pts:
+                    continue
+                if chunk.end_pts is not None and frame.pts >= chunk.end_pts:
+                    break
+                frame_index = round((frame.pts - stream_start) * time_base * chunk.fps)
+                img = frame.to_ndarray(format="bgr24")
+                draw_hud(img, chunk.hud.get(frame_index))
+                hud_frame = av.VideoFrame.from_ndarray(img, format="bgr24")
+                hud_frame.pts = frame_index
+                hud_frame.time_base = 1 / chunk.fps
+                for packet in out_stream.encode(hud_frame):
+                    output.mux(packet)
+                chunk.frames += 1
+            for packet in out_stream.encode():
+                output.mux(packet)
+    chunk.hud = {}
+    chunk.seconds = time.perf_counter() - start
+    return chunk
+
+
+class BurnInExport:
+    """
+    export a video with the telemetry of its SRT rendered into every frame
+
+    the video is split into keyframe aligned chunks that are rendered in
+    parallel worker processes and then concatenated without re-encoding
+    """
+
+    def __init__(
+        self,
+        video_path: str,
+        srt_path: str,
+        output_path: str,
+        workers: int = None,
+        chunk_duration: float = 10.0,
+        crf: int = 20,
+        preset: str = "veryfast",
+    ):
+        """
+        construct the export
+
+        Args:
+            video_path (str): the path of the video
+            srt_path (str): the path of the SRT telemetry of the video
+            output_path (str): the path of the mp4 file to create
+            workers (int): the number of worker processes - default: all cpus
+            chunk_duration (float): the minimum duration of a chunk in seconds
+            crf (int): the x264 constant rate factor
+            preset (str): the x264 preset
+        """
+        self.video_path = video_path
+        self.srt_path = srt_path
+        self.output_path = output_path
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_duration = chunk_duration
+        self.crf = crf
+        self.preset = preset
+        video_info = VideoInfo.probe(video_path)
+        self.fps = video_info.fps
+        self.frames = video_info.frames
+        with open(srt_path, encoding="utf-8") as srt_file:
+            srt = SRT.from_text(srt_file.read())
+        self.table = TelemetryTable.from_srt(srt, float(self.fps), self.frames)
+
+    def get_chunks(self, work_dir: str) -> List[BurnInChunk]:
+        """
+        get the keyframe aligned chunks of my video
+        """
+        segmenter = HlsSegmenter(self.video_path, None, self.chunk_duration)
+        try:
+            segments = segmenter.get_segments()
+            stream_start = segmenter.stream.start_time or 0
+            time_base = segmenter.stream.time_base
+        finally:
+            segmenter.close()
+        chunks = []
+        for segment in segments:
+            first = round((segment.start_pts - stream_start) * time_base * self.fps)
+            if segment.end_pts is None:
+                last = self.frames
+            else:
+                last = round((segment.end_pts - stream_start) * time_base * self.fps)
+            hud = {
+                frame_index: self.table.get_lines(frame_index)
+                for frame_index in range(first, last)
+            }
+            chunk = BurnInChunk(
+                index=segment.index,
+                video_path=self.video_path,
+                chunk_path=os.path.join(work_dir, f"chunk_{segment.index:05d}.mp4"),
+                start_pts=segment.start_pts,
+                end_pts=segment.end_pts,
+                fps=self.fps,
+                hud=hud,
+                crf=self.crf,
+                preset=self.preset,
+            )
+            chunks.append(chunk)
+        return chunks
+
+    def concat(self, chunks: List[BurnInChunk]):
+        """
+        concatenate the rendered chunks into my output file
+        """
+        with av.open(chunks[0].chunk_path) as first:
+            template = first.streams.video[0]
+            with av.open(self.output_path, "w") as output:
+                out_stream = output.add_stream_from_template(template)
+                for chunk in chunks:
+                    with av.open(chunk.chunk_path) as chunk_container:
+                        in_stream = chunk_container.streams.video[0]
+                        for packet in chunk_container.demux(in_stream):
+                            # the flushing packet at the end of the stream
+                            if packet.dts is None:
+                                continue
+                            packet.stream = out_stream
+                            output.mux(packet)
+
+    def show_progress(self, done: int, total: int, frames: int, elapsed: float):
+        """
+        show the progress after each chunk
+        """
+        fps = frames / elapsed if elapsed > 0 else 0.0
+        eta = (self.frames - frames) / fps if fps > 0 else 0.0
+        print(
+            f"chunk {done}/{total}: {frames}/{self.frames} frames {fps:.1f} fps ETA {eta:.0f} s",
+            flush=True,
+        )
+
+    def run(self, progress: Callable[[int, int, int, float], None] = None) -> dict:
+        """
+        run the export
+
+        Args:
+            progress (Callable): called with the done and total chunks, the rendered frames and the elapsed seconds after each chunk - default: show_progress
+
+        Returns:
+            dict: the throughput statistics
+        """
+        if progress is None:
+            progress = self.show_progress
+        start = time.perf_counter()
+        out_dir = os.path.dirname(os.path.abspath(self.output_path))
+        with tempfile.TemporaryDirectory(dir=out_dir) as work_dir:
+            chunks = self.get_chunks(work_dir)
+            frames = 0
+            render_seconds = 0.0
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=lower_priority,
+            ) as executor:
+                futures = [executor.submit(render_chunk, chunk) for chunk in chunks]
+                for done, future in enumerate(as_completed(futures), start=1):
+                    rendered = future.result()
+                    chunks[rendered.index] = rendered
+                    frames += rendered.frames
+                    render_seconds += rendered.seconds
+                    progress(done, len(chunks), frames, time.perf_counter() - start)
+            concat_start = time.perf_counter()
+            self.concat(chunks)
+            concat_seconds = time.perf_counter() - concat_start
+        elapsed = time.perf_counter() - start
+        stats = {
+            "frames": frames,
+            "chunks": len(chunks),
+            "workers": self.workers,
+            "seconds": elapsed,
+            "fps": frames / elapsed if elapsed > 0 else 0.0,
+            "worker_fps": frames / render_seconds if render_seconds > 0 else 0.0,
+            "concat_seconds": concat_seconds,
+        }
+        return stats
@@ -0,0 +1,693 @@
+"""
+Created on 2025-01-06
+
+@author: wf
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from nicetrack.file_index import FileIndex
+from nicetrack.path_transport import PolylineCodec
+from nicetrack.track_api import TrackApi
+from nicetrack.track_cache import NAIVE_EPOCH, Track
+from nicetrack.video_proxy import lower_priority
+
+logger = logging.getLogger(__name__)
+
+
+def summarize_track(path: str, tolerance: float = 10.0, precision: int = 5) -> dict:
+    """
+    parse the given SRT or GPX file and summarize it for the catalog
+
+    runs in a worker process
+
+    Args:
+        path (str): the path of the track file
+        tolerance (float): the simplification tolerance of the geometry in meters
+        precision (int): the number of decimal digits of the encoded geometry
+
+    Returns:
+        dict: the point count, time range, bounding box, statistics and encoded geometry
+        or the error if the file could not be parsed
+    """
+    try:
+        track = Track.from_file(path)
+    except Exception as ex:
+        return {"path": path, "error": f"{type(ex).__name__}: {ex}"}
+    summary = {
+        "path": path,
+        "name": track.name,
+        "count": len(track),
+        "timestamp_aware": track.timestamp_aware,
+        "stats": TrackApi.get_stats(track),
+    }
+    if len(track) == 0:
+        return summary
+    summary["distance_km"] = float(track.distance[-1])
+    summary["bbox"] = (
+        float(track.lat.min()),
+        float(track.lon.min()),
+        float(track.lat.max()),
+        float(track.lon.max()),
+    )
+    known = track.timestamp[~np.isnan(track.timestamp)]
+    if len(known):
+        summary["start_time"] = float(known.min())
+        summary["end_time"] = float(known.max())
+    indices = track.get_simplified_indices(tolerance)
+    summary["geometry"] = PolylineCodec.encode(
+        track.lat[indices], track.lon[indices], precision
+    )
+    return summary
+
+
+@dataclass
+class BoundingBox:
+    """
+    a latitude/longitude bounding box
+    """
+
+    min_lat: float
+    min_lon: float
+    max_lat: float
+    max_lon: float
+
+    @classmethod
+    def from_string(cls, text: str) -> "BoundingBox":
+        """
+        parse the given comma separated bounding box in the
+        OGC order min_lon,min_lat,max_lon,max_lat
+
+        Raises:
+            ValueError: if the text is not a valid bounding box
+        """
+        try:
+            min_lon, min_lat, max_lon, max_lat = (float(v) for v in text.split(","))
+        except ValueError:
+            raise ValueError(
+                f"invalid bbox {text} - use min_lon,min_lat,max_lon,max_lat"
+            )
+        if min_lat > max_lat or min_lon > max_lon:
+            raise ValueError(f"invalid bbox {text} - the minimum exceeds the maximum")
+        return cls(min_lat, min_lon, max_lat, max_lon)
+
+    @classmethod
+    def around(cls, lat: float, lon: float, radius_m: float) -> "BoundingBox":
+        """
+        get the bounding box of the circle with the given radius around the given position
+        """
+        dlat = math.degrees(radius_m / Catalog.earth_radius)
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        dlon = min(180.0, dlat / cos_lat)
+        return cls(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+
+
+@dataclass
+class CatalogTrack:
+    """
+    a track of the catalog
+    """
+
+    id: int
+    # the path relative to the root path of the catalog
+    path: str
+    name: str
+    # srt or gpx
+    file_type: str
+    count: int
+    # seconds as in Track.timestamp - None if unknown
+    start_time: Optional[float]
+    end_time: Optional[float]
+    timestamp_aware: bool
+    distance_km: Optional[float]
+    bbox: Optional[BoundingBox]
+    stats: dict
+    # the simplified path as Google encoded polyline
+    geometry: Optional[str] = None
+
+    @classmethod
+    def get_iso(cls, seconds: Optional[float], aware: bool) -> Optional[str]:
+        if seconds is None:
+            return None
+        if aware:
+            return datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat()
+        return (NAIVE_EPOCH + timedelta(seconds=seconds)).isoformat()
+
+    def as_dict(self) -> dict:
+        """
+        get me as a json compatible dict with iso timestamps
+        """
+        record = {
+            "id": self.id,
+            "path": self.path,
+            "name": self.name,
+            "file_type": self.file_type,
+            "count": self.count,
+            "start": self.get_iso(self.start_time, self.timestamp_aware),
+            "end": self.get_iso(self.end_time, self.timestamp_aware),
+            "distance_km": self.distance_km,
+            "bbox": self.bbox.__dict__ if self.bbox else None,
+            "stats": self.stats,
+        }
+        if self.geometry is not None:
+            record["geometry"] = self.geometry
+        return record
+
+    def get_positions(self, precision: int = 5) -> np.ndarray:
+        """
+        get the positions of my simplified path as an n x 2 array
+        """
+        return PolylineCodec.decode(self.geometry or "", precision)
+
+
+class Catalog:
+    """
+    a SQLite catalog of all tracks below the root path of a file index
+    with their bounding box, time range, statistics and simplified path
+
+    the bounding boxes and time ranges are kept in an R-tree so that spatial
+    and temporal queries do not need to look at every track
+    """
+
+    earth_radius = 6371000.0
+    # 2: the ids of removed tracks are not reused
+    format_version = 2
+    # the R-tree stores 32 bit floats - tracks without timestamps span all times
+    no_time = 1e38
+    columns = (
+        "id, path, name, file_type, count, start_time, end_time, timestamp_aware, "
+        "distance_km, min_lat, min_lon, max_lat, max_lon, stats"
+    )
+
+    def __init__(
+        self,
+        file_index: FileIndex,
+        db_path: str = None,
+        tolerance: float = 10.0,
+        precision: int = 5,
+    ):
+        """
+        construct the catalog
+
+        Args:
+            file_index (FileIndex): the index of the track files to catalog
+            db_path (str): the SQLite database - default: ~/.nicetrack/catalog/<hash of the root path>.sqlite
+            tolerance (float): the simplification tolerance of the stored paths in meters
+            precision (int): the number of decimal digits of the stored paths
+        """
+        self.file_index = file_index
+        self.root_path = file_index.root_path
+        if db_path is None:
+            db_path = self.default_db_path(os.path.realpath(self.root_path))
+        self.db_path = db_path
+        self.tolerance = tolerance
+        self.precision = precision
+        # the file index version of the last ingest
+        self.ingested_version = None
+        # called with the stats after each ingest e.g. to update derived views
+        self.listeners: List[Callable[[dict], None]] = []
+        self.task = None
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.create_schema()
+
+    @classmethod
+    def default_db_path(cls, root_path: str) -> str:
+        key = hashlib.sha1(root_path.encode("utf-8")).hexdigest()[:16]
+        return f"{Path.home()}/.nicetrack/catalog/{key}.sqlite"
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        get a new connection - connections are not shared between threads
+        """
+        connection = sqlite3.connect(self.db_path, timeout=30.0)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def create_schema(self):
+        """
+        create the tables - a catalog of another format version is dropped and rebuilt
+        """
+        with self.connect() as connection:
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version not in (0, self.format_version):
+                connection.execute("DROP TABLE IF EXISTS tracks")
+                connection.execute("DROP TABLE IF EXISTS track_rtree")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT UNIQUE NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    name TEXT,
+                    file_type TEXT,
+                    count INTEGER,
+                    start_time REAL,
+                    end_time REAL,
+                    timestamp_aware INTEGER,
+                    distance_km REAL,
+                    min_lat REAL,
+                    min_lon REAL,
+                    max_lat REAL,
+                    max_lon REAL,
+                    stats TEXT,
+                    geometry TEXT,
+                    error TEXT
+                )""")
+            connection.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS track_rtree USING rtree(
+                    id, min_lon, max_lon, min_lat, max_lat, start_time, end_time
+                )""")
+            connection.execute(f"PRAGMA user_version={self.format_version}")
+        connection.close()
+
+    def get_known(self, connection: sqlite3.Connection) -> Dict[str, Tuple]:
+        """
+        get the id, size and modification time of the cataloged files by relative path
+        """
+        rows = connection.execute("SELECT path, id, size, mtime_ns FROM tracks")
+        known = {
+            path: (track_id, size, mtime_ns) for path, track_id, size, mtime_ns in rows
+        }
+        return known
+
+    def delete(self, connection: sqlite3.Connection, track_id: int):
+        connection.execute("DELETE FROM tracks WHERE id=?", (track_id,))
+        connection.execute("DELETE FROM track_rtree WHERE id=?", (track_id,))
+
+    def store(self, connection: sqlite3.Connection, indexed_file, summary: dict):
+        """
+        store the given summary of the given indexed file replacing a previous version
+        """
+        rel_path = os.path.relpath(indexed_file.path, self.root_path)
+        row = connection.execute(
+            "SELECT id FROM tracks WHERE path=?", (rel_path,)
+        ).fetchone()
+        if row:
+            self.delete(connection, row[0])
+        bbox = summary.get("bbox") or (None, None, None, None)
+        cursor = connection.execute(
+            """INSERT INTO tracks (
+                path, size, mtime_ns, name, file_type, count, start_time, end_time,
+                timestamp_aware, distance_km, min_lat, min_lon, max_lat, max_lon,
+                stats, geometry, error
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                rel_path,
+                indexed_file.size,
+                indexed_file.mtime_ns,
+                summary.get("name", os.path.basename(rel_path)),
+                indexed_file.file_type,
+                summary.get("count"),
+                summary.get("start_time"),
+                summary.get("end_time"),
+                int(summary.get("timestamp_aware", False)),
+                summary.get("distance_km"),
+                *bbox,
+                json.dumps(summary["stats"]) if "stats" in summary else None,
+                summary.get("geometry"),
+                summary.get("error"),
+            ),
+        )
+        if summary.get("bbox"):
+            min_lat, min_lon, max_lat, max_lon = bbox
+            connection.execute(
+                "INSERT INTO track_rtree VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    cursor.lastrowid,
+                    min_lon,
+                    max_lon,
+                    min_lat,
+                    max_lat,
+                    summary.get("start_time", -self.no_time),
+                    summary.get("end_time", self.no_time),
+                ),
+            )
+
+    def ingest(self, workers: int = None, batch_size: int = 100) -> dict:
+        """
+        bring the catalog up to date with the file index - only new and
+        changed files are parsed, in parallel worker processes
+
+        Args:
+            workers (int): the number of worker processes - default: half of the cpus, 0 to parse in this process
+            batch_size (int): the number of tracks stored per transaction
+
+        Returns:
+            dict: the number of files, unchanged, ingested, failed and removed tracks and the seconds taken
+        """
+        start = time.perf_counter()
+        version = self.file_index.version
+        indexed_files = [
+            indexed_file
+            for indexed_file in self.file_index.get_files()
+            if indexed_file.file_type in ("srt", "gpx")
+        ]
+        connection = self.connect()
+        try:
+            known = self.get_known(connection)
+            changed = []
+            paths = set()
+            for indexed_file in indexed_files:
+                rel_path = os.path.relpath(indexed_file.path, self.root_path)
+                paths.add(rel_path)
+                entry = known.get(rel_path)
+                if entry is None or entry[1:] != (
+                    indexed_file.size,
+                    indexed_file.mtime_ns,
+                ):
+                    changed.append(indexed_file)
+            removed = [entry[0] for path, entry in known.items() if path not in paths]
+            with connection:
+                for track_id in removed:
+                    self.delete(connection, track_id)
+            failed = 0
+            summaries = self.summarize(changed, workers)
+            for i, (indexed_file, summary) in enumerate(zip(changed, summaries)):
+                if "error" in summary:
+                    failed += 1
+                    logger.warning(
+                        f"could not catalog {indexed_file.path}: {summary['error']}"
+                    )
+                self.store(connection, indexed_file, summary)
+                # the stored tracks become visible batch by batch
+                if (i + 1) % batch_size == 0:
+                    connection.commit()
+            connection.commit()
+        finally:
+            connection.close()
+        self.ingested_version = version
+        stats = {
+            "files": len(indexed_files),
+            "unchanged": len(indexed_files) - len(changed),
+            "ingested": len(changed) - failed,
+            "failed": failed,
+            "removed": len(removed),
+            "seconds": time.perf_counter() - start,
+        }
+        for listener in self.listeners:
+            listener(stats)
+        return stats
+
+    def summarize(self, indexed_files: List, workers: int = None):
+        """
+        summarize the given files in worker processes
+
+        Returns:
+            the summaries in the order of the files
+        """
+        paths = [indexed_file.path for indexed_file in indexed_files]
+        args = ([self.tolerance] * len(paths), [self.precision] * len(paths))
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 1) // 2)
+        if workers == 0 or len(paths) < 2:
+            yield from map(summarize_track, paths, *args)
+            return
+        # spawned workers don't inherit the server's threads
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(paths)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=lower_priority,
+        ) as executor:
+            chunksize = max(1, min(16, len(paths) // (workers * 4)))
+            yield from executor.map(summarize_track, paths, *args, chunksize=chunksize)
+
+    def get_tracks(
+        self,
+        connection: sqlite3.Connection,
+        where: str,
+        params: tuple,
+        with_geometry: bool,
+    ) -> List[CatalogTrack]:
+        """
+        get the tracks of the given where clause
+        """
+        columns = self.columns + (", geometry" if with_geometry else "")
+        rows = connection.execute(
+            f"SELECT {columns} FROM tracks WHERE {where}", params
+        ).fetchall()
+        tracks = []
+        for row in rows:
+            (
+                track_id,
+                path,
+                name,
+                file_type,
+                count,
+                start_time,
+                end_time,
+                aware,
+                distance_km,
+                min_lat,
+                min_lon,
+                max_lat,
+                max_lon,
+                stats,
+            ) = row[:14]
+            tracks.append(
+                CatalogTrack(
+                    id=track_id,
+                    path=path,
+                    name=name,
+                    file_type=file_type,
+                    count=count,
+                    start_time=start_time,
+                    end_time=end_time,
+                    timestamp_aware=bool(aware),
+                    distance_km=distance_km,
+                    bbox=(
+                        BoundingBox(min_lat, min_lon, max_lat, max_lon)
+                        if min_lat is not None
+                        else None
+                    ),
+                    stats=json.loads(stats) if stats else {},
+                    geometry=row[14] if with_geometry else None,
+                )
+            )
+        return tracks
+
+    def query(
+        self,
+        bbox: BoundingBox = None,
+        start_time: float = None,
+        end_time: float = None,
+        limit: int = None,
+        with_geometry: bool = False,
+    ) -> List[CatalogTrack]:
+        """
+        get the tracks that intersect the given bounding box and time range
+
+        Args:
+            bbox (BoundingBox): the area - None for everywhere
+            start_time (float): the start of the time range in seconds as in Track.timestamp - None for open
+            end_time (float): the end of the time range - None for open
+            limit (int): the maximum number of tracks - the longest tracks first - None for all
+            with_geometry (bool): if True include the simplified paths
+
+        Returns:
+            List[CatalogTrack]: the tracks sorted by start time
+        """
+        conditions = []
+        params = []
+        if bbox is not None:
+            conditions.append("min_lon<=? AND max_lon>=? AND min_lat<=? AND max_lat>=?")
+            params += [bbox.max_lon, bbox.min_lon, bbox.max_lat, bbox.min_lat]
+        if start_time is not None:
+            conditions.append("end_time>=?")
+            params.append(start_time)
+        if end_time is not None:
+            conditions.append("start_time<=?")
+            params.append(end_time)
+        if conditions:
+            # the R-tree finds the candidates - its 32 bit floats are rounded outwards
+            where = (
+                f"id IN (SELECT id FROM track_rtree WHERE {' AND '.join(conditions)})"
+            )
+        else:
+            where = "count>0"
+        # the exact check of the time range excludes the tracks without timestamps
+        if start_time is not None:
+            where += " AND end_time>=?"
+            params.append(start_time)
+        if end_time is not None:
+            where += " AND start_time<=?"
+            params.append(end_time)
+        if limit:
+            where += f" ORDER BY distance_km DESC LIMIT {int(limit)}"
+        connection = self.connect()
+        try:
+            tracks = self.get_tracks(connection, where, tuple(params), with_geometry)
+        finally:
+            connection.close()
+        tracks.sort(
+            key=lambda track: (
+                track.start_time is None,
+                track.start_time or 0,
+                track.path,
+            )
+        )
+        return tracks
+
+    @classmethod
+    def get_path_distance(cls, positions: np.ndarray, lat: float, lon: float) -> float:
+        """
+        get the distance of the given position from the given path
+
+        Args:
+            positions (np.ndarray): the (lat, lon) positions of the path as an n x 2 array
+            lat (float): the latitude of the position
+            lon (float): the longitude of the position
+
+        Returns:
+            float: the distance in meters in an equirectangular projection around the position
+        """
+        if len(positions) == 0:
+            return math.inf
+        cos_lat = math.cos(math.radians(lat))
+        x = np.radians(positions[:, 1] - lon) * cls.earth_radius * cos_lat
+        y = np.radians(positions[:, 0] - lat) * cls.earth_radius
+        if len(positions) == 1:
+            return float(np.hypot(x[0], y[0]))
+        # the closest point of each segment to the origin
+        x1, y1, dx, dy = x[:-1], y[:-1], np.diff(x), np.diff(y)
+        length2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(length2 > 0, -(x1 * dx + y1 * dy) / length2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        distance = np.hypot(x1 + t * dx, y1 + t * dy).min()
+        return float(distance)
+
+    def near(
+        self,
+        lat: float,
+        lon: float,
+        radius_m: float,
+        start_time: float = None,
+        end_time: float = None,
+        limit: int = None,
+    ) -> List[Tuple[CatalogTrack, float]]:
+        """
+        get the tracks that passed within the given radius of the given position
+
+        the distance is measured to the simplified path so it may be off by the tolerance
+
+        Args:
+            lat (float): the latitude of the position
+            lon (float): the longitude of the position
+            radius_m (float): the radius in meters
+            start_time (float): the start of the time range - None for open
+            end_time (float): the end of the time range - None for open
+            limit (int): the maximum number of tracks - None for all
+
+        Returns:
+            List[Tuple[CatalogTrack, float]]: the tracks and their distances in meters - the closest first
+        """
+        bbox = BoundingBox.around(lat, lon, radius_m)
+        candidates = self.query(bbox, start_time, end_time, with_geometry=True)
+        found = []
+        for track in candidates:
+            distance = self.get_path_distance(
+                track.get_positions(self.precision), lat, lon
+            )
+            if distance <= radius_m:
+                found.append((track, distance))
+        found.sort(key=lambda item: item[1])
+        return found[:limit] if limit else found
+
+    def get_track(
+        self, track_id: int, with_geometry: bool = True
+    ) -> Optional[CatalogTrack]:
+        """
+        get the track with the given id - None if there is none
+        """
+        connection = self.connect()
+        try:
+            tracks = self.get_tracks(connection, "id=?", (track_id,), with_geometry)
+        finally:
+            connection.close()
+        return tracks[0] if tracks else None
+
+    def get_geometries(self) -> Dict[int, str]:
+        """
+        get the encoded simplified paths of all tracks by id
+        """
+        connection = self.connect()
+        try:
+            rows = connection.execute(
+                "SELECT id, geometry FROM tracks WHERE geometry IS NOT NULL"
+            ).fetchall()
+        finally:
+            connection.close()
+        return dict(rows)
+
+    def get_failures(self) -> Dict[str, str]:
+        """
+        get the errors of the files that could not be parsed by relative path
+        """
+        connection = self.connect()
+        try:
+            rows = connection.execute(
+                "SELECT path, error FROM tracks WHERE error IS NOT NULL ORDER BY path"
+            ).fetchall()
+        finally:
+            connection.close()
+        return dict(rows)
+
+    @classmethod
+    def get_seconds(cls, iso: str) -> Optional[float]:
+        """
+        get the seconds of the given iso date or timestamp as in Track.timestamp
+
+        naive timestamps such as those of DJI SRT files are compared as they are
+
+        Raises:
+            ValueError: if the text is not an iso date or timestamp
+        """
+        if not iso:
+            return None
+        seconds, _aware = Track.get_seconds([datetime.fromisoformat(iso)])
+        return float(seconds[0])
+
+    async def watch(self, interval: float = 60.0, workers: int = None):
+        """
+        keep the catalog up to date with the file index
+
+        Args:
+            interval (float): the seconds between two checks of the file index - 0 to only ingest once
+            workers (int): the number of worker processes
+        """
+        while True:
+            await asyncio.to_thread(self.file_index.ensure_scanned)
+            if self.file_index.version != self.ingested_version:
+                stats = await asyncio.to_thread(self.ingest, workers)
+                logger.info(f"catalog {self.root_path}: {stats}")
+            if not interval:
+                return
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = 60.0, workers: int = None) -> asyncio.Task:
+        """
+        start keeping the catalog up to date in the background
+        """
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.watch(interval, workers))
+        return self.task
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
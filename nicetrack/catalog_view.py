@@ -0,0 +1,150 @@
+"""
+Created on 2025-01-06
+
+@author: wf
+"""
+
+import asyncio
+from typing import Dict
+
+from ngwidgets.leaflet_map import LeafletMap
+from nicegui import ui
+
+from nicetrack.catalog import BoundingBox, Catalog
+from nicetrack.heatmap import Heatmap
+from nicetrack.path_transport import EncodedPath, PathTransport
+from nicetrack.update_scheduler import UpdateScheduler
+
+
+class CatalogView:
+    """
+    a map of the cataloged tracks that only loads the tracks
+    intersecting the current viewport
+    """
+
+    options = {"color": "blue", "weight": 2, "opacity": 0.6}
+    heat_options = {"opacity": 0.7, "maxZoom": 22, "attribution": "nicetrack"}
+
+    def __init__(
+        self,
+        solution,
+        catalog: Catalog,
+        heatmap: Heatmap = None,
+        max_tracks: int = 200,
+    ):
+        """
+        construct the view
+
+        Args:
+            solution: the solution to show the view in
+            catalog (Catalog): the catalog of the tracks
+            heatmap (Heatmap): the density of all tracks - None for no heatmap overlay
+            max_tracks (int): the maximum number of tracks shown at once - the longest first
+        """
+        self.solution = solution
+        self.catalog = catalog
+        self.heatmap = heatmap
+        self.max_tracks = max_tracks
+        self.geo_map = None
+        self.heat_layer = None
+        # the path layers by track id
+        self.layers: Dict[int, EncodedPath] = {}
+        # panning and zooming load the viewport at most twice per second
+        self.scheduler = UpdateScheduler(
+            self.load_viewport,
+            max_rate=2.0,
+            handle_exception=self.solution.handle_exception,
+        )
+
+    async def setup_ui(self):
+        """
+        set up the time range inputs and the map
+        """
+        with ui.row().classes("items-center"):
+            self.start_input = ui.input(
+                "start", placeholder="2024-03-01", on_change=self.reload
+            )
+            self.end_input = ui.input(
+                "end", placeholder="2024-06-01", on_change=self.reload
+            )
+            if self.heatmap is not None:
+                ui.checkbox("heatmap", on_change=self.toggle_heatmap)
+            self.status_label = ui.label()
+        self.geo_map = LeafletMap(
+            center=(20.0, 0.0),
+            zoom=2,
+            with_draw_control=False,
+            classes="w-full h-[70vh]",
+        )
+        self.solution.webserver.configure_map(self.geo_map)
+        # the decoder of the encoded paths
+        self.geo_map._props["additional-resources"].append(PathTransport.script_url)
+        self.geo_map.on("map-moveend", self.reload)
+        await self.geo_map.initialized()
+        self.reload()
+
+    def reload(self, _args=None):
+        self.scheduler.submit(None)
+
+    def toggle_heatmap(self, args):
+        """
+        show or hide the density of all tracks on top of the paths
+        """
+        if args.value and self.heat_layer is None:
+            self.heat_layer = self.geo_map.tile_layer(
+                url_template=Heatmap.url_template, options=self.heat_options
+            )
+        elif not args.value and self.heat_layer is not None:
+            self.geo_map.remove_layer(self.heat_layer)
+            self.heat_layer = None
+
+    async def get_bounds(self) -> BoundingBox:
+        """
+        get the bounding box of the current viewport
+        """
+        bounds = await self.geo_map.run_map_method("getBounds")
+        south_west, north_east = bounds["_southWest"], bounds["_northEast"]
+        # the viewport may span more than the world
+        bbox = BoundingBox(
+            max(-90.0, south_west["lat"]),
+            max(-180.0, south_west["lng"]),
+            min(90.0, north_east["lat"]),
+            min(180.0, north_east["lng"]),
+        )
+        return bbox
+
+    async def load_viewport(self, _value=None):
+        """
+        show the tracks intersecting the viewport and the time range -
+        tracks that are already shown are kept
+        """
+        bbox = await self.get_bounds()
+        try:
+            start_time = Catalog.get_seconds(self.start_input.value)
+            end_time = Catalog.get_seconds(self.end_input.value)
+        except ValueError as ve:
+            self.status_label.text = str(ve)
+            return
+        tracks = await asyncio.to_thread(
+            self.catalog.query,
+            bbox,
+            start_time,
+            end_time,
+            limit=self.max_tracks,
+            with_geometry=True,
+        )
+        visible = {track.id for track in tracks}
+        for track_id in list(self.layers):
+            if track_id not in visible:
+                self.geo_map.remove_layer(self.layers.pop(track_id))
+        for track in tracks:
+            if track.id not in self.layers and track.geometry:
+                with self.geo_map:
+                    self.layers[track.id] = EncodedPath(
+                        mode="polyline",
+                        chunks=[track.geometry],
+                        precision=self.catalog.precision,
+                        options=self.options,
+                    )
+        more = " (the longest)" if len(tracks) == self.max_tracks else ""
+        self.status_label.text = f"{len(tracks)} tracks in view{more}"
@@ -0,0 +1,487 @@
+"""
+Created on 2025-01-05
+
+@author: wf
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ngwidgets.file_selector import FileSelector
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IndexedFile:
+    """
+    a track or video file of the index
+    """
+
+    # the absolute path
+    path: str
+    size: int
+    # the modification time in nanoseconds
+    mtime_ns: int
+    # srt, mp4 or gpx
+    file_type: str
+    # the path of the video of an SRT file or of the SRT file of a video - None if there is none
+    pair: Optional[str] = None
+
+
+class FileIndex:
+    """
+    a persistent index of the track and video files below a root path
+    with their size, modification time and type and the pairing of each
+    SRT file with its video
+
+    a rescan only lists the directories whose modification time changed
+    """
+
+    # the indexed file types by lower case extension - mp4 is the type of all videos
+    types = {".srt": "srt", ".mp4": "mp4", ".mov": "mp4", ".gpx": "gpx"}
+    format_version = 2
+
+    def __init__(self, root_path: str, index_path: str = None):
+        """
+        construct the index
+
+        Args:
+            root_path (str): the directory to index
+            index_path (str): the json file to persist the index in - default: ~/.nicetrack/index/<hash of the root path>.json
+        """
+        self.root_path = os.path.abspath(root_path)
+        if index_path is None:
+            index_path = self.default_index_path(os.path.realpath(root_path))
+        self.index_path = index_path
+        # the modification time, sub directory names and files by relative directory path
+        self.dirs: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.scan_lock = threading.Lock()
+        # incremented on every change - lets views cache what they derive from the index
+        self.version = 0
+        self.scanned = False
+        self.scans = 0
+        self.listed_dirs = 0
+        self.trees: Dict[Tuple, dict] = {}
+        # called with the index after each change e.g. to process new files
+        self.listeners: List[Callable[["FileIndex"], None]] = []
+        self.task = None
+
+    @classmethod
+    def default_index_path(cls, root_path: str) -> str:
+        key = hashlib.sha1(root_path.encode("utf-8")).hexdigest()[:16]
+        return f"{Path.home()}/.nicetrack/index/{key}.json"
+
+    @classmethod
+    def get_type(cls, name: str) -> Optional[str]:
+        """
+        get the type of the file with the given name - None if it is not indexed
+        """
+        return cls.types.get(os.path.splitext(name)[1].lower())
+
+    def load(self) -> bool:
+        """
+        load the persisted index
+
+        Returns:
+            bool: True if a valid index of my root path was loaded
+        """
+        try:
+            with open(self.index_path) as json_file:
+                data = json.load(json_file)
+        except (OSError, ValueError):
+            return False
+        if (
+            data.get("version") != self.format_version
+            or data.get("root") != self.root_path
+        ):
+            return False
+        with self.lock:
+            self.dirs = data["dirs"]
+            self.version += 1
+            self.trees = {}
+        self.scanned = True
+        self.notify()
+        return True
+
+    def save(self):
+        """
+        persist the index atomically
+        """
+        with self.lock:
+            data = {
+                "version": self.format_version,
+                "root": self.root_path,
+                "dirs": self.dirs,
+            }
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as json_file:
+                json.dump(data, json_file, separators=(",", ":"))
+            os.replace(tmp_path, self.index_path)
+        except OSError as ex:
+            logger.warning(f"could not save the file index {self.index_path}: {ex}")
+
+    def list_dir(self, rel_dir: str, mtime_ns: int) -> dict:
+        """
+        list the given directory
+
+        Returns:
+            dict: the modification time, the sorted sub directory names and the indexed files by name
+        """
+        abs_dir = os.path.join(self.root_path, rel_dir)
+        subdirs = []
+        files = {}
+        try:
+            with os.scandir(abs_dir) as entries:
+                for entry in entries:
+                    if entry.name.startswith("._"):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            subdirs.append(entry.name)
+                        elif self.get_type(entry.name):
+                            stat = entry.stat()
+                            files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        self.listed_dirs += 1
+        return {"mtime": mtime_ns, "dirs": sorted(subdirs), "files": files}
+
+    def rescan(self, full: bool = False) -> bool:
+        """
+        rescan my root path - only the directories whose modification time changed are listed again
+
+        Args:
+            full (bool): if True list all directories e.g. to find files that were modified in place
+
+        Returns:
+            bool: True if the index changed
+        """
+        with self.scan_lock:
+            old_dirs = self.dirs
+            dirs = {}
+            stack = [""]
+            while stack:
+                rel_dir = stack.pop()
+                try:
+                    mtime_ns = os.stat(
+                        os.path.join(self.root_path, rel_dir)
+                    ).st_mtime_ns
+                except OSError:
+                    continue
+                old = old_dirs.get(rel_dir)
+                if not full and old is not None and old["mtime"] == mtime_ns:
+                    listing = old
+                else:
+                    listing = self.list_dir(rel_dir, mtime_ns)
+                dirs[rel_dir] = listing
+                stack.extend(os.path.join(rel_dir, name) for name in listing["dirs"])
+            changed = dirs != old_dirs
+            with self.lock:
+                self.dirs = dirs
+                if changed:
+                    self.version += 1
+                    self.trees = {}
+            self.scanned = True
+            self.scans += 1
+        if changed:
+            self.save()
+            self.notify()
+        return changed
+
+    def notify(self):
+        """
+        let my listeners know that the index changed
+        """
+        for listener in list(self.listeners):
+            try:
+                listener(self)
+            except Exception as ex:
+                # a failing listener must not stop the rescans
+                logger.warning(f"file index listener {listener} failed: {ex}")
+
+    def ensure_scanned(self):
+        """
+        load or scan the index if that has not been done yet
+
+        this may walk the whole root path - call it from a worker thread
+        """
+        if not self.scanned and not self.load():
+            self.rescan()
+
+    def get_listing_files(
+        self, rel_dir: str, listing: dict, file_type: str = None
+    ) -> List[IndexedFile]:
+        """
+        get the indexed files of the given directory listing with their pairs
+        """
+        # the pairing ignores the case of the extensions e.g. DJI_0001.SRT and DJI_0001.MP4
+        by_stem = {}
+        for name in listing["files"]:
+            stem, ext = os.path.splitext(name)
+            by_stem[(stem, self.types[ext.lower()])] = name
+        dir_path = os.path.join(self.root_path, rel_dir).rstrip(os.sep)
+        indexed_files = []
+        for name, (size, mtime_ns) in sorted(listing["files"].items()):
+            stem, ext = os.path.splitext(name)
+            name_type = self.types[ext.lower()]
+            if file_type and name_type != file_type:
+                continue
+            pair_type = {"srt": "mp4", "mp4": "srt"}.get(name_type)
+            pair_name = by_stem.get((stem, pair_type))
+            indexed_files.append(
+                IndexedFile(
+                    path=os.path.join(dir_path, name),
+                    size=size,
+                    mtime_ns=mtime_ns,
+                    file_type=name_type,
+                    pair=os.path.join(dir_path, pair_name) if pair_name else None,
+                )
+            )
+        return indexed_files
+
+    def get_files(self, file_type: str = None) -> List[IndexedFile]:
+        """
+        get the indexed files
+
+        the index is loaded or scanned first if necessary - call it from a worker thread
+
+        Args:
+            file_type (str): srt, mp4 or gpx - None for all
+
+        Returns:
+            List[IndexedFile]: the files sorted by directory and name
+        """
+        self.ensure_scanned()
+        with self.lock:
+            dirs = self.dirs
+        indexed_files = []
+        for rel_dir, listing in sorted(dirs.items()):
+            indexed_files.extend(self.get_listing_files(rel_dir, listing, file_type))
+        return indexed_files
+
+    def get_file(self, path: str) -> Optional[IndexedFile]:
+        """
+        get the indexed file with the given path - None if it is not indexed
+        or the index is not loaded yet - never scans so it may be used on the event loop
+        """
+        rel_path = os.path.relpath(os.path.abspath(path), self.root_path)
+        rel_dir, name = os.path.split(rel_path)
+        with self.lock:
+            listing = self.dirs.get(rel_dir)
+        if listing is None or name not in listing["files"]:
+            return None
+        for indexed_file in self.get_listing_files(rel_dir, listing):
+            if os.path.basename(indexed_file.path) == name:
+                return indexed_file
+        return None
+
+    def get_video(self, srt_path: str) -> Optional[str]:
+        """
+        get the video of the given SRT file
+
+        Returns:
+            str: the path of the video or None if there is none
+        """
+        indexed_file = self.get_file(srt_path)
+        if indexed_file is None or indexed_file.file_type != "srt":
+            return None
+        return indexed_file.pair
+
+    def get_tree(self, extensions: dict) -> Optional[dict]:
+        """
+        get the directory tree of the files with the given extensions
+        in the structure of the ngwidgets FileSelector
+
+        never scans so it may be used on the event loop - the tree is a single
+        indexing node until the index is loaded or scanned in the background
+
+        Args:
+            extensions (dict): the extensions to show by name e.g. {"srt": ".SRT"}
+
+        Returns:
+            dict: the tree - None if there are no such files
+        """
+        if not self.scanned:
+            return self.get_indexing_tree()
+        key = tuple(sorted(extensions.values()))
+        with self.lock:
+            if key in self.trees:
+                return self.trees[key]
+            dirs = self.dirs
+            version = self.version
+        tree = self.build_tree(dirs, "", list(extensions.values()), [1])
+        with self.lock:
+            if self.version == version:
+                self.trees[key] = tree
+        return tree
+
+    def get_indexing_tree(self) -> dict:
+        """
+        get the tree to show while the index is not available yet
+        """
+        tree = {
+            "id": "1",
+            "label": f"indexing {os.path.basename(self.root_path)} …",
+            "value": self.root_path,
+            "children": [],
+        }
+        return tree
+
+    def build_tree(
+        self, dirs: Dict[str, dict], rel_dir: str, extensions: List[str], id_path
+    ) -> Optional[dict]:
+        """
+        build the tree of the given directory - the directories first then the files as the FileSelector does
+        """
+        listing = dirs.get(rel_dir)
+        if listing is None:
+            return None
+        children = []
+        item_counter = 1
+        for name in listing["dirs"]:
+            subtree = self.build_tree(
+                dirs, os.path.join(rel_dir, name), extensions, id_path + [item_counter]
+            )
+            if subtree:
+                children.append(subtree)
+                item_counter += 1
+        abs_dir = os.path.join(self.root_path, rel_dir).rstrip(os.sep)
+        for name in sorted(listing["files"]):
+            if any(name.endswith(ext) for ext in extensions if ext):
+                children.append(
+                    {
+                        "id": ".".join(map(str, id_path + [item_counter])),
+                        "label": name,
+                        "value": os.path.join(abs_dir, name),
+                    }
+                )
+                item_counter += 1
+        if not children:
+            return None
+        tree = {
+            "id": ".".join(map(str, id_path)),
+            "label": os.path.basename(abs_dir),
+            "value": abs_dir,
+            "children": children,
+        }
+        return tree
+
+    async def watch(self, interval: float = 60.0):
+        """
+        keep the index up to date - rescan on file system events where
+        watchfiles is available and every interval seconds in any case
+        since network storage does not report its changes
+
+        Args:
+            interval (float): the seconds between two rescans - 0 to only load or scan the index once
+        """
+        await asyncio.to_thread(self.ensure_scanned)
+        if not interval:
+            return
+        try:
+            from watchfiles import awatch
+        except ImportError:
+            awatch = None
+        if awatch is not None:
+            try:
+                async for _changes in awatch(
+                    self.root_path,
+                    rust_timeout=int(interval * 1000),
+                    yield_on_timeout=True,
+                ):
+                    await asyncio.to_thread(self.rescan)
+            except (OSError, RuntimeError) as ex:
+                # e.g. too many directories for the inotify watches
+                logger.warning(
+                    f"watching {self.root_path} failed - rescanning only: {ex}"
+                )
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.rescan)
+
+    def start(self, interval: float = 60.0) -> asyncio.Task:
+        """
+        start keeping the index up to date in the background
+        """
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.watch(interval))
+        return self.task
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+class IndexedFileSelector(FileSelector):
+    """
+    a FileSelector that shows the files of a FileIndex instead of walking the directory tree
+
+    while the index is not available yet an indexing node is shown and the
+    tree is refreshed once the background scan has finished
+    """
+
+    def __init__(self, file_index: FileIndex, **kwargs):
+        """
+        construct the selector
+
+        Args:
+            file_index (FileIndex): the index of the root path
+            **kwargs: the FileSelector options
+        """
+        self.file_index = file_index
+        super().__init__(path=file_index.root_path, **kwargs)
+        if not file_index.scanned and hasattr(self, "tree"):
+            self.loop = asyncio.get_running_loop()
+            file_index.listeners.append(self.on_index_changed)
+            if file_index.scanned:
+                # the scan finished while the listener was added
+                self.on_index_changed(file_index)
+
+    def on_index_changed(self, file_index: FileIndex):
+        """
+        the index is available - refresh my tree on the event loop once
+        """
+        try:
+            file_index.listeners.remove(self.on_index_changed)
+        except ValueError:
+            # already refreshed
+            return
+        self.loop.call_soon_threadsafe(self.refresh)
+
+    def refresh(self):
+        """
+        show the files of the index
+        """
+        if self.tree.is_deleted:
+            return
+        self.tree_structure = self.get_dir_tree(self.path, self.extensions)
+        self.tree._props["nodes"] = [self.tree_structure]
+        self.tree.update()
+
+    def get_dir_tree(self, path: str, extensions: dict, id_path=[1]) -> Optional[dict]:
+        tree = self.file_index.get_tree(extensions)
+        self.file_count = self.count_files(tree)
+        return tree
+
+    @classmethod
+    def count_files(cls, tree: Optional[dict]) -> int:
+        if not tree:
+            return 0
+        children = tree.get("children")
+        if children is None:
+            return 1
+        return sum(cls.count_files(child) for child in children)
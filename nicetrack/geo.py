@@ -12,9 +12,7 @@ from datetime import datetime
 from pathlib import Path
 from typing import List, Tuple
 
-import gpxpy
-from OSMPythonTools.cachingStrategy import JSON, CachingStrategy
-from OSMPythonTools.nominatim import Nominatim
+from nicetrack.metrics import Metrics
 
 
 @dataclass
@@ -61,7 +59,8 @@ class Trackpoint:
         """
         get the location details via nominatim
         """
-        result = nominatim.query(f"{self.lat}, {self.lon}").toJSON()
+        with Metrics.get_instance().geocoder_seconds.time():
+            result = nominatim.query(f"{self.lat}, {self.lon}").toJSON()
         location = result[0]
         details = location.get("display_name", "Location not found")
         return details
@@ -82,6 +81,9 @@ class GeoPath:
     a 3D Path of geographic coordinates in lat/lon notation
     """
 
+    # the shared nominatim geocoders by cache directory
+    nominatims = {}
+
     def __init__(self, name: str = None, cacheDir: str = None):
         self.name = name
         self.path: List[Trackpoint] = []
@@ -92,8 +94,38 @@ class GeoPath:
         if not os.path.exists(self.cacheDir):
             os.makedirs(self.cacheDir)
         logging.getLogger("OSMPythonTools").setLevel(logging.ERROR)
-        CachingStrategy.use(JSON, cacheDir=self.cacheDir)
-        self.nominatim = Nominatim()
+        self._nominatim = None
+
+    @property
+    def nominatim(self):
+        """
+        the nominatim geocoder - OSMPythonTools is only imported
+        when the first location is looked up
+        """
+        if self._nominatim is None:
+            self._nominatim = self.get_nominatim(self.cacheDir)
+        return self._nominatim
+
+    @classmethod
+    def get_nominatim(cls, cacheDir: str = None):
+        """
+        get the shared nominatim geocoder for the given cache directory
+        - this may import OSMPythonTools so it should run off the event loop
+
+        Args:
+            cacheDir (str): the cache directory - default: ~/.nominatim
+        """
+        if cacheDir is None:
+            cacheDir = f"{Path.home()}/.nominatim"
+        nominatim = cls.nominatims.get(cacheDir)
+        if nominatim is None:
+            from OSMPythonTools.cachingStrategy import JSON, CachingStrategy
+            from OSMPythonTools.nominatim import Nominatim
+
+            os.makedirs(cacheDir, exist_ok=True)
+            CachingStrategy.use(JSON, cacheDir=cacheDir)
+            nominatim = cls.nominatims.setdefault(cacheDir, Nominatim())
+        return nominatim
 
     @classmethod
     def from_points(cls, *points) -> "GeoPath":
@@ -108,6 +140,8 @@ class GeoPath:
 
     @classmethod
     def from_gpx(cls, gpx_data: str) -> "GeoPath":
+        import gpxpy
+
         geo_path = cls()
         gpx = gpxpy.parse(gpx_data)
         for track in gpx.tracks:
@@ -130,8 +164,24 @@ class GeoPath:
     def get_path(self) -> List[Trackpoint]:
         return self.path
 
-    def as_tuple_list(self) -> List[Tuple[float, float]]:
-        return [(point.lat, point.lon) for point in self.path]
+    def as_tuple_list(self, max_points: int = None) -> List[Tuple[float, float]]:
+        """
+        get the path as (lat, lon) tuples
+
+        Args:
+            max_points (int): thin out the path to about this many points keeping the first and last point - None for all points
+
+        Returns:
+            List[Tuple[float, float]]: the (lat, lon) tuples
+        """
+        path = self.path
+        if max_points and len(path) > max_points:
+            step = math.ceil(len(path) / max_points)
+            thinned = path[::step]
+            if (len(path) - 1) % step:
+                thinned.append(path[-1])
+            path = thinned
+        return [(point.lat, point.lon) for point in path]
 
     def haversine_distance(self, point1: Trackpoint, point2: Trackpoint) -> float:
         R = 6371.0
@@ -181,6 +231,16 @@ class GeoPath:
         link = tp.as_google_maps_link()
         return link
 
+    def get_info(self, index: int, with_details: bool = True) -> str:
+        """
+        get the info of the point with the given index - this may
+        set up the geocoder and query it so it should run off the event loop
+        """
+        self.validate_index(index)
+        tp = self.path[index]
+        info = tp.get_info(self.nominatim, with_details=with_details)
+        return info
+
     def get_start_location_details(self) -> str:
         if len(self.path) < 1:
             return "No points in path"
@@ -0,0 +1,325 @@
+"""
+Created on 2025-01-07
+
+@author: wf
+"""
+
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from nicetrack.catalog import Catalog
+from nicetrack.http_cache import CacheValidator
+from nicetrack.path_transport import PolylineCodec
+from nicetrack.web_mercator import WebMercator
+
+
+class PngEncoder:
+    """
+    a minimal encoder of 8 bit RGBA images as PNG - see https://www.w3.org/TR/png/
+    """
+
+    signature = b"\x89PNG\r\n\x1a\n"
+
+    @classmethod
+    def chunk(cls, tag: bytes, data: bytes) -> bytes:
+        crc = zlib.crc32(tag + data) & 0xFFFFFFFF
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", crc)
+
+    @classmethod
+    def encode(cls, rgba: np.ndarray, level: int = 6) -> bytes:
+        """
+        encode the given image
+
+        Args:
+            rgba (np.ndarray): the height x width x 4 uint8 image
+            level (int): the zlib compression level
+
+        Returns:
+            bytes: the PNG
+        """
+        height, width = rgba.shape[:2]
+        # each row starts with the filter type 0 - none
+        raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+        raw[:, 1:] = rgba.reshape(height, width * 4)
+        header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+        png = (
+            cls.signature
+            + cls.chunk(b"IHDR", header)
+            + cls.chunk(b"IDAT", zlib.compress(raw.tobytes(), level))
+            + cls.chunk(b"IEND", b"")
+        )
+        return png
+
+
+class Heatmap:
+    """
+    the density of all cataloged tracks as heatmap tiles
+
+    the simplified paths of the catalog are resampled at evenly spaced map
+    positions so that a cell counts how much path crosses it regardless of the
+    recording rate of the track - the samples are binned into sparse per zoom
+    grids of bins x bins cells per tile which are updated incrementally when
+    tracks are ingested or removed
+    """
+
+    # the route of the tiles for Leaflet
+    url_template = "/tiles/heat/{z}/{x}/{y}"
+    # the color ramp from sparse to dense as RGBA
+    ramp_stops = np.array([0.0, 0.25, 0.5, 0.75, 1.0])
+    ramp_colors = np.array(
+        [
+            [0, 0, 255, 96],
+            [0, 255, 255, 160],
+            [0, 255, 0, 192],
+            [255, 255, 0, 224],
+            [255, 0, 0, 255],
+        ],
+        dtype=np.float64,
+    )
+
+    def __init__(
+        self,
+        catalog: Catalog = None,
+        min_zoom: int = 0,
+        max_zoom: int = 12,
+        bins: int = 64,
+        cache_tiles: int = 1024,
+    ):
+        """
+        construct the heatmap
+
+        Args:
+            catalog (Catalog): the catalog to follow - None to add the tracks explicitly
+            min_zoom (int): the lowest zoom level with a grid
+            max_zoom (int): the highest zoom level with a grid - higher zoom levels are cut from it
+            bins (int): the number of cells per tile side - a divisor of the tile size
+            cache_tiles (int): the number of encoded tiles kept in memory
+        """
+        if WebMercator.tile_size % bins:
+            raise ValueError(f"bins {bins} must divide {WebMercator.tile_size}")
+        self.catalog = catalog
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.bins = bins
+        self.cache_tiles = cache_tiles
+        # the sparse grids of each zoom level by tile x and y
+        self.grids: List[Dict[Tuple[int, int], np.ndarray]] = [
+            {} for _zoom in range(max_zoom + 1)
+        ]
+        # the densest cell of each zoom level
+        self.max_counts = [0] * (max_zoom + 1)
+        # the encoded paths of the binned tracks by catalog id
+        self.geometries: Dict[int, str] = {}
+        self.lock = threading.Lock()
+        self.update_lock = threading.Lock()
+        self.tiles: OrderedDict[Tuple[int, int, int], bytes] = OrderedDict()
+        # incremented on every change - part of the validators of the tiles
+        self.version = 0
+        self.updated = time.time()
+        self.empty_png = PngEncoder.encode(
+            np.zeros((WebMercator.tile_size, WebMercator.tile_size, 4), np.uint8)
+        )
+        if catalog is not None:
+            catalog.listeners.append(self.on_ingest)
+
+    def sample(
+        self, geometry: str, precision: int = 5
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        get evenly spaced world coordinates along the given encoded path -
+        half a cell of the highest zoom level apart
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: the x and y world coordinates
+        """
+        positions = PolylineCodec.decode(geometry, precision)
+        x, y = WebMercator.project(positions[:, 0], positions[:, 1])
+        if len(x) < 2:
+            return x, y
+        steps = np.hypot(np.diff(x), np.diff(y))
+        distance = np.concatenate([[0.0], np.cumsum(steps)])
+        spacing = 0.5 / ((1 << self.max_zoom) * self.bins)
+        samples = np.arange(0.0, distance[-1], spacing)
+        return np.interp(samples, distance, x), np.interp(samples, distance, y)
+
+    def bin(self, x: np.ndarray, y: np.ndarray, sign: int = 1) -> int:
+        """
+        add the given world coordinates to the grids of all zoom levels - or remove them
+
+        Args:
+            x (np.ndarray): the x world coordinates
+            y (np.ndarray): the y world coordinates
+            sign (int): 1 to add and -1 to remove
+
+        Returns:
+            int: the number of touched tiles
+        """
+        bins = self.bins
+        touched = 0
+        for zoom in range(self.min_zoom, self.max_zoom + 1):
+            cells = (1 << zoom) * bins
+            cx = np.clip((x * cells).astype(np.int64), 0, cells - 1)
+            cy = np.clip((y * cells).astype(np.int64), 0, cells - 1)
+            tiles = (cx // bins) * (1 << zoom) + cy // bins
+            local = (cy % bins) * bins + cx % bins
+            keys, counts = np.unique(tiles * bins * bins + local, return_counts=True)
+            tile_keys = keys // (bins * bins)
+            # the keys are sorted so each tile is a contiguous run
+            starts = np.flatnonzero(np.diff(tile_keys, prepend=-1))
+            ends = np.append(starts[1:], len(keys))
+            grids = self.grids[zoom]
+            for start, end in zip(starts, ends):
+                tx, ty = divmod(int(tile_keys[start]), 1 << zoom)
+                grid = grids.get((tx, ty))
+                if grid is None:
+                    grid = grids[(tx, ty)] = np.zeros(bins * bins, dtype=np.int32)
+                # the cells of a tile are unique
+                grid[keys[start:end] % (bins * bins)] += sign * counts[start:end]
+                if sign < 0 and not grid.any():
+                    del grids[(tx, ty)]
+            touched += len(starts)
+        return touched
+
+    def add_track(self, track_id: int, geometry: str, precision: int = 5):
+        """
+        add the given encoded path - a track that is already binned is replaced
+        """
+        x, y = self.sample(geometry, precision)
+        with self.lock:
+            old = self.geometries.pop(track_id, None)
+            if old is not None:
+                self.bin(*self.sample(old, precision), sign=-1)
+            self.bin(x, y)
+            self.geometries[track_id] = geometry
+
+    def remove_track(self, track_id: int, precision: int = 5):
+        """
+        remove the track with the given id
+        """
+        with self.lock:
+            geometry = self.geometries.pop(track_id, None)
+            if geometry is not None:
+                self.bin(*self.sample(geometry, precision), sign=-1)
+
+    def changed(self):
+        """
+        invalidate the encoded tiles after a change of the grids
+        """
+        with self.lock:
+            self.max_counts = [
+                max((int(grid.max()) for grid in grids.values()), default=0)
+                for grids in self.grids
+            ]
+            self.tiles.clear()
+            self.version += 1
+            self.updated = time.time()
+
+    def update(self) -> dict:
+        """
+        bring the grids up to date with the catalog - only the added and removed tracks are binned
+
+        Returns:
+            dict: the number of added and removed tracks
+        """
+        with self.update_lock:
+            geometries = self.catalog.get_geometries()
+            removed = [tid for tid in self.geometries if tid not in geometries]
+            added = [tid for tid in geometries if tid not in self.geometries]
+            for track_id in removed:
+                self.remove_track(track_id, self.catalog.precision)
+            for track_id in added:
+                self.add_track(track_id, geometries[track_id], self.catalog.precision)
+            if removed or added:
+                self.changed()
+        return {"added": len(added), "removed": len(removed)}
+
+    def on_ingest(self, _stats: dict):
+        self.update()
+
+    def get_cells(
+        self, z: int, x: int, y: int
+    ) -> Tuple[Optional[np.ndarray], int, int]:
+        """
+        get the cells of the given tile - tiles above the highest zoom level are cut from it
+
+        Returns:
+            Tuple[np.ndarray, int, int]: the cells or None if the tile is empty, the densest cell of the zoom level and the version of the grids they were read from
+        """
+        zoom = min(z, self.max_zoom)
+        factor = 1 << (z - zoom)
+        with self.lock:
+            version = self.version
+            grid = self.grids[zoom].get((x // factor, y // factor))
+            max_count = self.max_counts[zoom]
+            if grid is None:
+                return None, max_count, version
+            cells = grid.reshape(self.bins, self.bins).copy()
+        if factor > 1:
+            size = max(1, self.bins // factor)
+            ox = (x % factor) * self.bins // factor
+            oy = (y % factor) * self.bins // factor
+            cells = cells[oy : oy + size, ox : ox + size]
+            if not cells.any():
+                return None, max_count, version
+        return cells, max_count, version
+
+    def get_validator(self, z: int, x: int, y: int) -> CacheValidator:
+        """
+        get the validator of the given tile - it changes with every update of the grids
+        """
+        validator = CacheValidator(
+            etag=f'"heat-{self.version}-{z}-{x}-{y}"',
+            last_modified=formatdate(self.updated, usegmt=True),
+            mtime=self.updated,
+            immutable=False,
+        )
+        return validator
+
+    def render(self, z: int, x: int, y: int) -> bytes:
+        """
+        render the given tile as PNG
+
+        Raises:
+            ValueError: if the tile does not exist
+        """
+        WebMercator.check_tile(z, x, y)
+        if z < self.min_zoom:
+            return self.empty_png
+        key = (z, x, y)
+        with self.lock:
+            png = self.tiles.get(key)
+            if png is not None:
+                self.tiles.move_to_end(key)
+                return png
+        cells, max_count, version = self.get_cells(z, x, y)
+        if cells is None:
+            png = self.empty_png
+        else:
+            # a logarithmic scale shows single flights next to hot spots
+            level = np.log1p(cells) / np.log1p(max(max_count, 1))
+            rgba = np.stack(
+                [
+                    np.interp(level, self.ramp_stops, self.ramp_colors[:, channel])
+                    for channel in range(4)
+                ],
+                axis=-1,
+            )
+            rgba[cells <= 0] = 0
+            scale = WebMercator.tile_size // len(cells)
+            rgba = np.repeat(np.repeat(rgba, scale, axis=0), scale, axis=1)
+            png = PngEncoder.encode(rgba.astype(np.uint8))
+        with self.lock:
+            # a tile rendered from grids that changed meanwhile must not outlive the change
+            if version != self.version:
+                return png
+            self.tiles[key] = png
+            while len(self.tiles) > self.cache_tiles:
+                self.tiles.popitem(last=False)
+        return png
@@ -0,0 +1,433 @@
+"""
+Created on 2024-12-24
+
+@author: wf
+"""
+
+import asyncio
+import hashlib
+import io
+import math
+import os
+import re
+import struct
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Tuple
+
+from fastapi import HTTPException
+from starlette.responses import Response
+
+from nicetrack.http_cache import CacheValidator
+from nicetrack.metrics import Metrics
+
+
+@dataclass
+class HlsSegment:
+    """
+    a segment of a video starting at a keyframe
+    """
+
+    index: int
+    # presentation timestamps in the time base of the video stream
+    start_pts: int
+    # None for the last segment
+    end_pts: int
+    # seconds
+    duration: float
+
+
+class SegmentCache:
+    """
+    a disk cache for the init and media segments of remuxed videos
+    with least recently used eviction by total size
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = 2 * 1024**3):
+        """
+        construct the cache
+
+        Args:
+            cache_dir (str): the cache directory - default: ~/.nicetrack/hls
+            max_bytes (int): the maximum total size of the cached files
+        """
+        if cache_dir is None:
+            home = str(Path.home())
+            cache_dir = f"{home}/.nicetrack/hls"
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.metrics = Metrics.get_instance()
+        self.size = sum(size for _path, _mtime, size in self.get_entries())
+
+    def get_path(self, key: str, name: str) -> str:
+        """
+        get the path of the cache file for the given video key and file name
+        """
+        return os.path.join(self.cache_dir, key, name)
+
+    def get_entries(self) -> List[Tuple[str, float, int]]:
+        """
+        get the path, modification time and size of all cached files
+        """
+        entries = []
+        for root, _dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def get(self, key: str, name: str) -> bytes:
+        """
+        get the cached content for the given video key and file name
+
+        Returns:
+            bytes: the content or None if it is not cached
+        """
+        path = self.get_path(key, name)
+        try:
+            with open(path, "rb") as cache_file:
+                data = cache_file.read()
+            # the modification time is the last access time for the eviction
+            os.utime(path)
+        except FileNotFoundError:
+            data = None
+        result = "miss" if data is None else "hit"
+        self.metrics.cache_requests.inc("hls", result)
+        return data
+
+    def put(self, key: str, name: str, data: bytes):
+        """
+        cache the given content and evict the least recently used files if needed
+        """
+        path = self.get_path(key, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as cache_file:
+            cache_file.write(data)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """
+        remove the least recently used files until the cache fits its maximum size
+        """
+        entries = sorted(self.get_entries(), key=lambda entry: entry[1])
+        self.size = sum(size for _path, _mtime, size in entries)
+        for path, _mtime, size in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+
+class HlsSegmenter:
+    """
+    remux a video on demand into an HLS playlist of fragmented mp4 segments
+    that start at keyframes - no re-encoding is done so seeking to any time
+    only needs a single small segment
+
+    only the video stream is remuxed - the drone clips have no audio
+    """
+
+    # each segment is written as a fragmented mp4 whose timestamps are kept
+    # as in the source so that the segments fit together
+    options = {
+        "movflags": "frag_keyframe+empty_moov+default_base_moof+frag_discont",
+        "use_editlist": "1",
+    }
+    media_types = {
+        "m3u8": "application/vnd.apple.mpegurl",
+        "mp4": "video/mp4",
+        "m4s": "video/iso.segment",
+    }
+
+    def __init__(
+        self, video_path: str, cache: SegmentCache, target_duration: float = 4.0
+    ):
+        """
+        construct the segmenter
+
+        Args:
+            video_path (str): the path of the video
+            cache (SegmentCache): the disk cache for the segments - None if only the segment boundaries are needed
+            target_duration (float): the minimum duration of a segment in seconds - longer gops give longer segments
+        """
+        self.video_path = video_path
+        self.cache = cache
+        self.target_duration = target_duration
+        self.key = self.get_key(video_path, target_duration)
+        self.lock = threading.Lock()
+        self.container = None
+        self.stream = None
+        self.segments = None
+
+    @classmethod
+    def get_key(cls, video_path: str, target_duration: float = 4.0) -> str:
+        """
+        get the cache key for the segments of the given video - changes with the file
+        """
+        identity = CacheValidator.file_identity(video_path)
+        key = hashlib.sha1(f"{identity}:{target_duration}".encode("utf-8")).hexdigest()
+        return key[:16]
+
+    def open(self):
+        """
+        open my video
+        """
+        if self.container is None:
+            import av
+
+            self.container = av.open(self.video_path)
+            self.stream = self.container.streams.video[0]
+
+    def close(self):
+        """
+        close my video
+        """
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+            self.stream = None
+
+    def probe_keyframe(self, pts: int) -> int:
+        """
+        get the presentation timestamp of the keyframe at or before the given timestamp
+
+        only the packet headers are read - nothing is decoded
+        """
+        self.container.seek(pts, stream=self.stream, backward=True)
+        for packet in self.container.demux(self.stream):
+            if packet.pts is not None and packet.is_keyframe:
+                return packet.pts
+        return None
+
+    def get_end_pts(self) -> int:
+        """
+        get the presentation timestamp of the end of my video stream
+        """
+        import av
+
+        start_pts = self.stream.start_time or 0
+        if self.stream.duration:
+            end_pts = start_pts + self.stream.duration
+        else:
+            end_pts = start_pts + int(
+                self.container.duration / av.time_base / self.stream.time_base
+            )
+        return end_pts
+
+    def get_segments(self) -> List[HlsSegment]:
+        """
+        get the segments of my video
+
+        the keyframes are found by seeking in steps of the target duration
+        so that only a few packets are read even for multi-GB files
+        """
+        if self.segments is None:
+            with self.lock:
+                self.open()
+                time_base = self.stream.time_base
+                start_pts = self.stream.start_time or 0
+                end_pts = self.get_end_pts()
+                step = max(1, int(self.target_duration / time_base))
+                keyframes = []
+                for pts in range(start_pts, end_pts, step):
+                    keyframe = self.probe_keyframe(pts)
+                    if keyframe is not None and (
+                        not keyframes or keyframe > keyframes[-1]
+                    ):
+                        keyframes.append(keyframe)
+                segments = []
+                for index, keyframe in enumerate(keyframes):
+                    is_last = index + 1 == len(keyframes)
+                    next_pts = end_pts if is_last else keyframes[index + 1]
+                    segment = HlsSegment(
+                        index=index,
+                        start_pts=keyframe,
+                        end_pts=None if is_last else next_pts,
+                        duration=float((next_pts - keyframe) * time_base),
+                    )
+                    segments.append(segment)
+                self.segments = segments
+        return self.segments
+
+    def get_version(self) -> str:
+        """
+        get the version of my segments to be used as cache buster in the playlist
+        """
+        return self.key[:8]
+
+    def get_playlist(self) -> str:
+        """
+        get the HLS video on demand playlist
+        """
+        segments = self.get_segments()
+        version = self.get_version()
+        target = max([math.ceil(segment.duration) for segment in segments] + [1])
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:7",
+            f"#EXT-X-TARGETDURATION:{target}",
+            "#EXT-X-PLAYLIST-TYPE:VOD",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-INDEPENDENT-SEGMENTS",
+            f'#EXT-X-MAP:URI="init.mp4?v={version}"',
+        ]
+        for segment in segments:
+            lines.append(f"#EXTINF:{segment.duration:.6f},")
+            lines.append(f"segment_{segment.index}.m4s?v={version}")
+        lines.append("#EXT-X-ENDLIST")
+        playlist = "\n".join(lines) + "\n"
+        return playlist
+
+    @classmethod
+    def split_boxes(cls, data: bytes) -> List[Tuple[str, bytes]]:
+        """
+        split the given mp4 data into its top level boxes
+
+        Returns:
+            List[Tuple[str, bytes]]: the type and the complete bytes of each box
+        """
+        boxes = []
+        offset = 0
+        while offset + 8 <= len(data):
+            size, box_type = struct.unpack(">I4s", data[offset : offset + 8])
+            if size == 1:
+                size = struct.unpack(">Q", data[offset + 8 : offset + 16])[0]
+            elif size == 0:
+                size = len(data) - offset
+            boxes.append((box_type.decode("latin-1"), data[offset : offset + size]))
+            offset += size
+        return boxes
+
+    def remux(self, segment: HlsSegment) -> bytes:
+        """
+        remux the packets of the given segment into a fragmented mp4
+        """
+        import av
+
+        buffer = io.BytesIO()
+        with self.lock:
+            self.open()
+            with av.open(buffer, "w", format="mp4", options=self.options) as output:
+                out_stream = output.add_stream_from_template(self.stream)
+                self.container.seek(
+                    segment.start_pts, stream=self.stream, backward=True
+                )
+                started = False
+                for packet in self.container.demux(self.stream):
+                    # the flushing packet at the end of the stream
+                    if packet.dts is None:
+                        continue
+                    if packet.is_keyframe:
+                        if (
+                            segment.end_pts is not None
+                            and packet.pts >= segment.end_pts
+                        ):
+                            break
+                        if packet.pts >= segment.start_pts:
+                            started = True
+                    if not started:
+                        continue
+                    packet.stream = out_stream
+                    output.mux(packet)
+        return buffer.getvalue()
+
+    def create_segment(self, segment: HlsSegment) -> Tuple[bytes, bytes]:
+        """
+        create and cache the init and media segment for the given segment
+
+        Returns:
+            Tuple[bytes, bytes]: the init segment and the media segment
+        """
+        data = self.remux(segment)
+        boxes = self.split_boxes(data)
+        init = b"".join(box for box_type, box in boxes if box_type in ("ftyp", "moov"))
+        media = b"".join(box for box_type, box in boxes if box_type in ("moof", "mdat"))
+        self.cache.put(self.key, f"segment_{segment.index}.m4s", media)
+        if self.cache.get(self.key, "init.mp4") is None:
+            self.cache.put(self.key, "init.mp4", init)
+        return init, media
+
+    def get_init(self) -> bytes:
+        """
+        get the init segment with the movie header of all media segments
+        """
+        init = self.cache.get(self.key, "init.mp4")
+        if init is None:
+            segments = self.get_segments()
+            if not segments:
+                raise ValueError(f"no keyframes found in {self.video_path}")
+            init, _media = self.create_segment(segments[0])
+        return init
+
+    def get_segment(self, index: int) -> bytes:
+        """
+        get the media segment with the given index
+        """
+        segments = self.get_segments()
+        if index < 0 or index >= len(segments):
+            raise IndexError(f"invalid segment {index} of {len(segments)}")
+        media = self.cache.get(self.key, f"segment_{index}.m4s")
+        if media is None:
+            _init, media = self.create_segment(segments[index])
+        return media
+
+    def get_content(self, name: str) -> bytes:
+        """
+        get the content for the given file name of the playlist
+        """
+        if name == "index.m3u8":
+            return self.get_playlist().encode("utf-8")
+        if name == "init.mp4":
+            return self.get_init()
+        match = re.fullmatch(r"segment_(\d+)\.m4s", name)
+        if not match:
+            raise FileNotFoundError(name)
+        return self.get_segment(int(match.group(1)))
+
+    async def get_response(
+        self, name: str, if_none_match: str = None, if_modified_since: str = None
+    ) -> Response:
+        """
+        get the response for the given file name of the playlist
+
+        Args:
+            name (str): index.m3u8, init.mp4 or segment_<index>.m4s
+            if_none_match (str): the If-None-Match header
+            if_modified_since (str): the If-Modified-Since header
+
+        Returns:
+            Response: the content, 304 Not Modified or 404 for unknown names
+        """
+        validator = CacheValidator.for_file(
+            self.video_path, "hls", self.target_duration, name
+        )
+        if name == "index.m3u8":
+            # the playlist url stays the same when the video changes
+            validator.immutable = False
+        if validator.is_not_modified(if_none_match, if_modified_since):
+            return validator.not_modified_response()
+        try:
+            content = await asyncio.to_thread(self.get_content, name)
+        except (FileNotFoundError, IndexError) as ex:
+            raise HTTPException(status_code=404, detail=str(ex))
+        except ValueError as ex:
+            raise HTTPException(status_code=400, detail=str(ex))
+        media_type = self.media_types[name.rsplit(".", 1)[-1]]
+        return Response(
+            content=content, media_type=media_type, headers=validator.headers
+        )
@@ -0,0 +1,136 @@
+"""
+Created on 2024-12-20
+
+@author: wf
+"""
+
+import hashlib
+import os
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+
+from starlette.responses import Response
+
+
+@dataclass
+class CacheValidator:
+    """
+    strong http cache validators for content derived from a local file
+    that never changes as long as the file stays the same e.g. the frames of a video
+    """
+
+    etag: str
+    last_modified: str
+    mtime: float
+    # a year - the content for a given validator never changes
+    max_age: int = 31536000
+    # False for content that may change under the same url and needs revalidation
+    immutable: bool = True
+
+    @classmethod
+    def file_identity(cls, file_path: str) -> str:
+        """
+        get the identity of the given file from its resolved path, size and modification time
+
+        Args:
+            file_path (str): the path of the file
+
+        Returns:
+            str: the identity
+        """
+        stat = os.stat(file_path)
+        identity = f"{os.path.realpath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return identity
+
+    @classmethod
+    def for_file(cls, file_path: str, *variant) -> "CacheValidator":
+        """
+        get the validator for the given file and variant of its content
+
+        Args:
+            file_path (str): the path of the file
+            *variant: the parameters that select the content e.g. frame, format and size
+
+        Returns:
+            CacheValidator: the validator
+        """
+        identity = cls.file_identity(file_path)
+        key = ":".join([identity] + [str(part) for part in variant])
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        mtime = os.path.getmtime(file_path)
+        validator = cls(
+            etag=f'"{digest}"',
+            last_modified=formatdate(mtime, usegmt=True),
+            mtime=mtime,
+        )
+        return validator
+
+    @classmethod
+    def for_frame(
+        cls,
+        video_path: str,
+        frame_index: int,
+        img_format: str,
+        width: int = None,
+        height: int = None,
+        quality: int = None,
+    ) -> "CacheValidator":
+        """
+        get the validator for the given frame image of the given video
+        """
+        validator = cls.for_file(
+            video_path, frame_index, img_format, f"{width}x{height}", quality
+        )
+        return validator
+
+    @property
+    def headers(self) -> dict:
+        """
+        the caching headers to send with the content
+        """
+        if self.immutable:
+            cache_control = f"public, max-age={self.max_age}, immutable"
+        else:
+            cache_control = "public, no-cache"
+        headers = {
+            "ETag": self.etag,
+            "Last-Modified": self.last_modified,
+            "Cache-Control": cache_control,
+        }
+        return headers
+
+    def is_not_modified(
+        self, if_none_match: str = None, if_modified_since: str = None
+    ) -> bool:
+        """
+        check the conditional request headers
+
+        Args:
+            if_none_match (str): the If-None-Match header
+            if_modified_since (str): the If-Modified-Since header - ignored if If-None-Match is given
+
+        Returns:
+            bool: True if the client's copy is still valid
+        """
+        if if_none_match:
+            for tag in if_none_match.split(","):
+                tag = tag.strip()
+                # If-None-Match uses the weak comparison
+                if tag.startswith("W/"):
+                    tag = tag[2:]
+                if tag == "*" or tag == self.etag:
+                    return True
+            return False
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(self.mtime) <= since
+        return False
+
+    def not_modified_response(self) -> Response:
+        """
+        get a 304 Not Modified response
+        """
+        return Response(status_code=304, headers=self.headers)
@@ -31,6 +31,7 @@ class Map:
             if location:
                 with ui.row() as self.map_row:
                     self.map = LeafletMap(center=location, zoom=self.zoom_level)
+                    self.solution.webserver.configure_map(self.map)
                     await self.map.initialized()
                     self.map.marker(latlng=location)
             with ui.row() as self.label_row:
@@ -0,0 +1,284 @@
+"""
+Created on 2025-01-03
+
+@author: wf
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+
+class NoTimer:
+    """
+    the timer of a disabled metric - does nothing
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        return False
+
+
+NO_TIMER = NoTimer()
+
+
+class Timer:
+    """
+    time a block and observe its duration in a histogram
+    """
+
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: "Histogram", labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Metric:
+    """
+    a metric with labelled values in the Prometheus text format
+    """
+
+    metric_type = "untyped"
+
+    def __init__(self, registry: "Metrics", name: str, help_text: str, labels=()):
+        """
+        construct the metric
+
+        Args:
+            registry (Metrics): the registry that enables the metric
+            name (str): the name of the metric
+            help_text (str): the help text
+            labels: the names of the labels
+        """
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+        registry.metrics.append(self)
+
+    def format_labels(self, labels: Tuple[str, ...], extra: str = None) -> str:
+        parts = []
+        for name, value in zip(self.label_names, labels):
+            escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+            parts.append(f'{name}="{escaped}"')
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    @classmethod
+    def format_value(cls, value: float) -> str:
+        if value == math.inf:
+            return "+Inf"
+        return repr(float(value)) if isinstance(value, float) else str(value)
+
+    def get_samples(self) -> List[str]:
+        with self.lock:
+            items = sorted(self.values.items())
+        return [
+            f"{self.name}{self.format_labels(labels)} {self.format_value(value)}"
+            for labels, value in items
+        ]
+
+    def as_text(self) -> str:
+        """
+        get my help, type and samples
+        """
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        lines.extend(self.get_samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    a monotonically increasing count
+    """
+
+    metric_type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    a value that goes up and down - tracked even when the metrics are
+    disabled so that it is right when they are enabled at runtime
+    """
+
+    metric_type = "gauge"
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    """
+    the distribution of durations in seconds
+    """
+
+    metric_type = "histogram"
+    default_buckets = (
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+    )
+
+    def __init__(
+        self,
+        registry: "Metrics",
+        name: str,
+        help_text: str,
+        labels=(),
+        buckets=default_buckets,
+    ):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # the per bucket counts, the sum and the count by labels
+        self.counts: Dict[Tuple[str, ...], List[int]] = {}
+        self.sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *labels: str):
+        if not self.registry.enabled:
+            return
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.counts.get(labels)
+            if counts is None:
+                counts = self.counts[labels] = [0] * len(self.buckets)
+                self.sums[labels] = 0.0
+            counts[index] += 1
+            self.sums[labels] += value
+
+    def time(self, *labels: str):
+        """
+        time a block e.g. with histogram.time("av"):
+
+        Returns:
+            a context manager - a shared no-op if the metrics are disabled
+        """
+        if not self.registry.enabled:
+            return NO_TIMER
+        return Timer(self, labels)
+
+    def get_samples(self) -> List[str]:
+        with self.lock:
+            items = sorted(
+                (labels, list(counts)) for labels, counts in self.counts.items()
+            )
+            sums = dict(self.sums)
+        samples = []
+        for labels, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{self.format_value(bound)}"'
+                samples.append(
+                    f"{self.name}_bucket{self.format_labels(labels, le)} {cumulative}"
+                )
+            label_text = self.format_labels(labels)
+            samples.append(f"{self.name}_sum{label_text} {repr(sums[labels])}")
+            samples.append(f"{self.name}_count{label_text} {cumulative}")
+        return samples
+
+
+class Metrics:
+    """
+    the process wide registry of the nicetrack metrics in the Prometheus text format
+
+    disabled by default - a disabled counter or histogram returns at its first statement
+    """
+
+    instance = None
+    media_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.metrics: List[Metric] = []
+        self.parse_seconds = Histogram(
+            self, "nicetrack_parse_seconds", "time to parse a track file", ["format"]
+        )
+        self.frame_decode_seconds = Histogram(
+            self,
+            "nicetrack_frame_decode_seconds",
+            "time to seek and decode a video frame",
+            ["backend"],
+        )
+        self.frame_encode_seconds = Histogram(
+            self,
+            "nicetrack_frame_encode_seconds",
+            "time to encode a video frame as an image",
+            ["backend"],
+        )
+        self.frame_seconds = Histogram(
+            self,
+            "nicetrack_frame_seconds",
+            "total latency of a frame request including waiting for the decoder",
+            ["backend"],
+        )
+        self.geocoder_seconds = Histogram(
+            self, "nicetrack_geocoder_seconds", "latency of a geocoder lookup"
+        )
+        self.cache_requests = Counter(
+            self,
+            "nicetrack_cache_requests_total",
+            "cache lookups by cache and result",
+            ["cache", "result"],
+        )
+        self.open_decoders = Gauge(
+            self,
+            "nicetrack_open_decoders",
+            "number of open video decoders",
+            ["backend"],
+        )
+
+    @classmethod
+    def get_instance(cls) -> "Metrics":
+        """
+        get the process wide metrics
+        """
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def as_text(self) -> str:
+        """
+        get all metrics in the Prometheus text exposition format
+        """
+        text = "\n".join(metric.as_text() for metric in self.metrics) + "\n"
+        return text
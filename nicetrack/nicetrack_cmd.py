@@ -4,11 +4,16 @@ Created on 2023-08-16
 @author: wf
 """
 
+import os
 import sys
 from argparse import ArgumentParser
+from pathlib import Path
 
 from ngwidgets.cmd import WebserverCmd
 
+from nicetrack.path_transport import PathTransport
+from nicetrack.request_profiler import RequestProfiler
+from nicetrack.video_stepper_base import VideoStepperBase
 from nicetrack.webserver import WebServer
 
 
@@ -42,8 +47,199 @@ class NiceTrackCmd(WebserverCmd):
             default=WebServer.examples_path(),
             help="path to files [default: %(default)s]",
         )
+        parser.add_argument(
+            "--stepper",
+            default="opencv",
+            choices=list(VideoStepperBase.backends),
+            help="video decoding backend for frame stepping [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--hls_cache_mb",
+            type=int,
+            default=2048,
+            help="maximum size of the HLS segment disk cache in MB [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--proxy",
+            action="store_true",
+            help="transcode low resolution proxies of all videos for scrubbing [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--proxy_height",
+            type=int,
+            default=360,
+            help="maximum height of the proxies [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--proxy_workers",
+            type=int,
+            default=None,
+            help="number of proxy transcoding processes [default: half of the cpus]",
+        )
+        parser.add_argument(
+            "--track_cache_mb",
+            type=int,
+            default=256,
+            help="memory budget of the shared parsed track cache in MB [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--path_transport",
+            default="polyline",
+            choices=PathTransport.modes,
+            help="how paths are sent to the browser [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--path_chunk_points",
+            type=int,
+            default=20000,
+            help="maximum number of path positions per message - 0 for a single message [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--vector_tile_points",
+            type=int,
+            default=200000,
+            help="draw the complete path of tracks with more points from vector tiles - 0 to always send the complete path [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--index_interval",
+            type=float,
+            default=60.0,
+            help="seconds between two background rescans of the file index of the root path - 0 to only scan once [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--tile_cache",
+            action="store_true",
+            help="serve the base map tiles from an offline MBTiles cache in ~/.nicetrack/tiles [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--tile_url",
+            default=None,
+            help="url template of the tile server that fills the tile cache [default: OpenStreetMap]",
+        )
+        parser.add_argument(
+            "--tile_workers",
+            type=int,
+            default=2,
+            help="number of concurrent tile fetches while caching the tiles around a track [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--tile_max_zoom",
+            type=int,
+            default=16,
+            help="highest zoom level of the map tiles that are fetched on demand [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--tile_cache_mb",
+            type=int,
+            default=512,
+            help="size of the tile cache in MB above which no more tiles are fetched on demand [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--seed_zooms",
+            type=int,
+            nargs="+",
+            default=list(range(10, 16)),
+            help="zoom levels of the tiles that are cached around a track [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--catalog",
+            action="store_true",
+            help="catalog all tracks below the root path for spatial and temporal queries and the /catalog map [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--catalog_workers",
+            type=int,
+            default=None,
+            help="number of catalog ingest processes [default: half of the cpus]",
+        )
+        parser.add_argument(
+            "--metrics",
+            action="store_true",
+            help="record latencies and cache counters and serve them at /metrics in the Prometheus text format [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--profile",
+            nargs="?",
+            const="cprofile",
+            choices=RequestProfiler.modes,
+            help="profile the render, video_step and video_feed requests with cProfile or by sampling [default: off - cprofile if no mode is given]",
+        )
+        parser.add_argument(
+            "--profile_dir",
+            default=f"{Path.home()}/.nicetrack/profiles",
+            help="the directory to dump the pstats or speedscope profiles to [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--profile_window",
+            type=float,
+            default=60.0,
+            help="the seconds of each dumped profile window [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--slider_rate",
+            type=float,
+            default=15.0,
+            help="maximum number of time slider updates per second while dragging [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--track_disk_cache",
+            action="store_true",
+            help="keep the parsed tracks in ~/.nicetrack/tracks across restarts [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--track_sidecars",
+            action="store_true",
+            help="write the parsed tracks as sidecar .ntrk files next to local track files [default: %(default)s]",
+        )
+        parser.add_argument(
+            "--export",
+            help="export the --input video with its telemetry burnt in to the given mp4 file",
+        )
+        parser.add_argument(
+            "--srt",
+            help="the SRT telemetry of the video to export [default: the SRT next to the video]",
+        )
+        parser.add_argument(
+            "--export_workers",
+            type=int,
+            default=None,
+            help="number of export processes [default: all cpus]",
+        )
         return parser
 
+    def get_srt_path(self, video_path: str) -> str:
+        """
+        get the SRT file next to the given video
+        """
+        base, _ext = os.path.splitext(video_path)
+        for ext in [".SRT", ".srt"]:
+            srt_path = base + ext
+            if os.path.exists(srt_path):
+                return srt_path
+        raise FileNotFoundError(f"no SRT found for {video_path}")
+
+    def handle_args(self, args) -> bool:
+        """
+        handle the export before the webserver arguments
+        """
+        if args.export:
+            # the export needs the media stacks - the server does not
+            from nicetrack.burnin import BurnInExport
+
+            srt_path = args.srt or self.get_srt_path(args.input)
+            export = BurnInExport(
+                args.input, srt_path, args.export, workers=args.export_workers
+            )
+            stats = export.run()
+            print(
+                f"exported {stats['frames']} frames in {stats['seconds']:.1f} s: "
+                f"{stats['fps']:.1f} fps with {stats['workers']} workers "
+                f"({stats['worker_fps']:.1f} fps per worker)"
+            )
+            return True
+        handled = super().handle_args(args)
+        return handled
+
 
 def main(argv: list = None):
     """
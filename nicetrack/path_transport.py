@@ -0,0 +1,244 @@
+"""
+Created on 2024-12-30
+
+@author: wf
+"""
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+import numpy as np
+from nicegui.elements.leaflet.leaflet_layer import Layer
+
+
+class PolylineCodec:
+    """
+    Google encoded polyline and delta encoded integer arrays of positions -
+    see https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+    """
+
+    @classmethod
+    def to_ints(
+        cls, lat: np.ndarray, lon: np.ndarray, precision: int = 5
+    ) -> np.ndarray:
+        """
+        get the given positions as interleaved integer lat/lon deltas - the first position is absolute
+
+        Returns:
+            np.ndarray: the deltas lat0, lon0, dlat1, dlon1, ...
+        """
+        scale = 10**precision
+        ints = np.empty((len(lat), 2), dtype=np.int64)
+        ints[:, 0] = np.round(np.asarray(lat, dtype=np.float64) * scale)
+        ints[:, 1] = np.round(np.asarray(lon, dtype=np.float64) * scale)
+        # the deltas of the rounded values do not accumulate rounding errors
+        ints[1:] = np.diff(ints, axis=0)
+        return ints.ravel()
+
+    @classmethod
+    def from_ints(cls, deltas: np.ndarray, precision: int = 5) -> np.ndarray:
+        """
+        get the positions from the given interleaved integer deltas
+
+        Returns:
+            np.ndarray: the (lat, lon) positions as an n x 2 array
+        """
+        ints = np.cumsum(np.asarray(deltas, dtype=np.int64).reshape(-1, 2), axis=0)
+        return ints / 10**precision
+
+    @classmethod
+    def encode(cls, lat: np.ndarray, lon: np.ndarray, precision: int = 5) -> str:
+        """
+        encode the given positions as a Google encoded polyline
+
+        Returns:
+            str: the encoded polyline
+        """
+        deltas = cls.to_ints(lat, lon, precision)
+        if len(deltas) == 0:
+            return ""
+        # zigzag - the sign goes to the lowest bit
+        values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+        # split each value into 5 bit chunks - at most 7 for 32 bit values
+        shifts = np.arange(7, dtype=np.int64) * 5
+        chunks = (values[:, None] >> shifts) & 0x1F
+        counts = np.maximum(1, (np.floor(np.log2(np.maximum(values, 1))) // 5 + 1))
+        used = np.arange(7) < counts[:, None]
+        # all but the last chunk of a value have the continuation bit
+        more = np.arange(7) < (counts[:, None] - 1)
+        chunks = chunks | np.where(more, 0x20, 0)
+        encoded = (chunks[used] + 63).astype(np.uint8).tobytes().decode("ascii")
+        return encoded
+
+    @classmethod
+    def decode(cls, encoded: str, precision: int = 5) -> np.ndarray:
+        """
+        decode the given Google encoded polyline
+
+        Returns:
+            np.ndarray: the (lat, lon) positions as an n x 2 array
+        """
+        if not encoded:
+            return np.zeros((0, 2))
+        chunks = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64)
+        chunks -= 63
+        ends = (chunks & 0x20) == 0
+        value_index = np.concatenate([[0], np.cumsum(ends)[:-1]])
+        starts = np.concatenate([[0], np.flatnonzero(ends)[:-1] + 1])
+        position = np.arange(len(chunks)) - starts[value_index]
+        values = np.zeros(int(ends.sum()), dtype=np.int64)
+        np.add.at(values, value_index, (chunks & 0x1F) << (5 * position))
+        deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+        return cls.from_ints(deltas, precision)
+
+
+@dataclass(kw_only=True)
+class EncodedPath(Layer):
+    """
+    a polyline layer whose positions are sent in encoded chunks and
+    decoded in the browser by path_transport.js
+    """
+
+    mode: str
+    chunks: List[Any] = field(default_factory=list)
+    precision: int = 5
+    options: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "type": "nicetrackPath",
+            "args": [self.mode, self.chunks, self.precision, self.options],
+        }
+
+    def append(self, chunk: Any):
+        """
+        append the given encoded chunk to the path in the browser
+        """
+        self.chunks.append(chunk)
+        self.run_method("nicetrackAppend", chunk)
+
+
+class PathTransport:
+    """
+    send paths to the browser as plain json or compactly as
+    Google encoded polylines or delta encoded integer arrays
+    optionally split in chunks for very long tracks
+    """
+
+    modes = ["json", "polyline", "delta"]
+    # the url of the browser side decoder
+    script_url = "/nicetrack/path_transport.js"
+    script_path = os.path.join(
+        os.path.dirname(__file__), "resources", "path_transport.js"
+    )
+    options = {"color": "red", "weight": 3, "opacity": 0.7}
+
+    def __init__(
+        self, mode: str = "polyline", precision: int = 5, chunk_points: int = 20000
+    ):
+        """
+        construct the path transport
+
+        Args:
+            mode (str): "json", "polyline" or "delta"
+            precision (int): the number of decimal digits of the encoded positions
+            chunk_points (int): the maximum number of positions per message - 0 for a single message
+        """
+        if mode not in self.modes:
+            raise ValueError(
+                f"Unknown path transport {mode} - use one of {', '.join(self.modes)}"
+            )
+        self.mode = mode
+        self.precision = precision
+        self.chunk_points = chunk_points
+
+    def encode(self, lat: np.ndarray, lon: np.ndarray) -> List[Any]:
+        """
+        encode the given positions in chunks
+
+        Returns:
+            List[Any]: the payloads of the messages
+        """
+        if self.mode == "json":
+            return [list(zip(np.asarray(lat).tolist(), np.asarray(lon).tolist()))]
+        step = self.chunk_points or len(lat) or 1
+        chunks = []
+        for start in range(0, len(lat), step):
+            chunk_lat = lat[start : start + step]
+            chunk_lon = lon[start : start + step]
+            if self.mode == "polyline":
+                chunk = PolylineCodec.encode(chunk_lat, chunk_lon, self.precision)
+            else:
+                chunk = PolylineCodec.to_ints(chunk_lat, chunk_lon, self.precision)
+                chunk = chunk.tolist()
+            chunks.append(chunk)
+        return chunks
+
+    def add_layer(self, geo_map, chunk: Any, options: Dict = None) -> Layer:
+        """
+        add a path layer with the given first chunk to the given map
+
+        Args:
+            geo_map: the LeafletMap to draw on
+            chunk (Any): the first payload as returned by encode
+            options (Dict): the styling options of the polyline
+
+        Returns:
+            Layer: the layer of the path
+        """
+        if options is None:
+            options = self.options
+        with geo_map:
+            if self.mode == "json":
+                layer = geo_map.draw_path(chunk, options)
+            else:
+                layer = EncodedPath(
+                    mode=self.mode,
+                    chunks=[chunk],
+                    precision=self.precision,
+                    options=options,
+                )
+        return layer
+
+    async def append_chunks(self, layer: EncodedPath, chunks: List[Any]):
+        """
+        append the given chunks to the given path layer one message at a time
+        so that the browser draws the first part while the rest is still sent
+        """
+        for chunk in chunks:
+            # let the outbox send the previous chunk in its own message
+            await asyncio.sleep(0)
+            layer.append(chunk)
+
+    @classmethod
+    def measure(cls, lat: np.ndarray, lon: np.ndarray, precision: int = 5) -> dict:
+        """
+        measure the payload size and encoding time of all modes for the given positions
+
+        Returns:
+            dict: the bytes, the encoding time in ms and the maximum position error of each mode
+        """
+        stats = {}
+        for mode in cls.modes:
+            transport = cls(mode, precision=precision, chunk_points=0)
+            start = time.perf_counter()
+            chunks = transport.encode(lat, lon)
+            payload = json.dumps(chunks, separators=(",", ":"))
+            encode_ms = (time.perf_counter() - start) * 1000
+            if mode == "json":
+                decoded = np.array(chunks[0])
+            elif mode == "polyline":
+                decoded = PolylineCodec.decode(chunks[0], precision)
+            else:
+                decoded = PolylineCodec.from_ints(chunks[0], precision)
+            error = np.abs(decoded - np.column_stack([lat, lon])).max()
+            stats[mode] = {
+                "bytes": len(payload),
+                "encode_ms": encode_ms,
+                "max_error": float(error),
+            }
+        return stats
@@ -0,0 +1,547 @@
+"""
+Created on 2025-01-04
+
+@author: wf
+"""
+
+import cProfile
+import functools
+import inspect
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+# the label of the request the current task or worker thread is working for
+current_request: ContextVar[str] = ContextVar("nicetrack_request", default=None)
+
+
+class ProfiledCoroutine:
+    """
+    drive a coroutine step by step and profile only its own steps - other
+    tasks that run on the event loop in between are not attributed to it
+    """
+
+    def __init__(self, profiler: "RequestProfiler", label: str, coro):
+        self.profiler = profiler
+        self.label = label
+        self.coro = coro
+
+    def __await__(self):
+        send_value, error = None, None
+        while True:
+            entered = self.profiler.enter(self.label)
+            try:
+                if error is None:
+                    future = self.coro.send(send_value)
+                else:
+                    future = self.coro.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                if entered:
+                    self.profiler.exit(self.label)
+            try:
+                send_value, error = (yield future), None
+            except GeneratorExit:
+                self.coro.close()
+                raise
+            except BaseException as ex:
+                send_value, error = None, ex
+
+
+class ProfilingExecutor(ThreadPoolExecutor):
+    """
+    a thread pool that profiles the functions submitted by a profiled request -
+    used as the default executor of the event loop so that the work that
+    asyncio.to_thread moves off the event loop is attributed to its request
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        profiler = RequestProfiler.get_instance()
+        label = current_request.get() if profiler.enabled else None
+        if label is None:
+            return super().submit(fn, *args, **kwargs)
+        return super().submit(profiler.run_worker, label, fn, *args, **kwargs)
+
+
+class ProfileWindow:
+    """
+    the profiles and request times collected in one time window
+    """
+
+    def __init__(self, number: int = 0):
+        self.number = number
+        self.start = time.time()
+        # the cProfile profiles by thread id and request label
+        self.profiles: Dict[Tuple[int, str], cProfile.Profile] = {}
+        # the sampled stacks by request label
+        self.samples: Dict[str, Counter] = {}
+        # the count, total and maximum seconds by request label
+        self.requests: Dict[str, List[float]] = {}
+
+    @property
+    def stamp(self) -> str:
+        start = datetime.fromtimestamp(self.start).strftime("%Y%m%d-%H%M%S")
+        return f"{start}-{self.number:04d}"
+
+    def is_empty(self) -> bool:
+        return not (self.profiles or self.samples or self.requests)
+
+
+class RequestProfiler:
+    """
+    opt-in cProfile or sampling profiles of selected requests - attributed to the
+    request that was served and dumped per time window as pstats or speedscope json
+
+    disabled by default - a disabled profiled function only checks a flag
+    """
+
+    modes = ["cprofile", "sampling"]
+    instance = None
+
+    def __init__(
+        self,
+        profile_dir: str = None,
+        window: float = 60.0,
+        mode: str = "cprofile",
+        interval: float = 0.005,
+        max_files: int = 1000,
+    ):
+        """
+        construct the profiler
+
+        Args:
+            profile_dir (str): the directory to dump the profiles to - default: ~/.nicetrack/profiles
+            window (float): the seconds of each dumped window
+            mode (str): "cprofile" for deterministic profiles as pstats or "sampling" for speedscope json
+            interval (float): the seconds between two samples in sampling mode
+            max_files (int): the maximum number of dumped files to keep - the oldest are removed
+        """
+        if profile_dir is None:
+            profile_dir = f"{Path.home()}/.nicetrack/profiles"
+        self.check_mode(mode)
+        self.profile_dir = profile_dir
+        self.window_seconds = window
+        self.mode = mode
+        self.interval = interval
+        self.max_files = max_files
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.window = ProfileWindow()
+        # the keys of the profiles that are enabled right now
+        self.active = set()
+        # the request label of each thread that runs a profiled step in sampling mode
+        self.thread_labels: Dict[int, str] = {}
+        self.sampler = None
+        self.writer = None
+        self.dumped: List[str] = []
+
+    @classmethod
+    def get_instance(cls) -> "RequestProfiler":
+        """
+        get the process wide profiler
+        """
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    @classmethod
+    def check_mode(cls, mode: str):
+        if mode not in cls.modes:
+            raise ValueError(
+                f"Unknown profile mode {mode} - use one of {', '.join(cls.modes)}"
+            )
+
+    @classmethod
+    def profiled(cls, label: str = None) -> Callable:
+        """
+        decorate a sync or async function to be profiled when the profiler is enabled
+
+        Args:
+            label (str): the request label - None to attribute the calls to the
+            request that is being served e.g. for functions that run in a worker thread
+
+        Returns:
+            Callable: the decorator
+        """
+
+        def decorator(func: Callable) -> Callable:
+            if inspect.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    profiler = cls.get_instance()
+                    if not profiler.enabled:
+                        return await func(*args, **kwargs)
+                    return await profiler.run_async(
+                        label or func.__qualname__, func(*args, **kwargs)
+                    )
+
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                profiler = cls.get_instance()
+                if not profiler.enabled:
+                    return func(*args, **kwargs)
+                return profiler.run(label or func.__qualname__, func, *args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def get_status(self) -> dict:
+        """
+        get my configuration and the state of the current window
+        """
+        with self.lock:
+            requests = {
+                label: int(times[0]) for label, times in self.window.requests.items()
+            }
+        status = {
+            "enabled": self.enabled,
+            "mode": self.mode,
+            "window": self.window_seconds,
+            "profile_dir": self.profile_dir,
+            "requests": requests,
+            "dumped": self.dumped[-10:],
+        }
+        return status
+
+    def enable(self, mode: str = None):
+        """
+        start profiling - in the given mode if it is not None
+        """
+        if mode is not None and mode != self.mode:
+            self.check_mode(mode)
+            self.disable()
+            self.mode = mode
+        if self.enabled:
+            return
+        with self.lock:
+            self.window = ProfileWindow(self.window.number + 1)
+        self.enabled = True
+        if self.mode == "sampling":
+            self.sampler = threading.Thread(
+                target=self.sample_loop, name="nicetrack-sampler", daemon=True
+            )
+            self.sampler.start()
+
+    def disable(self):
+        """
+        stop profiling and dump the current window
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self.sampler is not None:
+            self.sampler.join()
+            self.sampler = None
+        self.flush(wait=True)
+
+    def enter(self, label: str) -> bool:
+        """
+        start profiling a step of the given request in the current thread
+
+        Returns:
+            bool: False if the thread already profiles an enclosing step
+        """
+        if not self.enabled or getattr(self.local, "label", None) is not None:
+            return False
+        self.local.label = label
+        thread_id = threading.get_ident()
+        if self.mode == "sampling":
+            self.thread_labels[thread_id] = label
+            return True
+        key = (thread_id, label)
+        with self.lock:
+            profile = self.window.profiles.get(key)
+            created = profile is None
+            if created:
+                profile = self.window.profiles[key] = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # since python 3.12 only one profiler may be active per interpreter -
+                # it sees the calls of this thread as well
+                if created:
+                    self.window.profiles.pop(key, None)
+                self.local.label = None
+                return False
+            self.active.add(key)
+            self.local.profile = profile
+        return True
+
+    def exit(self, label: str):
+        """
+        stop profiling the step of the given request in the current thread
+        """
+        self.local.label = None
+        thread_id = threading.get_ident()
+        profile = getattr(self.local, "profile", None)
+        if profile is None:
+            # sampling mode
+            self.thread_labels.pop(thread_id, None)
+            return
+        with self.lock:
+            profile.disable()
+            self.local.profile = None
+            self.active.discard((thread_id, label))
+
+    def run(self, label: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        call the given sync function profiled for the current request or the given label
+        """
+        request = current_request.get()
+        if request is not None:
+            label = request
+        token = current_request.set(label)
+        entered = self.enter(label)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if entered:
+                self.exit(label)
+            current_request.reset(token)
+            if request is None:
+                self.record_request(label, time.perf_counter() - start)
+
+    def run_worker(self, label: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        call the given sync function in a worker thread profiled for the request with the given label
+        """
+        entered = self.enter(label)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if entered:
+                self.exit(label)
+
+    async def run_async(self, label: str, coro) -> Any:
+        """
+        await the given coroutine profiled for the current request or the given label
+        """
+        request = current_request.get()
+        if request is not None:
+            label = request
+        token = current_request.set(label)
+        start = time.perf_counter()
+        try:
+            return await ProfiledCoroutine(self, label, coro)
+        finally:
+            current_request.reset(token)
+            if request is None:
+                self.record_request(label, time.perf_counter() - start)
+
+    async def profile_iterator(self, label: str, iterator):
+        """
+        iterate the given async iterator e.g. the body of a streaming response
+        profiled as a request with the given label
+        """
+        if not self.enabled:
+            async for item in iterator:
+                yield item
+            return
+        # the streaming task ends with the iteration - no need to reset
+        current_request.set(label)
+        start = time.perf_counter()
+        try:
+            while True:
+                try:
+                    item = await ProfiledCoroutine(self, label, iterator.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield item
+        finally:
+            self.record_request(label, time.perf_counter() - start)
+
+    def record_request(self, label: str, seconds: float):
+        """
+        record the wall time of a request and dump the window if it is over
+        """
+        with self.lock:
+            times = self.window.requests.setdefault(label, [0, 0.0, 0.0])
+            times[0] += 1
+            times[1] += seconds
+            times[2] = max(times[2], seconds)
+        self.check_window()
+
+    def check_window(self):
+        if time.time() - self.window.start >= self.window_seconds:
+            self.flush()
+
+    def sample_loop(self):
+        """
+        sample the stacks of the threads that work for a profiled request
+        """
+        while self.enabled:
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, label in list(self.thread_labels.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks.append((label, self.get_stack(frame)))
+            with self.lock:
+                for label, stack in stacks:
+                    self.window.samples.setdefault(label, Counter())[stack] += 1
+            self.check_window()
+            time.sleep(self.interval)
+
+    @classmethod
+    def get_stack(cls, frame) -> Tuple[Tuple[str, str, int], ...]:
+        """
+        get the given stack from the root to the given frame
+        """
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            # co_qualname is only available since python 3.11
+            name = getattr(code, "co_qualname", code.co_name)
+            stack.append((name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def flush(self, wait: bool = False):
+        """
+        start a new window and dump the previous one in a background thread
+
+        Args:
+            wait (bool): if True wait until the window is dumped
+        """
+        with self.lock:
+            window = self.window
+            self.window = ProfileWindow(window.number + 1)
+            # profiles that are running right now continue in the new window
+            for key in self.active:
+                self.window.profiles[key] = window.profiles.pop(key)
+            if not window.is_empty():
+                self.writer = threading.Thread(
+                    target=self.dump,
+                    args=(window, self.writer),
+                    name="nicetrack-profile-dump",
+                )
+                self.writer.start()
+            writer = self.writer
+        if wait and writer is not None:
+            writer.join()
+
+    @classmethod
+    def get_file_label(cls, label: str) -> str:
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", label)
+
+    def dump(
+        self, window: ProfileWindow, previous: threading.Thread = None
+    ) -> List[str]:
+        """
+        dump the given window to my profile directory
+
+        Args:
+            window (ProfileWindow): the window to dump
+            previous (threading.Thread): the writer of the previous window to wait for
+
+        Returns:
+            List[str]: the paths of the dumped files
+        """
+        if previous is not None:
+            # keep the windows in order
+            previous.join()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        prefix = os.path.join(self.profile_dir, window.stamp)
+        paths = []
+        by_label: Dict[str, pstats.Stats] = {}
+        for (_thread_id, label), profile in window.profiles.items():
+            try:
+                if label in by_label:
+                    by_label[label].add(profile)
+                else:
+                    by_label[label] = pstats.Stats(profile)
+            except TypeError:
+                # a profile without any calls
+                pass
+        for label, stats in by_label.items():
+            path = f"{prefix}_{self.get_file_label(label)}.prof"
+            stats.dump_stats(path)
+            paths.append(path)
+        if window.samples:
+            path = f"{prefix}.speedscope.json"
+            with open(path, "w") as json_file:
+                json.dump(self.to_speedscope(window), json_file)
+            paths.append(path)
+        if window.requests:
+            path = f"{prefix}_requests.json"
+            requests = {
+                label: {
+                    "count": int(count),
+                    "total_s": total,
+                    "mean_s": total / count,
+                    "max_s": max_s,
+                }
+                for label, (count, total, max_s) in sorted(
+                    window.requests.items(), key=lambda item: -item[1][1]
+                )
+            }
+            with open(path, "w") as json_file:
+                json.dump({"start": window.stamp, "requests": requests}, json_file)
+            paths.append(path)
+        self.dumped.extend(paths)
+        while len(self.dumped) > self.max_files:
+            try:
+                os.remove(self.dumped.pop(0))
+            except OSError:
+                pass
+        return paths
+
+    def to_speedscope(self, window: ProfileWindow) -> dict:
+        """
+        get the sampled stacks of the given window in the speedscope file format -
+        see https://www.speedscope.app/file-format-schema.json
+        """
+        frames = []
+        frame_index = {}
+        profiles = []
+        for label, stacks in window.samples.items():
+            samples = []
+            weights = []
+            for stack, count in stacks.items():
+                indices = []
+                for key in stack:
+                    index = frame_index.get(key)
+                    if index is None:
+                        index = frame_index[key] = len(frames)
+                        name, file, line = key
+                        frames.append({"name": name, "file": file, "line": line})
+                    indices.append(index)
+                samples.append(indices)
+                weights.append(count * self.interval)
+            profiles.append(
+                {
+                    "type": "sampled",
+                    "name": label,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            )
+        speedscope = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"nicetrack {window.stamp}",
+            "exporter": "nicetrack",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+        return speedscope
@@ -0,0 +1,69 @@
+/*
+ * decode the paths sent by nicetrack.path_transport as
+ * Google encoded polylines or delta encoded integer arrays
+ *
+ * loaded as an additional resource of the leaflet map - it registers
+ * the L.nicetrackPath layer factory used by the EncodedPath layer
+ */
+(function (L) {
+  function decodePolyline(encoded, precision) {
+    const scale = Math.pow(10, precision);
+    const points = [];
+    let index = 0;
+    let lat = 0;
+    let lon = 0;
+    while (index < encoded.length) {
+      const deltas = [0, 0];
+      for (let i = 0; i < 2; i++) {
+        let shift = 0;
+        let value = 0;
+        let chunk;
+        do {
+          chunk = encoded.charCodeAt(index++) - 63;
+          // no bitwise operators - values may exceed 31 bits
+          value += (chunk & 0x1f) * Math.pow(2, shift);
+          shift += 5;
+        } while (chunk >= 0x20);
+        deltas[i] = value % 2 ? -(value + 1) / 2 : value / 2;
+      }
+      lat += deltas[0];
+      lon += deltas[1];
+      points.push([lat / scale, lon / scale]);
+    }
+    return points;
+  }
+
+  function decodeDeltas(deltas, precision) {
+    const scale = Math.pow(10, precision);
+    const points = [];
+    let lat = 0;
+    let lon = 0;
+    for (let i = 0; i + 1 < deltas.length; i += 2) {
+      lat += deltas[i];
+      lon += deltas[i + 1];
+      points.push([lat / scale, lon / scale]);
+    }
+    return points;
+  }
+
+  function decode(mode, chunk, precision) {
+    return mode === "polyline" ? decodePolyline(chunk, precision) : decodeDeltas(chunk, precision);
+  }
+
+  if (L) {
+    L.nicetrackPath = function (mode, chunks, precision, options) {
+      let latlngs = [];
+      for (const chunk of chunks) {
+        latlngs = latlngs.concat(decode(mode, chunk, precision));
+      }
+      const polyline = L.polyline(latlngs, options);
+      polyline.nicetrackAppend = function (chunk) {
+        this.setLatLngs(this.getLatLngs().concat(decode(mode, chunk, precision)));
+      };
+      return polyline;
+    };
+  }
+  if (typeof module !== "undefined") {
+    module.exports = { decodePolyline, decodeDeltas };
+  }
+})(typeof window !== "undefined" ? window.L : undefined);
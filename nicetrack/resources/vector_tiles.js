@@ -0,0 +1,158 @@
+/*
+ * draw the Mapbox Vector Tiles of nicetrack.vector_tiles on canvas tiles
+ *
+ * a minimal renderer of the line features of the tiles served by the
+ * /tiles/track route - loaded on demand when the first track with more than
+ * --vector_tile_points points is drawn - it registers the L.nicetrackTiles
+ * layer factory
+ */
+(function (L) {
+  // the protocol buffers wire types
+  const VARINT = 0;
+  const FIXED64 = 1;
+  const LENGTH_DELIMITED = 2;
+  const FIXED32 = 5;
+
+  function readVarint(bytes, state) {
+    let value = 0;
+    let factor = 1;
+    let byte;
+    do {
+      byte = bytes[state.offset++];
+      // no bitwise operators - values may exceed 31 bits
+      value += (byte & 0x7f) * factor;
+      factor *= 128;
+    } while (byte >= 0x80);
+    return value;
+  }
+
+  function readFields(bytes) {
+    const fields = [];
+    const state = { offset: 0 };
+    while (state.offset < bytes.length) {
+      const key = readVarint(bytes, state);
+      const number = Math.floor(key / 8);
+      const wireType = key % 8;
+      let value = null;
+      if (wireType === VARINT) {
+        value = readVarint(bytes, state);
+      } else if (wireType === LENGTH_DELIMITED) {
+        const length = readVarint(bytes, state);
+        value = bytes.subarray(state.offset, state.offset + length);
+        state.offset += length;
+      } else if (wireType === FIXED64) {
+        state.offset += 8;
+      } else if (wireType === FIXED32) {
+        state.offset += 4;
+      } else {
+        throw new Error("unsupported wire type " + wireType);
+      }
+      fields.push([number, value]);
+    }
+    return fields;
+  }
+
+  function readPacked(bytes) {
+    const values = [];
+    const state = { offset: 0 };
+    while (state.offset < bytes.length) {
+      values.push(readVarint(bytes, state));
+    }
+    return values;
+  }
+
+  function zigzag(value) {
+    return value % 2 ? -(value + 1) / 2 : value / 2;
+  }
+
+  /*
+   * decode the lines of all layers of the given tile
+   * as arrays of [x, y] tile coordinates scaled to the given size
+   */
+  function decodeLines(bytes, size) {
+    const lines = [];
+    for (const [number, layer] of readFields(bytes)) {
+      if (number !== 3) continue;
+      const layerFields = readFields(layer);
+      let extent = 4096;
+      for (const [field, value] of layerFields) {
+        if (field === 5) extent = value;
+      }
+      const scale = size / extent;
+      for (const [field, feature] of layerFields) {
+        if (field !== 2) continue;
+        let geometry = null;
+        for (const [featureField, value] of readFields(feature)) {
+          if (featureField === 4) geometry = readPacked(value);
+        }
+        if (geometry === null) continue;
+        let x = 0;
+        let y = 0;
+        let i = 0;
+        while (i < geometry.length) {
+          const command = geometry[i] % 8;
+          const count = Math.floor(geometry[i] / 8);
+          i += 1;
+          // 1: move to 2: line to 7: close path
+          if (command === 1) lines.push([]);
+          if (command === 7) continue;
+          for (let n = 0; n < count; n++) {
+            x += zigzag(geometry[i]);
+            y += zigzag(geometry[i + 1]);
+            lines[lines.length - 1].push([x * scale, y * scale]);
+            i += 2;
+          }
+        }
+      }
+    }
+    return lines;
+  }
+
+  if (L) {
+    L.NicetrackTiles = L.GridLayer.extend({
+      initialize: function (url, options) {
+        this._url = url;
+        L.GridLayer.prototype.initialize.call(this, options);
+      },
+
+      createTile: function (coords, done) {
+        const tile = L.DomUtil.create("canvas", "leaflet-tile");
+        const size = this.getTileSize();
+        const ratio = window.devicePixelRatio || 1;
+        tile.width = size.x * ratio;
+        tile.height = size.y * ratio;
+        const style = this.options.style || {};
+        const url = L.Util.template(this._url, coords);
+        fetch(url)
+          .then((response) => (response.ok ? response.arrayBuffer() : new ArrayBuffer(0)))
+          .then((buffer) => {
+            const context = tile.getContext("2d");
+            context.scale(ratio, ratio);
+            context.strokeStyle = style.color || "red";
+            context.globalAlpha = style.opacity === undefined ? 1.0 : style.opacity;
+            context.lineWidth = style.weight || 3;
+            context.lineJoin = "round";
+            context.lineCap = "round";
+            for (const line of decodeLines(new Uint8Array(buffer), size.x)) {
+              context.beginPath();
+              context.moveTo(line[0][0], line[0][1]);
+              for (let i = 1; i < line.length; i++) {
+                context.lineTo(line[i][0], line[i][1]);
+              }
+              context.stroke();
+            }
+            done(null, tile);
+          })
+          .catch((error) => done(error, tile));
+        return tile;
+      },
+    });
+
+    L.nicetrackTiles = function (url, options) {
+      return new L.NicetrackTiles(url, options);
+    };
+  }
+  if (typeof module !== "undefined") {
+    module.exports = { decodeLines };
+  }
+})(typeof window !== "undefined" ? window.L : undefined);
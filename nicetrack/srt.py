@@ -75,6 +75,19 @@ class SRT:
         d = self.as_unified_dict(d)
         return d
 
+    def as_telemetry(self, index: int) -> dict:
+        """
+        convert the subtitle at the given index to a dict of all its values -
+        the raw values e.g. the camera settings plus the unified position values
+        """
+        s = self.subtitles[index].text
+        if "<font" in s:
+            d = self.as_dji_dict(s)
+        else:
+            d = self.as_srt_dict(s)
+        d.update(self.as_unified_dict(d))
+        return d
+
     def as_unified_dict(self, data_dict: dict) -> dict:
         unified_dict = {}
 
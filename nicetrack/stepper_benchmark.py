@@ -0,0 +1,238 @@
+"""
+Created on 2024-12-22
+
+@author: wf
+"""
+
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from fractions import Fraction
+from typing import Dict, List, Union
+
+import av
+import numpy as np
+
+from nicetrack.video_stepper_base import VideoStepperBase
+
+
+@dataclass
+class BenchmarkResult:
+    """
+    the result of benchmarking a stepper backend on a test clip
+    """
+
+    backend: str
+    codec: str
+    width: int
+    height: int
+    frames: int
+    # seconds from opening the video to having the first frame
+    first_frame_latency: float = 0.0
+    # seconds per random seek
+    seek_latency_mean: float = 0.0
+    seek_latency_median: float = 0.0
+    seek_latency_p95: float = 0.0
+    # frames per second when stepping forward frame by frame
+    step_fps: float = 0.0
+    # resident memory growth in MB while the stepper is in use
+    memory_mb: float = 0.0
+
+
+@dataclass
+class StepperBenchmark:
+    """
+    reproducible benchmark of the video stepper backends on locally generated clips
+    """
+
+    work_dir: str
+    width: int = 1280
+    height: int = 720
+    frames: int = 120
+    fps: int = 30
+    gop: int = 30
+    bframes: int = 2
+    seeks: int = 20
+    steps: int = 30
+    seed: int = 42
+    results: List[BenchmarkResult] = field(default_factory=list)
+
+    # the ffmpeg encoders for the codecs to benchmark
+    encoders = {"h264": "libx264", "h265": "libx265"}
+
+    @classmethod
+    def create_clip(
+        cls,
+        video_path: str,
+        codec: str = "h264",
+        width: int = 1280,
+        height: int = 720,
+        frames: int = 120,
+        fps: Union[int, Fraction] = 30,
+        gop: int = 30,
+        bframes: int = 2,
+    ):
+        """
+        create a synthetic test clip - a moving gradient with a frame counter bar
+
+        Args:
+            video_path (str): the path of the mp4 file to create
+            codec (str): "h264" or "h265"
+            width (int): the width of the clip
+            height (int): the height of the clip
+            frames (int): the number of frames
+            fps (Union[int, Fraction]): the frame rate e.g. Fraction(24000, 1001)
+            gop (int): the keyframe interval
+            bframes (int): the number of consecutive b-frames
+        """
+        encoder = cls.encoders[codec]
+        with av.open(video_path, "w") as container:
+            stream = container.add_stream(encoder, rate=Fraction(fps))
+            stream.width = width
+            stream.height = height
+            stream.pix_fmt = "yuv420p"
+            params_key = "x264-params" if encoder == "libx264" else "x265-params"
+            params = f"bframes={bframes}:keyint={gop}:min-keyint={gop}"
+            if encoder == "libx265":
+                params += ":log-level=error"
+            stream.options = {"preset": "ultrafast", params_key: params}
+            x = np.linspace(0, 255, width, dtype=np.float32)
+            for i in range(frames):
+                row = ((x + i * 10) % 256).astype(np.uint8)
+                img = np.repeat(np.repeat(row[None, :, None], height, 0), 3, 2)
+                # a bar whose length shows the frame index
+                bar = int(width * (i + 1) / frames)
+                img[: height // 10, :bar] = 255
+                frame = av.VideoFrame.from_ndarray(img, format="rgb24")
+                for packet in stream.encode(frame):
+                    container.mux(packet)
+            for packet in stream.encode():
+                container.mux(packet)
+
+    @classmethod
+    def get_rss_mb(cls) -> float:
+        """
+        get the current resident set size of this process in MB
+        """
+        statm = "/proc/self/statm"
+        if os.path.exists(statm):
+            with open(statm) as f:
+                pages = int(f.read().split()[1])
+            return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+        # fall back to the peak size - KB on linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return rss / divisor
+
+    def get_clip(self, codec: str) -> str:
+        """
+        get the test clip for the given codec - creating it if necessary
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        video_path = os.path.join(
+            self.work_dir,
+            f"bench_{codec}_{self.width}x{self.height}_{self.frames}_g{self.gop}.mp4",
+        )
+        if not os.path.exists(video_path):
+            self.create_clip(
+                video_path,
+                codec,
+                self.width,
+                self.height,
+                self.frames,
+                self.fps,
+                self.gop,
+                self.bframes,
+            )
+        return video_path
+
+    def run_backend(self, backend: str, codec: str) -> BenchmarkResult:
+        """
+        benchmark the given backend on the clip of the given codec
+        """
+        video_path = self.get_clip(codec)
+        result = BenchmarkResult(
+            backend=backend,
+            codec=codec,
+            width=self.width,
+            height=self.height,
+            frames=self.frames,
+        )
+        rss_before = self.get_rss_mb()
+        start = time.perf_counter()
+        # the frame rate of the stepper is the one of the clip
+        stepper = VideoStepperBase.create(backend, video_path)
+        frame = stepper.get_frame(0)
+        result.first_frame_latency = time.perf_counter() - start
+        if frame is None:
+            raise ValueError(f"{backend} could not decode the first frame of {codec}")
+        # random seeks - the same positions for every backend
+        rng = random.Random(self.seed)
+        latencies = []
+        for _ in range(self.seeks):
+            frame_index = rng.randrange(self.frames)
+            start = time.perf_counter()
+            stepper.get_frame(frame_index)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        result.seek_latency_mean = statistics.mean(latencies)
+        result.seek_latency_median = statistics.median(latencies)
+        result.seek_latency_p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        # sequential stepping - only the first frame is seeked to
+        steps = min(self.steps, self.frames - 1)
+        stepper.get_frame(0)
+        start = time.perf_counter()
+        for frame_index in range(1, steps + 1):
+            if stepper.get_frame(frame_index) is None:
+                raise ValueError(f"{backend} could not step to frame {frame_index}")
+        result.step_fps = steps / (time.perf_counter() - start)
+        result.memory_mb = self.get_rss_mb() - rss_before
+        stepper.close()
+        return result
+
+    def run(self, backends: List[str] = None, codecs: List[str] = None):
+        """
+        run the benchmark for all given backends and codecs
+        """
+        if backends is None:
+            backends = list(VideoStepperBase.backends)
+        if codecs is None:
+            codecs = list(self.encoders)
+        for codec in codecs:
+            for backend in backends:
+                result = self.run_backend(backend, codec)
+                self.results.append(result)
+        return self.results
+
+    def as_dict(self) -> Dict:
+        """
+        get the benchmark settings, environment and results
+        """
+        settings = asdict(self)
+        results = settings.pop("results")
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "av": av.__version__,
+            },
+            "settings": settings,
+            "results": results,
+        }
+        return record
+
+    def save(self, json_path: str):
+        """
+        save the results as JSON for regression tracking
+        """
+        with open(json_path, "w") as json_file:
+            json.dump(self.as_dict(), json_file, indent=2)
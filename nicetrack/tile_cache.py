@@ -0,0 +1,503 @@
+"""
+Created on 2025-01-09
+
+@author: wf
+"""
+
+import hashlib
+import http.client
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.utils import formatdate
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from nicetrack.catalog import BoundingBox
+from nicetrack.http_cache import CacheValidator
+from nicetrack.track_cache import Track
+from nicetrack.version import Version
+from nicetrack.web_mercator import WebMercator
+
+
+class MBTiles:
+    """
+    a store of map tiles in the MBTiles format - see https://github.com/mapbox/mbtiles-spec
+
+    the rows of the tiles are in the TMS scheme with y to the north - the
+    additional last_modified column keeps the time a tile was fetched
+    """
+
+    def __init__(self, db_path: str, name: str = "nicetrack", tile_format: str = "png"):
+        """
+        construct the store
+
+        Args:
+            db_path (str): the path of the SQLite database
+            name (str): the name of the tile set
+            tile_format (str): the image format of the tiles
+        """
+        self.db_path = db_path
+        self.name = name
+        self.tile_format = tile_format
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.create_schema()
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        get a new connection - connections are not shared between threads
+        """
+        connection = sqlite3.connect(self.db_path, timeout=30.0)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def create_schema(self):
+        with self.connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata (name TEXT UNIQUE, value TEXT)"
+            )
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS tiles (
+                    zoom_level INTEGER,
+                    tile_column INTEGER,
+                    tile_row INTEGER,
+                    tile_data BLOB,
+                    last_modified REAL
+                )""")
+            connection.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS tile_index
+                ON tiles (zoom_level, tile_column, tile_row)""")
+            connection.executemany(
+                "INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)",
+                [
+                    ("name", self.name),
+                    ("format", self.tile_format),
+                    ("type", "baselayer"),
+                ],
+            )
+        connection.close()
+
+    @classmethod
+    def tms_row(cls, z: int, y: int) -> int:
+        """
+        get the TMS row of the given slippy map tile row - the mapping is its own inverse
+        """
+        return (1 << z) - 1 - y
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[Tuple[bytes, float]]:
+        """
+        get the given tile
+
+        Returns:
+            Tuple[bytes, float]: the tile and the time it was fetched - None if it is not stored
+        """
+        connection = self.connect()
+        try:
+            row = connection.execute(
+                """SELECT tile_data, last_modified FROM tiles
+                WHERE zoom_level=? AND tile_column=? AND tile_row=?""",
+                (z, x, self.tms_row(z, y)),
+            ).fetchone()
+        finally:
+            connection.close()
+        return row
+
+    def put_tiles(
+        self, tiles: Iterable[Tuple[int, int, int, bytes]]
+    ) -> Tuple[float, int]:
+        """
+        store the given z, x, y and data of tiles replacing older versions
+
+        Returns:
+            Tuple[float, int]: the time of the tiles and the number of bytes the store grew by
+        """
+        now = time.time()
+        grown = 0
+        with self.connect() as connection:
+            for z, x, y, data in tiles:
+                key = (z, x, self.tms_row(z, y))
+                row = connection.execute(
+                    """SELECT LENGTH(tile_data) FROM tiles
+                    WHERE zoom_level=? AND tile_column=? AND tile_row=?""",
+                    key,
+                ).fetchone()
+                connection.execute(
+                    """INSERT OR REPLACE INTO tiles
+                    (zoom_level, tile_column, tile_row, tile_data, last_modified)
+                    VALUES (?, ?, ?, ?, ?)""",
+                    (*key, data, now),
+                )
+                replaced = row[0] if row and row[0] else 0
+                grown += len(data) - replaced
+        connection.close()
+        return now, grown
+
+    def get_stored(self, z: int) -> set:
+        """
+        get the x and y of the stored tiles of the given zoom level
+        """
+        connection = self.connect()
+        try:
+            rows = connection.execute(
+                "SELECT tile_column, tile_row FROM tiles WHERE zoom_level=?", (z,)
+            ).fetchall()
+        finally:
+            connection.close()
+        return {(x, self.tms_row(z, row)) for x, row in rows}
+
+    def get_size(self) -> int:
+        """
+        get the number of bytes of all stored tiles
+        """
+        connection = self.connect()
+        try:
+            return connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(tile_data)), 0) FROM tiles"
+            ).fetchone()[0]
+        finally:
+            connection.close()
+
+    def count(self) -> int:
+        connection = self.connect()
+        try:
+            return connection.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+        finally:
+            connection.close()
+
+
+class ConnectionPool:
+    """
+    a pool of keep-alive http connections by host - a connection is used by
+    one thread at a time and put back after its response has been read
+    """
+
+    def __init__(self, max_idle: int = 8, timeout: float = 10.0):
+        """
+        construct the pool
+
+        Args:
+            max_idle (int): the number of idle connections kept per host
+            timeout (float): the socket timeout in seconds
+        """
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.idle: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = {}
+        self.lock = threading.Lock()
+        self.created = 0
+
+    def acquire(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        with self.lock:
+            idle = self.idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+            self.created += 1
+        connection_class = (
+            http.client.HTTPSConnection
+            if scheme == "https"
+            else http.client.HTTPConnection
+        )
+        return connection_class(netloc, timeout=self.timeout)
+
+    def release(self, scheme: str, netloc: str, connection: http.client.HTTPConnection):
+        with self.lock:
+            idle = self.idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def get(self, url: str, headers: dict) -> Tuple[int, bytes]:
+        """
+        get the given url - a failed request e.g. on a connection that the server
+        has closed meanwhile or that timed out is retried once on a new connection
+
+        Returns:
+            Tuple[int, bytes]: the status and the body
+        """
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        for attempt in range(2):
+            connection = self.acquire(parts.scheme, parts.netloc)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if attempt:
+                    raise
+                continue
+            if response.will_close:
+                connection.close()
+            else:
+                self.release(parts.scheme, parts.netloc, connection)
+            return response.status, body
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for connection in idle:
+                    connection.close()
+            self.idle.clear()
+
+
+class TileCache:
+    """
+    an offline cache of the base map tiles - tiles are fetched from the
+    upstream tile server once and served from a local MBTiles store from then on
+
+    seeding the tiles around a track before going into the field should stay
+    within the usage policy of the tile server e.g. https://operations.osmfoundation.org/policies/tiles/ -
+    so only a few connections are used and on demand fetching is limited in zoom and store size
+    """
+
+    # the route of the cached tiles for Leaflet
+    url_template = "/tiles/base/{z}/{x}/{y}.png"
+    default_upstream = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+
+    def __init__(
+        self,
+        db_path: str = None,
+        upstream: str = None,
+        workers: int = 2,
+        max_seed_tiles: int = 10000,
+        max_age: int = 30 * 24 * 3600,
+        max_zoom: int = 16,
+        max_bytes: int = 512 * 1024 * 1024,
+    ):
+        """
+        construct the tile cache
+
+        Args:
+            db_path (str): the path of the MBTiles store - None for the default in the home directory
+            upstream (str): the url template of the tile server - may contain {s} for the subdomains a, b and c
+            workers (int): the number of concurrent fetches while seeding
+            max_seed_tiles (int): the maximum number of tiles of one seeding
+            max_age (int): the seconds browsers may keep a tile
+            max_zoom (int): the highest zoom level of the tiles that are fetched on demand
+            max_bytes (int): the size of the store above which no more tiles are fetched on demand
+        """
+        self.db_path = db_path or self.default_db_path()
+        self.upstream = upstream or self.default_upstream
+        self.workers = workers
+        self.max_seed_tiles = max_seed_tiles
+        self.max_age = max_age
+        self.max_zoom = max_zoom
+        self.max_bytes = max_bytes
+        self.store = MBTiles(self.db_path)
+        self.size = self.store.get_size()
+        self.pool = ConnectionPool(max_idle=workers)
+        self.headers = {"User-Agent": f"{Version.name}/{Version.version}"}
+        # the fetches in progress by tile so that concurrent misses fetch once
+        self.pending: Dict[Tuple[int, int, int], Future] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def default_db_path(cls) -> str:
+        return f"{Path.home()}/.nicetrack/tiles/base.mbtiles"
+
+    def get_upstream_url(self, z: int, x: int, y: int) -> str:
+        url = self.upstream.format(z=z, x=x, y=y, s="abc"[(x + y) % 3])
+        return url
+
+    def fetch(self, z: int, x: int, y: int) -> bytes:
+        """
+        fetch the given tile from the tile server
+
+        Raises:
+            IOError: if the tile server does not deliver the tile
+        """
+        url = self.get_upstream_url(z, x, y)
+        try:
+            status, body = self.pool.get(url, self.headers)
+        except http.client.HTTPException as ex:
+            raise IOError(f"{url} failed: {ex}") from ex
+        if status != 200:
+            raise IOError(f"{url} failed with status {status}")
+        return body
+
+    def put_tiles(self, tiles: List[Tuple[int, int, int, bytes]]) -> float:
+        """
+        store the given tiles and account for their size
+
+        Returns:
+            float: the time of the tiles
+        """
+        fetched, grown = self.store.put_tiles(tiles)
+        with self.lock:
+            self.size += grown
+        return fetched
+
+    def may_fetch(self, z: int) -> bool:
+        """
+        check whether a missing tile of the given zoom level may be fetched on demand
+        """
+        return z <= self.max_zoom and self.size < self.max_bytes
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[Tuple[bytes, float]]:
+        """
+        get the given tile from the store - fetching and storing it on a miss
+        within the on demand limits
+
+        Returns:
+            Tuple[bytes, float]: the tile and the time it was fetched - None if it is
+            not stored and above the maximum zoom level or the store is full
+
+        Raises:
+            ValueError: if the tile does not exist
+            IOError: if the tile is not stored and can not be fetched
+        """
+        WebMercator.check_tile(z, x, y)
+        stored = self.store.get_tile(z, x, y)
+        if stored is not None:
+            self.hits += 1
+            return stored
+        if not self.may_fetch(z):
+            return None
+        key = (z, x, y)
+        with self.lock:
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+                self.misses += 1
+        if owner:
+            try:
+                data = self.fetch(z, x, y)
+                fetched = self.put_tiles([(z, x, y, data)])
+                future.set_result((data, fetched))
+            except Exception as ex:
+                future.set_exception(ex)
+            finally:
+                with self.lock:
+                    del self.pending[key]
+        return future.result()
+
+    def get_validator(self, data: bytes, fetched: float) -> CacheValidator:
+        """
+        get the validator of the given tile - browsers keep it for max_age seconds
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        validator = CacheValidator(
+            etag=f'"{digest}"',
+            last_modified=formatdate(fetched, usegmt=True),
+            mtime=fetched,
+            max_age=self.max_age,
+        )
+        return validator
+
+    def get_seed_tiles(
+        self, bbox: BoundingBox, zooms: Iterable[int], margin: int = 1
+    ) -> List[Tuple[int, int, int]]:
+        """
+        get the tiles that cover the given bounding box at the given zoom levels
+
+        Args:
+            bbox (BoundingBox): the area to cover
+            zooms (Iterable[int]): the zoom levels
+            margin (int): the number of additional tiles around the area at each zoom level
+
+        Returns:
+            List[Tuple[int, int, int]]: the z, x and y of the tiles
+        """
+        tiles = []
+        for z in zooms:
+            n = 1 << z
+            min_x, min_y = WebMercator.get_tile(bbox.max_lat, bbox.min_lon, z)
+            max_x, max_y = WebMercator.get_tile(bbox.min_lat, bbox.max_lon, z)
+            for y in range(max(0, min_y - margin), min(n - 1, max_y + margin) + 1):
+                for x in range(max(0, min_x - margin), min(n - 1, max_x + margin) + 1):
+                    tiles.append((z, x, y))
+        return tiles
+
+    def seed(self, bbox: BoundingBox, zooms: Iterable[int], margin: int = 1) -> dict:
+        """
+        fetch the missing tiles around the given bounding box concurrently
+
+        Args:
+            bbox (BoundingBox): the area to cover
+            zooms (Iterable[int]): the zoom levels
+            margin (int): the number of additional tiles around the area at each zoom level
+
+        Returns:
+            dict: the number of tiles, already cached, fetched and failed tiles and the seconds it took
+
+        Raises:
+            ValueError: if the area needs more than max_seed_tiles tiles
+        """
+        start = time.time()
+        tiles = self.get_seed_tiles(bbox, zooms, margin)
+        if len(tiles) > self.max_seed_tiles:
+            raise ValueError(
+                f"{len(tiles)} tiles exceed the limit of {self.max_seed_tiles} - choose fewer zoom levels"
+            )
+        stored = {z: self.store.get_stored(z) for z in {tile[0] for tile in tiles}}
+        missing = [(z, x, y) for z, x, y in tiles if (x, y) not in stored[z]]
+
+        def fetch(tile: Tuple[int, int, int]):
+            try:
+                return tile, self.fetch(*tile)
+            except IOError:
+                return tile, None
+
+        fetched = 0
+        failed = 0
+        batch = []
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="tile-seed"
+        ) as executor:
+            for (z, x, y), data in executor.map(fetch, missing):
+                if data is None:
+                    failed += 1
+                    continue
+                batch.append((z, x, y, data))
+                # stored in batches so that an interrupted seeding keeps its tiles
+                if len(batch) >= 100:
+                    self.put_tiles(batch)
+                    fetched += len(batch)
+                    batch = []
+        self.put_tiles(batch)
+        fetched += len(batch)
+        stats = {
+            "tiles": len(tiles),
+            "cached": len(tiles) - len(missing),
+            "fetched": fetched,
+            "failed": failed,
+            "seconds": time.time() - start,
+        }
+        return stats
+
+    def seed_track(self, track: Track, zooms: Iterable[int], margin: int = 1) -> dict:
+        """
+        fetch the missing tiles around the bounding box of the given track
+
+        see seed
+        """
+        bbox = BoundingBox(
+            float(np.nanmin(track.lat)),
+            float(np.nanmin(track.lon)),
+            float(np.nanmax(track.lat)),
+            float(np.nanmax(track.lon)),
+        )
+        return self.seed(bbox, zooms, margin)
+
+    def use(self, geo_map):
+        """
+        let the given map load its base tiles from the cache - before the map is initialized
+
+        Args:
+            geo_map: the LeafletMap
+        """
+        for layer in geo_map.layers:
+            # the default OpenStreetMap layer - not the local heatmap or other routes
+            if layer.to_dict()["type"] == "tileLayer" and "://" in layer.url_template:
+                layer.url_template = self.url_template
+
+    def close(self):
+        self.pool.close()
@@ -0,0 +1,394 @@
+"""
+Created on 2025-01-02
+
+@author: wf
+"""
+
+import asyncio
+import gzip
+import io
+import json
+from typing import Dict, List, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+from starlette.responses import Response
+
+from nicetrack.http_cache import CacheValidator
+from nicetrack.track_cache import Track, TrackCache
+
+
+class TrackApi:
+    """
+    serve the columns and statistics of parsed tracks as
+    gzip'd json, raw little-endian float64 arrays or npz
+    """
+
+    media_types = {
+        "json": "application/json",
+        "bin": "application/octet-stream",
+        "npz": "application/x-npz",
+    }
+
+    def __init__(self, track_cache: TrackCache):
+        """
+        construct the api
+
+        Args:
+            track_cache (TrackCache): the shared cache of the parsed tracks
+        """
+        self.track_cache = track_cache
+
+    def get_track(self, source: str) -> Track:
+        """
+        get the track of the given local file - parsed only once
+        """
+        track = self.track_cache.get_track(source, Track.from_file)
+        return track
+
+    async def load_track(self, source: str) -> Track:
+        """
+        get the track of the given local file in a worker thread
+
+        Raises:
+            HTTPException: if the file is not a track
+        """
+        try:
+            track = await asyncio.to_thread(self.get_track, source)
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
+        return track
+
+    @classmethod
+    def select(
+        cls,
+        track: Track,
+        start: int = None,
+        stop: int = None,
+        step: int = 1,
+        tolerance: float = None,
+        columns: List[str] = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        select the given slice and columns of the given track
+
+        Args:
+            track (Track): the track
+            start (int): the index of the first point
+            stop (int): the index after the last point
+            step (int): take every step-th point
+            tolerance (float): simplify the slice keeping points that differ more than this many meters from the simplified path - None for no simplification
+            columns (List[str]): the names of the columns - None for all
+
+        Returns:
+            Dict[str, np.ndarray]: the selected columns by name
+
+        Raises:
+            ValueError: for an invalid step or unknown column
+        """
+        if step is None or step < 1:
+            raise ValueError(f"invalid step {step}")
+        all_columns = track.get_columns()
+        if columns is None:
+            columns = list(all_columns)
+        unknown = [column for column in columns if column not in all_columns]
+        if unknown:
+            raise ValueError(
+                f"unknown columns {', '.join(unknown)} - use some of {', '.join(all_columns)}"
+            )
+        indices = np.arange(len(track))[slice(start, stop, step)]
+        if tolerance:
+            indices = track.get_simplified_indices(tolerance, indices)
+        selected = {column: all_columns[column][indices] for column in columns}
+        return selected
+
+    @classmethod
+    def get_stats(cls, track: Track) -> dict:
+        """
+        get the statistics of the given track
+
+        Returns:
+            dict: the point count, distance, duration, bounding box, elevation and speed
+        """
+
+        def number(value) -> float:
+            # json has no NaN
+            return None if value is None or np.isnan(value) else float(value)
+
+        count = len(track)
+        stats = {
+            "name": track.name,
+            "count": count,
+            "columns": list(track.get_columns()),
+            "timestamp_aware": track.timestamp_aware,
+        }
+        if count == 0:
+            return stats
+        stats["distance_km"] = float(track.distance[-1])
+        stats["bbox"] = {
+            "min_lat": float(track.lat.min()),
+            "min_lon": float(track.lon.min()),
+            "max_lat": float(track.lat.max()),
+            "max_lon": float(track.lon.max()),
+        }
+        known = ~np.isnan(track.timestamp)
+        if known.any():
+            first, last = np.flatnonzero(known)[[0, -1]]
+            start, end = track.get_datetime(first), track.get_datetime(last)
+            stats["start"] = start.isoformat()
+            stats["end"] = end.isoformat()
+            stats["duration_s"] = float(track.elapsed[last])
+        elevation = track.elevation[~np.isnan(track.elevation)]
+        if len(elevation):
+            steps = np.diff(elevation)
+            stats["elevation"] = {
+                "min": float(elevation.min()),
+                "max": float(elevation.max()),
+                "gain": float(steps[steps > 0].sum()),
+                "loss": float(-steps[steps < 0].sum()),
+            }
+        times = track.elapsed[known]
+        if len(times) > 1:
+            dt = np.diff(times)
+            dd = np.diff(track.distance[known])
+            moving = dt > 0
+            if moving.any():
+                speeds = dd[moving] / dt[moving] * 3600
+                duration = times[-1] - times[0]
+                average = dd.sum() / duration * 3600 if duration > 0 else None
+                stats["speed_kmh"] = {
+                    "avg": number(average),
+                    "max": number(speeds.max()),
+                }
+        return stats
+
+    @classmethod
+    def encode_json(cls, data: dict) -> bytes:
+        """
+        encode the given dict with numpy columns as json - NaN becomes null
+        """
+        parts = []
+        for key, value in data.items():
+            if isinstance(value, dict):
+                encoded = cls.encode_json(value).decode("utf-8")
+            elif isinstance(value, np.ndarray):
+                # the arrays only contain numbers so NaN can be replaced textually
+                encoded = json.dumps(value.tolist()).replace("NaN", "null")
+            else:
+                encoded = json.dumps(value)
+            parts.append(f"{json.dumps(key)}:{encoded}")
+        return ("{" + ",".join(parts) + "}").encode("utf-8")
+
+    @classmethod
+    def encode(
+        cls, track: Track, selected: Dict[str, np.ndarray], track_format: str
+    ) -> bytes:
+        """
+        encode the given selected columns of the given track
+
+        Args:
+            track (Track): the track the columns were selected from
+            selected (Dict[str, np.ndarray]): the selected columns
+            track_format (str): "json", "bin" or "npz"
+
+        Returns:
+            bytes: the content
+        """
+        if track_format == "json":
+            content = cls.encode_json(
+                {
+                    "name": track.name,
+                    "count": cls.get_count(selected),
+                    "timestamp_aware": track.timestamp_aware,
+                    "columns": selected,
+                }
+            )
+        elif track_format == "bin":
+            content = b"".join(
+                np.ascontiguousarray(array, dtype="<f8").tobytes()
+                for array in selected.values()
+            )
+        else:
+            buffer = io.BytesIO()
+            np.savez(buffer, **selected)
+            content = buffer.getvalue()
+        return content
+
+    @classmethod
+    def get_count(cls, selected: Dict[str, np.ndarray]) -> int:
+        return len(next(iter(selected.values()))) if selected else 0
+
+    @classmethod
+    def compress(
+        cls, content: bytes, accept_encoding: str = None
+    ) -> Tuple[bytes, dict]:
+        """
+        gzip the given json content if the client accepts it
+
+        Returns:
+            Tuple[bytes, dict]: the content and its encoding headers
+        """
+        headers = {"Vary": "Accept-Encoding"}
+        if accept_encoding and "gzip" in accept_encoding:
+            content = gzip.compress(content, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        return content, headers
+
+    @classmethod
+    def json_response(
+        cls,
+        content: bytes,
+        headers: dict,
+        accept_encoding: str = None,
+        compressed: bool = False,
+    ) -> Response:
+        """
+        get a json response - gzip'd if the client accepts it
+
+        Args:
+            content (bytes): the json content
+            headers (dict): the headers of the response
+            accept_encoding (str): the Accept-Encoding header
+            compressed (bool): True if the content and headers are already the result of compress
+        """
+        headers = dict(headers)
+        if not compressed:
+            content, encoding_headers = cls.compress(content, accept_encoding)
+            headers.update(encoding_headers)
+        return Response(content, media_type=cls.media_types["json"], headers=headers)
+
+    @classmethod
+    def render(
+        cls,
+        track: Track,
+        start: int,
+        stop: int,
+        step: int,
+        tolerance: float,
+        column_names: List[str],
+        track_format: str,
+        accept_encoding: str = None,
+    ) -> Tuple[Dict[str, np.ndarray], bytes, dict]:
+        """
+        select, encode and compress the columns of the given track - the whole
+        work of a request in one call so that it can run in a worker thread
+
+        Returns:
+            Tuple[Dict[str, np.ndarray], bytes, dict]: the selected columns, the content and its encoding headers
+
+        Raises:
+            ValueError: if the selection is invalid
+        """
+        selected = cls.select(track, start, stop, step, tolerance, column_names)
+        content = cls.encode(track, selected, track_format)
+        headers = {}
+        if track_format == "json":
+            content, headers = cls.compress(content, accept_encoding)
+        return selected, content, headers
+
+    @classmethod
+    def render_stats(
+        cls, track: Track, accept_encoding: str = None
+    ) -> Tuple[bytes, dict]:
+        """
+        get the compressed json statistics of the given track
+
+        Returns:
+            Tuple[bytes, dict]: the content and its encoding headers
+        """
+        content = json.dumps(cls.get_stats(track)).encode("utf-8")
+        return cls.compress(content, accept_encoding)
+
+    async def get_response(
+        self,
+        source: str,
+        track_format: str = "json",
+        start: int = None,
+        stop: int = None,
+        step: int = 1,
+        tolerance: float = None,
+        columns: str = None,
+        accept_encoding: str = None,
+        if_none_match: str = None,
+        if_modified_since: str = None,
+    ) -> Response:
+        """
+        get the selected columns of the track of the given local file
+
+        Args:
+            source (str): the path of the SRT or GPX file
+            track_format (str): "json", "bin" or "npz"
+            start (int): the index of the first point
+            stop (int): the index after the last point
+            step (int): take every step-th point
+            tolerance (float): the simplification tolerance in meters - None for no simplification
+            columns (str): comma separated column names - None for all
+            accept_encoding (str): the Accept-Encoding header
+            if_none_match (str): the If-None-Match header of a conditional request
+            if_modified_since (str): the If-Modified-Since header of a conditional request
+
+        Returns:
+            Response: the columns - the bin format has the column names and point count
+            in the X-Track-Columns and X-Track-Count headers
+        """
+        if track_format not in self.media_types:
+            supported = ", ".join(self.media_types)
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported track format {track_format} - use one of {supported}",
+            )
+        column_names = columns.split(",") if columns else None
+        validator = CacheValidator.for_file(
+            source, "track", track_format, start, stop, step, tolerance, columns
+        )
+        # the file may change under the same url
+        validator.immutable = False
+        if validator.is_not_modified(if_none_match, if_modified_since):
+            return validator.not_modified_response()
+        track = await self.load_track(source)
+        try:
+            # simplifying and compressing large tracks must not block the event loop
+            selected, content, encoding_headers = await asyncio.to_thread(
+                self.render,
+                track,
+                start,
+                stop,
+                step,
+                tolerance,
+                column_names,
+                track_format,
+                accept_encoding,
+            )
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
+        headers = validator.headers
+        headers.update(encoding_headers)
+        if track_format == "json":
+            return self.json_response(content, headers, compressed=True)
+        headers["X-Track-Columns"] = ",".join(selected)
+        headers["X-Track-Count"] = str(self.get_count(selected))
+        return Response(
+            content, media_type=self.media_types[track_format], headers=headers
+        )
+
+    async def get_stats_response(
+        self,
+        source: str,
+        accept_encoding: str = None,
+        if_none_match: str = None,
+        if_modified_since: str = None,
+    ) -> Response:
+        """
+        get the statistics of the track of the given local file as json
+        """
+        validator = CacheValidator.for_file(source, "track", "stats")
+        validator.immutable = False
+        if validator.is_not_modified(if_none_match, if_modified_since):
+            return validator.not_modified_response()
+        track = await self.load_track(source)
+        content, encoding_headers = await asyncio.to_thread(
+            self.render_stats, track, accept_encoding
+        )
+        headers = validator.headers
+        headers.update(encoding_headers)
+        return self.json_response(content, headers, compressed=True)
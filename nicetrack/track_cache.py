@@ -0,0 +1,606 @@
+"""
+Created on 2024-12-28
+
+@author: wf
+"""
+
+import hashlib
+import http.client
+import os
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from nicetrack.geo import GeoPath, Trackpoint
+from nicetrack.metrics import Metrics
+from nicetrack.srt import SRT
+from nicetrack.track_file import TrackFile, TrackFileError
+
+# naive timestamps are stored as seconds since this epoch
+NAIVE_EPOCH = datetime(1970, 1, 1)
+
+
+@dataclass(frozen=True)
+class Track:
+    """
+    an immutable parsed track in columns with its derived indexes -
+    shared by all sessions that open the same source
+    """
+
+    name: str
+    lat: np.ndarray
+    lon: np.ndarray
+    # NaN if unknown
+    elevation: np.ndarray
+    # seconds since the epoch - NaN if unknown
+    timestamp: np.ndarray
+    # True if the timestamps were timezone aware (UTC)
+    timestamp_aware: bool
+    # derived: cumulative distance in km from the first point
+    distance: np.ndarray
+    # derived: seconds since the first timestamp - NaN if unknown
+    elapsed: np.ndarray
+    # telemetry columns e.g. the camera settings of an SRT - NaN if unknown
+    telemetry: Dict[str, np.ndarray] = field(default_factory=dict)
+
+    columns = ["lat", "lon", "elevation", "timestamp", "distance", "elapsed"]
+    # the numeric SRT values kept as telemetry columns
+    telemetry_keys = ["rel_alt", "iso", "shutter", "fnum", "ev", "ct", "focal_len"]
+
+    def __post_init__(self):
+        for array in self.get_columns().values():
+            array.setflags(write=False)
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        the memory used by my columns
+        """
+        return sum(array.nbytes for array in self.get_columns().values())
+
+    def get_columns(self) -> Dict[str, np.ndarray]:
+        """
+        get all my columns by name - telemetry columns are prefixed with "telemetry."
+        """
+        columns = {column: getattr(self, column) for column in self.columns}
+        for key, array in self.telemetry.items():
+            columns[f"telemetry.{key}"] = array
+        return columns
+
+    @classmethod
+    def get_distance(cls, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """
+        get the cumulative haversine distance in km along the given positions
+        """
+        distance = np.zeros(len(lat))
+        if len(lat) > 1:
+            lat1, lat2 = np.radians(lat[:-1]), np.radians(lat[1:])
+            dlat = lat2 - lat1
+            dlon = np.radians(lon[1:] - lon[:-1])
+            a = (
+                np.sin(dlat / 2) ** 2
+                + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+            )
+            steps = 2 * 6371.0 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+            distance[1:] = np.cumsum(steps)
+        return distance
+
+    @classmethod
+    def from_columns(
+        cls,
+        name: str,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        elevation: np.ndarray,
+        timestamp: np.ndarray,
+        timestamp_aware: bool = False,
+        telemetry: Dict[str, np.ndarray] = None,
+    ) -> "Track":
+        """
+        create a track from the given columns deriving the indexes
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        timestamp = np.asarray(timestamp, dtype=np.float64)
+        valid = timestamp[~np.isnan(timestamp)]
+        start = valid[0] if len(valid) else np.nan
+        track = cls(
+            name=name,
+            lat=lat,
+            lon=lon,
+            elevation=np.asarray(elevation, dtype=np.float64),
+            timestamp=timestamp,
+            timestamp_aware=timestamp_aware,
+            distance=cls.get_distance(lat, lon),
+            elapsed=timestamp - start,
+            telemetry={
+                key: np.asarray(values, dtype=np.float64)
+                for key, values in (telemetry or {}).items()
+            },
+        )
+        return track
+
+    @classmethod
+    def get_seconds(cls, timestamps: List[datetime]) -> Tuple[np.ndarray, bool]:
+        """
+        get the given timestamps as seconds
+
+        Returns:
+            Tuple[np.ndarray, bool]: the seconds - NaN if unknown - and True if the timestamps were timezone aware
+        """
+        seconds = np.full(len(timestamps), np.nan)
+        aware = False
+        for i, timestamp in enumerate(timestamps):
+            if timestamp is not None:
+                if timestamp.tzinfo is not None:
+                    aware = True
+                    seconds[i] = timestamp.timestamp()
+                else:
+                    seconds[i] = (timestamp - NAIVE_EPOCH).total_seconds()
+        return seconds, aware
+
+    @classmethod
+    def as_number(cls, value) -> float:
+        """
+        convert the given telemetry value to a float e.g. a shutter time of 1/180.0
+
+        Returns:
+            float: the value or NaN if it is not numeric
+        """
+        if isinstance(value, (int, float)):
+            return float(value)
+        try:
+            if isinstance(value, str) and "/" in value:
+                numerator, denominator = value.split("/", 1)
+                return float(numerator) / float(denominator)
+            return float(value)
+        except (TypeError, ValueError, ZeroDivisionError):
+            return np.nan
+
+    @classmethod
+    def from_srt(cls, srt: SRT, name: str = "") -> "Track":
+        """
+        create a track with telemetry columns from the given SRT
+
+        only subtitles with a position are used - as in SRT.as_geopath
+        """
+        rows = []
+        for index in range(len(srt.subtitles)):
+            try:
+                telemetry = srt.as_telemetry(index)
+            except BaseException as ex:
+                srt.handle_exception(ex, trace=srt.debug)
+                continue
+            if telemetry.get("lat") and telemetry.get("lon"):
+                rows.append(telemetry)
+        timestamp, aware = cls.get_seconds([row.get("timestamp") for row in rows])
+        track = cls.from_columns(
+            name=name,
+            lat=[row["lat"] for row in rows],
+            lon=[row["lon"] for row in rows],
+            elevation=[cls.as_number(row.get("elevation")) for row in rows],
+            timestamp=timestamp,
+            timestamp_aware=aware,
+            telemetry={
+                key: [cls.as_number(row.get(key)) for row in rows]
+                for key in cls.telemetry_keys
+                if any(key in row for row in rows)
+            },
+        )
+        return track
+
+    @classmethod
+    def from_geopath(cls, geo_path: GeoPath, name: str = None) -> "Track":
+        """
+        create a track from the given path
+        """
+        points = geo_path.path
+        timestamp, aware = cls.get_seconds([point.timestamp for point in points])
+        elevation = [np.nan if p.elevation is None else p.elevation for p in points]
+        track = cls.from_columns(
+            name=name or geo_path.name or "",
+            lat=[point.lat for point in points],
+            lon=[point.lon for point in points],
+            elevation=elevation,
+            timestamp=timestamp,
+            timestamp_aware=aware,
+        )
+        return track
+
+    @classmethod
+    def from_file(cls, file_path: str) -> "Track":
+        """
+        parse the given local SRT or GPX file
+
+        Raises:
+            ValueError: if the file is neither an SRT nor a GPX file
+        """
+        name = os.path.basename(file_path)
+        with open(file_path, encoding="utf-8") as track_file:
+            text = track_file.read()
+        if file_path.lower().endswith(".srt"):
+            track = cls.from_srt(SRT.from_text(text), name=name)
+        elif file_path.lower().endswith(".gpx"):
+            track = cls.from_geopath(GeoPath.from_gpx(text), name=name)
+        else:
+            raise ValueError(f"{file_path} is neither an SRT nor a GPX file")
+        return track
+
+    def get_datetime(self, index: int) -> datetime:
+        """
+        get the timestamp of the point with the given index
+        """
+        seconds = self.timestamp[index]
+        if np.isnan(seconds):
+            return None
+        if self.timestamp_aware:
+            return datetime.fromtimestamp(seconds, tz=timezone.utc)
+        return NAIVE_EPOCH + timedelta(seconds=float(seconds))
+
+    def get_trackpoint(self, index: int) -> Trackpoint:
+        """
+        get the trackpoint with the given index without building a GeoPath
+
+        Raises:
+            ValueError: if the index is out of range
+        """
+        if index < 0 or index >= len(self):
+            raise ValueError(f"Invalid index {index}: valid range is 0-{len(self) - 1}")
+        elevation = float(self.elevation[index])
+        tp = Trackpoint(
+            float(self.lat[index]),
+            float(self.lon[index]),
+            None if elevation != elevation else elevation,
+            self.get_datetime(index),
+        )
+        return tp
+
+    def as_geopath(self) -> GeoPath:
+        """
+        get a new GeoPath with my points
+        """
+        geo_path = GeoPath(name=self.name)
+        elevations = self.elevation.tolist()
+        for i, (lat, lon) in enumerate(zip(self.lat.tolist(), self.lon.tolist())):
+            elevation = elevations[i]
+            geo_path.add_point(
+                lat,
+                lon,
+                None if elevation != elevation else elevation,
+                self.get_datetime(i),
+            )
+        return geo_path
+
+    def get_indices(self, max_points: int = None) -> np.ndarray:
+        """
+        get the indices of my points thinned out to about max_points keeping the first and last point
+
+        Args:
+            max_points (int): the maximum number of points - None for all points
+        """
+        indices = np.arange(len(self))
+        if max_points and len(self) > max_points:
+            step = int(np.ceil(len(self) / max_points))
+            indices = indices[::step]
+            if indices[-1] != len(self) - 1:
+                indices = np.append(indices, len(self) - 1)
+        return indices
+
+    def get_simplified_indices(
+        self, tolerance: float, indices: np.ndarray = None
+    ) -> np.ndarray:
+        """
+        simplify my path with the Douglas-Peucker algorithm
+
+        Args:
+            tolerance (float): the maximum distance in meters of a dropped point from the simplified path
+            indices (np.ndarray): the indices of the points to simplify - None for all points
+
+        Returns:
+            np.ndarray: the indices of the kept points
+        """
+        if indices is None:
+            indices = np.arange(len(self))
+        if len(indices) < 3:
+            return indices
+        lat = self.lat[indices]
+        lon = self.lon[indices]
+        # an equirectangular projection in meters is good enough for tolerances
+        radius = 6371000.0
+        cos_lat = np.cos(np.radians(np.mean(lat)))
+        x = np.radians(lon) * radius * cos_lat
+        y = np.radians(lat) * radius
+        keep = np.zeros(len(indices), dtype=bool)
+        keep[0] = keep[-1] = True
+        # an explicit stack instead of recursion for very long tracks
+        stack = [(0, len(indices) - 1)]
+        while stack:
+            first, last = stack.pop()
+            if last - first < 2:
+                continue
+            dx, dy = x[last] - x[first], y[last] - y[first]
+            px = x[first + 1 : last] - x[first]
+            py = y[first + 1 : last] - y[first]
+            length = np.hypot(dx, dy)
+            if length > 0:
+                distances = np.abs(px * dy - py * dx) / length
+            else:
+                distances = np.hypot(px, py)
+            farthest = int(np.argmax(distances))
+            if distances[farthest] > tolerance:
+                split = first + 1 + farthest
+                keep[split] = True
+                stack.append((first, split))
+                stack.append((split, last))
+        return indices[keep]
+
+    def save(self, path: str, source_path: str = None):
+        """
+        save me as a binary track file
+
+        Args:
+            path (str): the path of the track file
+            source_path (str): the file I was parsed from
+        """
+        TrackFile.write(
+            path,
+            self.name,
+            self.get_columns(),
+            timestamp_aware=self.timestamp_aware,
+            source_path=source_path,
+        )
+
+    @classmethod
+    def load(cls, path: str, source_path: str = None, verify: bool = False) -> "Track":
+        """
+        load a track from the given binary track file with memory mapped columns
+
+        Args:
+            path (str): the path of the track file
+            source_path (str): the file the track was parsed from - it must not have changed since
+            verify (bool): if True check the crc32 of every column
+
+        Raises:
+            TrackFileError: if the file is invalid, corrupt or stale
+        """
+        record = TrackFile.read(path, source_path=source_path, verify=verify)
+        columns = record["columns"]
+        try:
+            track = cls(
+                name=record["name"],
+                timestamp_aware=record["timestamp_aware"],
+                telemetry={
+                    key[len("telemetry.") :]: array
+                    for key, array in columns.items()
+                    if key.startswith("telemetry.")
+                },
+                **{column: columns[column] for column in cls.columns},
+            )
+        except KeyError as ex:
+            raise TrackFileError(f"{path} has no column {ex}")
+        return track
+
+
+class TrackCache:
+    """
+    a process wide cache of the parsed tracks by source identity with
+    least recently used eviction by memory budget and an optional disk tier
+
+    local sources may also get a binary sidecar track file that is written after the
+    first parse and memory mapped instead of parsing again - this is opt-in since it
+    writes next to the sources - the disk tier in ~/.nicetrack/tracks is the default
+
+    track files are verified on their first load so that a corrupt file is a cache miss
+    """
+
+    instance = None
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024**2,
+        cache_dir: str = None,
+        sidecars: bool = False,
+    ):
+        """
+        construct the cache
+
+        Args:
+            max_bytes (int): the memory budget of the cached tracks
+            cache_dir (str): the directory of the disk tier - None for no disk tier
+            sidecars (bool): if True read and write sidecar track files next to local sources
+        """
+        self.max_bytes = max_bytes
+        self.sidecars = sidecars
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.tracks: OrderedDict[str, Track] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        # one lock per key so that a source is only parsed once at a time
+        self.key_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.sidecar_hits = 0
+        self.misses = 0
+        self.metrics = Metrics.get_instance()
+
+    @classmethod
+    def get_instance(cls) -> "TrackCache":
+        """
+        get the process wide cache
+        """
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    @classmethod
+    def default_cache_dir(cls) -> str:
+        """
+        the default directory of the disk tier
+        """
+        home = str(Path.home())
+        return f"{home}/.nicetrack/tracks"
+
+    def get_key(self, source: str) -> str:
+        """
+        get the cache key of the given path or url
+
+        Returns:
+            str: the key or None if the source has no validator and can't be cached
+            e.g. a url whose server does not answer a HEAD request - it is parsed uncached then
+        """
+        if not self.is_local(source):
+            request = urllib.request.Request(source, method="HEAD")
+            try:
+                with urllib.request.urlopen(request, timeout=10.0) as response:
+                    validator = response.headers.get("ETag") or response.headers.get(
+                        "Last-Modified"
+                    )
+            except (urllib.error.URLError, http.client.HTTPException, OSError):
+                validator = None
+            if not validator:
+                return None
+            identity = f"{source}:{validator}"
+        else:
+            stat = os.stat(source)
+            identity = f"{os.path.realpath(source)}:{stat.st_size}:{stat.st_mtime_ns}"
+        key = hashlib.sha1(identity.encode("utf-8")).hexdigest()
+        return key
+
+    def get_disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}{TrackFile.extension}")
+
+    def is_local(self, source: str) -> bool:
+        return not (source.startswith("http://") or source.startswith("https://"))
+
+    def load_sidecar(self, source: str) -> Track:
+        """
+        load the sidecar track file of the given local source
+
+        Returns:
+            Track: the track or None if there is no valid and current sidecar
+        """
+        if not self.sidecars or not self.is_local(source):
+            return None
+        sidecar_path = TrackFile.get_sidecar_path(source)
+        if not os.path.exists(sidecar_path):
+            return None
+        try:
+            track = Track.load(sidecar_path, source_path=source, verify=True)
+        except (OSError, TrackFileError):
+            # stale or corrupt - fall back to parsing the source
+            return None
+        self.sidecar_hits += 1
+        self.metrics.cache_requests.inc("track", "sidecar")
+        return track
+
+    def save_sidecar(self, source: str, track: Track):
+        """
+        save the sidecar track file of the given local source if its directory is writable
+        """
+        if self.sidecars and self.is_local(source):
+            try:
+                track.save(TrackFile.get_sidecar_path(source), source_path=source)
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Track:
+        """
+        get the cached track for the given key from memory or disk
+
+        Returns:
+            Track: the track or None if it is not cached
+        """
+        with self.lock:
+            track = self.tracks.get(key)
+            if track is not None:
+                self.tracks.move_to_end(key)
+                self.hits += 1
+                self.metrics.cache_requests.inc("track", "memory")
+                return track
+        if self.cache_dir:
+            disk_path = self.get_disk_path(key)
+            if os.path.exists(disk_path):
+                try:
+                    track = Track.load(disk_path, verify=True)
+                except (OSError, TrackFileError):
+                    track = None
+                if track is not None:
+                    self.disk_hits += 1
+                    self.metrics.cache_requests.inc("track", "disk")
+                    self.put(key, track, to_disk=False)
+        return track
+
+    def put(self, key: str, track: Track, to_disk: bool = True):
+        """
+        cache the given track and evict the least recently used tracks if needed
+        """
+        with self.lock:
+            old = self.tracks.pop(key, None)
+            if old is not None:
+                self.size -= old.nbytes
+            self.tracks[key] = track
+            self.size += track.nbytes
+            # the newest track is kept even if it exceeds the budget on its own
+            while self.size > self.max_bytes and len(self.tracks) > 1:
+                _old_key, old = self.tracks.popitem(last=False)
+                self.size -= old.nbytes
+        if to_disk and self.cache_dir:
+            track.save(self.get_disk_path(key))
+
+    def parse(self, source: str, parse: Callable[[str], Track]) -> Track:
+        """
+        parse the given source as a cache miss
+        """
+        self.misses += 1
+        self.metrics.cache_requests.inc("track", "miss")
+        path = urllib.parse.urlparse(source).path if "://" in source else source
+        track_format = Path(path).suffix.lower().lstrip(".") or "unknown"
+        with self.metrics.parse_seconds.time(track_format):
+            track = parse(source)
+        return track
+
+    def get_track(self, source: str, parse: Callable[[str], Track]) -> Track:
+        """
+        get the track of the given source - parsing it only if it is not cached
+
+        Args:
+            source (str): the path or url of the track
+            parse (Callable): the function to parse the source into a track
+
+        Returns:
+            Track: the shared immutable track
+        """
+        key = self.get_key(source)
+        if key is None:
+            return self.parse(source, parse)
+        track = self.get(key)
+        if track is None:
+            with self.lock:
+                key_lock = self.key_locks.setdefault(key, threading.Lock())
+            with key_lock:
+                # another session may have parsed it in the meantime
+                track = self.get(key)
+                if track is None:
+                    track = self.load_sidecar(source)
+                    parsed = track is None
+                    if parsed:
+                        track = self.parse(source, parse)
+                        self.save_sidecar(source, track)
+                    # a sidecar is already on disk
+                    self.put(key, track, to_disk=parsed)
+            with self.lock:
+                self.key_locks.pop(key, None)
+        return track
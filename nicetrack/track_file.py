@@ -0,0 +1,198 @@
+"""
+Created on 2024-12-29
+
+@author: wf
+"""
+
+import json
+import os
+import struct
+import threading
+import zlib
+from typing import Dict
+
+import numpy as np
+
+
+class TrackFileError(ValueError):
+    """
+    a track file is invalid, corrupt or stale
+    """
+
+
+class TrackFile:
+    """
+    the binary track file format - a versioned header with a json
+    directory followed by the columns as raw little-endian arrays
+    that are memory mapped when loading::
+
+        0  magic      4s  b"NTRK"
+        4  version    <H
+        6  flags      <H  bit 0: timezone aware timestamps
+        8  dir_size   <I  size of the json directory
+        12 dir_crc32  <I  crc32 of the json directory
+        16 directory  json with the name, point count, source identity and
+                      the name, dtype, offset and crc32 of each column
+        .. columns    each aligned to 64 bytes
+    """
+
+    magic = b"NTRK"
+    version = 1
+    header = struct.Struct("<4sHHII")
+    alignment = 64
+    FLAG_TIMESTAMP_AWARE = 1
+    extension = ".ntrk"
+
+    @classmethod
+    def get_sidecar_path(cls, source_path: str) -> str:
+        """
+        get the path of the sidecar track file of the given source file
+        """
+        return source_path + cls.extension
+
+    @classmethod
+    def get_source_identity(cls, source_path: str) -> Dict[str, int]:
+        """
+        get the size and modification time of the given source file
+        """
+        stat = os.stat(source_path)
+        identity = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        return identity
+
+    @classmethod
+    def align(cls, offset: int) -> int:
+        return (offset + cls.alignment - 1) // cls.alignment * cls.alignment
+
+    @classmethod
+    def write(
+        cls,
+        path: str,
+        name: str,
+        columns: Dict[str, np.ndarray],
+        timestamp_aware: bool = False,
+        source_path: str = None,
+    ):
+        """
+        write the given columns atomically
+
+        Args:
+            path (str): the path of the track file
+            name (str): the name of the track
+            columns (Dict[str, np.ndarray]): the float columns of equal length
+            timestamp_aware (bool): True if the timestamps were timezone aware
+            source_path (str): the file the track was parsed from - to detect stale track files
+        """
+        arrays = {
+            column: np.ascontiguousarray(array, dtype="<f8")
+            for column, array in columns.items()
+        }
+        counts = {len(array) for array in arrays.values()}
+        if len(counts) > 1:
+            raise TrackFileError(f"columns of different lengths {counts}")
+        count = counts.pop() if counts else 0
+        directory = {
+            "name": name,
+            "count": count,
+            "source": cls.get_source_identity(source_path) if source_path else None,
+            "columns": [],
+        }
+        # the offsets depend on the directory size - iterate until stable
+        data_start = 0
+        while True:
+            offset = data_start
+            entries = []
+            for column, array in arrays.items():
+                entries.append(
+                    {
+                        "name": column,
+                        "dtype": "<f8",
+                        "offset": offset,
+                        "crc32": zlib.crc32(array.data),
+                    }
+                )
+                offset = cls.align(offset + array.nbytes)
+            directory["columns"] = entries
+            dir_bytes = json.dumps(directory).encode("utf-8")
+            needed = cls.align(cls.header.size + len(dir_bytes))
+            if needed <= data_start:
+                break
+            data_start = needed
+        flags = cls.FLAG_TIMESTAMP_AWARE if timestamp_aware else 0
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as track_file:
+            track_file.write(
+                cls.header.pack(
+                    cls.magic, cls.version, flags, len(dir_bytes), zlib.crc32(dir_bytes)
+                )
+            )
+            track_file.write(dir_bytes)
+            for entry, array in zip(entries, arrays.values()):
+                track_file.seek(entry["offset"])
+                track_file.write(array.tobytes())
+            # pad to the aligned end so that empty columns are within the file
+            track_file.truncate(offset)
+            track_file.flush()
+            os.fsync(track_file.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def read(
+        cls, path: str, source_path: str = None, verify: bool = False
+    ) -> Dict[str, object]:
+        """
+        read the given track file memory mapping its columns
+
+        the header is always checked - the columns are only read from disk
+        when they are used unless verify is set
+
+        Args:
+            path (str): the path of the track file
+            source_path (str): the file the track was parsed from - it must not have changed since
+            verify (bool): if True check the crc32 of every column
+
+        Returns:
+            dict: the name, timestamp_aware flag and columns
+
+        Raises:
+            TrackFileError: if the file is invalid, corrupt or stale
+        """
+        with open(path, "rb") as track_file:
+            fixed = track_file.read(cls.header.size)
+            if len(fixed) < cls.header.size:
+                raise TrackFileError(f"{path} is truncated")
+            magic, version, flags, dir_size, dir_crc = cls.header.unpack(fixed)
+            if magic != cls.magic:
+                raise TrackFileError(f"{path} is not a track file")
+            if version != cls.version:
+                raise TrackFileError(f"{path} has unsupported version {version}")
+            dir_bytes = track_file.read(dir_size)
+        if len(dir_bytes) != dir_size or zlib.crc32(dir_bytes) != dir_crc:
+            raise TrackFileError(f"{path} has a corrupt header")
+        directory = json.loads(dir_bytes)
+        if source_path is not None:
+            if directory["source"] != cls.get_source_identity(source_path):
+                raise TrackFileError(f"{path} is stale - {source_path} has changed")
+        count = directory["count"]
+        file_size = os.path.getsize(path)
+        columns = {}
+        mapped = None
+        for entry in directory["columns"]:
+            dtype = np.dtype(entry["dtype"])
+            end = entry["offset"] + count * dtype.itemsize
+            if end > file_size:
+                raise TrackFileError(f"{path} is truncated")
+            if count == 0:
+                array = np.zeros(0, dtype=dtype)
+            else:
+                if mapped is None:
+                    mapped = np.memmap(path, dtype=np.uint8, mode="r")
+                array = mapped[entry["offset"] : end].view(dtype)
+            if verify and zlib.crc32(array.data) != entry["crc32"]:
+                raise TrackFileError(f"{path} column {entry['name']} is corrupt")
+            columns[entry["name"]] = array
+        record = {
+            "name": directory["name"],
+            "timestamp_aware": bool(flags & cls.FLAG_TIMESTAMP_AWARE),
+            "columns": columns,
+        }
+        return record
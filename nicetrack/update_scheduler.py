@@ -0,0 +1,148 @@
+"""
+Created on 2024-12-30
+
+@author: wf
+"""
+
+import asyncio
+import inspect
+import itertools
+from typing import Any, Callable, Dict, Hashable
+
+
+class UpdateScheduler:
+    """
+    coalesce rapid updates e.g. of a slider that is dragged -
+    only the latest pending value is applied and at most max_rate times per second
+    """
+
+    def __init__(
+        self,
+        apply: Callable[[Any], Any],
+        max_rate: float = 15.0,
+        handle_exception: Callable[[BaseException], None] = None,
+    ):
+        """
+        construct the scheduler
+
+        Args:
+            apply (Callable): the sync or async function to apply a value with
+            max_rate (float): the maximum number of updates per second - 0 for no limit
+            handle_exception (Callable): the handler of exceptions of apply - None to raise them
+        """
+        self.apply = apply
+        self.max_rate = max_rate
+        self.handle_exception = handle_exception
+        self.pending = None
+        self.has_pending = False
+        self.last_applied = None
+        self.task = None
+        self.submitted = 0
+        self.applied = 0
+
+    @property
+    def interval(self) -> float:
+        """
+        the minimum time between two updates in seconds
+        """
+        return 1.0 / self.max_rate if self.max_rate else 0.0
+
+    @property
+    def coalesced(self) -> int:
+        """
+        the number of values that were superseded before they were applied
+        """
+        pending = 1 if self.has_pending else 0
+        return self.submitted - self.applied - pending
+
+    def submit(self, value: Any):
+        """
+        submit the given value - it replaces a value that is still pending
+        """
+        self.pending = value
+        self.has_pending = True
+        self.submitted += 1
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        """
+        apply the latest pending value once per tick until there is none
+        """
+        loop = asyncio.get_running_loop()
+        while self.has_pending:
+            if self.last_applied is not None:
+                wait = self.last_applied + self.interval - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            else:
+                # let the values of the same event loop cycle coalesce
+                await asyncio.sleep(0)
+            value = self.pending
+            self.pending = None
+            self.has_pending = False
+            self.last_applied = loop.time()
+            try:
+                result = self.apply(value)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as ex:
+                if self.handle_exception is None:
+                    raise
+                self.handle_exception(ex)
+            self.applied += 1
+
+    async def flush(self):
+        """
+        wait until the pending value has been applied
+        """
+        if self.task is not None:
+            await self.task
+
+    def cancel(self):
+        """
+        drop the pending value and stop applying
+        """
+        self.pending = None
+        self.has_pending = False
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+
+class LatestRequests:
+    """
+    the latest request per key e.g. the frame a view currently wants -
+    requests that are superseded while they wait are dropped
+    """
+
+    def __init__(self):
+        self.tickets = itertools.count(1)
+        self.latest: Dict[Hashable, int] = {}
+        self.dropped = 0
+
+    def start(self, key: Hashable) -> int:
+        """
+        start a request for the given key superseding the previous one
+
+        Returns:
+            int: the ticket of the request
+        """
+        ticket = next(self.tickets)
+        self.latest[key] = ticket
+        return ticket
+
+    def is_superseded(self, key: Hashable, ticket: int) -> bool:
+        """
+        check whether a newer request for the given key has been started
+        """
+        superseded = self.latest.get(key) != ticket
+        if superseded:
+            self.dropped += 1
+        return superseded
+
+    def finish(self, key: Hashable, ticket: int):
+        """
+        the request with the given ticket is done
+        """
+        if self.latest.get(key) == ticket:
+            del self.latest[key]
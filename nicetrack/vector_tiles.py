@@ -0,0 +1,529 @@
+"""
+Created on 2025-01-08
+
+@author: wf
+"""
+
+import gzip
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from nicetrack.http_cache import CacheValidator
+from nicetrack.track_cache import Track
+from nicetrack.web_mercator import WebMercator
+
+
+class Protobuf:
+    """
+    the protocol buffers wire format needed to write vector tiles -
+    see https://protobuf.dev/programming-guides/encoding/
+    """
+
+    VARINT = 0
+    LENGTH_DELIMITED = 2
+
+    @classmethod
+    def varint(cls, value: int) -> bytes:
+        """
+        encode the given unsigned integer as varint
+        """
+        encoded = bytearray()
+        while value > 0x7F:
+            encoded.append((value & 0x7F) | 0x80)
+            value >>= 7
+        encoded.append(value)
+        return bytes(encoded)
+
+    @classmethod
+    def varints(cls, values: np.ndarray) -> bytes:
+        """
+        encode the given unsigned integers as consecutive varints
+        """
+        values = np.asarray(values, dtype=np.uint64)
+        if len(values) == 0:
+            return b""
+        # the number of 7 bit groups of each value
+        counts = np.ones(len(values), dtype=np.int64)
+        rest = values >> np.uint64(7)
+        while rest.any():
+            counts += rest > 0
+            rest >>= np.uint64(7)
+        groups = np.arange(counts.max())
+        shifts = (groups * 7).astype(np.uint64)
+        chunks = (values[:, None] >> shifts) & np.uint64(0x7F)
+        # all but the last group of a value have the continuation bit
+        more = groups < (counts[:, None] - 1)
+        chunks = chunks | np.where(more, 0x80, 0).astype(np.uint64)
+        used = groups < counts[:, None]
+        return chunks[used].astype(np.uint8).tobytes()
+
+    @classmethod
+    def zigzag(cls, values: np.ndarray) -> np.ndarray:
+        """
+        map the given signed integers to unsigned integers with the sign in the lowest bit
+        """
+        values = np.asarray(values, dtype=np.int64)
+        return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+    @classmethod
+    def key(cls, number: int, wire_type: int) -> bytes:
+        return cls.varint((number << 3) | wire_type)
+
+    @classmethod
+    def uint(cls, number: int, value: int) -> bytes:
+        return cls.key(number, cls.VARINT) + cls.varint(value)
+
+    @classmethod
+    def message(cls, number: int, data: bytes) -> bytes:
+        """
+        encode the given embedded message, string or packed field
+        """
+        return cls.key(number, cls.LENGTH_DELIMITED) + cls.varint(len(data)) + data
+
+    @classmethod
+    def string(cls, number: int, text: str) -> bytes:
+        return cls.message(number, text.encode("utf-8"))
+
+    @classmethod
+    def packed(cls, number: int, values: np.ndarray) -> bytes:
+        return cls.message(number, cls.varints(values))
+
+
+class MvtEncoder:
+    """
+    encode lines as Mapbox Vector Tiles -
+    see https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+    """
+
+    media_type = "application/vnd.mapbox-vector-tile"
+    version = 2
+    LINESTRING = 2
+    MOVE_TO = 1
+    LINE_TO = 2
+
+    @classmethod
+    def command(cls, command_id: int, count: int) -> int:
+        return (command_id & 0x7) | (count << 3)
+
+    @classmethod
+    def encode_geometry(cls, parts: List[np.ndarray]) -> np.ndarray:
+        """
+        encode the given lines as the geometry commands of one (multi) line feature
+
+        Args:
+            parts (List[np.ndarray]): the lines as n x 2 integer tile coordinates with n >= 2
+
+        Returns:
+            np.ndarray: the command and parameter integers
+        """
+        encoded = []
+        cursor = np.zeros(2, dtype=np.int64)
+        for part in parts:
+            deltas = np.diff(part, axis=0, prepend=cursor[None, :])
+            params = Protobuf.zigzag(deltas).ravel()
+            encoded.append([cls.command(cls.MOVE_TO, 1)])
+            encoded.append(params[:2])
+            encoded.append([cls.command(cls.LINE_TO, len(part) - 1)])
+            encoded.append(params[2:])
+            cursor = part[-1]
+        if not encoded:
+            return np.zeros(0, dtype=np.uint64)
+        return np.concatenate([np.asarray(e, dtype=np.uint64) for e in encoded])
+
+    @classmethod
+    def encode_layer(
+        cls, name: str, features: List[Tuple[List[np.ndarray], dict]], extent: int
+    ) -> bytes:
+        """
+        encode a layer of line features with string properties
+
+        Args:
+            name (str): the name of the layer
+            features (List[Tuple[List[np.ndarray], dict]]): the lines and properties of each feature
+            extent (int): the size of the tile in tile coordinates
+
+        Returns:
+            bytes: the layer message
+        """
+        keys: List[str] = []
+        values: List[str] = []
+        encoded_features = b""
+        for feature_id, (parts, properties) in enumerate(features, start=1):
+            tags = []
+            for key, value in properties.items():
+                value = str(value)
+                if key not in keys:
+                    keys.append(key)
+                if value not in values:
+                    values.append(value)
+                tags += [keys.index(key), values.index(value)]
+            feature = (
+                Protobuf.uint(1, feature_id)
+                + Protobuf.packed(2, np.asarray(tags, dtype=np.uint64))
+                + Protobuf.uint(3, cls.LINESTRING)
+                + Protobuf.packed(4, cls.encode_geometry(parts))
+            )
+            encoded_features += Protobuf.message(2, feature)
+        layer = (
+            Protobuf.uint(15, cls.version)
+            + Protobuf.string(1, name)
+            + encoded_features
+            + b"".join(Protobuf.string(3, key) for key in keys)
+            # a Value message with a string_value
+            + b"".join(Protobuf.message(4, Protobuf.string(1, v)) for v in values)
+            + Protobuf.uint(5, extent)
+        )
+        return layer
+
+    @classmethod
+    def encode_tile(cls, layers: List[bytes]) -> bytes:
+        """
+        encode a tile with the given encoded layers
+        """
+        return b"".join(Protobuf.message(3, layer) for layer in layers)
+
+
+@dataclass
+class TrackTiles:
+    """
+    a registered track with its world coordinates and the
+    bounding boxes of its chunks of consecutive points
+    """
+
+    track_id: str
+    track: Track
+    # incremented when another track is registered under the same id
+    generation: int
+    # the time of the registration
+    registered: float = field(default_factory=time.time)
+    x: np.ndarray = field(init=False)
+    y: np.ndarray = field(init=False)
+    # the world bounding box of each chunk as min_x, max_x, min_y, max_y
+    chunk_bounds: np.ndarray = field(init=False)
+    chunk_points: int = 4096
+
+    def __post_init__(self):
+        self.x, self.y = WebMercator.project(self.track.lat, self.track.lon)
+        n = len(self.x)
+        starts = np.arange(0, max(n - 1, 0), self.chunk_points)
+        if len(starts) == 0:
+            self.chunk_bounds = np.zeros((0, 4))
+            return
+        # each chunk includes the first point of the next chunk
+        nexts = np.minimum(starts + self.chunk_points, n - 1)
+        bounds = []
+        for values in (self.x, self.y):
+            low = np.minimum(np.minimum.reduceat(values, starts), values[nexts])
+            high = np.maximum(np.maximum.reduceat(values, starts), values[nexts])
+            bounds += [low, high]
+        self.chunk_bounds = np.column_stack(bounds)
+
+    def get_segments(self, box: Tuple[float, float, float, float]) -> np.ndarray:
+        """
+        get the segments that may intersect the given world box
+
+        Args:
+            box (Tuple): min_x, max_x, min_y, max_y in world coordinates
+
+        Returns:
+            np.ndarray: the sorted indices of the first point of each segment
+        """
+        min_x, max_x, min_y, max_y = box
+        bounds = self.chunk_bounds
+        hit = (
+            (bounds[:, 0] <= max_x)
+            & (bounds[:, 1] >= min_x)
+            & (bounds[:, 2] <= max_y)
+            & (bounds[:, 3] >= min_y)
+        )
+        last = len(self.x) - 1
+        chunks = [
+            np.arange(start, min(start + self.chunk_points, last))
+            for start in np.flatnonzero(hit) * self.chunk_points
+        ]
+        if not chunks:
+            return np.zeros(0, dtype=np.int64)
+        segments = np.concatenate(chunks)
+        x0, x1 = self.x[segments], self.x[segments + 1]
+        y0, y1 = self.y[segments], self.y[segments + 1]
+        hit = (
+            (np.minimum(x0, x1) <= max_x)
+            & (np.maximum(x0, x1) >= min_x)
+            & (np.minimum(y0, y1) <= max_y)
+            & (np.maximum(y0, y1) >= min_y)
+        )
+        return segments[hit]
+
+
+class VectorTiles:
+    """
+    serve the paths of loaded tracks as Mapbox Vector Tiles that are
+    clipped and simplified per zoom level, generated lazily and kept in
+    a least recently used cache - so that a browser only downloads the
+    geometry of its viewport even for tracks with millions of points
+    """
+
+    layer_name = "track"
+    url_template = "/tiles/track/{track_id}/{z}/{x}/{y}.mvt"
+    # the browser side renderer of the tiles - served locally so that maps work offline
+    script_url = "/nicetrack/vector_tiles.js"
+    script_path = os.path.join(
+        os.path.dirname(__file__), "resources", "vector_tiles.js"
+    )
+    # the Leaflet layer factory of the renderer
+    layer_factory = "nicetrackTiles"
+
+    def __init__(
+        self,
+        extent: int = 4096,
+        buffer: int = 64,
+        tolerance: float = 1.0,
+        max_tracks: int = 16,
+        cache_tiles: int = 4096,
+    ):
+        """
+        construct the vector tiles
+
+        Args:
+            extent (int): the size of a tile in tile coordinates
+            buffer (int): the tile coordinates around a tile that are kept when clipping
+            tolerance (float): the simplification tolerance in tile coordinates
+            max_tracks (int): the number of registered tracks that are kept
+            cache_tiles (int): the number of encoded tiles that are kept
+        """
+        self.extent = extent
+        self.buffer = buffer
+        self.tolerance = tolerance
+        self.max_tracks = max_tracks
+        self.cache_tiles = cache_tiles
+        self.tracks: OrderedDict[str, TrackTiles] = OrderedDict()
+        self.tiles: OrderedDict[Tuple, bytes] = OrderedDict()
+        self.lock = threading.Lock()
+        self.generations = 0
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, track: Track, source: str) -> str:
+        """
+        register the given track so that its tiles can be requested
+
+        Args:
+            track (Track): the track
+            source (str): the path or url the track was parsed from
+
+        Returns:
+            str: the id of the track in the tile urls
+        """
+        track_id = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+        with self.lock:
+            track_tiles = self.tracks.get(track_id)
+            if track_tiles is not None and track_tiles.track is track:
+                self.tracks.move_to_end(track_id)
+                return track_id
+            self.generations += 1
+            generation = self.generations
+        # the projection of a very long track takes a moment - outside of the lock
+        track_tiles = TrackTiles(track_id, track, generation)
+        with self.lock:
+            self.tracks[track_id] = track_tiles
+            self.tracks.move_to_end(track_id)
+            while len(self.tracks) > self.max_tracks:
+                self.tracks.popitem(last=False)
+        return track_id
+
+    def get_url_template(self, track_id: str) -> str:
+        """
+        get the Leaflet url template of the tiles of the given track
+        """
+        return self.url_template.replace("{track_id}", track_id)
+
+    @classmethod
+    def get_layer_options(cls, style: dict) -> dict:
+        """
+        get the options of the layer that draws the track with the given style
+        """
+        options = {"style": style, "maxZoom": 22}
+        return options
+
+    def get_track_tiles(self, track_id: str) -> Optional[TrackTiles]:
+        with self.lock:
+            return self.tracks.get(track_id)
+
+    def get_validator(self, track_tiles: TrackTiles, z: int, x: int, y: int):
+        """
+        get the validator of the given tile - it changes with the registered track
+        """
+        etag = f'"{track_tiles.track_id}-{track_tiles.generation}-{z}-{x}-{y}"'
+        validator = CacheValidator(
+            etag=etag,
+            last_modified=formatdate(track_tiles.registered, usegmt=True),
+            mtime=track_tiles.registered,
+            immutable=False,
+        )
+        return validator
+
+    def simplify(
+        self, track_tiles: TrackTiles, indices: np.ndarray, tx, ty, z: int
+    ) -> np.ndarray:
+        """
+        simplify the given run of points for the given zoom level
+
+        the points that fall on the same tile coordinate as their predecessor are dropped
+        before the Douglas-Peucker simplification with the tolerance in meters of the zoom level
+        """
+        qx, qy = np.round(tx), np.round(ty)
+        moved = np.ones(len(indices), dtype=bool)
+        moved[1:] = (np.diff(qx) != 0) | (np.diff(qy) != 0)
+        moved[-1] = True
+        kept = indices[moved]
+        lat = float(np.mean(track_tiles.track.lat[kept]))
+        meters = (
+            2
+            * math.pi
+            * 6371000.0
+            * math.cos(math.radians(lat))
+            / ((1 << z) * self.extent)
+        )
+        return track_tiles.track.get_simplified_indices(self.tolerance * meters, kept)
+
+    @classmethod
+    def clip(
+        cls, px: np.ndarray, py: np.ndarray, low: float, high: float
+    ) -> List[np.ndarray]:
+        """
+        clip the given line to the given square with the Liang-Barsky algorithm
+
+        Returns:
+            List[np.ndarray]: the parts of the line inside as n x 2 arrays
+        """
+        x0, y0 = px[:-1], py[:-1]
+        dx, dy = np.diff(px), np.diff(py)
+        t0 = np.zeros(len(dx))
+        t1 = np.ones(len(dx))
+        for p, q in (
+            (-dx, x0 - low),
+            (dx, high - x0),
+            (-dy, y0 - low),
+            (dy, high - y0),
+        ):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                r = q / p
+            t0 = np.where(p < 0, np.maximum(t0, r), t0)
+            t1 = np.where(p > 0, np.minimum(t1, r), t1)
+            # parallel to the edge and outside of it
+            t1 = np.where((p == 0) & (q < 0), -1.0, t1)
+        visible = t0 <= t1
+        # a segment continues the part of its predecessor if the shared point is inside
+        continued = np.zeros(len(dx), dtype=bool)
+        continued[1:] = visible[:-1] & visible[1:] & (t1[:-1] >= 1) & (t0[1:] <= 0)
+        starts = np.zeros((len(dx), 2))
+        ends = np.zeros((len(dx), 2))
+        starts[:, 0], starts[:, 1] = x0 + t0 * dx, y0 + t0 * dy
+        ends[:, 0], ends[:, 1] = x0 + t1 * dx, y0 + t1 * dy
+        parts = []
+        segments = np.flatnonzero(visible)
+        if len(segments) == 0:
+            return parts
+        first = np.flatnonzero(~continued[segments])
+        for run in np.split(segments, first[1:]):
+            parts.append(np.vstack([starts[run[:1]], ends[run]]))
+        return parts
+
+    def get_parts(self, track_tiles: TrackTiles, z: int, x: int, y: int) -> List:
+        """
+        get the clipped and simplified parts of the track in the given tile
+
+        Returns:
+            List[np.ndarray]: the parts as n x 2 integer tile coordinates
+        """
+        n = 1 << z
+        margin = self.buffer / self.extent
+        box = (
+            (x - margin) / n,
+            (x + 1 + margin) / n,
+            (y - margin) / n,
+            (y + 1 + margin) / n,
+        )
+        segments = track_tiles.get_segments(box)
+        parts = []
+        if len(segments) == 0:
+            return parts
+        scale = n * self.extent
+        # runs of consecutive segments
+        breaks = np.flatnonzero(np.diff(segments) != 1) + 1
+        for run in np.split(segments, breaks):
+            indices = np.arange(run[0], run[-1] + 2)
+            tx = track_tiles.x[indices] * scale - x * self.extent
+            ty = track_tiles.y[indices] * scale - y * self.extent
+            kept = self.simplify(track_tiles, indices, tx, ty, z)
+            positions = np.searchsorted(indices, kept)
+            for part in self.clip(
+                tx[positions], ty[positions], -self.buffer, self.extent + self.buffer
+            ):
+                part = np.round(part).astype(np.int64)
+                moved = np.ones(len(part), dtype=bool)
+                moved[1:] = np.any(np.diff(part, axis=0) != 0, axis=1)
+                part = part[moved]
+                if len(part) >= 2:
+                    parts.append(part)
+        return parts
+
+    def get_tile(self, track_id: str, z: int, x: int, y: int) -> Optional[bytes]:
+        """
+        get the given tile of the given track
+
+        Returns:
+            bytes: the encoded tile - empty if the track does not cross it - None if the track is not registered
+
+        Raises:
+            ValueError: if the tile does not exist
+        """
+        WebMercator.check_tile(z, x, y)
+        track_tiles = self.get_track_tiles(track_id)
+        if track_tiles is None:
+            return None
+        key = (track_id, track_tiles.generation, z, x, y)
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+        self.misses += 1
+        parts = self.get_parts(track_tiles, z, x, y)
+        if parts:
+            properties = {"name": track_tiles.track.name}
+            layer = MvtEncoder.encode_layer(
+                self.layer_name, [(parts, properties)], self.extent
+            )
+            tile = MvtEncoder.encode_tile([layer])
+        else:
+            tile = b""
+        with self.lock:
+            self.tiles[key] = tile
+            while len(self.tiles) > self.cache_tiles:
+                self.tiles.popitem(last=False)
+        return tile
+
+    @classmethod
+    def compress(cls, tile: bytes, accept_encoding: str = None) -> Tuple[bytes, dict]:
+        """
+        gzip the given tile if the client accepts it
+
+        Returns:
+            Tuple[bytes, dict]: the content and the additional headers
+        """
+        headers = {"Vary": "Accept-Encoding"}
+        if tile and accept_encoding and "gzip" in accept_encoding:
+            tile = gzip.compress(tile, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        return tile, headers
@@ -0,0 +1,198 @@
+"""
+Created on 2024-12-23
+
+@author: wf
+"""
+
+import asyncio
+from typing import Dict, Set, Tuple
+
+from nicetrack.video_stream import JpegReader, LatestFrame, VideoStream
+
+
+class Broadcast:
+    """
+    a single decode and encode pipeline for a video whose frames
+    are fanned out to all subscribed viewers
+    """
+
+    def __init__(
+        self,
+        hub: "BroadcastHub",
+        key: Tuple,
+        video_path: str,
+        start_time: float = 0.0,
+        fps: float = 30.0,
+        width: int = None,
+        height: int = None,
+    ):
+        """
+        construct the broadcast
+
+        Args:
+            hub (BroadcastHub): the hub this broadcast is registered with
+            key (Tuple): the key of this broadcast in the hub
+            video_path (str): the path of the video
+            start_time (float): the start time in seconds
+            fps (float): the frames per second
+            width (int): maximum width of the frames
+            height (int): maximum height of the frames
+        """
+        self.hub = hub
+        self.key = key
+        self.video_stream = VideoStream(video_path)
+        self.start_time = start_time
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.subscribers: Set[LatestFrame] = set()
+        self.current = None
+        self.frames = 0
+        self.task = None
+        # True when the video has ended or the producer has stopped
+        self.closed = False
+
+    def put(self, frame: bytes):
+        """
+        fan out the given frame to all subscribers
+        """
+        self.current = frame
+        self.frames += 1
+        for latest in self.subscribers:
+            latest.put(frame)
+
+    def close(self):
+        """
+        the video has ended - signal all subscribers and leave the hub
+        """
+        self.closed = True
+        for latest in self.subscribers:
+            latest.close()
+        self.hub.remove(self)
+
+    async def run(self):
+        """
+        produce the frames until the video ends or the last subscriber leaves
+        """
+        reader = await asyncio.to_thread(
+            JpegReader,
+            self.video_stream.video_path,
+            self.start_time,
+            self.width,
+            self.height,
+        )
+        try:
+            await self.video_stream.produce_frames(reader, self, self.fps)
+        finally:
+            await asyncio.to_thread(reader.release)
+
+    def subscribe(self) -> LatestFrame:
+        """
+        subscribe a viewer - a late joiner starts at the current frame
+
+        Returns:
+            LatestFrame: the slot the viewer gets its frames from
+        """
+        latest = LatestFrame()
+        if self.current is not None:
+            latest.put(self.current)
+        if self.closed or (self.task is not None and self.task.done()):
+            # the producer has finished - there will be no further frames
+            latest.close()
+            return latest
+        self.subscribers.add(latest)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return latest
+
+    def unsubscribe(self, latest: LatestFrame):
+        """
+        unsubscribe a viewer - the producer is shut down when the last viewer leaves
+        """
+        self.subscribers.discard(latest)
+        if not self.subscribers:
+            self.closed = True
+            self.hub.remove(self)
+            if self.task is not None:
+                self.task.cancel()
+
+    async def generate_frames(self):
+        """
+        generate the multipart jpeg frames for a new viewer
+        """
+        latest = self.subscribe()
+        try:
+            async for part in VideoStream.multipart_frames(latest):
+                yield part
+        finally:
+            self.unsubscribe(latest)
+
+
+class BroadcastHub:
+    """
+    the running broadcasts by video, start time, fps and size
+    """
+
+    def __init__(self):
+        self.broadcasts: Dict[Tuple, Broadcast] = {}
+
+    def get_broadcast(
+        self,
+        video_path: str,
+        start_time: float = 0.0,
+        fps: float = 30.0,
+        width: int = None,
+        height: int = None,
+    ) -> Broadcast:
+        """
+        get the running broadcast for the given parameters or start a new one
+        """
+        key = (video_path, start_time, fps, width, height)
+        broadcast = self.broadcasts.get(key)
+        if broadcast is None or broadcast.closed:
+            broadcast = Broadcast(self, key, video_path, start_time, fps, width, height)
+            self.broadcasts[key] = broadcast
+        return broadcast
+
+    def remove(self, broadcast: Broadcast):
+        """
+        remove the given broadcast
+        """
+        if self.broadcasts.get(broadcast.key) is broadcast:
+            del self.broadcasts[broadcast.key]
+
+    async def video_feed(
+        self,
+        video_path: str,
+        start_time: float = 0.0,
+        fps: float = 30.0,
+        width: int = None,
+        height: int = None,
+    ):
+        """
+        get a motion jpeg response subscribed to the shared broadcast
+        """
+        frame_gen = self.generate_frames(video_path, start_time, fps, width, height)
+        return VideoStream.feed_response(frame_gen)
+
+    async def generate_frames(
+        self,
+        video_path: str,
+        start_time: float = 0.0,
+        fps: float = 30.0,
+        width: int = None,
+        height: int = None,
+    ):
+        """
+        generate the frames of the shared broadcast - it is only looked up
+        or started when the response body is iterated so that a response that
+        is never sent doesn't leave a broadcast behind
+        """
+        broadcast = self.get_broadcast(video_path, start_time, fps, width, height)
+        frame_gen = broadcast.generate_frames()
+        try:
+            async for part in frame_gen:
+                yield part
+        finally:
+            # unsubscribes right away when the client disconnects
+            await frame_gen.aclose()
@@ -0,0 +1,156 @@
+"""
+Created on 2024-12-31
+
+@author: wf
+"""
+
+import os
+import threading
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import TYPE_CHECKING, ClassVar
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import av
+
+
+@dataclass(frozen=True)
+class VideoInfo:
+    """
+    the timing of the first video stream of a container -
+    read once per file and used to map times and track points to frames
+    """
+
+    # frames per second e.g. 24000/1001
+    fps: Fraction
+    # the unit of the presentation timestamps
+    time_base: Fraction
+    # the presentation timestamp of the first frame
+    start_pts: int
+    # the number of frames
+    frames: int
+
+    # the probed infos by path, size and modification time
+    cache: ClassVar = {}
+    cache_lock: ClassVar = threading.Lock()
+
+    @property
+    def start_time(self) -> float:
+        """
+        the start offset of the first frame in seconds
+        """
+        return float(self.start_pts * self.time_base)
+
+    @property
+    def duration(self) -> float:
+        """
+        the duration in seconds
+        """
+        return float(self.frames / self.fps)
+
+    @classmethod
+    def from_stream(cls, stream: "av.video.stream.VideoStream") -> "VideoInfo":
+        """
+        get the timing of the given video stream
+        """
+        import av
+
+        fps = stream.average_rate or stream.guessed_rate or stream.base_rate
+        if not fps:
+            fps = Fraction(30)
+        time_base = stream.time_base or Fraction(1, 90000)
+        start_pts = stream.start_time or 0
+        frames = stream.frames
+        if not frames:
+            if stream.duration:
+                duration = stream.duration * time_base
+            else:
+                duration = Fraction(stream.container.duration or 0, av.time_base)
+            frames = round(duration * fps)
+        video_info = cls(
+            fps=Fraction(fps),
+            time_base=Fraction(time_base),
+            start_pts=start_pts,
+            frames=frames,
+        )
+        return video_info
+
+    @classmethod
+    def probe(cls, video_path: str) -> "VideoInfo":
+        """
+        get the timing of the given video - the container is only opened
+        the first time or when the file has changed
+
+        Args:
+            video_path (str): the path of the video
+
+        Returns:
+            VideoInfo: the timing of the first video stream
+        """
+        stat = os.stat(video_path)
+        key = (os.path.realpath(video_path), stat.st_size, stat.st_mtime_ns)
+        with cls.cache_lock:
+            video_info = cls.cache.get(key)
+        if video_info is None:
+            import av
+
+            with av.open(video_path) as container:
+                video_info = cls.from_stream(container.streams.video[0])
+            with cls.cache_lock:
+                cls.cache[key] = video_info
+        return video_info
+
+    def get_pts(self, frame_index: int) -> int:
+        """
+        get the presentation timestamp of the frame with the given index
+        """
+        pts = self.start_pts + round(frame_index / self.fps / self.time_base)
+        return pts
+
+    def get_frame_indices(self, seconds: np.ndarray) -> np.ndarray:
+        """
+        get the indices of the frames shown at the given times since the first frame
+
+        Args:
+            seconds (np.ndarray): the times - NaN for unknown times
+
+        Returns:
+            np.ndarray: the frame indices clipped to the video - -1 for unknown times
+        """
+        seconds = np.asarray(seconds, dtype=np.float64)
+        known = ~np.isnan(seconds)
+        indices = np.full(len(seconds), -1, dtype=np.int64)
+        # a tiny epsilon keeps exact frame times e.g. 1001/24000 s on their frame
+        frames = np.floor(seconds[known] * float(self.fps) + 1e-6)
+        indices[known] = np.clip(frames, 0, max(self.frames - 1, 0))
+        return indices
+
+    def get_frame_table(self, elapsed: np.ndarray, offset: float = 0.0) -> np.ndarray:
+        """
+        get the frame of each track point
+
+        track points without a time are interpolated between their neighbours - if no
+        track point has a time the points are spread evenly over the video
+
+        Args:
+            elapsed (np.ndarray): the seconds of the track points since the first track point
+            offset (float): the seconds of the first track point in the video
+
+        Returns:
+            np.ndarray: the frame index of each track point
+        """
+        elapsed = np.asarray(elapsed, dtype=np.float64)
+        count = len(elapsed)
+        known = ~np.isnan(elapsed)
+        positions = np.arange(count)
+        if known.all():
+            seconds = elapsed
+        elif known.any():
+            seconds = np.interp(positions, positions[known], elapsed[known])
+        else:
+            last_frame_time = max(self.frames - 1, 0) / float(self.fps)
+            seconds = positions * (last_frame_time / max(count - 1, 1))
+        frame_table = self.get_frame_indices(seconds + offset)
+        return frame_table
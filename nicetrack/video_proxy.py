@@ -0,0 +1,292 @@
+"""
+Created on 2024-12-26
+
+@author: wf
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from fractions import Fraction
+from pathlib import Path
+from typing import Dict, Tuple
+
+from nicetrack.http_cache import CacheValidator
+from nicetrack.video_stepper_base import VideoStepperBase
+
+logger = logging.getLogger(__name__)
+
+
+def lower_priority():
+    """
+    let the proxy workers yield the CPU to the server
+    """
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+def transcode_proxy(
+    source_path: str, proxy_path: str, height: int = 360, gop: int = 1, crf: int = 23
+) -> str:
+    """
+    transcode the given video to a low resolution proxy with the same frames
+
+    runs in a worker process with a single encoder thread
+
+    Args:
+        source_path (str): the path of the original video
+        proxy_path (str): the path of the proxy to create
+        height (int): the maximum height of the proxy
+        gop (int): the keyframe interval - 1 for all-intra
+        crf (int): the x264 constant rate factor
+
+    Returns:
+        str: the path of the proxy
+    """
+    tmp_path = f"{proxy_path}.{os.getpid()}.tmp.mp4"
+    try:
+        encode_proxy(source_path, tmp_path, height, gop, crf)
+        os.replace(tmp_path, proxy_path)
+    finally:
+        # a failed transcode leaves no partial proxy behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return proxy_path
+
+
+def encode_proxy(source_path: str, tmp_path: str, height: int, gop: int, crf: int):
+    """
+    encode the proxy of the given video to the given temporary path
+    """
+    import av
+
+    with av.open(source_path) as source:
+        in_stream = source.streams.video[0]
+        in_stream.thread_type = "AUTO"
+        rate = in_stream.average_rate or 30
+        width, height = VideoStepperBase.get_scaled_size(
+            in_stream.codec_context.width, in_stream.codec_context.height, None, height
+        )
+        # unscaled odd sizes are not supported by yuv420p
+        width, height = width // 2 * 2, height // 2 * 2
+        with av.open(tmp_path, "w") as proxy:
+            out_stream = proxy.add_stream("libx264", rate=rate)
+            out_stream.width = width
+            out_stream.height = height
+            out_stream.pix_fmt = "yuv420p"
+            out_stream.codec_context.thread_count = 1
+            out_stream.options = {
+                "preset": "veryfast",
+                "crf": str(crf),
+                "x264-params": f"keyint={gop}:min-keyint={gop}:bframes=0",
+            }
+            # frame i of the proxy is frame i of the original
+            for index, frame in enumerate(source.decode(in_stream)):
+                small = frame.reformat(
+                    width, height, format="yuv420p", interpolation="FAST_BILINEAR"
+                )
+                small.pts = index
+                small.time_base = 1 / Fraction(rate)
+                for packet in out_stream.encode(small):
+                    proxy.mux(packet)
+            for packet in out_stream.encode():
+                proxy.mux(packet)
+
+
+class VideoProxies:
+    """
+    low resolution proxies of the videos for scrubbing
+
+    the proxies are transcoded once in a pool of worker processes and cached
+    by the identity of the original file
+    """
+
+    # the extensions of the videos - the same the file index has as mp4 type
+    extensions = (".mp4", ".mov")
+
+    def __init__(
+        self,
+        cache_dir: str = None,
+        height: int = 360,
+        gop: int = 1,
+        cpu_budget: int = None,
+    ):
+        """
+        construct the proxies
+
+        Args:
+            cache_dir (str): the cache directory - default: ~/.nicetrack/proxy
+            height (int): the maximum height of the proxies
+            gop (int): the keyframe interval of the proxies - 1 for all-intra
+            cpu_budget (int): the number of worker processes - default: half of the cpus
+        """
+        if cache_dir is None:
+            home = str(Path.home())
+            cache_dir = f"{home}/.nicetrack/proxy"
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.height = height
+        self.gop = gop
+        if cpu_budget is None:
+            cpu_budget = max(1, (os.cpu_count() or 1) // 2)
+        self.cpu_budget = cpu_budget
+        self.executor = None
+        # pending transcodes by proxy path
+        self.pending: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+        # proxy frame sizes by proxy path
+        self.sizes: Dict[str, Tuple[int, int]] = {}
+
+    def get_proxy_path(self, video_path: str) -> str:
+        """
+        get the path of the proxy of the given video - changes with the file
+        """
+        identity = CacheValidator.file_identity(video_path)
+        key = f"{identity}:{self.height}:{self.gop}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        proxy_path = os.path.join(self.cache_dir, f"{digest}.mp4")
+        return proxy_path
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """
+        get the worker pool - spawned workers don't inherit the server's threads
+        """
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.cpu_budget,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=lower_priority,
+            )
+        return self.executor
+
+    def submit(self, video_path: str) -> Future:
+        """
+        make sure the proxy of the given video is created
+
+        Returns:
+            Future: the pending or finished transcode with the proxy path as result
+        """
+        proxy_path = self.get_proxy_path(video_path)
+        with self.lock:
+            future = self.pending.get(proxy_path)
+            if future is None:
+                if os.path.exists(proxy_path):
+                    future = Future()
+                    future.set_result(proxy_path)
+                else:
+                    future = self.get_executor().submit(
+                        transcode_proxy, video_path, proxy_path, self.height, self.gop
+                    )
+                    future.add_done_callback(
+                        lambda done: self.on_done(video_path, proxy_path, done)
+                    )
+                self.pending[proxy_path] = future
+        return future
+
+    def on_done(self, video_path: str, proxy_path: str, future: Future):
+        """
+        a transcode has finished - a failed one is logged and forgotten so
+        that the next scan tries again
+        """
+        if not future.cancelled() and future.exception() is None:
+            return
+        if not future.cancelled():
+            logger.warning(
+                f"could not create the proxy of {video_path}: {future.exception()}"
+            )
+        with self.lock:
+            if self.pending.get(proxy_path) is future:
+                del self.pending[proxy_path]
+
+    def scan(self, root_path: str) -> int:
+        """
+        queue the proxies of all videos below the given root path
+
+        Returns:
+            int: the number of videos found
+        """
+        count = 0
+        for root, _dirs, files in os.walk(root_path):
+            for name in sorted(files):
+                if name.lower().endswith(self.extensions):
+                    self.submit(os.path.join(root, name))
+                    count += 1
+        return count
+
+    def scan_index(self, file_index) -> int:
+        """
+        queue the proxies of the indexed videos - a listener of the file index
+        so that videos added while the server runs get their proxies too
+
+        Args:
+            file_index (FileIndex): the index of the root path
+
+        Returns:
+            int: the number of videos found
+        """
+        indexed_files = file_index.get_files("mp4")
+        for indexed_file in indexed_files:
+            try:
+                self.submit(indexed_file.path)
+            except OSError:
+                # removed since the last rescan
+                pass
+        return len(indexed_files)
+
+    def get_size(self, proxy_path: str) -> Tuple[int, int]:
+        """
+        get the frame size of the given proxy
+        """
+        size = self.sizes.get(proxy_path)
+        if size is None:
+            import av
+
+            with av.open(proxy_path) as proxy:
+                codec_context = proxy.streams.video[0].codec_context
+                size = (codec_context.width, codec_context.height)
+            self.sizes[proxy_path] = size
+        return size
+
+    def get_proxy(self, video_path: str, width: int = None, height: int = None) -> str:
+        """
+        get the proxy of the given video if it is ready and
+        large enough for the requested size
+
+        Args:
+            video_path (str): the path of the original video
+            width (int): the requested maximum width
+            height (int): the requested maximum height
+
+        Returns:
+            str: the path of the proxy or None if the original is needed
+        """
+        if width is None and height is None:
+            return None
+        proxy_path = self.get_proxy_path(video_path)
+        if not os.path.exists(proxy_path):
+            return None
+        proxy_width, proxy_height = self.get_size(proxy_path)
+        if width is not None and width > proxy_width:
+            return None
+        if height is not None and height > proxy_height:
+            return None
+        return proxy_path
+
+    def shutdown(self, wait: bool = True):
+        """
+        shut down the worker pool
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=True)
+            self.executor = None
+
+    def close(self):
+        """
+        shut down the worker pool without waiting for the running transcodes
+        """
+        self.shutdown(wait=False)
@@ -4,20 +4,19 @@ Created on 2023-08-31
 @author: wf
 """
 
-import io
-import os
-
 import cv2
-from fastapi import HTTPException
-from fastapi.responses import StreamingResponse
-from nicegui import ui
+import numpy as np
+
+from nicetrack.video_stepper_base import VideoStepperBase
 
 
-class VideoStepper:
+class VideoStepper(VideoStepperBase):
     """
-    Display a video step by step (frame-by-frame).
+    Display a video step by step (frame-by-frame) using OpenCV for video decoding.
     """
 
+    backend = "opencv"
+
     def __init__(self, video_path: str = None, root_path: str = None, fps: int = 30):
         """
         Initialize the VideoStepper instance.
@@ -28,135 +27,73 @@ class VideoStepper:
             fps (int, optional): Frames per second. Defaults to 30.
         """
         self.cap = None
-        self.root_path = root_path
-        self.video_path = None
-        self.fps = fps
-        self.set_video_path(video_path)
+        # the index of the frame the capture reads next - stepping forward needs no seek
+        self.next_index = None
+        super().__init__(video_path, root_path, fps)
+
+    def open(self):
+        self.cap = cv2.VideoCapture(self.video_path)
+        self.next_index = 0
+        self.metrics.open_decoders.inc(self.backend)
 
     def close(self):
         if self.cap is not None:
             self.cap.release()
+            self.cap = None
+            self.next_index = None
+            self.metrics.open_decoders.dec(self.backend)
 
-    def set_video_path(self, video_path: str):
-        self.close()
-        self.video_path = video_path
-        if video_path is None or not os.path.exists(video_path):
-            self.video_size = 0
-            self.base_url = None
-            self.fps = 1
-            # dummy image
-            self.url = "https://picsum.photos/id/28/1024/768"
-            return
-        self.video_size = os.path.getsize(video_path)
-        if self.root_path:
-            if video_path.startswith(self.root_path):
-                video_path = video_path.replace(self.root_path, "")
-                if video_path.startswith("/"):
-                    # replace first slash
-                    video_path = video_path.replace("/", "", 1)
-                else:
-                    video_path = os.path.basename(video_path)
-        self.base_url = f"/video_step/{video_path}"
-        self.cap = cv2.VideoCapture(self.video_path)
-        self.set_frame_index(0)
-
-    def set_frame_index(self, frame_index: int = 0):
-        self.frame_index = frame_index
-        if self.base_url:
-            self.url = f"{self.base_url}/{self.frame_index}"
-
-    def get_view(self, container):
-        with container:
-            self.view = (
-                ui.interactive_image(
-                    events=["click", "mousedown", "mouseup"], cross=True
-                )
-                .bind_source_from(self, "url")
-                .bind_content(self, "svg_content")
-            )
-        return self.view
-
-    def get_frame(self, frame: int = None):
+    def get_frame(
+        self, frame_index: int = None, width: int = None, height: int = None
+    ) -> np.ndarray:
         """
         Extracts the specified frame from the video.
 
         Args:
-            frame (int): The frame number to extract.
+            frame_index (int): The index of the frame to extract.
+            width (int): maximum width to downscale the frame to
+            height (int): maximum height to downscale the frame to
 
         Returns:
-            numpy.ndarray or None: The image of the specified frame or None if the frame doesn't exist.
+            numpy.ndarray or None: The BGR image of the specified frame or None if the frame doesn't exist.
         """
         if self.cap is None:
             return None
-        if frame is None:
-            frame = self.frame_index
+        if frame_index is None:
+            frame_index = self.frame_index
 
-        # Calculate the frame number
-        frame_number = frame * self.fps
-
-        # Set the position of the video file capture to the desired frame
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        if frame_index != self.next_index:
+            # Set the position of the video file capture to the desired frame
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
 
         ret, frame = self.cap.read()
 
-        if ret:
-            return frame
-        else:
+        if not ret:
+            self.next_index = None
             return None
-
-    def get_image(self, frame: int = None, img_format: str = "jpg") -> bytes:
-        """
-        Extracts the specified frame from the video and converts it to the desired image format.
-
-        Args:
-            frame (int): The frame number to extract.
-            img_format (str, optional): Image format, supports "jpg" and "png". Defaults to "jpg".
-
-        Returns:
-            bytes or None: The image bytes of the specified frame in the desired format or None if the frame doesn't exist.
-        """
-        if frame is None:
-            frame = self.frame_index
-
-        # Check if the provided format is supported
-        if img_format not in ["jpg", "png"]:
-            raise ValueError("Unsupported image format. Please use 'jpg' or 'png'.")
-
-        # Get the frame from the video
-        frame_img = self.get_frame(frame)
-
-        # If frame exists, encode it to the desired format
-        if frame_img is not None:
-            retval, buffer = cv2.imencode(f".{img_format}", frame_img)
-
-            if retval:
-                return buffer.tobytes()
-        return None
-
-    async def stream_image(
-        self, frame_index: int = 0, img_format: str = "jpg"
-    ) -> StreamingResponse:
-        """
-        Stream an image from the video at the specified frame index in the given image format.
-
-        Args:
-            frame_index (int, optional): Frame index to retrieve. Defaults to 0.
-            img_format (str, optional): Image format, supports "jpg" and "png". Defaults to "jpg".
-
-        Raises:
-            HTTPException: Raises a 404 exception if the video is not available.
-
-        Returns:
-            StreamingResponse: The image from the specified frame in the desired format.
-        """
-        if not self.video_size:
-            raise HTTPException(status_code=404, detail=f"Video not available")
-
-        image_bytes = self.get_image(frame_index, img_format)
-
-        if image_bytes:
-            return StreamingResponse(
-                io.BytesIO(image_bytes), media_type=f"image/{img_format}"
+        self.next_index = frame_index + 1
+        src_height, src_width = frame.shape[:2]
+        target_width, target_height = self.get_scaled_size(
+            src_width, src_height, width, height
+        )
+        if (target_width, target_height) != (src_width, src_height):
+            frame = cv2.resize(
+                frame,
+                (target_width, target_height),
+                interpolation=cv2.INTER_LINEAR,
             )
-        else:
-            raise HTTPException(status_code=404, detail="Image not found")
+        return frame
+
+    def encode_frame(
+        self, frame_img: np.ndarray, img_format: str, quality: int = None
+    ) -> bytes:
+        params = []
+        if quality:
+            if img_format == "jpg":
+                params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+            elif img_format == "webp":
+                params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        retval, buffer = cv2.imencode(f".{img_format}", frame_img, params)
+        if retval:
+            return buffer.tobytes()
+        return None
@@ -1,117 +1,187 @@
 import io
-import os
 
 import av
-from fastapi import HTTPException
-from fastapi.responses import StreamingResponse
-from nicegui import ui
+from PIL import Image
 
+from nicetrack.video_stepper_base import VideoStepperBase
 
-class VideoStepperAV:
+
+class VideoStepperAV(VideoStepperBase):
     """
     Display a video step by step (frame-by-frame) using PyAV for video decoding.
     """
 
-    def __init__(self, video_path: str = None, root_path: str = None, fps: int = 30):
+    backend = "av"
+
+    # frames before the seek target within which non-reference frames are decoded again
+    skip_margin = 16
+
+    def __init__(
+        self,
+        video_path: str = None,
+        root_path: str = None,
+        fps: int = 30,
+        thread_count: int = 0,
+        thread_type: str = "AUTO",
+        skip_nonref: bool = False,
+    ):
+        """
+        Initialize the VideoStepperAV instance.
+
+        Args:
+            video_path (str): Path to the video file.
+            root_path (str): Root directory path.
+            fps (int, optional): Frames per second. Defaults to 30.
+            thread_count (int, optional): number of decoder threads - 0 lets the codec pick one per core
+            thread_type (str, optional): "FRAME", "SLICE" or "AUTO" for both
+            skip_nonref (bool, optional): if True skip non-reference frames while scanning forward to a seek target
+        """
         self.container = None
-        self.root_path = root_path
-        self.video_path = None
-        self.fps = fps
-        self.set_video_path(video_path)
+        # the running decoder and the index of the frame it delivers next
+        # - stepping forward continues decoding without a seek
+        self.decoder = None
+        self.next_index = None
+        self.thread_count = thread_count
+        self.thread_type = thread_type
+        self.skip_nonref = skip_nonref
+        super().__init__(video_path, root_path, fps)
+
+    def open(self):
+        self.container = av.open(self.video_path)
+        self.metrics.open_decoders.inc(self.backend)
+        self.configure_threading()
 
     def close(self):
+        self.decoder = None
+        self.next_index = None
         if self.container is not None:
             self.container.close()
-
-    def set_video_path(self, video_path: str):
-        self.close()
-        self.video_path = video_path
-        if video_path is None or not os.path.exists(video_path):
-            self.video_size = 0
-            self.base_url = None
-            self.fps = 1
-            # dummy image
-            self.url = "https://picsum.photos/id/28/1024/768"
-            return
-        self.video_size = os.path.getsize(video_path)
-        if self.root_path:
-            if video_path.startswith(self.root_path):
-                video_path = video_path.replace(self.root_path, "")
-                if video_path.startswith("/"):
-                    video_path = video_path.replace("/", "", 1)
-                else:
-                    video_path = os.path.basename(video_path)
-        self.base_url = f"/video_step/{video_path}"
-        self.container = av.open(self.video_path)
-        self.set_frame_index(0)
-
-    def set_frame_index(self, frame_index: int = 0):
-        self.frame_index = frame_index
-        if self.base_url:
-            self.url = f"{self.base_url}/{self.frame_index}"
-
-    def get_view(self, container):
-        with container:
-            self.view = (
-                ui.interactive_image(
-                    events=["click", "mousedown", "mouseup"], cross=True
-                )
-                .bind_source_from(self, "url")
-                .bind_content(self, "svg_content")
-            )
-        return self.view
-
-    def get_frame(self, frame_index: int = None):
+            self.container = None
+            self.metrics.open_decoders.dec(self.backend)
+
+    def configure_threading(self):
+        """
+        enable frame and/or slice threading of the video codec
+        - needs to be done before the first frame is decoded
+        """
+        video_stream = self.container.streams.video[0]
+        video_stream.thread_type = self.thread_type
+        video_stream.codec_context.thread_count = self.thread_count
+
+    def get_frame(
+        self, frame_index: int = None, width: int = None, height: int = None
+    ) -> Image.Image:
+        """
+        get the frame with the given index as an image
+
+        Args:
+            frame_index (int): the index of the frame
+            width (int): maximum width to downscale the frame to
+            height (int): maximum height to downscale the frame to
+
+        Returns:
+            Image.Image: the image or None if the frame doesn't exist
+        """
         if self.container is None:
             return None
         if frame_index is None:
             frame_index = self.frame_index
 
-        # Seek to the desired frame
-        video_stream = self.container.streams.video[0]
-        frame_num = frame_index
-        framerate = video_stream.average_rate
-        time_base = video_stream.time_base
-        sec = int(frame_num / framerate)
-        self.container.seek(sec * 1000000, whence="time", backward=True)
-
-        # Get the next available frame
-        for _ in range(sec, frame_num):
-            frame = next(self.container.decode(video=0))
-        return frame.to_image()
-
-    def get_image(self, frame_index: int = None, img_format: str = "jpg") -> bytes:
-        if frame_index is None:
-            frame_index = self.frame_index
+        # the stream may not start at pts 0
+        target_pts = self.video_info.get_pts(frame_index)
+        frame = None
+        if frame_index == self.next_index:
+            frame = self.next_frame(target_pts)
+        if frame is None:
+            frame = self.seek_frame(target_pts, skip_nonref=self.skip_nonref)
+        if frame is None and self.skip_nonref:
+            # the target might have been skipped - retry decoding every frame
+            frame = self.seek_frame(target_pts, skip_nonref=False)
+        self.next_index = frame_index + 1 if frame is not None else None
+        if frame is not None:
+            target_width, target_height = self.get_scaled_size(
+                frame.width, frame.height, width, height
+            )
+            # downscale with the reformatter before converting to an image
+            frame = frame.reformat(
+                width=target_width,
+                height=target_height,
+                format="rgb24",
+                interpolation="FAST_BILINEAR",
+            )
+            return frame.to_image()
+        return None
+
+    def next_frame(self, target_pts: int) -> av.VideoFrame:
+        """
+        continue decoding after the previous frame
 
-        # Check if the provided format is supported
-        if img_format not in ["jpg", "png"]:
-            raise ValueError("Unsupported image format. Please use 'jpg' or 'png'.")
-
-        # Get the frame from the video
-        frame_img = self.get_frame(frame_index)
-
-        # If frame exists, encode it to the desired format
-        if frame_img is not None:
-            buffer = io.BytesIO()
-            img_format = (
-                "jpeg" if img_format == "jpg" else img_format
-            )  # Handle 'jpg' -> 'jpeg'
-            frame_img.save(buffer, format=img_format)
-            return buffer.getvalue()
+        Args:
+            target_pts (int): the expected presentation timestamp of the next frame
+
+        Returns:
+            av.VideoFrame: the frame or None if the next frame is not the expected one
+        """
+        if self.decoder is None:
+            return None
+        for frame in self.decoder:
+            if frame.pts is None:
+                continue
+            if frame.pts == target_pts:
+                return frame
+            break
+        self.decoder = None
         return None
 
-    async def stream_image(
-        self, frame_index: int = 0, img_format: str = "jpg"
-    ) -> StreamingResponse:
-        if not self.video_size:
-            raise HTTPException(status_code=404, detail=f"Video not available")
+    def seek_frame(self, target_pts: int, skip_nonref: bool = False) -> av.VideoFrame:
+        """
+        seek to the keyframe before the given presentation timestamp and decode
+        forward to the frame at the timestamp
 
-        image_bytes = self.get_image(frame_index, img_format)
+        Args:
+            target_pts (int): the presentation timestamp in the time base of the video stream
+            skip_nonref (bool): if True skip non-reference frames until the target is close
 
-        if image_bytes:
-            return StreamingResponse(
-                io.BytesIO(image_bytes), media_type=f"image/{img_format}"
-            )
-        else:
-            raise HTTPException(status_code=404, detail="Image not found")
+        Returns:
+            av.VideoFrame: the frame or None if the frame is not available
+        """
+        video_stream = self.container.streams.video[0]
+        codec_context = video_stream.codec_context
+        margin = int(self.skip_margin / self.video_info.fps / self.video_info.time_base)
+        self.container.seek(target_pts, backward=True, stream=video_stream)
+        skipping = skip_nonref
+        codec_context.skip_frame = "NONREF" if skipping else "DEFAULT"
+        result = None
+        # kept for continuing with the next frame
+        self.decoder = self.container.decode(video_stream)
+        try:
+            for frame in self.decoder:
+                if frame.pts is None:
+                    continue
+                if frame.pts < target_pts:
+                    if skipping and frame.pts >= target_pts - margin:
+                        # close to the target - decode all frames again
+                        skipping = False
+                        codec_context.skip_frame = "DEFAULT"
+                    continue
+                if skipping:
+                    # the target might have been skipped as non-reference frame
+                    break
+                result = frame
+                break
+            if result is None:
+                self.decoder = None
+        finally:
+            codec_context.skip_frame = "DEFAULT"
+        return result
+
+    def encode_frame(
+        self, frame_img: Image.Image, img_format: str, quality: int = None
+    ) -> bytes:
+        buffer = io.BytesIO()
+        img_format = (
+            "jpeg" if img_format == "jpg" else img_format
+        )  # Handle 'jpg' -> 'jpeg'
+        save_params = {"quality": quality} if quality and img_format != "png" else {}
+        frame_img.save(buffer, format=img_format, **save_params)
+        return buffer.getvalue()
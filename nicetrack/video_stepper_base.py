@@ -0,0 +1,394 @@
+"""
+Created on 2024-12-22
+
+@author: wf
+"""
+
+import asyncio
+import importlib
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+from nicegui import ui
+
+from nicetrack.http_cache import CacheValidator
+from nicetrack.metrics import Metrics
+from nicetrack.video_info import VideoInfo
+
+
+class VideoStepperBase(ABC):
+    """
+    Display a video step by step (frame-by-frame) - the common interface
+    of the video decoding backends.
+
+    A frame is always addressed by its zero based index in the video.
+    Backends implement the abstract methods open, close, get_frame and encode_frame.
+    """
+
+    # supported image formats and their media types
+    media_types = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+    # the name of the backend - the label of its metrics
+    backend = "base"
+
+    # the available backends by name as module and class name
+    backends = {
+        "opencv": ("nicetrack.video_stepper", "VideoStepper"),
+        "av": ("nicetrack.video_stepper_av", "VideoStepperAV"),
+    }
+
+    def __init__(self, video_path: str = None, root_path: str = None, fps: int = 30):
+        """
+        Initialize the video stepper.
+
+        Args:
+            video_path (str): Path to the video file.
+            root_path (str): Root directory path.
+            fps (int, optional): Frames per second if no video is loaded. Defaults to 30.
+        """
+        self.root_path = root_path
+        self.video_path = None
+        self.fps = fps
+        # the timing of the video - read once when the video is set
+        self.video_info = None
+        # the size and quality the view asks for - None means original size / default quality
+        self.width = None
+        self.height = None
+        self.quality = None
+        self.img_format = "jpg"
+        # the session of the view - lets the server drop its superseded frame requests
+        self.session = None
+        # frames are decoded in a worker thread one at a time
+        self.decode_lock = asyncio.Lock()
+        self.metrics = Metrics.get_instance()
+        self.set_video_path(video_path)
+
+    @classmethod
+    def get_backend_class(cls, backend: str) -> type:
+        """
+        get the stepper class for the given backend name
+
+        Args:
+            backend (str): the name of the backend e.g. "opencv" or "av"
+
+        Returns:
+            type: the VideoStepperBase subclass
+        """
+        if backend not in cls.backends:
+            supported = ", ".join(cls.backends)
+            raise ValueError(
+                f"Unknown stepper backend {backend} - use one of {supported}"
+            )
+        module_name, class_name = cls.backends[backend]
+        module = importlib.import_module(module_name)
+        backend_class = getattr(module, class_name)
+        return backend_class
+
+    @classmethod
+    def create(
+        cls,
+        backend: str = "opencv",
+        video_path: str = None,
+        root_path: str = None,
+        **kwargs,
+    ) -> "VideoStepperBase":
+        """
+        create a video stepper with the given backend
+
+        Args:
+            backend (str): the name of the backend e.g. "opencv" or "av"
+            video_path (str): Path to the video file.
+            root_path (str): Root directory path.
+            **kwargs: backend specific options
+
+        Returns:
+            VideoStepperBase: the video stepper
+        """
+        backend_class = cls.get_backend_class(backend)
+        video_stepper = backend_class(video_path, root_path, **kwargs)
+        return video_stepper
+
+    @abstractmethod
+    def open(self):
+        """
+        open my video for decoding
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def close(self):
+        """
+        release the decoding resources of my video
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_frame(
+        self, frame_index: int = None, width: int = None, height: int = None
+    ) -> Any:
+        """
+        get the frame with the given index in the native image representation of the backend
+
+        Args:
+            frame_index (int): the index of the frame - defaults to the current frame index
+            width (int): maximum width to downscale the frame to
+            height (int): maximum height to downscale the frame to
+
+        Returns:
+            the image of the frame or None if the frame doesn't exist
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def encode_frame(
+        self, frame_img: Any, img_format: str, quality: int = None
+    ) -> bytes:
+        """
+        encode the given frame image
+
+        Args:
+            frame_img: the image as returned by get_frame
+            img_format (str): "jpg", "png" or "webp"
+            quality (int): encoding quality 1-100 for jpg and webp
+
+        Returns:
+            bytes: the encoded image
+        """
+        raise NotImplementedError
+
+    def set_video_path(self, video_path: str):
+        self.close()
+        self.video_path = video_path
+        if video_path is None or not os.path.exists(video_path):
+            self.video_size = 0
+            self.base_url = None
+            self.video_info = None
+            # dummy image
+            self.url = "https://picsum.photos/id/28/1024/768"
+            return
+        self.video_size = os.path.getsize(video_path)
+        self.video_info = VideoInfo.probe(video_path)
+        self.fps = float(self.video_info.fps)
+        if self.root_path:
+            if video_path.startswith(self.root_path):
+                video_path = video_path.replace(self.root_path, "")
+                if video_path.startswith("/"):
+                    # replace first slash
+                    video_path = video_path.replace("/", "", 1)
+                else:
+                    video_path = os.path.basename(video_path)
+        self.base_url = f"/video_step/{video_path}"
+        self.open()
+        self.set_frame_index(0)
+
+    def set_frame_index(self, frame_index: int = 0):
+        self.frame_index = frame_index
+        if self.base_url:
+            self.url = f"{self.base_url}/{self.frame_index}{self.get_query()}"
+
+    def get_query(self) -> str:
+        """
+        get the query string for the size, quality and format the view asks for
+
+        Returns:
+            str: the query string e.g. ?width=640&img_format=webp or an empty string
+        """
+        params = []
+        for name in ["width", "height", "quality", "session"]:
+            value = getattr(self, name)
+            if value:
+                params.append(f"{name}={value}")
+        if self.img_format != "jpg":
+            params.append(f"img_format={self.img_format}")
+        query = "?" + "&".join(params) if params else ""
+        return query
+
+    def set_display_size(self, width: int = None, height: int = None):
+        """
+        set the size the frames are displayed with
+
+        Args:
+            width (int): the display width in pixels
+            height (int): the display height in pixels
+        """
+        self.width = width
+        self.height = height
+        self.set_frame_index(getattr(self, "frame_index", 0))
+
+    async def request_display_size(self):
+        """
+        ask the browser for the width my view is actually displayed with
+        and request frames of that size from now on
+        """
+        width = await ui.run_javascript(
+            f"return getHtmlElement({self.view.id}).clientWidth"
+        )
+        if width:
+            self.set_display_size(width=int(width))
+
+    def get_view(self, container):
+        with container:
+            self.view = (
+                ui.interactive_image(
+                    events=["click", "mousedown", "mouseup"], cross=True
+                )
+                .bind_source_from(self, "url")
+                .bind_content(self, "svg_content")
+            )
+        return self.view
+
+    @classmethod
+    def get_scaled_size(
+        cls, src_width: int, src_height: int, width: int = None, height: int = None
+    ) -> Tuple[int, int]:
+        """
+        get the size to scale a frame to keeping the aspect ratio - frames are never enlarged
+
+        Args:
+            src_width (int): the width of the frame
+            src_height (int): the height of the frame
+            width (int): the wanted width
+            height (int): the wanted height
+
+        Returns:
+            Tuple[int, int]: the target width and height
+        """
+        scale = 1.0
+        if width:
+            scale = min(scale, width / src_width)
+        if height:
+            scale = min(scale, height / src_height)
+        if scale >= 1.0:
+            return src_width, src_height
+        # keep even sizes for the benefit of the encoders
+        target_width = max(2, int(src_width * scale) // 2 * 2)
+        target_height = max(2, int(src_height * scale) // 2 * 2)
+        return target_width, target_height
+
+    @classmethod
+    def check_format(cls, img_format: str):
+        """
+        check that the given image format is supported
+
+        Args:
+            img_format (str): the image format
+
+        Raises:
+            ValueError: if the format is not supported
+        """
+        if img_format not in cls.media_types:
+            supported = ", ".join(f"'{fmt}'" for fmt in cls.media_types)
+            raise ValueError(
+                f"Unsupported image format. Please use one of {supported}."
+            )
+
+    def get_image(
+        self,
+        frame_index: int = None,
+        img_format: str = "jpg",
+        width: int = None,
+        height: int = None,
+        quality: int = None,
+    ) -> bytes:
+        """
+        Extracts the specified frame from the video and converts it to the desired image format.
+
+        Args:
+            frame_index (int): The index of the frame to extract.
+            img_format (str, optional): Image format, supports "jpg", "png" and "webp". Defaults to "jpg".
+            width (int, optional): maximum width to downscale the frame to before encoding.
+            height (int, optional): maximum height to downscale the frame to before encoding.
+            quality (int, optional): encoding quality 1-100 for jpg and webp.
+
+        Returns:
+            bytes or None: The image bytes of the specified frame in the desired format or None if the frame doesn't exist.
+        """
+        if frame_index is None:
+            frame_index = self.frame_index
+
+        # Check if the provided format is supported
+        self.check_format(img_format)
+
+        # Get the downscaled frame from the video
+        with self.metrics.frame_decode_seconds.time(self.backend):
+            frame_img = self.get_frame(frame_index, width=width, height=height)
+
+        # If frame exists, encode it to the desired format
+        if frame_img is not None:
+            with self.metrics.frame_encode_seconds.time(self.backend):
+                return self.encode_frame(frame_img, img_format, quality)
+        return None
+
+    async def stream_image(
+        self,
+        frame_index: int = 0,
+        img_format: str = "jpg",
+        width: int = None,
+        height: int = None,
+        quality: int = None,
+        if_none_match: str = None,
+        if_modified_since: str = None,
+        is_superseded: Callable[[], bool] = None,
+    ) -> Response:
+        """
+        Stream an image from the video at the specified frame index in the given image format.
+
+        Args:
+            frame_index (int, optional): Frame index to retrieve. Defaults to 0.
+            img_format (str, optional): Image format, supports "jpg", "png" and "webp". Defaults to "jpg".
+            width (int, optional): maximum width of the image.
+            height (int, optional): maximum height of the image.
+            quality (int, optional): encoding quality 1-100 for jpg and webp.
+            if_none_match (str, optional): the If-None-Match header of a conditional request.
+            if_modified_since (str, optional): the If-Modified-Since header of a conditional request.
+            is_superseded (Callable, optional): checked before decoding - if it returns True the frame is not wanted any more.
+
+        Raises:
+            HTTPException: Raises a 404 exception if the video is not available.
+
+        Returns:
+            Response: The image from the specified frame in the desired format with
+            caching headers, a 304 Not Modified response for a conditional request
+            or a 204 No Content response if the request was superseded while waiting.
+        """
+        if not self.video_size:
+            raise HTTPException(status_code=404, detail=f"Video not available")
+
+        validator = CacheValidator.for_frame(
+            self.video_path, frame_index, img_format, width, height, quality
+        )
+        if validator.is_not_modified(if_none_match, if_modified_since):
+            # the browser already has this frame - no need to decode it again
+            return validator.not_modified_response()
+
+        # the total latency includes waiting for the decoder
+        with self.metrics.frame_seconds.time(self.backend):
+            async with self.decode_lock:
+                if is_superseded and is_superseded():
+                    # the view already wants another frame - skip the decoding
+                    return Response(
+                        status_code=204, headers={"Cache-Control": "no-store"}
+                    )
+                try:
+                    image_bytes = await asyncio.to_thread(
+                        self.get_image,
+                        frame_index,
+                        img_format,
+                        width=width,
+                        height=height,
+                        quality=quality,
+                    )
+                except ValueError as ve:
+                    raise HTTPException(status_code=400, detail=str(ve))
+
+        if image_bytes:
+            return Response(
+                image_bytes,
+                media_type=self.media_types[img_format],
+                headers=validator.headers,
+            )
+        else:
+            raise HTTPException(status_code=404, detail="Image not found")
@@ -4,98 +4,443 @@ Created on 27.08.2023
 @author: wf
 """
 
+import asyncio
+import mmap
 import os
+import secrets
+import threading
+from typing import List, Tuple
 
-import cv2
-from fastapi import Header, HTTPException
+from fastapi import HTTPException
 from starlette.responses import FileResponse, StreamingResponse
 
+from nicetrack.http_cache import CacheValidator
+from nicetrack.metrics import Metrics
+from nicetrack.video_stepper_base import VideoStepperBase
+
+
+class WholeFileResponse(FileResponse):
+    """
+    a file response that always sends the whole file - the ranges are
+    handled by VideoStream which falls back to this response for missing,
+    ignored and too many ranges
+    """
+
+    async def __call__(self, scope, receive, send):
+        headers = [
+            (name, value) for name, value in scope["headers"] if name != b"range"
+        ]
+        await super().__call__({**scope, "headers": headers}, receive, send)
+
+
+class LatestFrame:
+    """
+    a slot that only keeps the latest frame - older frames
+    that have not been picked up yet are dropped
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.done = False
+        self.dropped = 0
+        self.event = asyncio.Event()
+
+    def put(self, frame: bytes):
+        """
+        put the given frame replacing any frame not picked up yet
+        """
+        if self.frame is not None:
+            self.dropped += 1
+        self.frame = frame
+        self.event.set()
+
+    def close(self):
+        """
+        signal that no more frames will follow
+        """
+        self.done = True
+        self.event.set()
+
+    async def get(self) -> bytes:
+        """
+        wait for the next frame
+
+        Returns:
+            bytes: the latest frame or None if no more frames will follow
+        """
+        while True:
+            if self.frame is not None:
+                frame = self.frame
+                self.frame = None
+                return frame
+            if self.done:
+                return None
+            await self.event.wait()
+            self.event.clear()
+
+
+class JpegReader:
+    """
+    reads jpeg encoded frames from a video capture - reading and releasing
+    are serialized so the capture can be released while a read is still running
+    in a worker thread
+    """
+
+    def __init__(
+        self,
+        video_path: str,
+        start_time: float = 0.0,
+        width: int = None,
+        height: int = None,
+    ):
+        """
+        open the capture of the given video
+
+        Args:
+            video_path (str): the path of the video
+            start_time (float): the time in seconds of the first frame to read
+            width (int): maximum width to downscale the frames to
+            height (int): maximum height to downscale the frames to
+        """
+        import cv2
+
+        self.lock = threading.Lock()
+        self.width = width
+        self.height = height
+        self.cap = cv2.VideoCapture(video_path)
+        # the frame index depends on the native frame rate not the paced output rate
+        native_fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.start_frame = int(start_time * native_fps) if native_fps > 0 else 0
+        if self.start_frame:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+        self.metrics = Metrics.get_instance()
+        self.metrics.open_decoders.inc("stream")
+
+    def read(self, skip: int = 0) -> bytes:
+        """
+        read and encode the next frame
+
+        Args:
+            skip (int): the number of frames to skip without converting them to images first
+
+        Returns:
+            bytes: the jpeg encoded frame or None at the end of the video
+        """
+        import cv2
+
+        with self.lock:
+            if self.cap is None:
+                return None
+            for _ in range(skip):
+                if not self.cap.grab():
+                    return None
+            ret, frame = self.cap.read()
+        if not ret:
+            return None
+        if self.width or self.height:
+            src_height, src_width = frame.shape[:2]
+            size = VideoStepperBase.get_scaled_size(
+                src_width, src_height, self.width, self.height
+            )
+            if size != (src_width, src_height):
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+        _, buffer = cv2.imencode(".jpg", frame)
+        return buffer.tobytes()
+
+    def release(self):
+        with self.lock:
+            if self.cap is not None:
+                self.cap.release()
+                self.cap = None
+                self.metrics.open_decoders.dec("stream")
+
 
 class VideoStream:
     """
     wrapper to stream a local file as a video
     """
 
+    media_type = "video/mp4"
+    # bytes per read of a range
+    chunk_size = 1024 * 1024
+    # requests with more ranges get the whole file
+    max_ranges = 64
+
     def __init__(self, video_path):
         self.video_path = video_path
         self.video_size = os.path.getsize(video_path)
 
-    def generate_frames(self, start_time: float = 0.0, fps: float = 30.0):
-        cap = cv2.VideoCapture(self.video_path)
+    async def produce_frames(self, reader: JpegReader, latest: LatestFrame, fps: float):
+        """
+        decode and encode frames off the event loop paced to the given frames per second
+        frames that can not be delivered in time are skipped
 
-        # Calculate the starting frame based on start_time and fps
-        start_frame = int(start_time * fps)
-        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        Args:
+            reader (JpegReader): the reader to get the frames from
+            latest (LatestFrame): the target to put the frames to - anything with put and close
+            fps (float): the frames per second
+        """
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / fps
+        start = loop.time()
+        frame_no = 0
+        skip = 0
+        try:
+            while True:
+                jpeg = await asyncio.to_thread(reader.read, skip)
+                if jpeg is None:
+                    break
+                frame_no += 1 + skip
+                latest.put(jpeg)
+                due = start + frame_no * interval
+                delay = due - loop.time()
+                if delay > 0:
+                    skip = 0
+                    await asyncio.sleep(delay)
+                else:
+                    # decoding falls behind the wall clock - skip the frames that are late
+                    skip = int(-delay / interval)
+        finally:
+            latest.close()
 
+    @classmethod
+    async def multipart_frames(cls, latest: LatestFrame):
+        """
+        generate the multipart parts for the frames of the given slot
+        """
         while True:
-            ret, frame = cap.read()
-            if not ret:
-                cap.release()
+            frame = await latest.get()
+            if frame is None:
                 break
-            _, buffer = cv2.imencode(".jpg", frame)
-            frame = buffer.tobytes()
             yield (
                 b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + frame + b"\r\n\r\n"
             )
 
-    async def video_feed(self, start_time: float = 0.0, fps: float = 30.0):
-        frame_gen = self.generate_frames(start_time=start_time, fps=fps)
+    async def generate_frames(
+        self,
+        start_time: float = 0.0,
+        fps: float = 30.0,
+        width: int = None,
+        height: int = None,
+    ):
+        """
+        generate the multipart jpeg frames of my video starting at the given time
+        paced to the given frames per second
+
+        a client that falls behind only gets the latest frame - the capture
+        is released when the client disconnects or the video ends
+        """
+        reader = await asyncio.to_thread(
+            JpegReader, self.video_path, start_time, width, height
+        )
+        latest = LatestFrame()
+        producer = asyncio.create_task(self.produce_frames(reader, latest, fps))
+        try:
+            async for part in self.multipart_frames(latest):
+                yield part
+        finally:
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+            await asyncio.to_thread(reader.release)
+
+    async def video_feed(
+        self,
+        start_time: float = 0.0,
+        fps: float = 30.0,
+        width: int = None,
+        height: int = None,
+    ):
+        frame_gen = self.generate_frames(
+            start_time=start_time, fps=fps, width=width, height=height
+        )
+        return self.feed_response(frame_gen)
+
+    @classmethod
+    def feed_response(cls, frame_gen) -> StreamingResponse:
+        """
+        get the motion jpeg response for the given multipart frame generator
+        """
         return StreamingResponse(
-            frame_gen, media_type="multipart/x-mixed-replace; boundary=frame"
+            frame_gen,
+            media_type="multipart/x-mixed-replace; boundary=frame",
         )
 
-    def parse_range_header(self, range_header: str) -> tuple:
+    def get_validator(self) -> CacheValidator:
+        """
+        get the cache validator of my video file
         """
-        Parse the Range header to determine the part of the file to stream.
-        Returns a tuple of (start_byte, end_byte).
+        validator = CacheValidator.for_file(self.video_path)
+        # the file may change under the same url so it needs to be revalidated
+        validator.immutable = False
+        return validator
+
+    def parse_range_header(self, range_header: str) -> List[Tuple[int, int]]:
         """
-        start_byte, end_byte = None, None
+        Parse the Range header to determine the parts of the file to stream.
+
+        supports byte ranges "bytes=a-b", open ranges "bytes=a-",
+        suffix ranges "bytes=-n" and comma separated lists of these
+
+        Args:
+            range_header (str): the Range header
 
-        if range_header:
+        Returns:
+            List[Tuple[int, int]]: the satisfiable (start_byte, end_byte) ranges
+            with inclusive end bytes - empty if there is no range header or it is
+            malformed and has to be ignored (RFC 9110 section 14.2)
+
+        Raises:
+            HTTPException: 416 for an unsatisfiable range header
+        """
+        ranges = []
+        if not range_header:
+            return ranges
+        unit, _, range_set = range_header.partition("=")
+        if unit.strip().lower() != "bytes" or not range_set:
+            return []
+        for range_spec in range_set.split(","):
             try:
-                byte1, byte2 = range_header.replace("bytes=", "").split("-")
-                start_byte = int(byte1)
-                end_byte = int(byte2) if byte2 else None
+                byte1, byte2 = range_spec.strip().split("-")
+                if byte1:
+                    start_byte = int(byte1)
+                    end_byte = int(byte2) if byte2 else self.video_size - 1
+                else:
+                    # suffix range - the last n bytes
+                    suffix_length = int(byte2)
+                    start_byte = max(0, self.video_size - suffix_length)
+                    end_byte = self.video_size - 1 if suffix_length > 0 else -1
             except ValueError:
-                raise HTTPException(status_code=400, detail="Malformed range header")
+                return []
+            if start_byte < 0 or (byte2 and byte1 and end_byte < start_byte):
+                return []
+            if start_byte < self.video_size and end_byte >= start_byte:
+                ranges.append((start_byte, min(end_byte, self.video_size - 1)))
+        if not ranges:
+            raise HTTPException(
+                status_code=416,
+                detail="Range not satisfiable",
+                headers={"Content-Range": f"bytes */{self.video_size}"},
+            )
+        return ranges
 
-        return start_byte, end_byte
+    def read_range(self, start: int, end: int):
+        """
+        read the bytes between the start and end bytes (inclusive)
+        from a memory map of my video in large chunks
+
+        Args:
+            start (int): the first byte
+            end (int): the last byte
+        """
+        with open(self.video_path, "rb") as video:
+            with mmap.mmap(video.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                position = start
+                while position <= end:
+                    chunk_end = min(position + self.chunk_size, end + 1)
+                    yield mapped[position:chunk_end]
+                    position = chunk_end
 
     def stream_partial_content(self, start: int, end: int) -> StreamingResponse:
         """
         Stream the content between the start and end bytes.
         """
+        content_length = end - start + 1
+        headers = {
+            "Content-Range": f"bytes {start}-{end}/{self.video_size}",
+            "Accept-Ranges": "bytes",
+            "Content-Length": str(content_length),
+            "Content-Type": self.media_type,
+        }
+        headers.update(self.get_validator().headers)
+        return StreamingResponse(
+            self.read_range(start, end), status_code=206, headers=headers
+        )
+
+    def stream_multipart_content(
+        self, ranges: List[Tuple[int, int]]
+    ) -> StreamingResponse:
+        """
+        Stream the given ranges as multipart/byteranges content.
+        """
+        boundary = secrets.token_hex(16)
+        part_headers = [
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {self.media_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{self.video_size}\r\n\r\n"
+            ).encode("ascii")
+            for start, end in ranges
+        ]
+        trailer = f"\r\n--{boundary}--\r\n".encode("ascii")
+        content_length = len(trailer) + sum(
+            len(part_header) + end - start + 1
+            for part_header, (start, end) in zip(part_headers, ranges)
+        )
+        # every part but the first is preceded by a line break
+        content_length += 2 * (len(ranges) - 1)
 
         def content_generator():
-            with open(self.video_path, "rb") as video:
-                video.seek(start)
-                while start <= end:
-                    chunk_size = min(8192, end - start + 1)
-                    buffer = video.read(chunk_size)
-                    if not buffer:
-                        break
-                    start += chunk_size
-                    yield buffer
+            for i, (part_header, (start, end)) in enumerate(zip(part_headers, ranges)):
+                yield part_header if i == 0 else b"\r\n" + part_header
+                yield from self.read_range(start, end)
+            yield trailer
 
-        content_length = end - start + 1
         headers = {
-            "Content-Range": f"bytes {start}-{end}/{self.video_size}",
             "Accept-Ranges": "bytes",
             "Content-Length": str(content_length),
-            "Content-Type": "video/mp4",
         }
+        headers.update(self.get_validator().headers)
+        return StreamingResponse(
+            content_generator(),
+            status_code=206,
+            headers=headers,
+            media_type=f"multipart/byteranges; boundary={boundary}",
+        )
 
-        return StreamingResponse(content_generator(), status_code=206, headers=headers)
+    def is_range_valid(self, if_range: str) -> bool:
+        """
+        check the If-Range header - a range request is only valid if
+        the client's copy is the current one
 
-    def get_video(self, range_header: str = Header(default=None)):
-        start, end = self.parse_range_header(range_header)
+        Args:
+            if_range (str): an entity tag or http date
 
-        if not start and not end:
-            # Just serve the whole file if no range
-            return FileResponse(self.video_path, media_type="video/mp4")
+        Returns:
+            bool: True if the range should be served
+        """
+        if not if_range:
+            return True
+        validator = self.get_validator()
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            # If-Range needs the strong comparison
+            return if_range == validator.etag
+        return if_range == validator.last_modified
 
-        if start >= self.video_size:
-            raise HTTPException(status_code=416, detail="Range not satisfiable")
+    def get_video(self, range_header: str = None, if_range: str = None):
+        """
+        get my video - completely or the requested byte ranges
+
+        Args:
+            range_header (str): the Range header
+            if_range (str): the If-Range header
+        """
+        ranges = []
+        if self.is_range_valid(if_range):
+            ranges = self.parse_range_header(range_header)
 
-        end = end or self.video_size - 1
-        return self.stream_partial_content(start, end)
+        if not ranges or len(ranges) > self.max_ranges:
+            # Just serve the whole file if no range
+            validator = self.get_validator()
+            headers = {"Accept-Ranges": "bytes"}
+            headers.update(validator.headers)
+            return WholeFileResponse(
+                self.video_path, media_type=self.media_type, headers=headers
+            )
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            return self.stream_partial_content(start, end)
+        return self.stream_multipart_content(ranges)
@@ -0,0 +1,102 @@
+"""
+Created on 2025-01-07
+
+@author: wf
+"""
+
+import math
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from nicetrack.catalog import BoundingBox
+
+
+class WebMercator:
+    """
+    the spherical mercator projection and the z/x/y tiles of slippy maps
+    such as Leaflet and OpenStreetMap - see https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames
+
+    world coordinates are in [0, 1] with x to the east and y to the south
+    """
+
+    # the latitude that makes the world square
+    max_lat = 85.0511287798066
+    tile_size = 256
+
+    @classmethod
+    def project(cls, lat, lon) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        get the world coordinates of the given positions
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: the x and y world coordinates
+        """
+        lat = np.clip(np.asarray(lat, dtype=np.float64), -cls.max_lat, cls.max_lat)
+        x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0
+        sin_lat = np.sin(np.radians(lat))
+        y = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)
+        return x, y
+
+    @classmethod
+    def unproject(cls, x, y) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        get the positions of the given world coordinates
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: the latitudes and longitudes
+        """
+        lon = np.asarray(x, dtype=np.float64) * 360.0 - 180.0
+        lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y)))))
+        return lat, lon
+
+    @classmethod
+    def check_tile(cls, z: int, x: int, y: int):
+        """
+        check the given tile address
+
+        Raises:
+            ValueError: if the tile does not exist
+        """
+        if z < 0 or z > 30:
+            raise ValueError(f"invalid zoom {z}")
+        n = 1 << z
+        if not (0 <= x < n and 0 <= y < n):
+            raise ValueError(f"invalid tile {z}/{x}/{y}")
+
+    @classmethod
+    def get_bounds(cls, z: int, x: int, y: int) -> BoundingBox:
+        """
+        get the bounding box of the given tile
+        """
+        n = 1 << z
+        lats, lons = cls.unproject([x / n, (x + 1) / n], [(y + 1) / n, y / n])
+        bbox = BoundingBox(
+            float(lats[0]), float(lons[0]), float(lats[1]), float(lons[1])
+        )
+        return bbox
+
+    @classmethod
+    def get_tile(cls, lat: float, lon: float, z: int) -> Tuple[int, int]:
+        """
+        get the x and y of the tile at the given zoom that contains the given position
+        """
+        n = 1 << z
+        wx, wy = cls.project(lat, lon)
+        x = min(n - 1, max(0, int(math.floor(float(wx) * n))))
+        y = min(n - 1, max(0, int(math.floor(float(wy) * n))))
+        return x, y
+
+    @classmethod
+    def get_tiles(cls, bbox: BoundingBox, z: int) -> Iterator[Tuple[int, int, int]]:
+        """
+        get the tiles at the given zoom that cover the given bounding box
+
+        Returns:
+            Iterator[Tuple[int, int, int]]: the z, x and y of the tiles row by row
+        """
+        min_x, min_y = cls.get_tile(bbox.max_lat, bbox.min_lon, z)
+        max_x, max_y = cls.get_tile(bbox.min_lat, bbox.max_lon, z)
+        for y in range(min_y, max_y + 1):
+            for x in range(min_x, max_x + 1):
+                yield z, x, y
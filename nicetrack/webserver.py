@@ -4,20 +4,39 @@ Created on 2023-06-19
 @author: wf
 """
 
+import asyncio
+import json
 import os
+from collections import OrderedDict
 
-from fastapi import Header, HTTPException, Query
-from ngwidgets.file_selector import FileSelector
+from fastapi import Header, HTTPException, Query, Request
 from ngwidgets.input_webserver import InputWebserver, InputWebSolution
 from ngwidgets.leaflet_map import LeafletMap
 from ngwidgets.webserver import WebserverConfig
-from nicegui import Client, ui
+from nicegui import Client, app, ui
+from starlette.responses import Response
 
+from nicetrack.catalog import BoundingBox, Catalog
+from nicetrack.catalog_view import CatalogView
+from nicetrack.file_index import FileIndex, IndexedFileSelector
 from nicetrack.geo import GeoPath
+from nicetrack.heatmap import Heatmap
+from nicetrack.hls import HlsSegmenter, SegmentCache
+from nicetrack.http_cache import CacheValidator
+from nicetrack.metrics import Metrics
+from nicetrack.path_transport import PathTransport
+from nicetrack.request_profiler import ProfilingExecutor, RequestProfiler
 from nicetrack.srt import SRT
+from nicetrack.tile_cache import TileCache
+from nicetrack.track_api import TrackApi
+from nicetrack.track_cache import Track, TrackCache
+from nicetrack.update_scheduler import LatestRequests, UpdateScheduler
+from nicetrack.vector_tiles import MvtEncoder, VectorTiles
 from nicetrack.version import Version
-from nicetrack.video_stepper import VideoStepper
-from nicetrack.video_stepper_av import VideoStepperAV
+from nicetrack.video_broadcast import BroadcastHub
+from nicetrack.video_info import VideoInfo
+from nicetrack.video_proxy import VideoProxies
+from nicetrack.video_stepper_base import VideoStepperBase
 from nicetrack.map import Map
 
 # from nicetrack.video import Video
@@ -50,34 +69,304 @@ class WebServer(InputWebserver):
         """
         config = WebServer.get_config()
         InputWebserver.__init__(self, config=config)
+        self.is_local = False
+        # video steppers by video path shared by all clients - the least recently used are closed
+        self.video_steppers = OrderedDict()
+        self.max_video_steppers = 8
+        # shared motion jpeg feeds
+        self.broadcast_hub = BroadcastHub()
+        # the video decoding backend of the steppers
+        self.stepper_backend = "opencv"
+        # HLS segmenters by video path and their shared disk cache
+        self.hls_segmenters = {}
+        self.hls_cache = None
+        # low resolution proxies for scrubbing - None if disabled
+        self.video_proxies = None
+        # the index of the files below the root path - set when the run is configured
+        self.file_index = None
+        # the seconds between two rescans of the file index
+        self.index_interval = 60.0
+        # the catalog of all tracks below the root path - None if disabled
+        self.catalog = None
+        # the number of catalog ingest processes - None for half of the cpus
+        self.catalog_workers = None
+        # the density of the cataloged tracks - None if the catalog is disabled
+        self.heatmap = None
+        # the offline cache of the base map tiles - None if the maps load them from the internet
+        self.tile_cache = None
+        # the zoom levels of the tiles that are cached around a track on request
+        self.seed_zooms = list(range(10, 16))
+        # the parsed tracks shared by all sessions
+        self.track_cache = TrackCache.get_instance()
+        self.track_api = TrackApi(self.track_cache)
+        # the latest frame request per view session
+        self.frame_requests = LatestRequests()
+        # the maximum number of time slider updates per second
+        self.slider_rate = 15.0
+        # how paths are sent to the browser
+        self.path_transport = PathTransport()
+        # paths with more points are sent as vector tiles - 0 to always send the complete path
+        self.vector_tile_points = 200000
+        self.vector_tiles = VectorTiles()
+        # the latencies and cache counters - disabled unless --metrics is given
+        self.metrics = Metrics.get_instance()
+        # the request profiles - disabled unless --profile is given or switched on at runtime
+        self.profiler = RequestProfiler.get_instance()
+        self.profiling_executor = None
+        app.on_shutdown(self.profiler.disable)
+        app.on_shutdown(self.close_video_steppers)
+        app.add_static_file(
+            local_file=PathTransport.script_path, url_path=PathTransport.script_url
+        )
+        app.add_static_file(
+            local_file=VectorTiles.script_path, url_path=VectorTiles.script_url
+        )
 
-        @ui.page("/video_play/{video_path:path}")
+        @app.api_route("/video_play/{video_path:path}", methods=["GET", "HEAD"])
         async def video_play(
-            client: Client, video_path: str, range_header: str = Header(None)
+            video_path: str,
+            range_header: str = Header(None, alias="Range"),
+            if_range: str = Header(None),
         ):
-            await self.page(
-                client, NicetrackSolution.video_play, video_path, range_header
+            return await self.video_play(video_path, range_header, if_range)
+
+        @app.get("/video_hls/{video_path:path}/{name}")
+        async def video_hls(
+            video_path: str,
+            name: str,
+            if_none_match: str = Header(None),
+            if_modified_since: str = Header(None),
+        ):
+            return await self.video_hls(
+                video_path,
+                name,
+                if_none_match=if_none_match,
+                if_modified_since=if_modified_since,
             )
 
-        @ui.page("/video_feed/{video_path:path}")
+        @app.get("/video_feed/{video_path:path}")
         async def video_feed(
-            client: Client,
             video_path: str,
             start_time: float = Query(0.0, description="Start timestamp in seconds"),
-            fps: float = Query(30.0, description="Frames per second of the video"),
+            fps: float = Query(
+                None,
+                gt=0,
+                description="Frames per second of the feed [default: the frame rate of the video]",
+            ),
+            width: int = Query(None, ge=1, description="maximum width of the frames"),
+            height: int = Query(None, ge=1, description="maximum height of the frames"),
+            broadcast: bool = Query(
+                False, description="share one decoder with all viewers of the same feed"
+            ),
         ):
-            await self.page(
-                client,
-                NicetrackSolution.video_feed,
+            return await self.video_feed(
                 video_path,
                 start_time=start_time,
                 fps=fps,
+                width=width,
+                height=height,
+                broadcast=broadcast,
             )
 
-        @ui.page("/video_step/{video_path:path}/{frame_index:int}")
-        async def video_step(client: Client, video_path: str, frame_index: int = 0):
-            await self.page(
-                client, NicetrackSolution.video_step, video_path, frame_index
+        @app.get("/video_step/{video_path:path}/{frame_index:int}")
+        async def video_step(
+            video_path: str,
+            frame_index: int = 0,
+            width: int = Query(None, ge=1, description="maximum width of the frame"),
+            height: int = Query(None, ge=1, description="maximum height of the frame"),
+            quality: int = Query(
+                None, ge=1, le=100, description="encoding quality for jpg and webp"
+            ),
+            img_format: str = Query("jpg", description="jpg, png or webp"),
+            session: str = Query(
+                None, description="the view session - superseded requests are dropped"
+            ),
+            if_none_match: str = Header(None),
+            if_modified_since: str = Header(None),
+        ):
+            return await self.video_step(
+                video_path,
+                frame_index,
+                img_format=img_format,
+                width=width,
+                height=height,
+                quality=quality,
+                session=session,
+                if_none_match=if_none_match,
+                if_modified_since=if_modified_since,
+            )
+
+        # the stats route needs to come first - the track path may contain slashes
+        @app.get("/api/track/{track_path:path}/stats")
+        async def track_stats(
+            track_path: str,
+            accept_encoding: str = Header(None),
+            if_none_match: str = Header(None),
+            if_modified_since: str = Header(None),
+        ):
+            return await self.track_stats(
+                track_path,
+                accept_encoding=accept_encoding,
+                if_none_match=if_none_match,
+                if_modified_since=if_modified_since,
+            )
+
+        @app.get("/api/track/{track_path:path}")
+        async def track_columns(
+            track_path: str,
+            track_format: str = Query(
+                "json", alias="format", description="json, bin or npz"
+            ),
+            start: int = Query(None, description="index of the first point"),
+            stop: int = Query(None, description="index after the last point"),
+            step: int = Query(1, ge=1, description="take every step-th point"),
+            tolerance: float = Query(
+                None, gt=0, description="simplification tolerance in meters"
+            ),
+            columns: str = Query(None, description="comma separated column names"),
+            accept_encoding: str = Header(None),
+            if_none_match: str = Header(None),
+            if_modified_since: str = Header(None),
+        ):
+            return await self.track_columns(
+                track_path,
+                track_format=track_format,
+                start=start,
+                stop=stop,
+                step=step,
+                tolerance=tolerance,
+                columns=columns,
+                accept_encoding=accept_encoding,
+                if_none_match=if_none_match,
+                if_modified_since=if_modified_since,
+            )
+
+        @app.get("/api/catalog/tracks")
+        async def catalog_tracks(
+            bbox: str = Query(None, description="min_lon,min_lat,max_lon,max_lat"),
+            start: str = Query(
+                None, description="iso date or timestamp of the start of the time range"
+            ),
+            end: str = Query(
+                None, description="iso date or timestamp of the end of the time range"
+            ),
+            limit: int = Query(
+                None, ge=1, description="maximum number of tracks - the longest first"
+            ),
+            geometry: bool = Query(
+                False, description="include the simplified paths as encoded polylines"
+            ),
+            accept_encoding: str = Header(None),
+        ):
+            return await self.catalog_tracks(
+                bbox=bbox,
+                start=start,
+                end=end,
+                limit=limit,
+                geometry=geometry,
+                accept_encoding=accept_encoding,
+            )
+
+        @app.get("/api/catalog/near")
+        async def catalog_near(
+            lat: float = Query(..., ge=-90, le=90),
+            lon: float = Query(..., ge=-180, le=180),
+            radius: float = Query(200.0, gt=0, description="radius in meters"),
+            start: str = Query(
+                None, description="iso date or timestamp of the start of the time range"
+            ),
+            end: str = Query(
+                None, description="iso date or timestamp of the end of the time range"
+            ),
+            limit: int = Query(
+                None, ge=1, description="maximum number of tracks - the closest first"
+            ),
+            geometry: bool = Query(
+                False, description="include the simplified paths as encoded polylines"
+            ),
+            accept_encoding: str = Header(None),
+        ):
+            return await self.catalog_near(
+                lat,
+                lon,
+                radius,
+                start=start,
+                end=end,
+                limit=limit,
+                geometry=geometry,
+                accept_encoding=accept_encoding,
+            )
+
+        @app.get("/tiles/heat/{z}/{x}/{y}")
+        async def heat_tile(
+            z: int,
+            x: int,
+            y: int,
+            if_none_match: str = Header(None),
+            if_modified_since: str = Header(None),
+        ):
+            return await self.heat_tile(
+                z,
+                x,
+                y,
+                if_none_match=if_none_match,
+                if_modified_since=if_modified_since,
+            )
+
+        @app.get("/tiles/base/{z}/{x}/{y}.png")
+        async def base_tile(
+            z: int,
+            x: int,
+            y: int,
+            if_none_match: str = Header(None),
+            if_modified_since: str = Header(None),
+        ):
+            return await self.base_tile(
+                z,
+                x,
+                y,
+                if_none_match=if_none_match,
+                if_modified_since=if_modified_since,
+            )
+
+        @app.get("/tiles/track/{track_id}/{z}/{x}/{y}.mvt")
+        async def track_tile(
+            track_id: str,
+            z: int,
+            x: int,
+            y: int,
+            accept_encoding: str = Header(None),
+            if_none_match: str = Header(None),
+            if_modified_since: str = Header(None),
+        ):
+            return await self.track_tile(
+                track_id,
+                z,
+                x,
+                y,
+                accept_encoding=accept_encoding,
+                if_none_match=if_none_match,
+                if_modified_since=if_modified_since,
+            )
+
+        @app.get("/metrics")
+        async def metrics():
+            return await self.get_metrics()
+
+        @app.get("/admin/profile")
+        async def profile_admin(
+            request: Request,
+            enabled: bool = Query(None, description="switch profiling on or off"),
+            mode: str = Query(None, description="cprofile or sampling"),
+            window: float = Query(
+                None, gt=0, description="seconds of each dumped profile window"
+            ),
+        ):
+            return await self.profile_admin(
+                request.client.host if request.client else None,
+                enabled=enabled,
+                mode=mode,
+                window=window,
             )
 
         @ui.page("/map")
@@ -86,6 +375,668 @@ class WebServer(InputWebserver):
                 client, NicetrackSolution.show_map
             )
 
+        @ui.page("/catalog")
+        async def show_catalog(client: Client):
+            await self.page(client, NicetrackSolution.show_catalog)
+
+    def get_video_source(self, video_path: str) -> str:
+        """
+        get the video source for the given video path relative to my root path
+
+        Args:
+            video_path (str): the relative path of the video
+
+        Returns:
+            str: the path of the existing video file
+        """
+        video_source = self.get_root_file(video_path)
+        if video_source is None:
+            raise HTTPException(status_code=404, detail=f"Video {video_path} not found")
+        return video_source
+
+    def get_root_file(self, relative_path: str) -> str:
+        """
+        get the existing file for the given path relative to my root path
+
+        Args:
+            relative_path (str): the relative path of the file
+
+        Returns:
+            str: the resolved path or None if it does not exist or is outside of my root path
+        """
+        root = os.path.realpath(self.root_path)
+        file_path = os.path.realpath(os.path.join(root, relative_path))
+        if not file_path.startswith(root + os.sep) or not os.path.isfile(file_path):
+            return None
+        return file_path
+
+    def get_track_source(self, track_path: str) -> str:
+        """
+        get the track file for the given track path relative to my root path
+
+        Args:
+            track_path (str): the relative path of the SRT or GPX file
+
+        Returns:
+            str: the path of the existing track file
+        """
+        track_source = self.get_root_file(track_path)
+        if track_source is None:
+            raise HTTPException(status_code=404, detail=f"Track {track_path} not found")
+        return track_source
+
+    async def track_columns(
+        self,
+        track_path: str,
+        track_format: str = "json",
+        start: int = None,
+        stop: int = None,
+        step: int = 1,
+        tolerance: float = None,
+        columns: str = None,
+        accept_encoding: str = None,
+        if_none_match: str = None,
+        if_modified_since: str = None,
+    ):
+        """
+        get the columns of the given track - parsed once and shared via the track cache
+        """
+        track_source = self.get_track_source(track_path)
+        track_response = await self.track_api.get_response(
+            track_source,
+            track_format=track_format,
+            start=start,
+            stop=stop,
+            step=step,
+            tolerance=tolerance,
+            columns=columns,
+            accept_encoding=accept_encoding,
+            if_none_match=if_none_match,
+            if_modified_since=if_modified_since,
+        )
+        return track_response
+
+    async def track_stats(
+        self,
+        track_path: str,
+        accept_encoding: str = None,
+        if_none_match: str = None,
+        if_modified_since: str = None,
+    ):
+        """
+        get the statistics of the given track
+        """
+        track_source = self.get_track_source(track_path)
+        stats_response = await self.track_api.get_stats_response(
+            track_source,
+            accept_encoding=accept_encoding,
+            if_none_match=if_none_match,
+            if_modified_since=if_modified_since,
+        )
+        return stats_response
+
+    def get_catalog(self) -> Catalog:
+        """
+        get the catalog
+
+        Raises:
+            HTTPException: 404 if the catalog is disabled
+        """
+        if self.catalog is None:
+            raise HTTPException(status_code=404, detail="the catalog is disabled")
+        return self.catalog
+
+    def get_time_range(self, start: str, end: str):
+        """
+        get the seconds of the given iso start and end of a time range
+
+        Raises:
+            HTTPException: 400 for an invalid date or timestamp
+        """
+        try:
+            time_range = Catalog.get_seconds(start), Catalog.get_seconds(end)
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
+        return time_range
+
+    def catalog_response(self, records: list, accept_encoding: str = None):
+        content = json.dumps({"count": len(records), "tracks": records}).encode("utf-8")
+        # the catalog changes when files are ingested
+        headers = {"Cache-Control": "no-cache"}
+        return TrackApi.json_response(content, headers, accept_encoding)
+
+    async def catalog_tracks(
+        self,
+        bbox: str = None,
+        start: str = None,
+        end: str = None,
+        limit: int = None,
+        geometry: bool = False,
+        accept_encoding: str = None,
+    ) -> Response:
+        """
+        get the cataloged tracks that intersect the given bounding box and time range
+
+        Args:
+            bbox (str): min_lon,min_lat,max_lon,max_lat - None for everywhere
+            start (str): the iso start of the time range - None for open
+            end (str): the iso end of the time range - None for open
+            limit (int): the maximum number of tracks - None for all
+            geometry (bool): if True include the simplified paths
+            accept_encoding (str): the Accept-Encoding header
+
+        Returns:
+            Response: the tracks as json
+        """
+        catalog = self.get_catalog()
+        try:
+            bounding_box = BoundingBox.from_string(bbox) if bbox else None
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
+        start_time, end_time = self.get_time_range(start, end)
+        tracks = await asyncio.to_thread(
+            catalog.query, bounding_box, start_time, end_time, limit, geometry
+        )
+        records = [track.as_dict() for track in tracks]
+        return self.catalog_response(records, accept_encoding)
+
+    async def catalog_near(
+        self,
+        lat: float,
+        lon: float,
+        radius: float = 200.0,
+        start: str = None,
+        end: str = None,
+        limit: int = None,
+        geometry: bool = False,
+        accept_encoding: str = None,
+    ) -> Response:
+        """
+        get the cataloged tracks that passed within the given radius of the given position
+        in the given time range
+
+        Returns:
+            Response: the tracks with their distance_m as json - the closest first
+        """
+        catalog = self.get_catalog()
+        start_time, end_time = self.get_time_range(start, end)
+        found = await asyncio.to_thread(
+            catalog.near, lat, lon, radius, start_time, end_time, limit
+        )
+        records = []
+        for track, distance in found:
+            record = track.as_dict()
+            if not geometry:
+                record.pop("geometry", None)
+            record["distance_m"] = distance
+            records.append(record)
+        return self.catalog_response(records, accept_encoding)
+
+    async def heat_tile(
+        self,
+        z: int,
+        x: int,
+        y: int,
+        if_none_match: str = None,
+        if_modified_since: str = None,
+    ) -> Response:
+        """
+        get the given heatmap tile of the cataloged tracks as PNG
+
+        Raises:
+            HTTPException: 404 if the catalog is disabled or the tile does not exist
+        """
+        if self.heatmap is None:
+            raise HTTPException(status_code=404, detail="the catalog is disabled")
+        validator = self.heatmap.get_validator(z, x, y)
+        if validator.is_not_modified(if_none_match, if_modified_since):
+            return validator.not_modified_response()
+        try:
+            png = await asyncio.to_thread(self.heatmap.render, z, x, y)
+        except ValueError as ve:
+            raise HTTPException(status_code=404, detail=str(ve))
+        return Response(png, media_type="image/png", headers=validator.headers)
+
+    async def base_tile(
+        self,
+        z: int,
+        x: int,
+        y: int,
+        if_none_match: str = None,
+        if_modified_since: str = None,
+    ) -> Response:
+        """
+        get the given base map tile from the offline tile cache
+
+        Raises:
+            HTTPException: 404 if the tile cache is disabled, the tile does not exist or is not cached
+                and may not be fetched on demand - 502 if the tile is not cached and the tile server is not available
+        """
+        if self.tile_cache is None:
+            raise HTTPException(status_code=404, detail="the tile cache is disabled")
+        try:
+            tile = await asyncio.to_thread(self.tile_cache.get_tile, z, x, y)
+        except ValueError as ve:
+            raise HTTPException(status_code=404, detail=str(ve))
+        except IOError as ioe:
+            raise HTTPException(status_code=502, detail=str(ioe))
+        if tile is None:
+            raise HTTPException(status_code=404, detail=f"Tile {z}/{x}/{y} not cached")
+        data, fetched = tile
+        validator = self.tile_cache.get_validator(data, fetched)
+        if validator.is_not_modified(if_none_match, if_modified_since):
+            return validator.not_modified_response()
+        return Response(data, media_type="image/png", headers=validator.headers)
+
+    async def track_tile(
+        self,
+        track_id: str,
+        z: int,
+        x: int,
+        y: int,
+        accept_encoding: str = None,
+        if_none_match: str = None,
+        if_modified_since: str = None,
+    ) -> Response:
+        """
+        get the given vector tile of the path of a loaded track
+
+        Raises:
+            HTTPException: 404 if the track is not loaded or the tile does not exist
+        """
+        track_tiles = self.vector_tiles.get_track_tiles(track_id)
+        if track_tiles is None:
+            raise HTTPException(status_code=404, detail=f"Track {track_id} not loaded")
+        validator = self.vector_tiles.get_validator(track_tiles, z, x, y)
+        if validator.is_not_modified(if_none_match, if_modified_since):
+            return validator.not_modified_response()
+        try:
+            tile = await asyncio.to_thread(
+                self.vector_tiles.get_tile, track_id, z, x, y
+            )
+        except ValueError as ve:
+            raise HTTPException(status_code=404, detail=str(ve))
+        if tile is None:
+            raise HTTPException(status_code=404, detail=f"Track {track_id} not loaded")
+        content, headers = VectorTiles.compress(tile, accept_encoding)
+        headers.update(validator.headers)
+        return Response(content, media_type=MvtEncoder.media_type, headers=headers)
+
+    async def get_metrics(self) -> Response:
+        """
+        get the metrics in the Prometheus text format
+
+        Raises:
+            HTTPException: 404 if the metrics are disabled
+        """
+        if not self.metrics.enabled:
+            raise HTTPException(status_code=404, detail="metrics are disabled")
+        content = self.metrics.as_text()
+        return Response(
+            content,
+            media_type=Metrics.media_type,
+            headers={"Cache-Control": "no-store"},
+        )
+
+    def start_file_index(self):
+        """
+        keep the file index up to date in the background
+        """
+        self.file_index.start(self.index_interval)
+
+    def start_catalog(self):
+        """
+        ingest the tracks below the root path in the background whenever the file index changes
+        """
+        self.catalog.start(self.index_interval, self.catalog_workers)
+
+    def configure_map(self, geo_map: LeafletMap):
+        """
+        let the given map load its base tiles from the offline tile cache if it is enabled
+        """
+        if self.tile_cache is not None:
+            self.tile_cache.use(geo_map)
+
+    def install_profiling_executor(self):
+        """
+        let the work that profiled requests move to worker threads be attributed to them
+
+        only installed once profiling is used so that the worker threads of
+        an unprofiled server don't pay for the lookup of the request
+        """
+        if self.profiling_executor is None:
+            self.profiling_executor = ProfilingExecutor()
+            asyncio.get_running_loop().set_default_executor(self.profiling_executor)
+
+    async def profile_admin(
+        self,
+        client_host: str,
+        enabled: bool = None,
+        mode: str = None,
+        window: float = None,
+    ) -> dict:
+        """
+        show and switch the request profiling at runtime - only for local clients
+        of a server in local mode
+
+        Args:
+            client_host (str): the host of the client
+            enabled (bool): True to start and False to stop profiling - None to leave it as is
+            mode (str): the profile mode - None to leave it as is
+            window (float): the seconds of each dumped window - None to leave it as is
+
+        Returns:
+            dict: the status of the profiler
+        """
+        self.check_local("Profiling only available in local mode of server")
+        if client_host not in ("127.0.0.1", "::1", "localhost"):
+            raise HTTPException(
+                status_code=403, detail="profiling is only available locally"
+            )
+        if mode is not None and mode not in RequestProfiler.modes:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown profile mode {mode} - use one of {', '.join(RequestProfiler.modes)}",
+            )
+        if window is not None:
+            self.profiler.window_seconds = window
+        if mode is not None and mode != self.profiler.mode:
+            if self.profiler.enabled:
+                # dumps the window of the previous mode
+                await asyncio.to_thread(self.profiler.enable, mode)
+            else:
+                self.profiler.mode = mode
+        if enabled:
+            self.install_profiling_executor()
+            await asyncio.to_thread(self.profiler.enable)
+        elif enabled is False:
+            # dumps the current window
+            await asyncio.to_thread(self.profiler.disable)
+        return self.profiler.get_status()
+
+    def configure_run(self):
+        """
+        configure the run from the command line arguments
+        """
+        InputWebserver.configure_run(self)
+        self.metrics.enabled = getattr(self.args, "metrics", False)
+        self.profiler.profile_dir = getattr(
+            self.args, "profile_dir", self.profiler.profile_dir
+        )
+        self.profiler.window_seconds = getattr(
+            self.args, "profile_window", self.profiler.window_seconds
+        )
+        profile_mode = getattr(self.args, "profile", None)
+        if profile_mode:
+            self.profiler.enable(profile_mode)
+            app.on_startup(self.install_profiling_executor)
+        self.index_interval = getattr(self.args, "index_interval", self.index_interval)
+        if self.root_path:
+            self.file_index = FileIndex(self.root_path)
+            app.on_startup(self.start_file_index)
+            if getattr(self.args, "catalog", False):
+                self.catalog = Catalog(self.file_index)
+                # binned after each ingest
+                self.heatmap = Heatmap(self.catalog)
+                self.catalog_workers = getattr(self.args, "catalog_workers", None)
+                app.on_startup(self.start_catalog)
+                app.on_shutdown(self.catalog.stop)
+        if getattr(self.args, "tile_cache", False):
+            self.tile_cache = TileCache(
+                upstream=getattr(self.args, "tile_url", None),
+                workers=getattr(self.args, "tile_workers", 2),
+                max_zoom=getattr(self.args, "tile_max_zoom", 16),
+                max_bytes=getattr(self.args, "tile_cache_mb", 512) * 1024 * 1024,
+            )
+            app.on_shutdown(self.tile_cache.close)
+        self.seed_zooms = getattr(self.args, "seed_zooms", self.seed_zooms)
+        self.stepper_backend = getattr(self.args, "stepper", self.stepper_backend)
+        self.slider_rate = getattr(self.args, "slider_rate", self.slider_rate)
+        self.vector_tile_points = getattr(
+            self.args, "vector_tile_points", self.vector_tile_points
+        )
+        path_transport = getattr(self.args, "path_transport", None)
+        if path_transport is not None:
+            self.path_transport = PathTransport(
+                path_transport, chunk_points=self.args.path_chunk_points
+            )
+        hls_cache_mb = getattr(self.args, "hls_cache_mb", None)
+        if hls_cache_mb is not None:
+            self.get_hls_cache().max_bytes = hls_cache_mb * 1024 * 1024
+        track_cache_mb = getattr(self.args, "track_cache_mb", None)
+        if track_cache_mb is not None:
+            self.track_cache.max_bytes = track_cache_mb * 1024 * 1024
+        if getattr(self.args, "track_disk_cache", False):
+            self.track_cache.cache_dir = TrackCache.default_cache_dir()
+            os.makedirs(self.track_cache.cache_dir, exist_ok=True)
+        self.track_cache.sidecars = getattr(self.args, "track_sidecars", False)
+        if getattr(self.args, "proxy", False):
+            self.video_proxies = VideoProxies(
+                height=self.args.proxy_height, cpu_budget=self.args.proxy_workers
+            )
+            app.on_shutdown(self.video_proxies.close)
+            if self.file_index is not None:
+                # queued in the background on every change of the index
+                self.file_index.listeners.append(self.video_proxies.scan_index)
+
+    def get_frame_source(
+        self, video_path: str, width: int = None, height: int = None
+    ) -> str:
+        """
+        get the video to take frames of the given size from
+
+        Args:
+            video_path (str): the relative path of the video
+            width (int): the requested maximum width
+            height (int): the requested maximum height
+
+        Returns:
+            str: the path of the low resolution proxy if it is ready and large enough else of the video
+        """
+        video_source = self.get_video_source(video_path)
+        frame_source = None
+        if self.video_proxies:
+            frame_source = self.video_proxies.get_proxy(video_source, width, height)
+        if frame_source is None:
+            frame_source = video_source
+        return frame_source
+
+    def get_video_stepper(
+        self, video_path: str, width: int = None, height: int = None
+    ) -> VideoStepperBase:
+        """
+        get the video stepper for the given video path relative to my root path
+
+        Args:
+            video_path (str): the relative path of the video
+            width (int): the requested maximum width
+            height (int): the requested maximum height
+
+        Returns:
+            VideoStepperBase: the stepper of the configured backend - opened only once per video
+        """
+        video_source = self.get_frame_source(video_path, width, height)
+        video_stepper = self.video_steppers.get(video_source)
+        if video_stepper is None:
+            video_stepper = VideoStepperBase.create(
+                self.stepper_backend, video_source, self.root_path
+            )
+            self.video_steppers[video_source] = video_stepper
+            while len(self.video_steppers) > self.max_video_steppers:
+                _source, evicted = self.video_steppers.popitem(last=False)
+                asyncio.create_task(self.close_video_stepper(evicted))
+        self.video_steppers.move_to_end(video_source)
+        return video_stepper
+
+    async def close_video_stepper(self, video_stepper: VideoStepperBase):
+        """
+        close the decoder of the given evicted stepper once its running decode is done
+        """
+        async with video_stepper.decode_lock:
+            await asyncio.to_thread(video_stepper.close)
+
+    def close_video_steppers(self):
+        """
+        close the decoders of all shared steppers
+        """
+        while self.video_steppers:
+            _source, video_stepper = self.video_steppers.popitem()
+            video_stepper.close()
+
+    @RequestProfiler.profiled("video_step")
+    async def video_step(
+        self,
+        video_path: str,
+        frame_index: int = 0,
+        img_format: str = "jpg",
+        width: int = None,
+        height: int = None,
+        quality: int = None,
+        session: str = None,
+        if_none_match: str = None,
+        if_modified_since: str = None,
+    ):
+        """
+        get the image of the given frame scaled to the given size
+
+        this is a plain http route - no client page is needed to serve an image
+        conditional requests are answered before any video is opened
+        a request of a session that is superseded by a newer one while it waits
+        for the decoder is dropped
+        """
+        self.check_local()
+        frame_source = self.get_frame_source(video_path, width, height)
+        validator = CacheValidator.for_frame(
+            frame_source, frame_index, img_format, width, height, quality
+        )
+        if validator.is_not_modified(if_none_match, if_modified_since):
+            return validator.not_modified_response()
+        video_stepper = self.get_video_stepper(video_path, width, height)
+        is_superseded = None
+        if session:
+            ticket = self.frame_requests.start(session)
+            is_superseded = lambda: self.frame_requests.is_superseded(session, ticket)
+        try:
+            stream_response = await video_stepper.stream_image(
+                frame_index,
+                img_format,
+                width=width,
+                height=height,
+                quality=quality,
+                is_superseded=is_superseded,
+            )
+        finally:
+            if session:
+                self.frame_requests.finish(session, ticket)
+        return stream_response
+
+    def get_hls_cache(self) -> SegmentCache:
+        """
+        get the disk cache of the HLS segments - created on first use
+        """
+        if self.hls_cache is None:
+            self.hls_cache = SegmentCache()
+        return self.hls_cache
+
+    def get_hls_segmenter(self, video_path: str) -> HlsSegmenter:
+        """
+        get the HLS segmenter for the given video path relative to my root path
+
+        Args:
+            video_path (str): the relative path of the video
+
+        Returns:
+            HlsSegmenter: the segmenter - replaced when the video file changes
+        """
+        video_source = self.get_video_source(video_path)
+        segmenter = self.hls_segmenters.get(video_source)
+        if segmenter is None or segmenter.key != HlsSegmenter.get_key(video_source):
+            if segmenter is not None:
+                segmenter.close()
+            segmenter = HlsSegmenter(video_source, self.get_hls_cache())
+            self.hls_segmenters[video_source] = segmenter
+        return segmenter
+
+    async def video_hls(
+        self,
+        video_path: str,
+        name: str,
+        if_none_match: str = None,
+        if_modified_since: str = None,
+    ):
+        """
+        get the HLS playlist, init segment or media segment of the given video
+
+        the video is remuxed on demand into fragmented mp4 segments so that
+        seeking only needs the segment at the seek position
+        """
+        self.check_local()
+        segmenter = self.get_hls_segmenter(video_path)
+        hls_response = await segmenter.get_response(
+            name, if_none_match=if_none_match, if_modified_since=if_modified_since
+        )
+        return hls_response
+
+    def check_local(
+        self, detail: str = "Videos only available in local mode of server"
+    ):
+        """
+        make sure videos and the other local resources are only served in local mode
+
+        Args:
+            detail (str): the detail of the error if the server is not in local mode
+        """
+        if not self.is_local:
+            raise HTTPException(status_code=400, detail=detail)
+
+    async def video_play(
+        self, video_path: str, range_header: str = None, if_range: str = None
+    ):
+        """
+        play the given video - completely or the requested byte ranges
+        """
+        self.check_local()
+        video_source = self.get_video_source(video_path)
+        video_stream = VideoStream(video_source)
+        stream_response = video_stream.get_video(range_header, if_range)
+        return stream_response
+
+    @RequestProfiler.profiled("video_feed")
+    async def video_feed(
+        self,
+        video_path: str,
+        start_time: float = 0.0,
+        fps: float = None,
+        width: int = None,
+        height: int = None,
+        broadcast: bool = False,
+    ):
+        """
+        get a motion jpeg feed of the given video paced to the given frames per second
+
+        in broadcast mode all viewers of the same video, start time, fps and size
+        share a single decoder
+        """
+        self.check_local()
+        video_source = self.get_frame_source(video_path, width, height)
+        if fps is None:
+            fps = float(VideoInfo.probe(video_source).fps)
+        if broadcast:
+            stream_response = await self.broadcast_hub.video_feed(
+                video_source, start_time, fps, width, height
+            )
+        else:
+            video_stream = VideoStream(video_source)
+            stream_response = await video_stream.video_feed(
+                start_time, fps, width, height
+            )
+        if self.profiler.enabled:
+            # the frames are sent after this request returned
+            stream_response.body_iterator = self.profiler.profile_iterator(
+                "video_feed.stream", stream_response.body_iterator
+            )
+        return stream_response
+
     @classmethod
     def examples_path(cls) -> str:
         # the root directory (default: examples)
@@ -99,6 +1050,9 @@ class NicetrackSolution(InputWebSolution):
     A class to handle the UI and integration Nicetrack.
     """
 
+    # the number of points of the coarse path shown while rendering
+    preview_points = 500
+
     def __init__(self, webserver: WebServer, client: Client):
         """
         Initialize the solution
@@ -111,48 +1065,27 @@ class NicetrackSolution(InputWebSolution):
         super().__init__(webserver, client)  # Call to the superclass constructor#
 
         self.geo_desc = None
-        self.geo_path = None
+        # the parsed track and the video frame of each of its points
+        self.track = None
+        self.frame_table = None
+        self.frame_table_source = None
         self.zoom_level = 9
         self.video_stepper = None
+        # the running render and the path layers it has drawn
+        self.render_task = None
+        self.path_layers = []
+        # only the latest time slider value is applied while dragging
+        self.slider_scheduler = UpdateScheduler(
+            self.mark_trackpoint_at_index,
+            max_rate=webserver.slider_rate,
+            handle_exception=self.handle_exception,
+        )
 
     def set_zoom_level(self, zoom_level):
         self.zoom_level = zoom_level
         with self.geo_map as geo_map:
             geo_map.zoom = zoom_level
 
-    def get_video_stream(self, video_path: str):
-        # Check if not local
-        if not self.is_local:
-            raise HTTPException(
-                status_code=400, detail="Videos only available in local mode of server"
-            )
-        # Check if the video name exists in the root path
-        video_source = os.path.join(self.root_path, video_path)
-        if not os.path.exists(video_source):
-            raise HTTPException(
-                status_code=404, detail=f"Video {video_source} not found"
-            )
-        video_stream = VideoStream(video_source)
-        return video_stream
-
-    async def video_play(self, video_path: str, range_header: str):
-        video_stream = self.get_video_stream(video_path)
-        stream_response = video_stream.get_video(range_header)
-        return stream_response
-
-    async def video_feed(
-        self, video_path: str, start_time: float = 0.0, fps: int = 30.0
-    ):
-        video_stream = self.get_video_stream(video_path)
-        stream_response = await video_stream.video_feed(start_time, fps)
-        return stream_response
-
-    async def video_step(self, video_path: str, frame_index: int = 0):
-        if self.video_stepper is None:
-            self.video_stepper = VideoStepper(video_path, self.root_path)
-        stream_response = await self.video_stepper.stream_image(frame_index)
-        return stream_response
-
     def mark_trackpoint_at_index(self, index: int):
         """
         mark the trackpoint at the given index
@@ -160,65 +1093,262 @@ class NicetrackSolution(InputWebSolution):
         Args:
             index(int): the index of the position
         """
-        if self.geo_path:
+        if self.track is not None:
             # get the trackpoint
-            self.geo_path.validate_index(index)
-            tp = self.geo_path.path[index]
-            info = tp.get_info(self.geo_path.nominatim, with_details=False)
+            tp = self.track.get_trackpoint(index)
+            # no need for the geocoder without details
+            info = tp.get_info(None, with_details=False)
             loc = (tp.lat, tp.lon)
             self.trackpoint_desc.content = info
             with self.geo_map as geo_map:
                 geo_map.center = loc
                 geo_map.zoom = self.zoom_level
-            if self.video_stepper:
-                # @TODO make configurable
-                fps = 30
-                frame_index = self.geo_path.get_video_frame_index(index, fps)
-                self.video_stepper.set_frame_index(frame_index)
+            frame_table = self.get_frame_table()
+            if frame_table is not None:
+                self.video_stepper.set_frame_index(int(frame_table[index]))
 
-    async def render(self, _click_args=None):
+    def get_trackpoint_info(self, track: Track, index: int) -> str:
         """
-        Renders the SRT content
+        get the info of the trackpoint with the given index with its location details
+        - sets up and queries the geocoder so it runs in a worker thread
+        """
+        tp = track.get_trackpoint(index)
+        info = tp.get_info(GeoPath.get_nominatim())
+        return info
+
+    def get_frame_table(self):
+        """
+        get the video frame of each point of the current track - computed once per track and video
+
+        Returns:
+            np.ndarray: the frame indices or None if there is no track or video
+        """
+        video_info = self.video_stepper.video_info if self.video_stepper else None
+        if self.track is None or video_info is None:
+            return None
+        if self.frame_table_source != (id(self.track), id(video_info)):
+            self.frame_table = video_info.get_frame_table(self.track.elapsed)
+            self.frame_table_source = (id(self.track), id(video_info))
+        return self.frame_table
+
+    def cancel_render(self):
+        """
+        cancel a running render e.g. when another file is selected
+
+        a stage that already runs in a worker thread finishes but its result is dropped
+        """
+        if self.render_task and not self.render_task.done():
+            self.render_task.cancel()
+
+    async def read_and_optionally_render(self, input_str, with_render: bool = False):
+        """
+        read the given input - a render of the previous input is cancelled
+        """
+        self.cancel_render()
+        await super().read_and_optionally_render(input_str, with_render=with_render)
+
+    def parse_geo_text(self, input_source: str, geo_text: str) -> GeoPath:
+        """
+        parse the given SRT or GPX text - runs in a worker thread
 
         Args:
-            click_args (object): The click event arguments.
+            input_source (str): the url or path of the input
+            geo_text (str): the content of the input
+
+        Returns:
+            GeoPath: the path
+        """
+        geo_path = None
+        if input_source.lower().endswith(".srt"):
+            self.srt = SRT.from_text(geo_text)
+            geo_path = self.srt.as_geopath()
+        elif input_source.lower().endswith(".gpx"):
+            geo_path = GeoPath.from_gpx(geo_text)
+        else:
+            raise ValueError(f"{input_source} is neither an SRT nor a GPX file")
+        return geo_path
+
+    def parse_track(self, input_source: str) -> Track:
+        """
+        read and parse the given input - runs in a worker thread on a cache miss
+        """
+        geo_text = self.do_read_input(input_source)
+        name = input_source.split("/")[-1]
+        if input_source.lower().endswith(".srt"):
+            # keep the camera telemetry columns
+            self.srt = SRT.from_text(geo_text)
+            track = Track.from_srt(self.srt, name=name)
+        else:
+            geo_path = self.parse_geo_text(input_source, geo_text)
+            track = Track.from_geopath(geo_path, name=name)
+        return track
+
+    def clear_path_layers(self):
+        """
+        remove the path layers of the previous render stage
+        """
+        for layer in self.path_layers:
+            self.geo_map.remove_layer(layer)
+        self.path_layers = []
+
+    async def draw_path(self, track: Track, max_points: int = None, source: str = None):
+        """
+        draw the path of the given track replacing the path of the previous render stage
+
+        the positions are encoded in a worker thread and sent with the configured path transport -
+        the complete path of a very long track is drawn from vector tiles instead
+
+        Args:
+            track (Track): the track to draw
+            max_points (int): thin out the path to about this many points - None for all points
+            source (str): the path or url the track was parsed from
+        """
+        vector_tile_points = self.webserver.vector_tile_points
+        if max_points is None and source and 0 < vector_tile_points < len(track):
+            await self.draw_vector_tiles(track, source)
+            return
+        transport = self.webserver.path_transport
+        indices = track.get_indices(max_points)
+        chunks = await asyncio.to_thread(
+            transport.encode, track.lat[indices], track.lon[indices]
+        )
+        self.clear_path_layers()
+        if len(indices) > 0:
+            with self.geo_map as geo_map:
+                geo_map.center = (float(track.lat[0]), float(track.lon[0]))
+                geo_map.zoom = self.zoom_level
+            layer = transport.add_layer(self.geo_map, chunks[0])
+            self.path_layers.append(layer)
+            await transport.append_chunks(layer, chunks[1:])
+
+    async def load_vector_tiles_script(self):
+        """
+        load the renderer of the vector tiles into the page on first use -
+        only pages that show a very long track need it
+        """
+        await self.client.run_javascript(
+            f"""
+            if (!L.{VectorTiles.layer_factory}) {{
+                await new Promise((resolve, reject) => {{
+                    const script = document.createElement("script");
+                    script.src = "{VectorTiles.script_url}";
+                    script.onload = resolve;
+                    script.onerror = reject;
+                    document.head.appendChild(script);
+                }});
+            }}
+            """,
+            timeout=10.0,
+        )
+
+    async def draw_vector_tiles(self, track: Track, source: str):
+        """
+        draw the path of the given track from vector tiles so that the browser
+        only loads the geometry of its viewport and zoom level
+        """
+        vector_tiles = self.webserver.vector_tiles
+        track_id = await asyncio.to_thread(vector_tiles.register, track, source)
+        await self.load_vector_tiles_script()
+        self.clear_path_layers()
+        with self.geo_map as geo_map:
+            geo_map.center = (float(track.lat[0]), float(track.lon[0]))
+            geo_map.zoom = self.zoom_level
+            layer = geo_map.generic_layer(
+                name=VectorTiles.layer_factory,
+                args=[
+                    vector_tiles.get_url_template(track_id),
+                    VectorTiles.get_layer_options(PathTransport.options),
+                ],
+            )
+        self.path_layers.append(layer)
+
+    @RequestProfiler.profiled("render")
+    async def render_stages(self, input_source: str):
+        """
+        render the given input in stages that keep the event loop free:
+        get the parsed track from the shared cache or read and parse it in a worker thread,
+        draw a coarse preview, look up the start location and then draw the complete path
+
+        Args:
+            input_source (str): the url or path of the SRT or GPX input
         """
         try:
-            input_source = self.input
             if input_source.startswith("https://cycle.travel/map/journey/"):
                 input_source = input_source.replace("/map/journey", "/gpx") + ".gpx"
-            ui.notify(f"rendering {input_source}")
-            geo_text = self.do_read_input(input_source)
-            if input_source.lower().endswith(".srt"):
-                self.srt = SRT.from_text(geo_text)
-                self.geo_path = self.srt.as_geopath()
-            elif input_source.lower().endswith(".gpx"):
-                self.geo_path = GeoPath.from_gpx(geo_text)
-            path_len = len(self.geo_path.path)
+            self.notify(f"rendering {input_source}")
+            track = await asyncio.to_thread(
+                self.webserver.track_cache.get_track, input_source, self.parse_track
+            )
+            self.track = track
+            path_len = len(track)
+            self.notify(f"parsed {path_len} points")
+            if path_len == 0:
+                return
             self.time_slider._props["max"] = path_len
             self.time_slider.value = 0
             file_name = ""
-            tp_index = self.time_slider.value
-            tp = self.geo_path.path[tp_index]
-            info = tp.get_info(self.geo_path.nominatim)
             try:
-                file_name = self.input.split("/")[-1]
+                file_name = input_source.split("/")[-1]
             except BaseException as _bex:
                 pass
+            self.geo_desc.content = f"""{file_name}<br>
+{path_len} points
+"""
+            await self.draw_path(track, max_points=self.preview_points)
+            info = await asyncio.to_thread(
+                self.get_trackpoint_info, track, self.time_slider.value
+            )
             desc = f"""{file_name}<br>{info}<br>
 {path_len} points
 """
             self.geo_desc.content = desc
-            with self.geo_map as geo_map:
-                path_2d = self.geo_path.as_tuple_list()
-                if len(path_2d) > 0:
-                    loc = path_2d[0]
-                    geo_map.center = loc
-                    geo_map.zoom = self.zoom_level
-                    print(f"setting location to {loc}")
-                    geo_map.draw_path(path_2d)
-            # show render result in log
-            # self.log_view.push(render_result.stderr)
+            if path_len > self.preview_points:
+                await self.draw_path(track, source=input_source)
+            self.notify(f"rendered {path_len} points of {file_name}")
+        except asyncio.CancelledError:
+            raise
+        except BaseException as ex:
+            self.handle_exception(ex, self.do_trace)
+
+    async def render(self, _click_args=None):
+        """
+        Renders the SRT or GPX content without blocking other users
+
+        a render that is still running is cancelled
+
+        Args:
+            click_args (object): The click event arguments.
+        """
+        self.cancel_render()
+        input_source = self.input
+        task = asyncio.create_task(self.render_stages(input_source))
+        self.render_task = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            if not task.done():
+                # the caller was cancelled - not the render
+                task.cancel()
+                raise
+            self.notify(f"render of {input_source} cancelled")
+
+    async def seed_tiles(self):
+        """
+        cache the base map tiles around the current track for offline use - only in local mode
+        """
+        tile_cache = self.webserver.tile_cache
+        if not self.is_local or self.track is None or tile_cache is None:
+            return
+        try:
+            self.notify(
+                f"caching the map tiles of zoom levels {self.webserver.seed_zooms}"
+            )
+            stats = await asyncio.to_thread(
+                tile_cache.seed_track, self.track, self.webserver.seed_zooms
+            )
+            self.notify(
+                f"{stats['fetched']} map tiles fetched, {stats['cached']} already cached, {stats['failed']} failed"
+            )
         except BaseException as ex:
             self.handle_exception(ex, self.do_trace)
 
@@ -231,8 +1361,17 @@ class NicetrackSolution(InputWebSolution):
         try:
             if self.input.endswith(".SRT"):
                 # pyQT video playing
-                video_path = self.input.replace(".SRT", ".MP4")
-                self.video_stepper.set_video_path(video_path)
+                file_index = self.webserver.file_index
+                video_path = file_index.get_video(self.input) if file_index else None
+                if video_path is None:
+                    video_path = self.input.replace(".SRT", ".MP4")
+                # probing and opening the decoder block - a second click waits
+                async with self.video_stepper.decode_lock:
+                    await asyncio.to_thread(
+                        self.video_stepper.set_video_path, video_path
+                    )
+                # only ask for frames of the size that is actually displayed
+                await self.video_stepper.request_display_size()
                 pass
         except BaseException as ex:
             self.handle_exception(ex, self.do_trace)
@@ -251,8 +1390,30 @@ class NicetrackSolution(InputWebSolution):
 
         await self.setup_content_div(setup_map)
 
+    async def show_catalog(self):
+        """
+        show the cataloged tracks of the current viewport
+        """
+
+        async def setup_catalog():
+            catalog = self.webserver.catalog
+            if catalog is None:
+                ui.label("the catalog is disabled - start the server with --catalog")
+                return
+            self.catalog_view = CatalogView(self, catalog, self.webserver.heatmap)
+            await self.catalog_view.setup_ui()
+
+        await self.setup_content_div(setup_catalog)
+
     def configure_menu(self):
         self.link_button(name="map", icon_name="map", target="/map", new_tab=False)
+        if self.webserver.catalog is not None:
+            self.link_button(
+                name="catalog",
+                icon_name="travel_explore",
+                target="/catalog",
+                new_tab=False,
+            )
 
     async def home(self):
         """Generates the home page with a map"""
@@ -262,8 +1423,10 @@ class NicetrackSolution(InputWebSolution):
             with ui.element("div").classes("w-full"):
                 with ui.splitter() as splitter:
                     with splitter.before:
-                        self.example_selector = FileSelector(
-                            path=self.root_path, handler=self.read_and_optionally_render
+                        # the selector reads the shared index instead of walking the directories
+                        self.example_selector = IndexedFileSelector(
+                            self.webserver.file_index,
+                            handler=self.read_and_optionally_render,
                         )
                         self.input_input = ui.input(
                             value=self.input, on_change=self.input_changed
@@ -279,6 +1442,12 @@ class NicetrackSolution(InputWebSolution):
                                 self.tool_button(
                                     tooltip="play", icon="play_circle", handler=self.on_play
                                 )
+                                if self.webserver.tile_cache is not None:
+                                    self.tool_button(
+                                        tooltip="cache the map tiles around the track",
+                                        icon="download_for_offline",
+                                        handler=self.seed_tiles,
+                                    )
                     with splitter.after:
                         self.geo_desc = ui.html("")
                         self.trackpoint_desc = ui.html("")
@@ -286,8 +1455,16 @@ class NicetrackSolution(InputWebSolution):
                     with splitter.before:
                         with LeafletMap(classes="w-full h-96") as self.geo_map:
                             pass
+                        self.webserver.configure_map(self.geo_map)
+                        # the decoder of the encoded paths
+                        self.geo_map._props["additional-resources"].append(
+                            PathTransport.script_url
+                        )
                     with splitter.after as self.video_container:
-                        self.video_stepper = VideoStepper(None, self.root_path)
+                        self.video_stepper = VideoStepperBase.create(
+                            self.webserver.stepper_backend, None, self.root_path
+                        )
+                        self.video_stepper.session = self.client.id
                         self.video_view = self.video_stepper.get_view(
                             self.video_container
                         )
@@ -304,7 +1481,7 @@ class NicetrackSolution(InputWebSolution):
                 max=100,
                 step=1,
                 value=50,
-                on_change=lambda e: self.mark_trackpoint_at_index(e.value),
+                on_change=lambda e: self.slider_scheduler.submit(e.value),
             ).props(slider_props)
 
         await self.setup_content_div(setup_home)
@@ -0,0 +1,111 @@
+"""
+Created on 2024-12-27
+
+@author: wf
+"""
+
+import os
+import tempfile
+
+import av
+import numpy as np
+from ngwidgets.basetest import Basetest
+
+from nicetrack.burnin import BurnInExport, TelemetryTable, draw_hud
+from nicetrack.srt import SRT
+from nicetrack.stepper_benchmark import StepperBenchmark
+
+
+class TestBurnIn(Basetest):
+    """
+    test the parallel telemetry burn-in export
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.video_path = os.path.join(self.tmpdir.name, "flight.mp4")
+        StepperBenchmark.create_clip(
+            self.video_path, width=320, height=180, frames=90, gop=30
+        )
+        self.srt_path = os.path.join(self.tmpdir.name, "flight.srt")
+        with open(self.srt_path, "w") as srt_file:
+            srt_file.write(self.get_srt_text(subtitles=9, ms=333))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def get_srt_text(self, subtitles: int, ms: int) -> str:
+        """
+        get a DJI style SRT with the given number of subtitles moving north
+        """
+        parts = []
+        for i in range(subtitles):
+            start, end = i * ms, (i + 1) * ms
+            # about 1 m north per subtitle
+            lat = 48.486375 + i * 0.000009
+            parts.append(f"""{i + 1}
+00:00:{start // 1000:02d},{start % 1000:03d} --> 00:00:{end // 1000:02d},{end % 1000:03d}
+<font size="28">SrtCnt : {i + 1}, DiffTime : {ms}ms
+2023-08-15 09:18:24.589
+[iso : 200] [shutter : 1/180.0] [fnum : 170] [ev : 1.3] [ct : 5490] [color_md : default] [focal_len : 240] [dzoom_ratio: 10000, delta:0],[latitude: {lat:.6f}] [longitude: 8.375567] [rel_alt: 1.500 abs_alt: 530.095] </font>
+""")
+        return "\n".join(parts)
+
+    def test_telemetry_table(self):
+        """
+        test the frame to telemetry lookup
+        """
+        srt = SRT.from_text(self.get_srt_text(subtitles=9, ms=333))
+        table = TelemetryTable.from_srt(srt, fps=30, frames=90)
+        self.assertEqual(90, len(table.frame_subtitles))
+        self.assertEqual(0, table.frame_subtitles[0])
+        self.assertEqual(0, table.frame_subtitles[9])
+        self.assertEqual(1, table.frame_subtitles[10])
+        self.assertEqual(8, table.frame_subtitles[89])
+        lines = table.get_lines(45)
+        if self.debug:
+            print(lines)
+        self.assertIn("ALT 530.1 m REL 1.5 m", lines)
+        self.assertIn("ISO 200 S 1/180.0 EV 1.3 F1.7", lines)
+        # 1 m in a third of a second
+        self.assertIn("SPD 10.8 km/h", lines)
+        self.assertEqual([], table.get_lines(90))
+
+    def test_draw_hud(self):
+        """
+        test drawing the head up display
+        """
+        img = np.full((180, 320, 3), 200, dtype=np.uint8)
+        draw_hud(img, ["LAT 48.486375 LON 8.375567"])
+        self.assertLess(img[6, 6, 0], 200)
+        self.assertEqual(200, img[170, 300, 0])
+        draw_hud(img, [])
+
+    def test_export(self):
+        """
+        test exporting the video in parallel chunks
+        """
+        output_path = os.path.join(self.tmpdir.name, "flight_hud.mp4")
+        export = BurnInExport(
+            self.video_path, self.srt_path, output_path, workers=2, chunk_duration=1.0
+        )
+        calls = []
+        stats = export.run(progress=lambda *args: calls.append(args))
+        if self.debug:
+            print(stats)
+        self.assertEqual(3, stats["chunks"])
+        self.assertEqual(90, stats["frames"])
+        self.assertEqual(3, len(calls))
+        self.assertEqual((3, 3, 90), calls[-1][:3])
+        with av.open(output_path) as container:
+            frames = list(container.decode(video=0))
+        self.assertEqual(90, len(frames))
+        pts = [frame.pts for frame in frames]
+        self.assertEqual(sorted(pts), pts)
+        # the chunk files are gone
+        self.assertEqual(
+            sorted(["flight.mp4", "flight.srt", "flight_hud.mp4"]),
+            sorted(os.listdir(self.tmpdir.name)),
+        )
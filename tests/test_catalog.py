@@ -0,0 +1,116 @@
+"""
+Created on 2025-01-06
+
+@author: wf
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from ngwidgets.basetest import Basetest
+
+from nicetrack.catalog import BoundingBox, Catalog
+from nicetrack.file_index import FileIndex
+from nicetrack.track_cache import Track
+
+
+class TestCatalog(Basetest):
+    """
+    test the track catalog
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, "root")
+        examples = Path(__file__).parent.parent / "nicetrack_examples"
+        shutil.copytree(examples, self.root)
+        self.file_index = FileIndex(self.root, os.path.join(self.tmpdir.name, "i.json"))
+        self.catalog = Catalog(
+            self.file_index, os.path.join(self.tmpdir.name, "catalog.sqlite")
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def test_ingest(self):
+        """
+        test the parallel and the incremental ingest
+        """
+        stats = self.catalog.ingest(workers=2)
+        if self.debug:
+            print(stats)
+        self.assertEqual(6, stats["files"])
+        self.assertEqual(6, stats["ingested"])
+        tracks = {track.path: track for track in self.catalog.query()}
+        self.assertEqual(6, len(tracks))
+        gpx = tracks["gpx/149759.gpx"]
+        self.assertEqual(2334, gpx.count)
+        self.assertIsNone(gpx.start_time)
+        self.assertEqual(gpx.distance_km, gpx.stats["distance_km"])
+        srt = tracks["srt/sample1.SRT"]
+        self.assertEqual("2017-07-23T11:46:08", srt.as_dict()["start"])
+        # the stored path is simplified
+        positions = self.catalog.get_track(srt.id).get_positions()
+        self.assertLess(len(positions), srt.count)
+        self.assertGreater(len(positions), 1)
+        # nothing changed
+        stats = self.catalog.ingest(workers=0)
+        self.assertEqual(6, stats["unchanged"])
+        self.assertEqual(0, stats["ingested"])
+        # a removed, a broken and a changed file
+        os.remove(os.path.join(self.root, "srt/sample0.SRT"))
+        with open(os.path.join(self.root, "gpx/broken.gpx"), "w") as gpx_file:
+            gpx_file.write("<gpx")
+        with open(os.path.join(self.root, "srt/sample2.SRT"), "a") as srt_file:
+            srt_file.write("\n")
+        self.file_index.rescan(full=True)
+        stats = self.catalog.ingest(workers=0)
+        self.assertEqual(1, stats["removed"])
+        self.assertEqual(1, stats["failed"])
+        self.assertEqual(1, stats["ingested"])
+        self.assertEqual(["gpx/broken.gpx"], list(self.catalog.get_failures()))
+        self.assertEqual(5, len(self.catalog.query()))
+
+    def test_query(self):
+        """
+        test the spatial and temporal queries
+        """
+        self.catalog.ingest(workers=0)
+        # the two flights in Spain
+        spain = BoundingBox.from_string("-2,41,0,43")
+        paths = [track.path for track in self.catalog.query(spain)]
+        self.assertEqual(["srt/sample3.SRT", "srt/sample4.SRT"], paths)
+        start = Catalog.get_seconds("2018-01-01")
+        paths = [track.path for track in self.catalog.query(spain, start_time=start)]
+        self.assertEqual(["srt/sample4.SRT"], paths)
+        # the time range excludes the track without timestamps
+        paths = [track.path for track in self.catalog.query(end_time=start)]
+        self.assertEqual(4, len(paths))
+        self.assertNotIn("gpx/149759.gpx", paths)
+        longest = self.catalog.query(limit=1)
+        self.assertEqual(["gpx/149759.gpx"], [track.path for track in longest])
+        with self.assertRaises(ValueError):
+            BoundingBox.from_string("1,2,3")
+
+    def test_near(self):
+        """
+        test which tracks passed near a position
+        """
+        self.catalog.ingest(workers=0)
+        track = Track.from_file(os.path.join(self.root, "srt/sample1.SRT"))
+        lat, lon = float(track.lat[100]), float(track.lon[100])
+        found = self.catalog.near(lat, lon, 200)
+        self.assertEqual(["srt/sample1.SRT"], [t.path for t, _distance in found])
+        # the simplified path is within the tolerance of the original
+        self.assertLessEqual(found[0][1], self.catalog.tolerance)
+        # 0.01 degrees north is about 1.1 km away from the track
+        lat = float(track.lat.max()) + 0.01
+        self.assertEqual([], self.catalog.near(lat, lon, 200))
+        self.assertEqual(1, len(self.catalog.near(lat, lon, 2000)))
+        # the flight was in the summer of 2017
+        spring = Catalog.get_seconds("2017-03-01"), Catalog.get_seconds("2017-06-01")
+        self.assertEqual([], self.catalog.near(lat, lon, 2000, *spring))
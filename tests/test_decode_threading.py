@@ -0,0 +1,80 @@
+"""
+Created on 2024-12-21
+
+@author: wf
+"""
+
+import os
+import tempfile
+import time
+
+import numpy as np
+from ngwidgets.basetest import Basetest
+
+from nicetrack.stepper_benchmark import StepperBenchmark
+from nicetrack.video_stepper_av import VideoStepperAV
+
+
+class TestDecodeThreading(Basetest):
+    """
+    test and benchmark the multi-threaded decoding of the PyAV backend
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.video_path = os.path.join(self.tmpdir.name, "synthetic_4k.mp4")
+        self.frames = 24
+        StepperBenchmark.create_clip(
+            self.video_path, width=3840, height=2160, frames=self.frames, gop=12
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def decode_all(self, thread_count: int, thread_type: str) -> float:
+        """
+        decode all frames of the clip with the given thread settings
+
+        Returns:
+            float: the decoding throughput in frames per second
+        """
+        stepper = VideoStepperAV(
+            self.video_path, thread_count=thread_count, thread_type=thread_type
+        )
+        start = time.time()
+        count = 0
+        for _frame in stepper.container.decode(video=0):
+            count += 1
+        elapsed = time.time() - start
+        stepper.close()
+        self.assertEqual(self.frames, count)
+        return count / elapsed
+
+    def test_decode_throughput(self):
+        """
+        report the decode throughput at different thread settings
+        """
+        cores = os.cpu_count() or 1
+        settings = [(1, "SLICE"), (2, "FRAME"), (cores, "FRAME"), (0, "AUTO")]
+        for thread_count, thread_type in settings:
+            fps = self.decode_all(thread_count, thread_type)
+            print(f"threads {thread_count:2} {thread_type:5}: {fps:6.1f} fps")
+            self.assertTrue(fps > 0)
+
+    def test_skip_nonref(self):
+        """
+        test that skipping non-reference frames while seeking finds the same frames
+        """
+        full = VideoStepperAV(self.video_path)
+        skipping = VideoStepperAV(self.video_path, skip_nonref=True)
+        # make sure the skipping is exercised with the short test gop
+        skipping.skip_margin = 2
+        for frame_index in [0, 5, 13, 23]:
+            expected = np.asarray(full.get_frame(frame_index, width=320))
+            actual = np.asarray(skipping.get_frame(frame_index, width=320))
+            self.assertEqual(expected.shape, actual.shape)
+            self.assertTrue(np.array_equal(expected, actual), f"frame {frame_index}")
+        full.close()
+        skipping.close()
@@ -0,0 +1,182 @@
+"""
+Created on 2025-01-05
+
+@author: wf
+"""
+
+import asyncio
+import os
+import tempfile
+
+from ngwidgets.basetest import Basetest
+from ngwidgets.file_selector import FileSelector
+
+from nicetrack.file_index import FileIndex, IndexedFileSelector
+
+
+class TestFileIndex(Basetest):
+    """
+    test the persistent file index
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, "root")
+        self.index_path = os.path.join(self.tmpdir.name, "index.json")
+        for rel_path in [
+            "a/DJI_0001.SRT",
+            "a/DJI_0001.MP4",
+            "a/DJI_0002.SRT",
+            "a/._DJI_0002.SRT",
+            "b/c/route.gpx",
+            "b/notes.txt",
+            "empty/readme.md",
+        ]:
+            self.touch(rel_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def touch(self, rel_path: str, content: str = "x"):
+        path = os.path.join(self.root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write(content)
+        return path
+
+    def test_files(self):
+        """
+        test the types and the SRT and video pairing
+        """
+        file_index = FileIndex(self.root, self.index_path)
+        files = {
+            os.path.relpath(indexed_file.path, self.root): indexed_file
+            for indexed_file in file_index.get_files()
+        }
+        self.assertEqual(
+            ["a/DJI_0001.MP4", "a/DJI_0001.SRT", "a/DJI_0002.SRT", "b/c/route.gpx"],
+            sorted(files),
+        )
+        srt = files["a/DJI_0001.SRT"]
+        self.assertEqual("srt", srt.file_type)
+        self.assertEqual(1, srt.size)
+        self.assertEqual(os.path.join(self.root, "a/DJI_0001.MP4"), srt.pair)
+        self.assertEqual(srt.path, files["a/DJI_0001.MP4"].pair)
+        self.assertIsNone(files["a/DJI_0002.SRT"].pair)
+        self.assertEqual(["gpx"], [f.file_type for f in file_index.get_files("gpx")])
+        self.assertEqual(srt.pair, file_index.get_video(srt.path))
+        self.assertIsNone(file_index.get_video(os.path.join(self.root, "a/x.SRT")))
+
+    def test_tree(self):
+        """
+        test that the selector shows the same tree as a FileSelector walking the directories
+        """
+        file_index = FileIndex(self.root, self.index_path)
+        # the tree never scans - it shows an indexing node until the index is available
+        indexing = IndexedFileSelector(file_index, create_ui=False)
+        self.assertEqual([], indexing.tree_structure["children"])
+        self.assertEqual(0, indexing.file_count)
+        self.assertEqual(0, file_index.listed_dirs)
+        self.assertIsNone(
+            file_index.get_video(os.path.join(self.root, "a/DJI_0001.SRT"))
+        )
+        file_index.ensure_scanned()
+        for extensions in [None, {"srt": ".SRT"}, {"mp4": ".MP4", "gpx": ".gpx"}]:
+            walked = FileSelector(self.root, extensions=extensions, create_ui=False)
+            indexed = IndexedFileSelector(
+                file_index, extensions=extensions, create_ui=False
+            )
+            self.assertEqual(walked.tree_structure, indexed.tree_structure)
+            self.assertEqual(walked.file_count, indexed.file_count)
+
+    def test_refresh(self):
+        """
+        test that a selector shown before the index was available is refreshed
+        once after the background scan
+        """
+
+        class Tree:
+            is_deleted = False
+            updates = 0
+
+            def __init__(self):
+                self._props = {}
+
+            def update(self):
+                self.updates += 1
+
+        async def scan(selector: IndexedFileSelector):
+            selector.tree = Tree()
+            selector.loop = asyncio.get_running_loop()
+            file_index.listeners.append(selector.on_index_changed)
+            await asyncio.to_thread(file_index.ensure_scanned)
+            # a later change does not refresh again
+            self.touch("a/DJI_0005.SRT")
+            self.assertTrue(await asyncio.to_thread(file_index.rescan, True))
+            await asyncio.sleep(0.05)
+            return selector.tree
+
+        file_index = FileIndex(self.root, self.index_path)
+        selector = IndexedFileSelector(file_index, create_ui=False)
+        tree = asyncio.run(scan(selector))
+        self.assertEqual(1, tree.updates)
+        self.assertEqual([selector.tree_structure], tree._props["nodes"])
+        self.assertEqual(3, selector.file_count)
+        self.assertEqual([], file_index.listeners)
+
+    def test_incremental(self):
+        """
+        test that only changed directories are listed again and the index is persisted
+        """
+        file_index = FileIndex(self.root, self.index_path)
+        file_index.rescan()
+        listed = file_index.listed_dirs
+        # root, a, b, b/c and empty
+        self.assertEqual(5, listed)
+        version = file_index.version
+        self.assertFalse(file_index.rescan())
+        self.assertEqual(listed, file_index.listed_dirs)
+        self.touch("b/c/DJI_0003.SRT")
+        self.assertTrue(file_index.rescan())
+        self.assertEqual(listed + 1, file_index.listed_dirs)
+        self.assertGreater(file_index.version, version)
+        paths = [indexed_file.path for indexed_file in file_index.get_files()]
+        self.assertIn(os.path.join(self.root, "b/c/DJI_0003.SRT"), paths)
+        # a new process loads the persisted index without walking the directories
+        loaded = FileIndex(self.root, self.index_path)
+        self.assertEqual(paths, [f.path for f in loaded.get_files()])
+        self.assertEqual(0, loaded.listed_dirs)
+        # a file modified in place is only seen by a full rescan
+        self.touch("a/DJI_0002.SRT", "changed")
+        self.assertFalse(loaded.rescan())
+        self.assertTrue(loaded.rescan(full=True))
+        self.assertEqual(
+            7, loaded.get_file(os.path.join(self.root, "a/DJI_0002.SRT")).size
+        )
+
+    def test_watch(self):
+        """
+        test the background refresh
+        """
+
+        async def watch() -> bool:
+            file_index = FileIndex(self.root, self.index_path)
+            file_index.start(interval=0.2)
+            try:
+                for _ in range(100):
+                    await asyncio.sleep(0.05)
+                    if file_index.scanned:
+                        break
+                self.touch("a/DJI_0004.SRT")
+                new_path = os.path.join(self.root, "a/DJI_0004.SRT")
+                for _ in range(100):
+                    await asyncio.sleep(0.05)
+                    if file_index.get_file(new_path):
+                        return True
+                return False
+            finally:
+                file_index.stop()
+
+        self.assertTrue(asyncio.run(watch()))
@@ -98,3 +98,17 @@ class Test_GeoPath(Basetest):
             if debug:
                 print(f"{track_points} track points found")
             self.assertEqual(2334, track_points)
+
+    def test_preview(self):
+        """
+        test thinning out a path for a coarse preview
+        """
+        geo_path = GeoPath()
+        for i in range(1001):
+            geo_path.add_point(48.0 + i * 0.001, 8.0)
+        self.assertEqual(1001, len(geo_path.as_tuple_list()))
+        preview = geo_path.as_tuple_list(max_points=100)
+        self.assertLessEqual(len(preview), 101)
+        self.assertEqual(geo_path.as_tuple_list()[0], preview[0])
+        self.assertEqual(geo_path.as_tuple_list()[-1], preview[-1])
+        self.assertEqual(501, len(geo_path.as_tuple_list(max_points=1000)))
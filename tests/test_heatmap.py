@@ -0,0 +1,135 @@
+"""
+Created on 2025-01-07
+
+@author: wf
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from pathlib import Path
+
+import numpy as np
+from ngwidgets.basetest import Basetest
+
+from nicetrack.catalog import Catalog
+from nicetrack.file_index import FileIndex
+from nicetrack.heatmap import Heatmap, PngEncoder
+from nicetrack.web_mercator import WebMercator
+
+
+class TestHeatmap(Basetest):
+    """
+    test the density heatmap tiles
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, "root")
+        examples = Path(__file__).parent.parent / "nicetrack_examples"
+        shutil.copytree(examples, self.root)
+        self.file_index = FileIndex(self.root, os.path.join(self.tmpdir.name, "i.json"))
+        self.catalog = Catalog(
+            self.file_index, os.path.join(self.tmpdir.name, "catalog.sqlite")
+        )
+        self.heatmap = Heatmap(self.catalog)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def decode_png(self, png: bytes) -> np.ndarray:
+        """
+        decode an unfiltered RGBA PNG as written by the PngEncoder
+        """
+        self.assertEqual(PngEncoder.signature, png[:8])
+        offset = 8
+        chunks = {}
+        while offset < len(png):
+            (length,) = struct.unpack(">I", png[offset : offset + 4])
+            tag = png[offset + 4 : offset + 8]
+            data = png[offset + 8 : offset + 8 + length]
+            (crc,) = struct.unpack(
+                ">I", png[offset + 8 + length : offset + 12 + length]
+            )
+            self.assertEqual(zlib.crc32(tag + data) & 0xFFFFFFFF, crc)
+            chunks[tag] = data
+            offset += 12 + length
+        width, height = struct.unpack(">II", chunks[b"IHDR"][:8])
+        raw = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), dtype=np.uint8)
+        rgba = raw.reshape(height, width * 4 + 1)[:, 1:].reshape(height, width, 4)
+        return rgba
+
+    def get_alpha(self, lat: float, lon: float, z: int) -> np.ndarray:
+        x, y = WebMercator.get_tile(lat, lon, z)
+        return self.decode_png(self.heatmap.render(z, x, y))[:, :, 3]
+
+    def test_tiles(self):
+        """
+        test the tiles of the cataloged tracks
+        """
+        self.catalog.ingest(workers=0)
+        # the catalog updates the heatmap after the ingest
+        self.assertEqual(6, len(self.heatmap.geometries))
+        self.assertEqual(1, self.heatmap.version)
+        alpha = self.get_alpha(-38.427, 174.893, 14)
+        self.assertEqual((256, 256), alpha.shape)
+        self.assertTrue(alpha.any())
+        # the whole world contains all tracks
+        world = self.decode_png(self.heatmap.render(0, 0, 0))
+        self.assertGreaterEqual((world[:, :, 3] > 0).sum(), 6 * 16)
+        # far away from any track
+        self.assertFalse(self.get_alpha(60.0, 30.0, 10).any())
+        with self.assertRaises(ValueError):
+            self.heatmap.render(2, 4, 0)
+        # the tiles are cached until the grids change
+        x, y = WebMercator.get_tile(-38.427, 174.893, 14)
+        self.assertIs(self.heatmap.render(14, x, y), self.heatmap.render(14, x, y))
+        # a tile rendered while the grids change is not cached for the new version
+        get_cells = self.heatmap.get_cells
+
+        def get_changing_cells(z: int, x: int, y: int):
+            cells = get_cells(z, x, y)
+            self.heatmap.changed()
+            return cells
+
+        self.heatmap.get_cells = get_changing_cells
+        self.heatmap.render(13, x // 2, y // 2)
+        self.assertNotIn((13, x // 2, y // 2), self.heatmap.tiles)
+        self.assertEqual(2, self.heatmap.version)
+
+    def test_incremental(self):
+        """
+        test that removed tracks are subtracted from the grids
+        """
+        self.catalog.ingest(workers=0)
+        totals = [
+            sum(int(g.sum()) for g in grids.values()) for grids in self.heatmap.grids
+        ]
+        # every zoom level has the same samples
+        self.assertEqual(1, len(set(totals)))
+        os.remove(os.path.join(self.root, "srt/sample1.SRT"))
+        self.file_index.rescan()
+        self.assertFalse(self.get_alpha(-38.427, 174.893, 14).all())
+        stats = self.catalog.ingest(workers=0)
+        self.assertEqual(1, stats["removed"])
+        self.assertEqual(5, len(self.heatmap.geometries))
+        self.assertEqual(2, self.heatmap.version)
+        self.assertFalse(self.get_alpha(-38.427, 174.893, 14).any())
+        self.assertFalse(self.get_alpha(-38.427, 174.893, 8).any())
+        self.assertEqual({"added": 0, "removed": 0}, self.heatmap.update())
+        self.assertEqual(2, self.heatmap.version)
+
+    def test_validator(self):
+        """
+        test that the validators of the tiles change with the grids
+        """
+        validator = self.heatmap.get_validator(0, 0, 0)
+        self.assertFalse(validator.immutable)
+        self.catalog.ingest(workers=0)
+        changed = self.heatmap.get_validator(0, 0, 0)
+        self.assertNotEqual(validator.etag, changed.etag)
+        self.assertTrue(changed.is_not_modified(changed.etag))
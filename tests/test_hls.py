@@ -0,0 +1,129 @@
+"""
+Created on 2024-12-24
+
+@author: wf
+"""
+
+import io
+import os
+import tempfile
+import time
+
+import av
+from fastapi import FastAPI, Header
+from fastapi.testclient import TestClient
+from ngwidgets.basetest import Basetest
+
+from nicetrack.hls import HlsSegmenter, SegmentCache
+from nicetrack.stepper_benchmark import StepperBenchmark
+
+
+class TestHls(Basetest):
+    """
+    test remuxing videos into HLS fragmented mp4 segments
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.video_path = os.path.join(self.tmpdir.name, "hls.mp4")
+        # 10 seconds with a keyframe every second
+        StepperBenchmark.create_clip(
+            self.video_path, width=320, height=180, frames=300, gop=30
+        )
+        self.cache = SegmentCache(os.path.join(self.tmpdir.name, "cache"))
+        self.segmenter = HlsSegmenter(self.video_path, self.cache, target_duration=2.0)
+
+    def tearDown(self):
+        self.segmenter.close()
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def decode(self, *parts: bytes) -> list:
+        """
+        decode the given concatenated init and media segments
+
+        Returns:
+            list: the presentation timestamps of the decoded frames
+        """
+        with av.open(io.BytesIO(b"".join(parts))) as container:
+            pts = [frame.pts for frame in container.decode(video=0)]
+        return pts
+
+    def test_playlist(self):
+        """
+        test the keyframe aligned segments and the playlist
+        """
+        segments = self.segmenter.get_segments()
+        self.assertEqual(5, len(segments))
+        for segment in segments:
+            self.assertAlmostEqual(2.0, segment.duration, places=3)
+        self.assertIsNone(segments[-1].end_pts)
+        playlist = self.segmenter.get_playlist()
+        if self.debug:
+            print(playlist)
+        lines = playlist.splitlines()
+        self.assertEqual("#EXTM3U", lines[0])
+        self.assertIn("#EXT-X-TARGETDURATION:2", lines)
+        self.assertEqual("#EXT-X-ENDLIST", lines[-1])
+        uris = [line for line in lines if line.startswith("segment_")]
+        self.assertEqual(5, len(uris))
+
+    def test_segments(self):
+        """
+        test that every segment decodes on its own and all segments give the whole video
+        """
+        init = self.segmenter.get_init()
+        media = [self.segmenter.get_segment(i) for i in range(5)]
+        box_types = [box_type for box_type, _box in HlsSegmenter.split_boxes(init)]
+        self.assertEqual(["ftyp", "moov"], box_types)
+        all_pts = self.decode(init, *media)
+        self.assertEqual(300, len(all_pts))
+        self.assertEqual(sorted(all_pts), all_pts)
+        # seeking only needs the init segment and a single media segment
+        segment_pts = self.decode(init, media[3])
+        self.assertEqual(60, len(segment_pts))
+        self.assertEqual(all_pts[180:240], segment_pts)
+
+    def test_cache(self):
+        """
+        test the disk cache and its size based eviction
+        """
+        media = self.segmenter.get_segment(1)
+        self.assertEqual(media, self.cache.get(self.segmenter.key, "segment_1.m4s"))
+        start = time.perf_counter()
+        self.assertEqual(media, self.segmenter.get_segment(1))
+        if self.debug:
+            print(f"cached segment in {(time.perf_counter() - start) * 1000:.2f} ms")
+        # keep about two segments
+        self.cache.max_bytes = len(media) * 2 + len(self.segmenter.get_init())
+        for index in range(5):
+            self.segmenter.get_segment(index)
+        self.assertLessEqual(self.cache.size, self.cache.max_bytes)
+        self.assertIsNotNone(self.cache.get(self.segmenter.key, "segment_4.m4s"))
+        self.assertIsNone(self.cache.get(self.segmenter.key, "segment_0.m4s"))
+
+    def test_responses(self):
+        """
+        test the http responses including conditional requests
+        """
+        app = FastAPI()
+
+        @app.get("/hls/{name}")
+        async def hls(name: str, if_none_match: str = Header(None)):
+            return await self.segmenter.get_response(name, if_none_match)
+
+        client = TestClient(app)
+        r = client.get("/hls/index.m3u8")
+        self.assertEqual(200, r.status_code)
+        self.assertEqual("application/vnd.apple.mpegurl", r.headers["content-type"])
+        self.assertEqual("public, no-cache", r.headers["cache-control"])
+        r = client.get("/hls/segment_2.m4s")
+        self.assertEqual(200, r.status_code)
+        self.assertIn("immutable", r.headers["cache-control"])
+        r = client.get(
+            "/hls/segment_2.m4s", headers={"If-None-Match": r.headers["ETag"]}
+        )
+        self.assertEqual(304, r.status_code)
+        self.assertEqual(404, client.get("/hls/segment_5.m4s").status_code)
+        self.assertEqual(404, client.get("/hls/other.txt").status_code)
@@ -0,0 +1,91 @@
+"""
+Created on 2024-12-20
+
+@author: wf
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from ngwidgets.basetest import Basetest
+
+from nicetrack.http_cache import CacheValidator
+from nicetrack.video_stepper import VideoStepper
+
+
+class TestHttpCache(Basetest):
+    """
+    test the http caching of frame images
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.tmpdir.name, "test.bin")
+        with open(self.file_path, "wb") as f:
+            f.write(b"0123456789")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def test_etag(self):
+        """
+        test that the etag depends on file identity, frame, format and size
+        """
+        v1 = CacheValidator.for_frame(self.file_path, 1, "jpg", 320)
+        self.assertEqual(
+            v1.etag, CacheValidator.for_frame(self.file_path, 1, "jpg", 320).etag
+        )
+        for other in [
+            CacheValidator.for_frame(self.file_path, 2, "jpg", 320),
+            CacheValidator.for_frame(self.file_path, 1, "webp", 320),
+            CacheValidator.for_frame(self.file_path, 1, "jpg", 640),
+            CacheValidator.for_frame(self.file_path, 1, "jpg", 320, quality=50),
+        ]:
+            self.assertNotEqual(v1.etag, other.etag)
+        # a changed file gets a new identity
+        time.sleep(0.01)
+        with open(self.file_path, "ab") as f:
+            f.write(b"x")
+        v2 = CacheValidator.for_frame(self.file_path, 1, "jpg", 320)
+        self.assertNotEqual(v1.etag, v2.etag)
+        self.assertTrue(v1.etag.startswith('"'))
+        self.assertIn("immutable", v1.headers["Cache-Control"])
+
+    def test_conditional(self):
+        """
+        test the evaluation of conditional request headers
+        """
+        v = CacheValidator.for_frame(self.file_path, 0, "jpg")
+        self.assertTrue(v.is_not_modified(v.etag))
+        self.assertTrue(v.is_not_modified(f'"other", W/{v.etag}'))
+        self.assertTrue(v.is_not_modified("*"))
+        self.assertFalse(v.is_not_modified('"other"'))
+        self.assertFalse(v.is_not_modified())
+        self.assertTrue(v.is_not_modified(if_modified_since=v.last_modified))
+        self.assertFalse(
+            v.is_not_modified(if_modified_since="Thu, 01 Jan 1970 00:00:00 GMT")
+        )
+        # If-None-Match takes precedence
+        self.assertFalse(v.is_not_modified('"other"', v.last_modified))
+        self.assertFalse(v.is_not_modified(if_modified_since="garbage"))
+
+    def test_stream_image_not_modified(self):
+        """
+        test that a conditional request is answered without decoding
+        """
+        stepper = VideoStepper(None)
+        stepper.video_path = self.file_path
+        stepper.video_size = 10
+        v = CacheValidator.for_frame(self.file_path, 5, "jpg", 320)
+        with patch.object(stepper, "get_image") as get_image:
+            response = asyncio.run(
+                stepper.stream_image(5, "jpg", width=320, if_none_match=v.etag)
+            )
+            get_image.assert_not_called()
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(v.etag, response.headers["ETag"])
@@ -0,0 +1,79 @@
+"""
+Created on 2025-01-05
+
+@author: wf
+"""
+
+import subprocess
+import sys
+from typing import Dict, Tuple
+
+from ngwidgets.basetest import Basetest
+
+
+class TestImportTime(Basetest):
+    """
+    guard the server start against eager imports of the media and geocoding stacks
+    """
+
+    # the modules that are only needed once a video is decoded or a location is looked up
+    lazy_modules = ["cv2", "av", "OSMPythonTools", "gpxpy"]
+
+    def get_import_times(self, module: str) -> Dict[str, Tuple[int, int]]:
+        """
+        import the given module in a fresh interpreter with -X importtime
+
+        Returns:
+            Dict[str, Tuple[int, int]]: the self and cumulative microseconds by imported module
+        """
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        times = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:") :].split("|")
+            times[name.strip()] = (int(self_us), int(cumulative_us))
+        return times
+
+    def test_lazy_imports(self):
+        """
+        test that starting the server does not import the heavy stacks
+        """
+        for module in ["nicetrack.webserver", "nicetrack.nicetrack_cmd"]:
+            times = self.get_import_times(module)
+            self.assertIn(module, times)
+            for lazy_module in self.lazy_modules:
+                self.assertNotIn(lazy_module, times, f"{module} imports {lazy_module}")
+            own_us = sum(
+                self_us
+                for name, (self_us, _cumulative_us) in times.items()
+                if name.startswith("nicetrack")
+            )
+            if self.debug:
+                total_us = times[module][1]
+                print(
+                    f"{module}: {total_us/1000:.0f} ms total {own_us/1000:.0f} ms in nicetrack"
+                )
+            # the nicetrack modules themselves only define classes
+            self.assertLess(own_us, 500000)
+
+    def test_first_use(self):
+        """
+        test that the lazy modules are imported on first use
+        """
+        code = (
+            "import sys\n"
+            "from nicetrack.geo import GeoPath\n"
+            "geo_path = GeoPath()\n"
+            "assert 'OSMPythonTools' not in sys.modules\n"
+            "assert geo_path.nominatim is geo_path.nominatim\n"
+            "assert 'OSMPythonTools.nominatim' in sys.modules\n"
+            'GeoPath.from_gpx(\'<gpx version="1.1" creator="test"></gpx>\')\n'
+            "assert 'gpxpy' in sys.modules\n"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True)
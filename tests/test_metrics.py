@@ -0,0 +1,120 @@
+"""
+Created on 2025-01-03
+
+@author: wf
+"""
+
+import os
+import tempfile
+import time
+
+from ngwidgets.basetest import Basetest
+
+from nicetrack.metrics import NO_TIMER, Metrics
+from nicetrack.stepper_benchmark import StepperBenchmark
+from nicetrack.track_cache import Track, TrackCache
+from nicetrack.video_stepper_base import VideoStepperBase
+
+
+class TestMetrics(Basetest):
+    """
+    test the Prometheus metrics
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.metrics = Metrics.get_instance()
+        self.was_enabled = self.metrics.enabled
+
+    def tearDown(self):
+        self.metrics.enabled = self.was_enabled
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def test_text_format(self):
+        """
+        test the Prometheus text exposition format
+        """
+        metrics = Metrics(enabled=True)
+        metrics.cache_requests.inc("track", "miss")
+        metrics.cache_requests.inc("track", "miss")
+        metrics.cache_requests.inc("hls", "hit")
+        metrics.open_decoders.inc("av")
+        metrics.parse_seconds.observe(0.003, "srt")
+        metrics.parse_seconds.observe(0.2, "srt")
+        metrics.parse_seconds.observe(20.0, "srt")
+        text = metrics.as_text()
+        if self.debug:
+            print(text)
+        lines = text.splitlines()
+        self.assertIn("# TYPE nicetrack_parse_seconds histogram", lines)
+        self.assertIn("# TYPE nicetrack_cache_requests_total counter", lines)
+        self.assertIn(
+            'nicetrack_cache_requests_total{cache="track",result="miss"} 2', lines
+        )
+        self.assertIn(
+            'nicetrack_cache_requests_total{cache="hls",result="hit"} 1', lines
+        )
+        self.assertIn('nicetrack_open_decoders{backend="av"} 1', lines)
+        # the buckets are cumulative
+        self.assertIn(
+            'nicetrack_parse_seconds_bucket{format="srt",le="0.0025"} 0', lines
+        )
+        self.assertIn(
+            'nicetrack_parse_seconds_bucket{format="srt",le="0.005"} 1', lines
+        )
+        self.assertIn('nicetrack_parse_seconds_bucket{format="srt",le="0.25"} 2', lines)
+        self.assertIn('nicetrack_parse_seconds_bucket{format="srt",le="10.0"} 2', lines)
+        self.assertIn('nicetrack_parse_seconds_bucket{format="srt",le="+Inf"} 3', lines)
+        self.assertIn('nicetrack_parse_seconds_count{format="srt"} 3', lines)
+        self.assertIn('nicetrack_parse_seconds_sum{format="srt"} 20.203', lines)
+        self.assertTrue(text.endswith("\n"))
+
+    def test_disabled(self):
+        """
+        test that disabled metrics record nothing and cost less than a microsecond per event
+        """
+        metrics = Metrics(enabled=False)
+        metrics.cache_requests.inc("track", "memory")
+        metrics.frame_decode_seconds.observe(0.01, "av")
+        self.assertIs(NO_TIMER, metrics.frame_decode_seconds.time("av"))
+        self.assertNotIn("nicetrack_cache_requests_total{", metrics.as_text())
+        iterations = 100000
+        start = time.perf_counter()
+        for _ in range(iterations):
+            with metrics.frame_decode_seconds.time("av"):
+                pass
+            metrics.cache_requests.inc("track", "memory")
+        per_event = (time.perf_counter() - start) / iterations / 2
+        if self.debug:
+            print(f"{per_event*1e9:.0f} ns per disabled event")
+        self.assertLess(per_event, 1e-6)
+
+    def test_instrumentation(self):
+        """
+        test the instrumented track cache and video stepper
+        """
+        self.metrics.enabled = True
+        srt_path = os.path.join(self.tmpdir.name, "flight.srt")
+        with open(srt_path, "w") as srt_file:
+            srt_file.write(
+                "1\n00:00:00,000 --> 00:00:00,033\n"
+                "[latitude: 50.1] [longitude: 6.1] [rel_alt: 1.0 abs_alt: 100.0]\n\n"
+            )
+        track_cache = TrackCache(sidecars=False)
+        track_cache.get_track(srt_path, Track.from_file)
+        track_cache.get_track(srt_path, Track.from_file)
+        video_path = os.path.join(self.tmpdir.name, "clip.mp4")
+        StepperBenchmark.create_clip(video_path, width=160, height=90, frames=12)
+        stepper = VideoStepperBase.create("av", video_path)
+        image = stepper.get_image(3)
+        self.assertIsNotNone(image)
+        text = self.metrics.as_text()
+        stepper.close()
+        self.assertIn('nicetrack_parse_seconds_count{format="srt"}', text)
+        self.assertIn('cache="track",result="miss"', text)
+        self.assertIn('cache="track",result="memory"', text)
+        self.assertIn('nicetrack_frame_decode_seconds_count{backend="av"}', text)
+        self.assertIn('nicetrack_frame_encode_seconds_count{backend="av"}', text)
+        self.assertIn('nicetrack_open_decoders{backend="av"}', text)
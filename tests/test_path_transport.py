@@ -0,0 +1,118 @@
+"""
+Created on 2024-12-30
+
+@author: wf
+"""
+
+import json
+import shutil
+import subprocess
+import unittest
+from pathlib import Path
+
+import numpy as np
+from ngwidgets.basetest import Basetest
+
+from nicetrack.geo import GeoPath
+from nicetrack.path_transport import PathTransport, PolylineCodec
+from nicetrack.track_cache import Track
+
+
+class TestPathTransport(Basetest):
+    """
+    test the compact path transport to the browser
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        # the example of the Google polyline algorithm documentation
+        self.lat = np.array([38.5, 40.7, 43.252])
+        self.lon = np.array([-120.2, -120.95, -126.453])
+        self.encoded = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+    def get_track(self) -> Track:
+        examples = Path(__file__).parent.parent / "nicetrack_examples"
+        with open(examples / "gpx" / "149759.gpx") as gpx_file:
+            geo_path = GeoPath.from_gpx(gpx_file.read())
+        return Track.from_geopath(geo_path)
+
+    def test_polyline(self):
+        """
+        test encoding and decoding Google encoded polylines
+        """
+        self.assertEqual(self.encoded, PolylineCodec.encode(self.lat, self.lon))
+        decoded = PolylineCodec.decode(self.encoded)
+        np.testing.assert_allclose(np.column_stack([self.lat, self.lon]), decoded)
+        self.assertEqual("", PolylineCodec.encode([], []))
+        self.assertEqual((0, 2), PolylineCodec.decode("").shape)
+        # a higher precision and large deltas
+        lat = np.array([0.0, 89.999999, -89.999999, 0.000001])
+        lon = np.array([0.0, 179.999999, -179.999999, -0.000001])
+        encoded = PolylineCodec.encode(lat, lon, precision=6)
+        decoded = PolylineCodec.decode(encoded, precision=6)
+        np.testing.assert_allclose(np.column_stack([lat, lon]), decoded, atol=1e-9)
+
+    def test_chunks(self):
+        """
+        test that the chunks of a track concatenate to the complete path
+        """
+        track = self.get_track()
+        for mode in ["polyline", "delta"]:
+            transport = PathTransport(mode, chunk_points=1000)
+            chunks = transport.encode(track.lat, track.lon)
+            self.assertEqual(3, len(chunks))
+            if mode == "polyline":
+                parts = [PolylineCodec.decode(chunk) for chunk in chunks]
+            else:
+                parts = [PolylineCodec.from_ints(chunk) for chunk in chunks]
+            decoded = np.concatenate(parts)
+            self.assertEqual(len(track), len(decoded))
+            error = np.abs(decoded - np.column_stack([track.lat, track.lon])).max()
+            self.assertLessEqual(error, 0.5e-5 + 1e-12)
+        with self.assertRaises(ValueError):
+            PathTransport("xml")
+
+    def test_measure(self):
+        """
+        test the payload size against the json of the tuple list
+        """
+        track = self.get_track()
+        stats = PathTransport.measure(track.lat, track.lon)
+        if self.debug:
+            for mode, mode_stats in stats.items():
+                print(
+                    f"{mode:8}: {mode_stats['bytes']:7d} bytes {mode_stats['encode_ms']:6.2f} ms max error {mode_stats['max_error']:.1e}°"
+                )
+        self.assertEqual(0.0, stats["json"]["max_error"])
+        self.assertLess(stats["polyline"]["bytes"] * 4, stats["json"]["bytes"])
+        self.assertLess(stats["delta"]["bytes"] * 2, stats["json"]["bytes"])
+
+    @unittest.skipIf(shutil.which("node") is None, "node is not available")
+    def test_js_decoder(self):
+        """
+        test that the browser side decoder matches the python codec
+        """
+        track = self.get_track()
+        encoded = PolylineCodec.encode(track.lat, track.lon)
+        deltas = PolylineCodec.to_ints(track.lat, track.lon).tolist()
+        script = f"""
+const codec = require({json.dumps(PathTransport.script_path)});
+const encoded = {json.dumps(encoded)};
+const deltas = {json.dumps(deltas)};
+const sample = {json.dumps(self.encoded)};
+console.log(JSON.stringify({{
+  polyline: codec.decodePolyline(encoded, 5),
+  delta: codec.decodeDeltas(deltas, 5),
+  sample: codec.decodePolyline(sample, 5),
+}}));
+"""
+        result = subprocess.run(
+            ["node", "-e", script], capture_output=True, text=True, check=True
+        )
+        decoded = json.loads(result.stdout)
+        expected = PolylineCodec.decode(encoded)
+        np.testing.assert_allclose(expected, np.array(decoded["polyline"]))
+        np.testing.assert_allclose(expected, np.array(decoded["delta"]))
+        np.testing.assert_allclose(
+            np.column_stack([self.lat, self.lon]), np.array(decoded["sample"])
+        )
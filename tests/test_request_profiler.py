@@ -0,0 +1,234 @@
+"""
+Created on 2025-01-04
+
+@author: wf
+"""
+
+import asyncio
+import glob
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+
+from fastapi import HTTPException
+from ngwidgets.basetest import Basetest
+
+from nicetrack.request_profiler import ProfilingExecutor, RequestProfiler
+from nicetrack.webserver import WebServer
+
+
+def busy_worker(seconds: float) -> int:
+    """
+    burn cpu in a worker thread
+    """
+    end = time.perf_counter() + seconds
+    count = 0
+    while time.perf_counter() < end:
+        count += 1
+    return count
+
+
+def busy_loop(seconds: float) -> int:
+    """
+    burn cpu on the event loop
+    """
+    return busy_worker(seconds)
+
+
+def busy_other(seconds: float) -> int:
+    """
+    burn cpu for a task that is not profiled
+    """
+    return busy_worker(seconds)
+
+
+@RequestProfiler.profiled("step")
+async def profiled_request(seconds: float) -> int:
+    count = busy_loop(seconds)
+    await asyncio.sleep(0)
+    count += await asyncio.to_thread(busy_worker, seconds)
+    return count
+
+
+async def other_request(seconds: float):
+    for _ in range(3):
+        busy_other(seconds / 3)
+        await asyncio.sleep(0)
+
+
+class TestRequestProfiler(Basetest):
+    """
+    test the request profiler
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.previous = RequestProfiler.instance
+        self.request_profiler = RequestProfiler(
+            profile_dir=self.tmpdir.name, interval=0.001
+        )
+        RequestProfiler.instance = self.request_profiler
+
+    def tearDown(self):
+        self.request_profiler.disable()
+        RequestProfiler.instance = self.previous
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def serve(self, seconds: float = 0.05):
+        """
+        serve a profiled and an unprofiled request concurrently
+        """
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            loop.set_default_executor(ProfilingExecutor())
+            results = await asyncio.gather(
+                profiled_request(seconds), other_request(seconds)
+            )
+            return results[0]
+
+        return asyncio.run(main())
+
+    def get_functions(self, stats: pstats.Stats) -> set:
+        return {function for _file, _line, function in stats.stats}
+
+    def test_disabled(self):
+        """
+        test that a disabled profiler only passes the calls through
+        """
+        self.assertGreater(self.serve(0.01), 0)
+        self.request_profiler.flush(wait=True)
+        self.assertEqual([], os.listdir(self.tmpdir.name))
+
+    def test_active_profiler(self):
+        """
+        test that a step is run unprofiled if another profiler is already active
+        as python 3.12 allows only one profiler per interpreter
+        """
+
+        class ActiveProfile:
+            def enable(self):
+                raise ValueError("Another profiling tool is already active")
+
+        self.request_profiler.enable("cprofile")
+        key = (threading.get_ident(), "step")
+        self.request_profiler.window.profiles[key] = ActiveProfile()
+        self.assertEqual(3, self.request_profiler.run("step", lambda: 3))
+        self.assertNotIn(key, self.request_profiler.active)
+        self.assertIsNone(self.request_profiler.local.label)
+        # the thread is profiled again once the profiler is available
+        del self.request_profiler.window.profiles[key]
+        self.assertTrue(self.request_profiler.enter("step"))
+        self.request_profiler.exit("step")
+        self.request_profiler.disable()
+
+    def test_stack(self):
+        """
+        test the sampled stack of the current frame
+        """
+        stack = RequestProfiler.get_stack(sys._getframe())
+        name, filename, _line = stack[-1]
+        self.assertTrue(name.endswith("test_stack"))
+        self.assertEqual(__file__, filename)
+
+    def test_cprofile(self):
+        """
+        test the deterministic profiles and their attribution to the request
+        """
+        self.request_profiler.enable("cprofile")
+        self.assertGreater(self.serve(), 0)
+        self.request_profiler.disable()
+        prof_files = glob.glob(f"{self.tmpdir.name}/*_step.prof")
+        self.assertEqual(1, len(prof_files))
+        stats = pstats.Stats(prof_files[0])
+        functions = self.get_functions(stats)
+        if self.debug:
+            stats.sort_stats("cumulative").print_stats(10)
+        # the steps on the event loop and the work in the worker thread
+        self.assertIn("busy_loop", functions)
+        self.assertIn("busy_worker", functions)
+        # the other task ran in between but is not part of the request
+        self.assertNotIn("busy_other", functions)
+        request_files = glob.glob(f"{self.tmpdir.name}/*_requests.json")
+        self.assertEqual(1, len(request_files))
+        with open(request_files[0]) as json_file:
+            requests = json.load(json_file)["requests"]
+        self.assertEqual(1, requests["step"]["count"])
+        self.assertGreaterEqual(requests["step"]["max_s"], 0.1)
+
+    def test_sampling(self):
+        """
+        test the sampled profiles in the speedscope format
+        """
+        self.request_profiler.enable("sampling")
+        self.serve(0.2)
+        self.request_profiler.disable()
+        speedscope_files = glob.glob(f"{self.tmpdir.name}/*.speedscope.json")
+        self.assertEqual(1, len(speedscope_files))
+        with open(speedscope_files[0]) as json_file:
+            speedscope = json.load(json_file)
+        self.assertEqual(
+            "https://www.speedscope.app/file-format-schema.json", speedscope["$schema"]
+        )
+        profiles = {profile["name"]: profile for profile in speedscope["profiles"]}
+        self.assertEqual(["step"], list(profiles))
+        frames = speedscope["shared"]["frames"]
+        sampled = set()
+        for stack in profiles["step"]["samples"]:
+            sampled.update(frames[index]["name"] for index in stack)
+        self.assertIn("busy_worker", sampled)
+        self.assertNotIn("busy_other", sampled)
+
+    def test_window(self):
+        """
+        test that the profiles are dumped per window
+        """
+        self.request_profiler.window_seconds = 0.0
+        self.request_profiler.enable()
+        self.serve(0.01)
+        self.serve(0.01)
+        self.request_profiler.disable()
+        status = self.request_profiler.get_status()
+        self.assertFalse(status["enabled"])
+        request_files = [
+            path
+            for path in self.request_profiler.dumped
+            if path.endswith("_requests.json")
+        ]
+        self.assertEqual(2, len(request_files))
+        # only the newest files are kept
+        self.request_profiler.max_files = 1
+        self.request_profiler.enable()
+        self.serve(0.01)
+        self.request_profiler.disable()
+        self.assertEqual(1, len(self.request_profiler.dumped))
+        self.assertEqual(1, len(os.listdir(self.tmpdir.name)))
+
+    def test_admin(self):
+        """
+        test that profiling can only be switched on by a local client of a
+        server in local mode and that the executor is only installed then
+        """
+        webserver = WebServer()
+
+        async def switch(client_host: str):
+            try:
+                status = await webserver.profile_admin(client_host, enabled=True)
+            except HTTPException as ex:
+                status = ex.status_code
+            return status
+
+        self.assertEqual(400, asyncio.run(switch("127.0.0.1")))
+        webserver.is_local = True
+        self.assertEqual(403, asyncio.run(switch("192.0.2.1")))
+        self.assertFalse(self.request_profiler.enabled)
+        self.assertIsNone(webserver.profiling_executor)
+        status = asyncio.run(switch("127.0.0.1"))
+        self.assertTrue(status["enabled"])
+        self.assertIsInstance(webserver.profiling_executor, ProfilingExecutor)
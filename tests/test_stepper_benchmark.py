@@ -0,0 +1,48 @@
+"""
+Created on 2024-12-22
+
+@author: wf
+"""
+
+import json
+import os
+import tempfile
+
+from ngwidgets.basetest import Basetest
+
+from nicetrack.stepper_benchmark import StepperBenchmark
+
+
+class TestStepperBenchmark(Basetest):
+    """
+    run the stepper backend benchmark on locally generated clips
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+
+    def test_benchmark(self):
+        """
+        benchmark all backends on h.264 and h.265 clips and save the results as JSON
+        """
+        with tempfile.TemporaryDirectory() as work_dir:
+            benchmark = StepperBenchmark(
+                work_dir=work_dir, width=640, height=360, frames=90, seeks=10, steps=20
+            )
+            results = benchmark.run()
+            self.assertEqual(4, len(results))
+            for r in results:
+                if self.debug:
+                    print(
+                        f"{r.backend:6} {r.codec}: first frame {r.first_frame_latency*1000:6.1f} ms "
+                        f"seek {r.seek_latency_mean*1000:6.1f} ms (p95 {r.seek_latency_p95*1000:6.1f} ms) "
+                        f"step {r.step_fps:6.1f} fps memory {r.memory_mb:5.1f} MB"
+                    )
+                self.assertTrue(r.first_frame_latency > 0)
+                self.assertTrue(r.step_fps > 0)
+            json_path = os.path.join(work_dir, "stepper_benchmark.json")
+            benchmark.save(json_path)
+            with open(json_path) as json_file:
+                record = json.load(json_file)
+            self.assertEqual(4, len(record["results"]))
+            self.assertEqual(42, record["settings"]["seed"])
@@ -0,0 +1,181 @@
+"""
+Created on 2025-01-09
+
+@author: wf
+"""
+
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ngwidgets.basetest import Basetest
+
+from nicetrack.catalog import BoundingBox
+from nicetrack.tile_cache import MBTiles, TileCache
+
+
+class StubTileHandler(BaseHTTPRequestHandler):
+    """
+    a tile server that answers /{z}/{x}/{y}.png with the tile address as content
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.connections.add(self.client_address)
+        time.sleep(server.delay)
+        match = re.fullmatch(r"/(\d+)/(\d+)/(\d+)\.png", self.path)
+        if match is None or int(match.group(1)) > 14:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = f"tile {'/'.join(match.groups())}".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTileCache(Basetest):
+    """
+    test the offline cache of the base map tiles against a local stub tile server
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubTileHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.connections = set()
+        self.server.delay = 0.0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "tiles", "base.mbtiles")
+        port = self.server.server_address[1]
+        self.tile_cache = TileCache(
+            self.db_path, upstream=f"http://127.0.0.1:{port}/{{z}}/{{x}}/{{y}}.png"
+        )
+
+    def tearDown(self):
+        self.tile_cache.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def test_get_tile(self):
+        """
+        test fetching a missing tile once and serving it from the store
+        """
+        data, fetched = self.tile_cache.get_tile(12, 2190, 1420)
+        self.assertEqual(b"tile 12/2190/1420", data)
+        cached, cached_fetched = self.tile_cache.get_tile(12, 2190, 1420)
+        self.assertEqual(data, cached)
+        self.assertEqual(fetched, cached_fetched)
+        self.assertEqual(1, len(self.server.requests))
+        self.assertEqual((1, 1), (self.tile_cache.hits, self.tile_cache.misses))
+        # the store uses the TMS rows of the MBTiles format
+        connection = sqlite3.connect(self.db_path)
+        row = connection.execute(
+            "SELECT tile_row FROM tiles WHERE zoom_level=12 AND tile_column=2190"
+        ).fetchone()
+        connection.close()
+        self.assertEqual(4095 - 1420, row[0])
+        self.assertEqual(1420, MBTiles.tms_row(12, row[0]))
+        with self.assertRaises(IOError):
+            self.tile_cache.get_tile(15, 0, 0)
+        with self.assertRaises(ValueError):
+            self.tile_cache.get_tile(2, 4, 0)
+        validator = self.tile_cache.get_validator(data, fetched)
+        self.assertTrue(validator.immutable)
+        self.assertIn(
+            f"max-age={self.tile_cache.max_age}", validator.headers["Cache-Control"]
+        )
+
+    def test_limits(self):
+        """
+        test that tiles are only fetched on demand up to the maximum zoom and store size
+        """
+        self.assertEqual(2, self.tile_cache.workers)
+        self.tile_cache.max_zoom = 12
+        self.assertIsNone(self.tile_cache.get_tile(13, 4380, 2840))
+        self.assertIsNotNone(self.tile_cache.get_tile(12, 2190, 1420))
+        self.assertEqual(len(b"tile 12/2190/1420"), self.tile_cache.size)
+        self.tile_cache.max_bytes = self.tile_cache.size
+        self.assertIsNone(self.tile_cache.get_tile(12, 2191, 1420))
+        # stored tiles are still served
+        self.assertIsNotNone(self.tile_cache.get_tile(12, 2190, 1420))
+        self.assertEqual(1, len(self.server.requests))
+        # the size of an existing store is known on startup
+        reopened = TileCache(self.db_path)
+        self.assertEqual(self.tile_cache.size, reopened.size)
+        # replaced tiles only account for the difference
+        self.tile_cache.put_tiles([(12, 2190, 1420, b"tile"), (12, 2190, 1420, b"t")])
+        self.assertEqual(1, self.tile_cache.size)
+        self.assertEqual(self.tile_cache.store.get_size(), self.tile_cache.size)
+
+    def test_timeout(self):
+        """
+        test that a connection that timed out is closed and the request retried
+        """
+        self.tile_cache.pool.timeout = 0.1
+        self.server.delay = 0.3
+        with self.assertRaises(IOError):
+            self.tile_cache.get_tile(10, 5, 6)
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual(2, self.tile_cache.pool.created)
+        self.assertFalse(any(self.tile_cache.pool.idle.values()))
+        self.server.delay = 0.0
+        data, _fetched = self.tile_cache.get_tile(10, 5, 6)
+        self.assertEqual(b"tile 10/5/6", data)
+
+    def test_concurrent_misses(self):
+        """
+        test that concurrent requests of a missing tile fetch it once
+        """
+        self.server.delay = 0.2
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(
+                executor.map(lambda _i: self.tile_cache.get_tile(10, 5, 6), range(8))
+            )
+        self.assertEqual(1, len(self.server.requests))
+        self.assertEqual({b"tile 10/5/6"}, {data for data, _fetched in results})
+
+    def test_seed(self):
+        """
+        test seeding the tiles around a bounding box
+        """
+        bbox = BoundingBox(48.10, 11.50, 48.20, 11.70)
+        zooms = [10, 11, 12, 13, 14, 15]
+        tiles = self.tile_cache.get_seed_tiles(bbox, zooms)
+        self.assertEqual(len(tiles), len(set(tiles)))
+        stats = self.tile_cache.seed(bbox, zooms)
+        self.assertEqual(len(tiles), stats["tiles"])
+        # the stub only serves up to zoom 14
+        failed = len([tile for tile in tiles if tile[0] == 15])
+        self.assertEqual(failed, stats["failed"])
+        self.assertEqual(len(tiles) - failed, stats["fetched"])
+        self.assertEqual(stats["fetched"], self.tile_cache.store.count())
+        # the keep-alive connections are reused
+        self.assertLessEqual(len(self.server.connections), self.tile_cache.workers + 1)
+        requests = len(self.server.requests)
+        again = self.tile_cache.seed(bbox, zooms[:-1])
+        self.assertEqual(0, again["fetched"])
+        self.assertEqual(again["tiles"], again["cached"])
+        self.assertEqual(requests, len(self.server.requests))
+        self.tile_cache.max_seed_tiles = 10
+        with self.assertRaises(ValueError):
+            self.tile_cache.seed(bbox, zooms)
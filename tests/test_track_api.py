@@ -0,0 +1,138 @@
+"""
+Created on 2025-01-02
+
+@author: wf
+"""
+
+import asyncio
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from fastapi import HTTPException
+from ngwidgets.basetest import Basetest
+
+from nicetrack.track_api import TrackApi
+from nicetrack.track_cache import Track, TrackCache
+
+
+class TestTrackApi(Basetest):
+    """
+    test the columnar track api
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        examples = Path(__file__).parent.parent / "nicetrack_examples"
+        self.gpx_path = os.path.join(self.tmpdir.name, "149759.gpx")
+        shutil.copy(examples / "gpx" / "149759.gpx", self.gpx_path)
+        self.cache = TrackCache(sidecars=False)
+        self.api = TrackApi(self.cache)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def get(self, **kwargs):
+        return asyncio.run(self.api.get_response(self.gpx_path, **kwargs))
+
+    def test_formats(self):
+        """
+        test the json, bin and npz formats
+        """
+        track = Track.from_file(self.gpx_path)
+        response = self.get(accept_encoding="gzip, deflate", columns="lat,lon")
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        data = json.loads(gzip.decompress(response.body))
+        self.assertEqual(2334, data["count"])
+        self.assertEqual(["lat", "lon"], list(data["columns"]))
+        self.assertEqual(track.lat.tolist(), data["columns"]["lat"])
+        # no timestamps - NaN becomes null
+        response = self.get(columns="elapsed", stop=2)
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual([None, None], json.loads(response.body)["columns"]["elapsed"])
+        response = self.get(track_format="bin", columns="lat,lon,distance")
+        self.assertEqual("lat,lon,distance", response.headers["X-Track-Columns"])
+        self.assertEqual("2334", response.headers["X-Track-Count"])
+        columns = np.frombuffer(response.body, dtype="<f8").reshape(3, -1)
+        np.testing.assert_array_equal(track.distance, columns[2])
+        response = self.get(track_format="npz")
+        with np.load(io.BytesIO(response.body)) as npz:
+            self.assertEqual(set(Track.columns), set(npz.files))
+            np.testing.assert_array_equal(track.lon, npz["lon"])
+        if self.debug:
+            for fmt in ["json", "bin", "npz"]:
+                size = len(self.get(track_format=fmt, accept_encoding="gzip").body)
+                print(f"{fmt}: {size} bytes")
+        # parsed only once
+        self.assertEqual(1, self.cache.misses)
+
+    def test_select(self):
+        """
+        test slicing and simplification
+        """
+        track = Track.from_file(self.gpx_path)
+        selected = TrackApi.select(track, start=10, stop=20, step=3, columns=["lat"])
+        np.testing.assert_array_equal(track.lat[10:20:3], selected["lat"])
+        simplified = TrackApi.select(track, tolerance=10.0)
+        count = len(simplified["lat"])
+        if self.debug:
+            print(f"simplified {len(track)} to {count} points with 10 m tolerance")
+        self.assertLess(count, len(track) / 2)
+        self.assertEqual(track.lat[0], simplified["lat"][0])
+        self.assertEqual(track.lat[-1], simplified["lat"][-1])
+        # a straight line keeps only its ends
+        line = Track.from_columns(
+            "line", np.linspace(48, 49, 100), np.full(100, 8.0), *[np.zeros(100)] * 2
+        )
+        self.assertEqual([0, 99], line.get_simplified_indices(1.0).tolist())
+        for kwargs in [{"columns": ["speed"]}, {"step": 0}]:
+            with self.assertRaises(ValueError):
+                TrackApi.select(track, **kwargs)
+        for kwargs in [{"track_format": "xml"}, {"step": 0}]:
+            with self.assertRaises(HTTPException) as context:
+                self.get(**kwargs)
+            self.assertEqual(400, context.exception.status_code)
+
+    def test_stats(self):
+        """
+        test the statistics
+        """
+        gpx_path = os.path.join(self.tmpdir.name, "timed.gpx")
+        with open(gpx_path, "w") as gpx_file:
+            gpx_file.write("""<?xml version="1.0"?>
+<gpx version="1.1" creator="test"><trk><trkseg>
+<trkpt lat="48.0" lon="8.0"><ele>500</ele><time>2023-08-15T09:18:00Z</time></trkpt>
+<trkpt lat="48.01" lon="8.0"><ele>520</ele><time>2023-08-15T09:20:00Z</time></trkpt>
+<trkpt lat="48.02" lon="8.0"><ele>510</ele><time>2023-08-15T09:22:00Z</time></trkpt>
+</trkseg></trk></gpx>""")
+        response = asyncio.run(self.api.get_stats_response(gpx_path))
+        stats = json.loads(response.body)
+        if self.debug:
+            print(json.dumps(stats, indent=2))
+        self.assertEqual(3, stats["count"])
+        self.assertAlmostEqual(2.224, stats["distance_km"], places=3)
+        self.assertEqual(240.0, stats["duration_s"])
+        self.assertEqual("2023-08-15T09:18:00+00:00", stats["start"])
+        self.assertEqual(
+            {"min": 500, "max": 520, "gain": 20, "loss": 10}, stats["elevation"]
+        )
+        self.assertAlmostEqual(33.36, stats["speed_kmh"]["avg"], places=2)
+        response = asyncio.run(
+            self.api.get_stats_response(gpx_path, accept_encoding="gzip")
+        )
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertEqual(stats, json.loads(gzip.decompress(response.body)))
+        # a conditional request is answered without parsing
+        etag = response.headers["ETag"]
+        response = asyncio.run(
+            self.api.get_stats_response(gpx_path, if_none_match=etag)
+        )
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(1, self.cache.misses)
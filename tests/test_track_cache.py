@@ -0,0 +1,190 @@
+"""
+Created on 2024-12-28
+
+@author: wf
+"""
+
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from ngwidgets.basetest import Basetest
+
+from nicetrack.geo import GeoPath
+from nicetrack.srt import SRT
+from nicetrack.track_cache import Track, TrackCache
+
+
+class TestTrackCache(Basetest):
+    """
+    test the shared parsed track cache
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        examples = Path(__file__).parent.parent / "nicetrack_examples"
+        self.gpx_path = str(examples / "gpx" / "149759.gpx")
+        self.parses = 0
+        self.parse_lock = threading.Lock()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def parse(self, source: str) -> Track:
+        """
+        parse the given gpx file counting the calls
+        """
+        with self.parse_lock:
+            self.parses += 1
+        with open(source) as gpx_file:
+            geo_path = GeoPath.from_gpx(gpx_file.read())
+        return Track.from_geopath(geo_path, name=os.path.basename(source))
+
+    def test_track(self):
+        """
+        test the columns, derived indexes and the GeoPath round trip
+        """
+        track = self.parse(self.gpx_path)
+        self.assertEqual(2334, len(track))
+        # the example has no timestamps
+        self.assertTrue(np.isnan(track.elapsed).all())
+        self.assertFalse(track.lat.flags.writeable)
+        geo_path = track.as_geopath()
+        with open(self.gpx_path) as gpx_file:
+            expected = GeoPath.from_gpx(gpx_file.read())
+        self.assertAlmostEqual(expected.total_distance(), track.distance[-1], places=6)
+        for index in [0, 1000, 2333]:
+            self.assertEqual(expected.path[index], geo_path.path[index])
+            self.assertEqual(expected.path[index], track.get_trackpoint(index))
+        with self.assertRaises(ValueError):
+            track.get_trackpoint(2334)
+        # timezone aware GPX timestamps
+        gpx_path = GeoPath.from_gpx("""<?xml version="1.0"?>
+<gpx version="1.1" creator="test"><trk><trkseg>
+<trkpt lat="48.0" lon="8.0"><ele>500.5</ele><time>2023-08-15T09:18:24.500Z</time></trkpt>
+<trkpt lat="48.001" lon="8.0"><time>2023-08-15T09:18:34Z</time></trkpt>
+</trkseg></trk></gpx>""")
+        gpx_track = Track.from_geopath(gpx_path)
+        self.assertTrue(gpx_track.timestamp_aware)
+        self.assertEqual([0.0, 9.5], gpx_track.elapsed.tolist())
+        self.assertEqual(gpx_path.path, gpx_track.as_geopath().path)
+        self.assertEqual(gpx_path.path[1], gpx_track.get_trackpoint(1))
+        # naive SRT timestamps
+        srt = SRT.from_text("""1
+00:00:00,000 --> 00:00:00,033
+<font size="28">SrtCnt : 1, DiffTime : 33ms
+2023-08-15 09:18:24.589
+[iso : 200] [latitude: 48.486375] [longitude: 8.375567] [rel_alt: 0.000 abs_alt: 530.095] </font>
+""")
+        srt_path = srt.as_geopath()
+        srt_track = Track.from_geopath(srt_path)
+        self.assertFalse(srt_track.timestamp_aware)
+        self.assertEqual(srt_path.path[0], srt_track.as_geopath().path[0])
+        self.assertEqual(srt_path.path[0], srt_track.get_trackpoint(0))
+
+    def test_indices(self):
+        """
+        test thinning out the indices of a track for a coarse preview
+        """
+        geo_path = GeoPath()
+        for i in range(1001):
+            geo_path.add_point(48.0 + i * 0.001, 8.0)
+        track = Track.from_geopath(geo_path)
+        self.assertEqual(1001, len(track.get_indices()))
+        preview = track.get_indices(max_points=100)
+        self.assertLessEqual(len(preview), 101)
+        self.assertEqual(0, preview[0])
+        self.assertEqual(1000, preview[-1])
+        self.assertEqual(501, len(track.get_indices(max_points=1000)))
+
+    def test_cache(self):
+        """
+        test that concurrent sessions share a single parse
+        """
+        cache = TrackCache(sidecars=False)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            tracks = list(
+                executor.map(
+                    lambda _i: cache.get_track(self.gpx_path, self.parse), range(8)
+                )
+            )
+        elapsed = time.perf_counter() - start
+        self.assertEqual(1, self.parses)
+        self.assertTrue(all(track is tracks[0] for track in tracks))
+        self.assertEqual(7, cache.hits)
+        start = time.perf_counter()
+        cache.get_track(self.gpx_path, self.parse)
+        cached = time.perf_counter() - start
+        if self.debug:
+            print(f"parse: {elapsed * 1000:.1f} ms cached: {cached * 1000:.3f} ms")
+        # a changed file is parsed again
+        later = time.time() + 10
+        copy_path = os.path.join(self.tmpdir.name, "copy.gpx")
+        with open(self.gpx_path) as src, open(copy_path, "w") as dst:
+            dst.write(src.read())
+        cache.get_track(copy_path, self.parse)
+        os.utime(copy_path, (later, later))
+        cache.get_track(copy_path, self.parse)
+        self.assertEqual(3, self.parses)
+
+    def test_url_without_validator(self):
+        """
+        test that a url whose validator can't be fetched is parsed uncached
+        """
+        cache = TrackCache(sidecars=False)
+        # nothing listens on the discard port
+        url = "http://127.0.0.1:9/149759.gpx"
+        self.assertIsNone(cache.get_key(url))
+        track = cache.get_track(url, lambda _source: self.parse(self.gpx_path))
+        self.assertGreater(len(track), 0)
+        cache.get_track(url, lambda _source: self.parse(self.gpx_path))
+        self.assertEqual(2, self.parses)
+
+    def test_eviction(self):
+        """
+        test the eviction by memory budget
+        """
+        tracks = [Track.from_columns(f"t{i}", *[np.zeros(1000)] * 4) for i in range(3)]
+        cache = TrackCache(max_bytes=int(tracks[0].nbytes * 2.5))
+        for i, track in enumerate(tracks):
+            cache.put(f"k{i}", track)
+        self.assertIsNone(cache.get("k0"))
+        self.assertIs(tracks[2], cache.get("k2"))
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+    def test_disk_tier(self):
+        """
+        test that the disk tier survives a restart
+        """
+        cache_dir = os.path.join(self.tmpdir.name, "tracks")
+        cache = TrackCache(cache_dir=cache_dir, sidecars=False)
+        track = cache.get_track(self.gpx_path, self.parse)
+        restarted = TrackCache(cache_dir=cache_dir, sidecars=False)
+        loaded = restarted.get_track(self.gpx_path, self.parse)
+        self.assertEqual(1, self.parses)
+        self.assertEqual(1, restarted.disk_hits)
+        self.assertEqual(track.name, loaded.name)
+        for column in Track.columns:
+            np.testing.assert_array_equal(
+                getattr(track, column), getattr(loaded, column)
+            )
+        self.assertEqual(track.as_geopath().path[100], loaded.as_geopath().path[100])
+        # a corrupt column in the disk tier is a cache miss
+        disk_path = restarted.get_disk_path(restarted.get_key(self.gpx_path))
+        size = os.path.getsize(disk_path)
+        with open(disk_path, "r+b") as disk_file:
+            disk_file.seek(size // 2)
+            byte = disk_file.read(1)
+            disk_file.seek(size // 2)
+            disk_file.write(bytes([byte[0] ^ 0xFF]))
+        corrupt = TrackCache(cache_dir=cache_dir, sidecars=False)
+        corrupt.get_track(self.gpx_path, self.parse)
+        self.assertEqual(2, self.parses)
+        self.assertEqual(0, corrupt.disk_hits)
@@ -0,0 +1,190 @@
+"""
+Created on 2024-12-29
+
+@author: wf
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from ngwidgets.basetest import Basetest
+
+from nicetrack.geo import GeoPath
+from nicetrack.srt import SRT
+from nicetrack.track_cache import Track, TrackCache
+from nicetrack.track_file import TrackFile, TrackFileError
+
+
+class TestTrackFile(Basetest):
+    """
+    test the binary track file format
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        examples = Path(__file__).parent.parent / "nicetrack_examples"
+        # work on a copy so that no sidecar is written next to the examples
+        self.gpx_path = os.path.join(self.tmpdir.name, "149759.gpx")
+        shutil.copy(examples / "gpx" / "149759.gpx", self.gpx_path)
+        self.parses = 0
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def parse(self, source: str) -> Track:
+        """
+        parse the given gpx file counting the calls
+        """
+        self.parses += 1
+        with open(source) as gpx_file:
+            geo_path = GeoPath.from_gpx(gpx_file.read())
+        return Track.from_geopath(geo_path, name=os.path.basename(source))
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_roundtrip(self):
+        """
+        test writing and memory mapping a track with telemetry columns
+        """
+        srt = SRT.from_text("""1
+00:00:00,000 --> 00:00:00,033
+<font size="28">SrtCnt : 1, DiffTime : 33ms
+2023-08-15 09:18:24.589
+[iso : 200] [shutter : 1/180.0] [fnum : 170] [ev : 1.3] [latitude: 48.486375] [longitude: 8.375567] [rel_alt: 1.500 abs_alt: 530.095] </font>
+
+2
+00:00:00,033 --> 00:00:00,066
+<font size="28">SrtCnt : 2, DiffTime : 33ms
+2023-08-15 09:18:24.622
+[iso : 400] [shutter : 1/250.0] [fnum : 170] [ev : 0] [latitude: 48.486384] [longitude: 8.375567] [rel_alt: 1.600 abs_alt: 530.195] </font>
+""")
+        track = Track.from_srt(srt, name="flight.srt")
+        self.assertEqual([200.0, 400.0], track.telemetry["iso"].tolist())
+        self.assertAlmostEqual(1 / 180, track.telemetry["shutter"][0])
+        self.assertAlmostEqual(0.033, track.elapsed[1], places=6)
+        path = self.get_path("flight.ntrk")
+        track.save(path)
+        loaded = Track.load(path, verify=True)
+        self.assertIsInstance(loaded.lat.base, np.memmap)
+        self.assertFalse(loaded.lat.flags.writeable)
+        self.assertEqual("flight.srt", loaded.name)
+        self.assertFalse(loaded.timestamp_aware)
+        for column, array in track.get_columns().items():
+            np.testing.assert_array_equal(array, loaded.get_columns()[column])
+        self.assertEqual(track.as_geopath().path, loaded.as_geopath().path)
+        # an empty track
+        empty_path = self.get_path("empty.ntrk")
+        Track.from_columns("empty", [], [], [], []).save(empty_path)
+        self.assertEqual(0, len(Track.load(empty_path)))
+
+    def test_integrity(self):
+        """
+        test that invalid, corrupt and truncated track files are rejected
+        """
+        path = self.get_path("track.ntrk")
+        self.parse(self.gpx_path).save(path)
+        with open(path, "rb") as track_file:
+            data = bytearray(track_file.read())
+        cases = {
+            "magic": lambda d: d.__setitem__(slice(0, 4), b"XXXX"),
+            "version": lambda d: d.__setitem__(slice(4, 6), b"\x09\x00"),
+            "header": lambda d: d.__setitem__(20, d[20] ^ 0xFF),
+            "truncated": lambda d: d.__delitem__(slice(len(d) - 100, None)),
+        }
+        for case, damage in cases.items():
+            damaged = bytearray(data)
+            damage(damaged)
+            damaged_path = self.get_path(f"{case}.ntrk")
+            with open(damaged_path, "wb") as damaged_file:
+                damaged_file.write(damaged)
+            with self.assertRaises(TrackFileError, msg=case):
+                Track.load(damaged_path)
+        # a flipped bit in a column is only found when verifying
+        damaged = bytearray(data)
+        damaged[len(damaged) // 2] ^= 0xFF
+        damaged_path = self.get_path("column.ntrk")
+        with open(damaged_path, "wb") as damaged_file:
+            damaged_file.write(damaged)
+        Track.load(damaged_path)
+        with self.assertRaises(TrackFileError):
+            Track.load(damaged_path, verify=True)
+
+    def test_sidecar(self):
+        """
+        test that the sidecar is written after the first parse and
+        ignored when it is stale or corrupt
+        """
+        sidecar_path = TrackFile.get_sidecar_path(self.gpx_path)
+        # sidecars are opt-in
+        TrackCache().get_track(self.gpx_path, self.parse)
+        self.assertFalse(os.path.exists(sidecar_path))
+        self.parses = 0
+        track = TrackCache(sidecars=True).get_track(self.gpx_path, self.parse)
+        self.assertTrue(os.path.exists(sidecar_path))
+        # a restart maps the sidecar instead of parsing
+        cache = TrackCache(sidecars=True)
+        loaded = cache.get_track(self.gpx_path, self.parse)
+        self.assertEqual(1, self.parses)
+        self.assertEqual(1, cache.sidecar_hits)
+        np.testing.assert_array_equal(track.distance, loaded.distance)
+        # a changed source makes the sidecar stale
+        later = time.time() + 10
+        os.utime(self.gpx_path, (later, later))
+        TrackCache(sidecars=True).get_track(self.gpx_path, self.parse)
+        self.assertEqual(2, self.parses)
+        # the rewritten sidecar is current again
+        TrackCache(sidecars=True).get_track(self.gpx_path, self.parse)
+        self.assertEqual(2, self.parses)
+        # a corrupt sidecar is parsed again
+        with open(sidecar_path, "r+b") as sidecar_file:
+            sidecar_file.write(b"XXXX")
+        TrackCache(sidecars=True).get_track(self.gpx_path, self.parse)
+        self.assertEqual(3, self.parses)
+        # a corrupt column is found on the first load
+        size = os.path.getsize(sidecar_path)
+        with open(sidecar_path, "r+b") as sidecar_file:
+            sidecar_file.seek(size // 2)
+            byte = sidecar_file.read(1)
+            sidecar_file.seek(size // 2)
+            sidecar_file.write(bytes([byte[0] ^ 0xFF]))
+        cache = TrackCache(sidecars=True)
+        cache.get_track(self.gpx_path, self.parse)
+        self.assertEqual(4, self.parses)
+        self.assertEqual(0, cache.sidecar_hits)
+
+    def test_large_track(self):
+        """
+        test that loading a 1M point track is only a page-in
+        """
+        count = 1_000_000
+        t = np.arange(count, dtype=np.float64)
+        track = Track.from_columns(
+            "large",
+            lat=48.0 + t * 1e-6,
+            lon=8.0 + t * 1e-6,
+            elevation=np.full(count, 500.0),
+            timestamp=1.7e9 + t,
+            timestamp_aware=True,
+        )
+        path = self.get_path("large.ntrk")
+        start = time.perf_counter()
+        track.save(path)
+        saved = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = Track.load(path)
+        load_time = time.perf_counter() - start
+        if self.debug:
+            print(
+                f"1M points: {os.path.getsize(path) / 1024**2:.1f} MB save: {saved * 1000:.1f} ms load: {load_time * 1000:.3f} ms"
+            )
+        self.assertEqual(count, len(loaded))
+        self.assertEqual(track.distance[-1], loaded.distance[-1])
+        # the columns are mapped not read
+        self.assertLess(load_time, 0.1)
@@ -0,0 +1,138 @@
+"""
+Created on 2024-12-30
+
+@author: wf
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+from ngwidgets.basetest import Basetest
+
+from nicetrack.stepper_benchmark import StepperBenchmark
+from nicetrack.update_scheduler import LatestRequests, UpdateScheduler
+from nicetrack.video_stepper_base import VideoStepperBase
+
+
+class TestUpdateScheduler(Basetest):
+    """
+    test coalescing and throttling of slider updates
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+
+    def test_coalesce(self):
+        """
+        test that a drag across 10k positions only applies a few updates
+        ending with the latest position
+        """
+        applied = []
+
+        async def drag():
+            scheduler = UpdateScheduler(applied.append, max_rate=20)
+            start = time.perf_counter()
+            for index in range(10000):
+                scheduler.submit(index)
+                if index % 500 == 0:
+                    # the browser sends the values spread over the drag
+                    await asyncio.sleep(0.01)
+            await scheduler.flush()
+            return scheduler, time.perf_counter() - start
+
+        scheduler, elapsed = asyncio.run(drag())
+        if self.debug:
+            print(
+                f"applied {scheduler.applied} of {scheduler.submitted} in {elapsed:.2f} s"
+            )
+        self.assertEqual(9999, applied[-1])
+        self.assertEqual(applied, sorted(applied))
+        self.assertEqual(10000, scheduler.submitted)
+        self.assertEqual(len(applied), scheduler.applied)
+        self.assertEqual(10000 - len(applied), scheduler.coalesced)
+        # at most 20 updates per second plus the first one
+        self.assertLessEqual(len(applied), int(elapsed * 20) + 2)
+
+    def test_async_apply(self):
+        """
+        test an async apply function and the exception handler
+        """
+        applied = []
+        errors = []
+
+        async def apply(value):
+            await asyncio.sleep(0.01)
+            if value < 0:
+                raise ValueError(value)
+            applied.append(value)
+
+        async def check():
+            scheduler = UpdateScheduler(
+                apply, max_rate=0, handle_exception=errors.append
+            )
+            scheduler.submit(-1)
+            await scheduler.flush()
+            scheduler.submit(1)
+            # submitted while the first value is applied
+            await asyncio.sleep(0.001)
+            scheduler.submit(2)
+            scheduler.submit(3)
+            await scheduler.flush()
+            scheduler.submit(4)
+            scheduler.cancel()
+
+        asyncio.run(check())
+        self.assertEqual([1, 3], applied)
+        self.assertEqual(1, len(errors))
+
+    def test_latest_requests(self):
+        """
+        test that superseded requests are detected per key
+        """
+        requests = LatestRequests()
+        first = requests.start("a")
+        other = requests.start("b")
+        second = requests.start("a")
+        self.assertTrue(requests.is_superseded("a", first))
+        self.assertFalse(requests.is_superseded("a", second))
+        self.assertFalse(requests.is_superseded("b", other))
+        requests.finish("a", first)
+        requests.finish("a", second)
+        requests.finish("b", other)
+        self.assertEqual({}, requests.latest)
+        self.assertEqual(1, requests.dropped)
+
+    def test_superseded_frame(self):
+        """
+        test that frame requests that are superseded while waiting for the decoder are dropped
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            video_path = os.path.join(tmpdir, "clip.mp4")
+            StepperBenchmark.create_clip(video_path, width=320, height=180, frames=60)
+            stepper = VideoStepperBase.create("av", video_path)
+            requests = LatestRequests()
+
+            async def request(frame_index: int):
+                ticket = requests.start("view")
+                try:
+                    response = await stepper.stream_image(
+                        frame_index,
+                        is_superseded=lambda: requests.is_superseded("view", ticket),
+                    )
+                finally:
+                    requests.finish("view", ticket)
+                return response.status_code
+
+            async def drag():
+                return await asyncio.gather(*[request(i) for i in range(0, 60, 6)])
+
+            statuses = asyncio.run(drag())
+            stepper.close()
+        if self.debug:
+            print(statuses)
+        # the first request got the decoder, the last one is the frame the view wants
+        self.assertEqual(200, statuses[0])
+        self.assertEqual(200, statuses[-1])
+        self.assertEqual([204] * 8, statuses[1:-1])
@@ -0,0 +1,209 @@
+"""
+Created on 2025-01-08
+
+@author: wf
+"""
+
+import gzip
+import json
+import shutil
+import subprocess
+import unittest
+
+import numpy as np
+from ngwidgets.basetest import Basetest
+
+from nicetrack.track_cache import Track
+from nicetrack.vector_tiles import MvtEncoder, Protobuf, VectorTiles
+from nicetrack.web_mercator import WebMercator
+
+
+class TestVectorTiles(Basetest):
+    """
+    test the Mapbox Vector Tiles of the paths of loaded tracks
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        # a wiggly line of 100000 points from Munich to the east
+        n = 100000
+        t = np.linspace(0.0, 1.0, n)
+        lat = 48.1 + 0.01 * np.sin(t * 400)
+        lon = 11.5 + 0.5 * t
+        self.track = Track.from_columns(
+            "wiggle", lat, lon, np.full(n, np.nan), np.full(n, np.nan)
+        )
+        self.vector_tiles = VectorTiles()
+        self.track_id = self.vector_tiles.register(self.track, "/tmp/wiggle.gpx")
+
+    def read_varint(self, data: bytes, offset: int):
+        value = 0
+        shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                return value, offset
+
+    def read_fields(self, data: bytes) -> list:
+        """
+        decode the fields of a protobuf message as (number, value) tuples
+        """
+        fields = []
+        offset = 0
+        while offset < len(data):
+            key, offset = self.read_varint(data, offset)
+            number, wire_type = key >> 3, key & 0x7
+            if wire_type == Protobuf.VARINT:
+                value, offset = self.read_varint(data, offset)
+            else:
+                self.assertEqual(Protobuf.LENGTH_DELIMITED, wire_type)
+                length, offset = self.read_varint(data, offset)
+                value = data[offset : offset + length]
+                offset += length
+            fields.append((number, value))
+        return fields
+
+    def read_packed(self, data: bytes) -> list:
+        values = []
+        offset = 0
+        while offset < len(data):
+            value, offset = self.read_varint(data, offset)
+            values.append(value)
+        return values
+
+    def decode_lines(self, tile: bytes) -> list:
+        """
+        decode the lines of the track layer of the given tile
+
+        Returns:
+            list: the lines as lists of x, y tile coordinates
+        """
+        lines = []
+        for number, layer in self.read_fields(tile):
+            self.assertEqual(3, number)
+            layer_fields = dict(self.read_fields(layer))
+            self.assertEqual(b"track", layer_fields[1])
+            self.assertEqual(2, layer_fields[15])
+            self.assertEqual(4096, layer_fields[5])
+            for number, feature in self.read_fields(layer):
+                if number != 2:
+                    continue
+                feature_fields = dict(self.read_fields(feature))
+                self.assertEqual(MvtEncoder.LINESTRING, feature_fields[3])
+                commands = self.read_packed(feature_fields[4])
+                x = y = 0
+                i = 0
+                while i < len(commands):
+                    command_id, count = commands[i] & 0x7, commands[i] >> 3
+                    i += 1
+                    if command_id == MvtEncoder.MOVE_TO:
+                        lines.append([])
+                    for _ in range(count):
+                        dx, dy = commands[i], commands[i + 1]
+                        x += (dx >> 1) ^ -(dx & 1)
+                        y += (dy >> 1) ^ -(dy & 1)
+                        lines[-1].append((x, y))
+                        i += 2
+        return lines
+
+    def get_lines(self, z: int, lat: float, lon: float) -> list:
+        x, y = WebMercator.get_tile(lat, lon, z)
+        return self.decode_lines(self.vector_tiles.get_tile(self.track_id, z, x, y))
+
+    def test_protobuf(self):
+        """
+        test the varint and zigzag encoding
+        """
+        values = np.array([0, 1, 127, 128, 300, 2**35 + 5], dtype=np.uint64)
+        encoded = Protobuf.varints(values)
+        self.assertEqual(b"".join(Protobuf.varint(int(v)) for v in values), encoded)
+        self.assertEqual([int(v) for v in values], self.read_packed(encoded))
+        self.assertEqual([0, 1, 2, 3, 4], list(Protobuf.zigzag([0, -1, 1, -2, 2])))
+
+    def test_clip(self):
+        """
+        test clipping a line to a square
+        """
+        px = np.array([-10.0, 5.0, 20.0, 5.0])
+        py = np.array([5.0, 5.0, 5.0, 5.0])
+        parts = VectorTiles.clip(px, py, 0.0, 10.0)
+        self.assertEqual(2, len(parts))
+        self.assertEqual([[0.0, 5.0], [5.0, 5.0], [10.0, 5.0]], parts[0].tolist())
+        self.assertEqual([[10.0, 5.0], [5.0, 5.0]], parts[1].tolist())
+        self.assertEqual([], VectorTiles.clip(px, py + 20, 0.0, 10.0))
+
+    def test_tiles(self):
+        """
+        test the clipped and simplified tiles
+        """
+        lines = self.get_lines(14, 48.1, 11.75)
+        self.assertTrue(lines)
+        low = -self.vector_tiles.buffer
+        high = self.vector_tiles.extent + self.vector_tiles.buffer
+        for line in lines:
+            self.assertGreaterEqual(len(line), 2)
+            for x, y in line:
+                self.assertTrue(low <= x <= high and low <= y <= high)
+        # a low zoom level needs far fewer points than the track has
+        overview = self.get_lines(6, 48.1, 11.75)
+        points = sum(len(line) for line in overview)
+        self.assertGreater(points, 10)
+        self.assertLess(points, len(self.track) // 10)
+        # far away from the track
+        x, y = WebMercator.get_tile(60.0, 30.0, 10)
+        self.assertEqual(b"", self.vector_tiles.get_tile(self.track_id, 10, x, y))
+        with self.assertRaises(ValueError):
+            self.vector_tiles.get_tile(self.track_id, 2, 4, 0)
+        self.assertIsNone(self.vector_tiles.get_tile("unknown", 0, 0, 0))
+
+    def test_cache(self):
+        """
+        test the tile cache and the validators of reloaded tracks
+        """
+        x, y = WebMercator.get_tile(48.1, 11.75, 12)
+        tile = self.vector_tiles.get_tile(self.track_id, 12, x, y)
+        self.assertIs(tile, self.vector_tiles.get_tile(self.track_id, 12, x, y))
+        self.assertEqual(1, self.vector_tiles.hits)
+        track_tiles = self.vector_tiles.get_track_tiles(self.track_id)
+        validator = self.vector_tiles.get_validator(track_tiles, 12, x, y)
+        # registering the same track again keeps its tiles
+        self.vector_tiles.register(self.track, "/tmp/wiggle.gpx")
+        self.assertIs(track_tiles, self.vector_tiles.get_track_tiles(self.track_id))
+        # a reloaded track under the same id changes the validators
+        reloaded = Track.from_columns(
+            "wiggle",
+            self.track.lat,
+            self.track.lon,
+            self.track.elevation,
+            self.track.timestamp,
+        )
+        self.assertEqual(
+            self.track_id, self.vector_tiles.register(reloaded, "/tmp/wiggle.gpx")
+        )
+        track_tiles = self.vector_tiles.get_track_tiles(self.track_id)
+        changed = self.vector_tiles.get_validator(track_tiles, 12, x, y)
+        self.assertNotEqual(validator.etag, changed.etag)
+        content, headers = VectorTiles.compress(tile, "gzip, deflate")
+        self.assertEqual("gzip", headers["Content-Encoding"])
+        self.assertEqual(tile, gzip.decompress(content))
+
+    @unittest.skipUnless(shutil.which("node"), "node is not installed")
+    def test_renderer(self):
+        """
+        test that the browser side renderer decodes the lines of a tile
+        """
+        x, y = WebMercator.get_tile(48.1, 11.75, 14)
+        tile = self.vector_tiles.get_tile(self.track_id, 14, x, y)
+        script = f"""
+const {{ decodeLines }} = require({json.dumps(VectorTiles.script_path)});
+const bytes = Uint8Array.from({json.dumps(list(tile))});
+console.log(JSON.stringify(decodeLines(bytes, 4096)));
+"""
+        result = subprocess.run(
+            ["node", "-e", script], capture_output=True, text=True, check=True
+        )
+        lines = [[tuple(p) for p in line] for line in json.loads(result.stdout)]
+        self.assertEqual(self.decode_lines(tile), lines)
@@ -0,0 +1,125 @@
+"""
+Created on 2024-12-23
+
+@author: wf
+"""
+
+import asyncio
+import os
+import tempfile
+from unittest.mock import patch
+
+from ngwidgets.basetest import Basetest
+
+from nicetrack.stepper_benchmark import StepperBenchmark
+from nicetrack.video_broadcast import BroadcastHub
+from nicetrack.video_stream import JpegReader
+
+
+class TestVideoBroadcast(Basetest):
+    """
+    test sharing one decode pipeline between viewers
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.video_path = os.path.join(self.tmpdir.name, "broadcast.mp4")
+        StepperBenchmark.create_clip(self.video_path, width=320, height=180, frames=30)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    async def watch(self, frame_gen, frames: int) -> int:
+        """
+        watch the given number of frames of the given feed
+        """
+        count = 0
+        async for _part in frame_gen:
+            count += 1
+            if count >= frames:
+                break
+        await frame_gen.aclose()
+        return count
+
+    def test_shared_pipeline(self):
+        """
+        test that concurrent viewers share one reader and the producer stops with the last viewer
+        """
+        readers = []
+        original_init = JpegReader.__init__
+
+        def counting_init(reader, *args, **kwargs):
+            readers.append(reader)
+            original_init(reader, *args, **kwargs)
+
+        async def check():
+            hub = BroadcastHub()
+            broadcast = hub.get_broadcast(self.video_path, fps=30, width=160)
+            self.assertIs(
+                broadcast, hub.get_broadcast(self.video_path, fps=30, width=160)
+            )
+            self.assertIsNot(broadcast, hub.get_broadcast(self.video_path, fps=15))
+            hub.broadcasts.clear()
+            broadcast = hub.get_broadcast(self.video_path, fps=30, width=160)
+            viewers = [broadcast.generate_frames() for _ in range(5)]
+            counts = await asyncio.gather(*[self.watch(v, 5) for v in viewers])
+            self.assertEqual([5] * 5, counts)
+            # the last viewer has left - the producer is shut down
+            await asyncio.sleep(0.05)
+            self.assertTrue(broadcast.task.done())
+            self.assertEqual({}, hub.broadcasts)
+
+        with patch.object(JpegReader, "__init__", counting_init):
+            asyncio.run(check())
+        self.assertEqual(1, len(readers))
+        self.assertIsNone(readers[0].cap)
+
+    def test_late_joiner(self):
+        """
+        test that a late joiner starts with the current frame of a running broadcast
+        """
+
+        async def check():
+            hub = BroadcastHub()
+            broadcast = hub.get_broadcast(self.video_path, fps=30)
+            first = broadcast.generate_frames()
+            await first.__anext__()
+            await asyncio.sleep(0.2)
+            late = broadcast.subscribe()
+            current = await late.get()
+            self.assertEqual(broadcast.current, current)
+            self.assertGreater(broadcast.frames, 1)
+            broadcast.unsubscribe(late)
+            await first.aclose()
+            self.assertEqual({}, hub.broadcasts)
+
+        asyncio.run(check())
+
+    def test_ended(self):
+        """
+        test that a viewer of a broadcast that has ended is not left waiting
+        and that a feed only starts a broadcast when it is sent
+        """
+
+        async def check():
+            hub = BroadcastHub()
+            await hub.video_feed(self.video_path, fps=300)
+            self.assertEqual({}, hub.broadcasts)
+            broadcast = hub.get_broadcast(self.video_path, fps=300)
+            count = await self.watch(broadcast.generate_frames(), 100)
+            # the feed ends with the video - frames that are late may be skipped
+            self.assertGreater(count, 0)
+            self.assertLessEqual(count, broadcast.frames)
+            self.assertTrue(broadcast.closed)
+            # a viewer that picked the broadcast before it ended
+            late = broadcast.subscribe()
+            self.assertEqual(broadcast.current, await late.get())
+            self.assertIsNone(await asyncio.wait_for(late.get(), 1.0))
+            # a new viewer gets a new broadcast
+            frame_gen = hub.generate_frames(self.video_path, fps=300)
+            self.assertEqual(5, await self.watch(frame_gen, 5))
+            self.assertEqual({}, hub.broadcasts)
+
+        asyncio.run(check())
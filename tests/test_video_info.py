@@ -0,0 +1,132 @@
+"""
+Created on 2024-12-31
+
+@author: wf
+"""
+
+import os
+import tempfile
+from fractions import Fraction
+
+import av
+import numpy as np
+from ngwidgets.basetest import Basetest
+
+from nicetrack.stepper_benchmark import StepperBenchmark
+from nicetrack.video_info import VideoInfo
+from nicetrack.video_stepper_base import VideoStepperBase
+
+
+class TestVideoInfo(Basetest):
+    """
+    test the video timing and the track to frame mapping
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def create_clip(self, name: str, fps, frames: int = 48) -> str:
+        video_path = os.path.join(self.tmpdir.name, name)
+        StepperBenchmark.create_clip(
+            video_path, width=320, height=180, frames=frames, fps=fps, gop=12
+        )
+        return video_path
+
+    def shift_clip(self, video_path: str, seconds: float) -> str:
+        """
+        remux the given clip so that its first frame starts at the given offset
+        """
+        shifted_path = video_path.replace(".mp4", "_shifted.mp4")
+        with av.open(video_path) as source, av.open(shifted_path, "w") as output:
+            in_stream = source.streams.video[0]
+            out_stream = output.add_stream_from_template(in_stream)
+            offset = round(seconds / in_stream.time_base)
+            for packet in source.demux(in_stream):
+                if packet.dts is None:
+                    continue
+                packet.pts += offset
+                packet.dts += offset
+                packet.stream = out_stream
+                output.mux(packet)
+        return shifted_path
+
+    def get_bar_frame(self, stepper: VideoStepperBase, frame_index: int) -> int:
+        """
+        get the frame index shown by the frame counter bar of the synthetic clip
+        """
+        img = np.asarray(stepper.get_frame(frame_index)).astype(np.int32)
+        # the bar is white where the gradient below it is not
+        differs = np.flatnonzero(np.abs(img[5, :, 0] - img[100, :, 0]) > 40)
+        bar = int(differs[-1]) + 1 if len(differs) else 0
+        frames = stepper.video_info.frames
+        return round(bar * frames / img.shape[1]) - 1
+
+    def test_probe(self):
+        """
+        test reading the timing of videos with different frame rates
+        """
+        for fps in [Fraction(24000, 1001), 50, 60]:
+            video_path = self.create_clip(f"clip{float(fps):.0f}.mp4", fps)
+            video_info = VideoInfo.probe(video_path)
+            if self.debug:
+                print(video_info)
+            self.assertEqual(Fraction(fps), video_info.fps)
+            self.assertEqual(48, video_info.frames)
+            self.assertEqual(0.0, video_info.start_time)
+            # probed only once
+            self.assertIs(video_info, VideoInfo.probe(video_path))
+            stepper = VideoStepperBase.create("av", video_path)
+            self.assertEqual(float(fps), stepper.fps)
+            for frame_index in [0, 13, 47]:
+                self.assertEqual(frame_index, self.get_bar_frame(stepper, frame_index))
+            stepper.close()
+
+    def test_start_offset(self):
+        """
+        test that frames are found in a video whose first frame does not start at 0
+        """
+        video_path = self.create_clip("clip.mp4", Fraction(24000, 1001))
+        shifted_path = self.shift_clip(video_path, 1.5)
+        video_info = VideoInfo.probe(shifted_path)
+        self.assertAlmostEqual(1.5, video_info.start_time, places=3)
+        self.assertEqual(video_info.start_pts + 1001, video_info.get_pts(1))
+        stepper = VideoStepperBase.create("av", shifted_path)
+        for frame_index in [0, 20, 47]:
+            self.assertEqual(frame_index, self.get_bar_frame(stepper, frame_index))
+        stepper.close()
+
+    def test_frame_table(self):
+        """
+        test the mapping of track points to frames
+        """
+        video_info = VideoInfo(
+            fps=Fraction(24000, 1001),
+            time_base=Fraction(1, 24000),
+            start_pts=0,
+            frames=240,
+        )
+        # a track point per second for 10 seconds and one beyond the video
+        elapsed = np.arange(12, dtype=np.float64)
+        table = video_info.get_frame_table(elapsed)
+        self.assertEqual([0, 23, 47, 71], table[:4].tolist())
+        self.assertEqual(239, table[-1])
+        # an exact frame time stays on its frame
+        self.assertEqual([1], video_info.get_frame_indices([1001 / 24000]).tolist())
+        self.assertEqual([-1], video_info.get_frame_indices([np.nan]).tolist())
+        # the track starts 2 seconds into the video
+        self.assertEqual(47, video_info.get_frame_table(elapsed, offset=2.0)[0])
+        # missing times are interpolated
+        gaps = np.array([0.0, np.nan, 2.0, np.nan])
+        self.assertEqual([0, 23, 47, 47], video_info.get_frame_table(gaps).tolist())
+        # without times the points are spread over the video
+        spread = video_info.get_frame_table(np.full(5, np.nan))
+        self.assertEqual([0, 59, 119, 179, 239], spread.tolist())
+        # a 1M point table is a single vectorized computation
+        table = video_info.get_frame_table(np.linspace(0, 10, 1_000_000))
+        self.assertEqual(1_000_000, len(table))
+        self.assertTrue((np.diff(table) >= 0).all())
@@ -0,0 +1,127 @@
+"""
+Created on 2024-12-26
+
+@author: wf
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import av
+import numpy as np
+from ngwidgets.basetest import Basetest
+
+from nicetrack.file_index import FileIndex
+from nicetrack.stepper_benchmark import StepperBenchmark
+from nicetrack.video_proxy import VideoProxies, transcode_proxy
+from nicetrack.video_stepper_base import VideoStepperBase
+
+
+class TestVideoProxy(Basetest):
+    """
+    test the low resolution proxies
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root_path = os.path.join(self.tmpdir.name, "videos")
+        os.makedirs(self.root_path)
+        self.video_path = os.path.join(self.root_path, "proxy.mp4")
+        StepperBenchmark.create_clip(
+            self.video_path, width=640, height=360, frames=60, gop=30
+        )
+        self.proxies = VideoProxies(
+            os.path.join(self.tmpdir.name, "proxy"), height=90, cpu_budget=1
+        )
+
+    def tearDown(self):
+        self.proxies.shutdown()
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def test_transcode(self):
+        """
+        test that the proxy is an all-intra downscaled copy with the same frames
+        """
+        proxy_path = os.path.join(self.tmpdir.name, "direct.mp4")
+        transcode_proxy(self.video_path, proxy_path, height=90)
+        with av.open(proxy_path) as proxy:
+            frames = list(proxy.decode(video=0))
+        self.assertEqual(60, len(frames))
+        self.assertEqual((160, 90), (frames[0].width, frames[0].height))
+        self.assertTrue(all(frame.key_frame for frame in frames))
+        # the same frame of the original and the proxy look alike
+        original = VideoStepperBase.create("av", self.video_path)
+        proxy = VideoStepperBase.create("av", proxy_path)
+        for frame_index in [0, 31, 59]:
+            expected = np.asarray(original.get_frame(frame_index, width=160))
+            actual = np.asarray(proxy.get_frame(frame_index))
+            diff = np.abs(expected.astype(int) - actual.astype(int)).mean()
+            self.assertLess(diff, 10, frame_index)
+        original.close()
+        proxy.close()
+
+    def test_proxies(self):
+        """
+        test creating the proxies in the worker pool and choosing them by size
+        """
+        self.assertIsNone(self.proxies.get_proxy(self.video_path, width=100))
+        self.assertEqual(1, self.proxies.scan(self.root_path))
+        future = self.proxies.submit(self.video_path)
+        proxy_path = future.result(timeout=120)
+        self.assertTrue(os.path.exists(proxy_path))
+        self.assertIs(future, self.proxies.submit(self.video_path))
+        self.assertEqual(proxy_path, self.proxies.get_proxy(self.video_path, width=100))
+        self.assertEqual(proxy_path, self.proxies.get_proxy(self.video_path, height=90))
+        # the original is needed for full size and large frames
+        self.assertIsNone(self.proxies.get_proxy(self.video_path))
+        self.assertIsNone(self.proxies.get_proxy(self.video_path, width=320))
+        # a changed video needs a new proxy
+        later = time.time() + 10
+        os.utime(self.video_path, (later, later))
+        self.assertNotEqual(proxy_path, self.proxies.get_proxy_path(self.video_path))
+        self.assertIsNone(self.proxies.get_proxy(self.video_path, width=100))
+
+    def test_scan_index(self):
+        """
+        test that the proxies of videos are queued whenever the file index changes
+        """
+        file_index = FileIndex(
+            self.root_path, os.path.join(self.tmpdir.name, "index.json")
+        )
+        file_index.listeners.append(self.proxies.scan_index)
+        file_index.rescan()
+        self.assertEqual(1, len(self.proxies.pending))
+        # a video added while the server runs
+        added_path = os.path.join(self.root_path, "added.mp4")
+        shutil.copy(self.video_path, added_path)
+        # quicktime videos are indexed as videos as well
+        shutil.copy(self.video_path, os.path.join(self.root_path, "added.MOV"))
+        later = time.time() + 10
+        os.utime(self.root_path, (later, later))
+        self.assertTrue(file_index.rescan())
+        self.assertEqual(3, len(self.proxies.pending))
+        future = self.proxies.submit(added_path)
+        self.assertTrue(os.path.exists(future.result(timeout=120)))
+
+    def test_failed(self):
+        """
+        test that a failed transcode is forgotten and leaves no partial proxy
+        """
+        broken_path = os.path.join(self.root_path, "broken.mp4")
+        with open(broken_path, "w") as broken_file:
+            broken_file.write("not a video")
+        future = self.proxies.submit(broken_path)
+        with self.assertRaises(Exception):
+            future.result(timeout=120)
+        for _ in range(100):
+            if not self.proxies.pending:
+                break
+            time.sleep(0.01)
+        self.assertEqual({}, self.proxies.pending)
+        self.assertEqual([], os.listdir(self.proxies.cache_dir))
+        # the next scan tries again
+        self.assertIsNot(future, self.proxies.submit(broken_path))
@@ -1,17 +1,19 @@
+import asyncio
 import os
+import shutil
+import tempfile
 import time
-import unittest
 
 import cv2
 import numpy as np
+from fastapi import HTTPException
 from ngwidgets.basetest import Basetest
 
-from nicetrack.video_stepper import (
-    VideoStepper,
-)  # Modify this import based on where your VideoStepper class is
-from nicetrack.video_stepper_av import (
-    VideoStepperAV,
-)  # Modify this import based on where your AV-based VideoStepper class is
+from nicetrack.stepper_benchmark import StepperBenchmark
+from nicetrack.video_stepper import VideoStepper
+from nicetrack.video_stepper_av import VideoStepperAV
+from nicetrack.video_stepper_base import VideoStepperBase
+from nicetrack.webserver import WebServer
 
 
 class TestVideoStepper(Basetest):
@@ -21,18 +23,159 @@ class TestVideoStepper(Basetest):
 
     def setUp(self, debug=False, profile=True):
         Basetest.setUp(self, debug=debug, profile=profile)
-        self.video_path = "/Volumes/videos/quadrocopter/2023/DJI_0024.MP4"
-        self.opencv_stepper = VideoStepper(
-            self.video_path, root_path="/Volumes/videos/quadrocopter/2023/"
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root_path = self.tmpdir.name
+        self.video_path = os.path.join(self.root_path, "test_clip.mp4")
+        StepperBenchmark.create_clip(self.video_path, width=640, height=360, frames=60)
+        self.opencv_stepper = VideoStepper(self.video_path, root_path=self.root_path)
+        self.pyav_stepper = VideoStepperAV(self.video_path, root_path=self.root_path)
+
+    def tearDown(self):
+        self.opencv_stepper.close()
+        self.pyav_stepper.close()
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def test_backends(self):
+        """
+        test creating steppers via the configurable backend
+        """
+        for backend, stepper_class in [
+            ("opencv", VideoStepper),
+            ("av", VideoStepperAV),
+        ]:
+            stepper = VideoStepperBase.create(backend, self.video_path, self.root_path)
+            self.assertIsInstance(stepper, stepper_class)
+            self.assertEqual("/video_step/test_clip.mp4/0", stepper.url)
+            stepper.close()
+        with self.assertRaises(ValueError):
+            VideoStepperBase.get_backend_class("unknown")
+        # an incomplete backend fails when it is created
+        with self.assertRaises(TypeError):
+            type(
+                "IncompleteStepper", (VideoStepperBase,), {"open": lambda self: None}
+            )()
+
+    def test_webserver_steppers(self):
+        """
+        test that the shared steppers only open videos below the root path
+        and that the least recently used ones are closed
+        """
+        webserver = WebServer()
+        webserver.root_path = os.path.join(self.root_path, "root")
+        os.makedirs(webserver.root_path)
+        for index in range(3):
+            shutil.copy(
+                self.video_path, os.path.join(webserver.root_path, f"clip{index}.mp4")
+            )
+        for video_path in ["../test_clip.mp4", "/etc/passwd", "missing.mp4"]:
+            with self.assertRaises(HTTPException) as context:
+                webserver.get_video_source(video_path)
+            self.assertEqual(404, context.exception.status_code)
+        with self.assertRaises(HTTPException) as context:
+            asyncio.run(webserver.video_step("clip0.mp4"))
+        self.assertEqual(400, context.exception.status_code)
+
+        async def open_steppers():
+            webserver.max_video_steppers = 2
+            steppers = [webserver.get_video_stepper(f"clip{i}.mp4") for i in range(3)]
+            # let the eviction close the decoder
+            await asyncio.sleep(0.1)
+            return steppers
+
+        steppers = asyncio.run(open_steppers())
+        self.assertEqual(2, len(webserver.video_steppers))
+        self.assertIsNone(steppers[0].cap)
+        self.assertIsNotNone(steppers[2].cap)
+        webserver.close_video_steppers()
+        self.assertIsNone(steppers[2].cap)
+
+    def test_frame_index(self):
+        """
+        test that both backends interpret the frame index the same way
+        """
+        for frame_index in [0, 7, 31, 59]:
+            opencv_frame = self.opencv_stepper.get_frame(frame_index)
+            # PyAV delivers RGB - OpenCV BGR
+            av_frame = np.asarray(self.pyav_stepper.get_frame(frame_index))[:, :, ::-1]
+            diff = np.abs(opencv_frame.astype(int) - av_frame.astype(int)).mean()
+            self.assertLess(diff, 8, f"frame {frame_index}")
+        self.assertIsNone(self.opencv_stepper.get_frame(60))
+        self.assertIsNone(self.pyav_stepper.get_frame(60))
+
+    def test_sequential(self):
+        """
+        test that stepping forward without a seek gives the same frames as seeking
+        """
+        for stepper in [self.opencv_stepper, self.pyav_stepper]:
+            stepped = [np.asarray(stepper.get_frame(i)) for i in range(20, 26)]
+            self.assertEqual(26, stepper.next_index)
+            for offset, frame_index in enumerate([25, 22, 21, 24, 20, 23]):
+                # jump around so that every frame is seeked to
+                stepper.get_frame(frame_index + 30)
+                seeked = np.asarray(stepper.get_frame(frame_index))
+                np.testing.assert_array_equal(
+                    seeked, stepped[frame_index - 20], f"{stepper.backend} {offset}"
+                )
+
+    def create_test_video(
+        self, video_path: str, width: int = 1280, height: int = 720, frames: int = 10
+    ):
+        """
+        create a synthetic test video with the given size
+        """
+        writer = cv2.VideoWriter(
+            video_path, cv2.VideoWriter_fourcc(*"mp4v"), 30, (width, height)
         )
-        self.pyav_stepper = VideoStepperAV(
-            self.video_path, root_path="/Volumes/videos/quadrocopter/2023/"
+        for i in range(frames):
+            frame = np.full((height, width, 3), i * 20 % 256, dtype=np.uint8)
+            writer.write(frame)
+        writer.release()
+
+    def test_scaled_image(self):
+        """
+        test server side downscaling and the supported image formats
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            video_path = os.path.join(tmpdir, "test.mp4")
+            self.create_test_video(video_path)
+            for stepper_class in [VideoStepper, VideoStepperAV]:
+                stepper = stepper_class(video_path, root_path=tmpdir)
+                self.assertEqual("/video_step/test.mp4/0", stepper.url)
+                stepper.set_display_size(width=320)
+                self.assertEqual("/video_step/test.mp4/0?width=320", stepper.url)
+                for img_format in ["jpg", "png", "webp"]:
+                    image_bytes = stepper.get_image(
+                        0, img_format=img_format, width=320, quality=50
+                    )
+                    image = cv2.imdecode(
+                        np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR
+                    )
+                    self.assertEqual((180, 320, 3), image.shape)
+                full_bytes = stepper.get_image(0, img_format="jpg")
+                image = cv2.imdecode(
+                    np.frombuffer(full_bytes, dtype=np.uint8), cv2.IMREAD_COLOR
+                )
+                self.assertEqual((720, 1280, 3), image.shape)
+                with self.assertRaises(ValueError):
+                    stepper.get_image(0, img_format="gif")
+                stepper.close()
+
+    def test_scaled_size(self):
+        """
+        test the aspect ratio preserving size calculation
+        """
+        self.assertEqual((640, 360), VideoStepper.get_scaled_size(3840, 2160, 640))
+        self.assertEqual(
+            (640, 360), VideoStepper.get_scaled_size(3840, 2160, 1000, 360)
         )
+        # frames are never enlarged
+        self.assertEqual((320, 240), VideoStepper.get_scaled_size(320, 240, 640, 480))
 
     def _test_get_frame(self, stepper):
         if os.path.exists(self.video_path):
             start = time.time()
-            frame = stepper.get_frame(5)  # e.g., get the frame of the 5th second
+            frame = stepper.get_frame(45)
             end = time.time()
 
             self.assertIsNotNone(frame, "Frame should not be None")
@@ -47,7 +190,7 @@ class TestVideoStepper(Basetest):
     def _test_get_image(self, stepper):
         if os.path.exists(self.video_path):
             start = time.time()
-            image_bytes = stepper.get_image(5, img_format="jpg")
+            image_bytes = stepper.get_image(45, img_format="jpg")
             end = time.time()
 
             self.assertIsNotNone(image_bytes, "Image bytes should not be None")
@@ -64,7 +207,6 @@ class TestVideoStepper(Basetest):
             time_taken = end - start
             return time_taken
 
-    @unittest.skipIf(Basetest.inPublicCI(), "queries unreliable wikidata endpoint")
     def test_compare_timing(self):
         """ """
         opencv_frame_time = self._test_get_frame(self.opencv_stepper)
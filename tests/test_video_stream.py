@@ -0,0 +1,278 @@
+"""
+Created on 2024-12-23
+
+@author: wf
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.testclient import TestClient
+from ngwidgets.basetest import Basetest
+
+from nicetrack.stepper_benchmark import StepperBenchmark
+from nicetrack.video_stream import JpegReader, LatestFrame, VideoStream
+
+
+class TestVideoStream(Basetest):
+    """
+    test the paced async motion jpeg feed
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.video_path = os.path.join(self.tmpdir.name, "feed.mp4")
+        StepperBenchmark.create_clip(self.video_path, width=320, height=180, frames=30)
+        self.video_stream = VideoStream(self.video_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    async def consume(self, fps: float, delay: float = 0.0, limit: int = None):
+        """
+        consume the feed with the given delay per frame
+        """
+        count = 0
+        start = time.perf_counter()
+        frame_gen = self.video_stream.generate_frames(fps=fps)
+        try:
+            async for part in frame_gen:
+                self.assertTrue(part.startswith(b"--frame\r\n"))
+                count += 1
+                if limit and count >= limit:
+                    break
+                if delay:
+                    await asyncio.sleep(delay)
+        finally:
+            await frame_gen.aclose()
+        elapsed = time.perf_counter() - start
+        return count, elapsed
+
+    def test_pacing(self):
+        """
+        test that the feed is paced to the requested frames per second
+        """
+        count, elapsed = asyncio.run(self.consume(fps=30))
+        print(f"{count} frames in {elapsed:.2f} s")
+        self.assertGreaterEqual(elapsed, 0.9)
+        self.assertGreaterEqual(count, 25)
+
+    def test_slow_client(self):
+        """
+        test that a slow client only gets the latest frames instead of a growing backlog
+        """
+        count, elapsed = asyncio.run(self.consume(fps=30, delay=0.1))
+        print(f"slow client: {count} frames in {elapsed:.2f} s")
+        self.assertLess(count, 20)
+        self.assertLess(elapsed, 2.5)
+
+    def test_release_on_disconnect(self):
+        """
+        test that the capture is released when the client disconnects
+        """
+        with patch.object(JpegReader, "release", autospec=True) as release:
+            count, _elapsed = asyncio.run(self.consume(fps=30, limit=3))
+        self.assertEqual(3, count)
+        release.assert_called_once()
+
+    def test_start_time(self):
+        """
+        test that the start time is mapped to a frame with the native frame rate
+        of the video - not the frame rate of the feed
+        """
+        reader = JpegReader(self.video_path, start_time=0.5)
+        self.assertEqual(15, reader.start_frame)
+        reader.release()
+        frames = []
+
+        def counting_read(reader, skip=0):
+            jpeg = original_read(reader, skip)
+            if jpeg is not None:
+                # frames skipped by a slow decode count as read
+                frames.extend([jpeg] * (1 + skip))
+            return jpeg
+
+        original_read = JpegReader.read
+
+        async def consume():
+            frame_gen = self.video_stream.generate_frames(start_time=0.5, fps=60)
+            async for _part in frame_gen:
+                pass
+
+        with patch.object(JpegReader, "read", counting_read):
+            asyncio.run(consume())
+        # the remaining half of the 30 frames at 30 fps
+        self.assertEqual(15, len(frames))
+
+    def test_latest_frame(self):
+        """
+        test the latest frame slot
+        """
+
+        async def check():
+            latest = LatestFrame()
+            latest.put(b"1")
+            latest.put(b"2")
+            self.assertEqual(b"2", await latest.get())
+            self.assertEqual(1, latest.dropped)
+            latest.close()
+            self.assertIsNone(await latest.get())
+
+        asyncio.run(check())
+
+
+class TestRangeServing(Basetest):
+    """
+    test serving byte ranges of a video file
+    """
+
+    def setUp(self, debug=False, profile=True):
+        Basetest.setUp(self, debug=debug, profile=profile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.video_path = os.path.join(self.tmpdir.name, "range.mp4")
+        self.content = bytes(range(256)) * 40
+        with open(self.video_path, "wb") as f:
+            f.write(self.content)
+        self.video_stream = VideoStream(self.video_path)
+        app = FastAPI()
+
+        @app.get("/video")
+        def video(
+            range_header: str = Header(None, alias="Range"),
+            if_range: str = Header(None),
+        ):
+            return self.video_stream.get_video(range_header, if_range)
+
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        Basetest.tearDown(self)
+
+    def test_parse_range_header(self):
+        """
+        test parsing range headers
+        """
+        size = len(self.content)
+        parse = self.video_stream.parse_range_header
+        self.assertEqual([], parse(None))
+        self.assertEqual([(0, 99)], parse("bytes=0-99"))
+        self.assertEqual([(100, size - 1)], parse("bytes=100-"))
+        self.assertEqual([(size - 500, size - 1)], parse("bytes=-500"))
+        self.assertEqual([(0, size - 1)], parse(f"bytes=-{size * 2}"))
+        self.assertEqual(
+            [(size - 10, size - 1)], parse(f"bytes={size - 10}-{size * 2}")
+        )
+        self.assertEqual([(0, 9), (20, 29)], parse("bytes=0-9, 20-29"))
+        # malformed range headers are ignored
+        for malformed in ["0-9", "bytes=a-b", "bytes=5-3", "items=0-9", "bytes=0-9,x"]:
+            self.assertEqual([], parse(malformed), malformed)
+        with self.assertRaises(HTTPException) as ctx:
+            parse(f"bytes={size}-")
+        self.assertEqual(416, ctx.exception.status_code)
+        self.assertEqual(f"bytes */{size}", ctx.exception.headers["Content-Range"])
+
+    def test_ranges(self):
+        """
+        test single, suffix and multipart range responses
+        """
+        size = len(self.content)
+        r = self.client.get("/video")
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(self.content, r.content)
+        etag = r.headers["ETag"]
+        # a range starting at 0 is a range
+        r = self.client.get("/video", headers={"Range": "bytes=0-9"})
+        self.assertEqual(206, r.status_code)
+        self.assertEqual(self.content[:10], r.content)
+        self.assertEqual(f"bytes 0-9/{size}", r.headers["Content-Range"])
+        r = self.client.get("/video", headers={"Range": "bytes=-16"})
+        self.assertEqual(206, r.status_code)
+        self.assertEqual(self.content[-16:], r.content)
+        r = self.client.get("/video", headers={"Range": "bytes=0-4,100-104"})
+        self.assertEqual(206, r.status_code)
+        self.assertTrue(r.headers["content-type"].startswith("multipart/byteranges"))
+        self.assertEqual(int(r.headers["content-length"]), len(r.content))
+        self.assertIn(f"Content-Range: bytes 100-104/{size}".encode(), r.content)
+        self.assertIn(b"\r\n" + self.content[100:105] + b"\r\n--", r.content)
+        r = self.client.get("/video", headers={"Range": f"bytes={size}-"})
+        self.assertEqual(416, r.status_code)
+        # a malformed range header gets the full body
+        r = self.client.get("/video", headers={"Range": "bytes=a-b"})
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(self.content, r.content)
+        # If-Range with the current and an outdated entity tag
+        r = self.client.get("/video", headers={"Range": "bytes=0-9", "If-Range": etag})
+        self.assertEqual(206, r.status_code)
+        r = self.client.get(
+            "/video", headers={"Range": "bytes=0-9", "If-Range": '"outdated"'}
+        )
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(size, len(r.content))
+
+    def test_throughput(self):
+        """
+        test that the memory mapped large chunk reads return the same bytes
+        as an 8 KB read loop in chunk_size chunks
+
+        set NICETRACK_RANGE_BENCH_BYTES to compare the throughput on a
+        larger sparse file e.g. 2147483648 for 2 GB
+        """
+        bench_size = os.environ.get("NICETRACK_RANGE_BENCH_BYTES")
+        big_path = os.path.join(self.tmpdir.name, "big.mp4")
+        if bench_size:
+            size = int(bench_size)
+            with open(big_path, "wb") as f:
+                f.truncate(size)
+        else:
+            size = 4 * 1024**2 + 12345
+            with open(big_path, "wb") as f:
+                f.write(os.urandom(size))
+        video_stream = VideoStream(big_path)
+        start, end = 0, size - 1
+
+        def read_8k():
+            with open(big_path, "rb") as video:
+                video.seek(start)
+                position = start
+                while position <= end:
+                    buffer = video.read(min(8192, end - position + 1))
+                    if not buffer:
+                        break
+                    position += len(buffer)
+                    yield buffer
+
+        digests = {}
+        for name, chunks in [
+            ("8 KB reads", read_8k()),
+            ("mmap 1 MB", video_stream.read_range(start, end)),
+        ]:
+            t0 = time.perf_counter()
+            digest = hashlib.sha1()
+            sizes = []
+            for chunk in chunks:
+                digest.update(chunk)
+                sizes.append(len(chunk))
+            elapsed = time.perf_counter() - t0
+            self.assertEqual(size, sum(sizes))
+            digests[name] = digest.hexdigest()
+            if name.startswith("mmap"):
+                self.assertEqual(-(-size // video_stream.chunk_size), len(sizes))
+                self.assertTrue(
+                    all(chunk == video_stream.chunk_size for chunk in sizes[:-1])
+                )
+            if self.debug or bench_size:
+                print(f"{name}: {size / elapsed / 1024**2:8.1f} MB/s")
+        self.assertEqual(1, len(set(digests.values())))
+        # a range in the middle
+        middle = b"".join(video_stream.read_range(1000, 2000))
+        with open(big_path, "rb") as f:
+            f.seek(1000)
+            self.assertEqual(f.read(1001), middle)
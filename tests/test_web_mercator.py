@@ -0,0 +1,51 @@
+"""
+Created on 2025-01-07
+
+@author: wf
+"""
+
+from ngwidgets.basetest import Basetest
+
+from nicetrack.catalog import BoundingBox
+from nicetrack.web_mercator import WebMercator
+
+
+class TestWebMercator(Basetest):
+    """
+    test the slippy map tile math
+    """
+
+    def test_tiles(self):
+        """
+        test the tile of a position and the bounds of a tile
+        """
+        # Munich at zoom 14
+        self.assertEqual((8718, 5685), WebMercator.get_tile(48.1372, 11.5756, 14))
+        bbox = WebMercator.get_bounds(14, 8718, 5685)
+        self.assertTrue(bbox.min_lat <= 48.1372 <= bbox.max_lat)
+        self.assertTrue(bbox.min_lon <= 11.5756 <= bbox.max_lon)
+        world = WebMercator.get_bounds(0, 0, 0)
+        self.assertAlmostEqual(WebMercator.max_lat, world.max_lat)
+        self.assertAlmostEqual(-180.0, world.min_lon)
+        x, y = WebMercator.project(48.1372, 11.5756)
+        lat, lon = WebMercator.unproject(x, y)
+        self.assertAlmostEqual(48.1372, float(lat))
+        self.assertAlmostEqual(11.5756, float(lon))
+        with self.assertRaises(ValueError):
+            WebMercator.check_tile(1, 2, 0)
+
+    def test_cover(self):
+        """
+        test the tiles that cover a bounding box
+        """
+        tiles = list(WebMercator.get_tiles(BoundingBox(-10, -10, 10, 10), 1))
+        self.assertEqual([(1, 0, 0), (1, 1, 0), (1, 0, 1), (1, 1, 1)], tiles)
+        # a box just inside a tile is covered by that tile only
+        bounds = WebMercator.get_bounds(10, 500, 300)
+        inside = BoundingBox(
+            bounds.min_lat + 1e-6,
+            bounds.min_lon + 1e-6,
+            bounds.max_lat - 1e-6,
+            bounds.max_lon - 1e-6,
+        )
+        self.assertEqual([(10, 500, 300)], list(WebMercator.get_tiles(inside, 10)))